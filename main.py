@@ -4,11 +4,37 @@ from PyQt6 import QtWidgets
 from PyQt6.QtWidgets import QApplication, QMessageBox
 from src.user_interface.startScreen import startScreen
 from src.data_processing.database import connect_to_database, create_file_name_tables, close_database
-from src.user_interface.scraping_ui import scrapeCRKN
+from src.user_interface.scraping_ui import scrapeCRKN, start_scheduled_refresh
 from src.user_interface.welcomeScreen import WelcomePage
 from src.utility.settings_manager import Settings
+from src.user_interface.upload_ui import start_watch_folder
+from src.utility.search_api import start_search_api
 from src.utility.logger import m_logger
+import logging
 import os
+import time
+
+# Time the background threads get in all to finish the current file once the window is closed
+BACKGROUND_STOP_MS = 5000
+
+
+def wait_for_background_threads(threads):
+    """
+    Give the background threads, told to stop when the application quit, BACKGROUND_STOP_MS in all to end.
+    An upload cut off after that is rolled back by SQLite, and its file is picked up again on the next start. A CRKN
+    update cut off carries on from its refresh journal the next time it runs.
+    :param threads: list of QThread
+    :return: True if they all ended
+    """
+    deadline = time.monotonic() + BACKGROUND_STOP_MS / 1000
+    ended = True
+    for thread in threads:
+        # Every thread is waited for, with what is left of the time
+        remaining = max(0, int((deadline - time.monotonic()) * 1000))
+        ended = thread.wait(remaining) and ended
+    if not ended:
+        m_logger.warning("A background thread did not stop in time, its work is left unfinished")
+    return ended
 
 
 def main():
@@ -21,13 +47,12 @@ def main():
     app.setApplicationDisplayName("ePat")
     widget = QtWidgets.QStackedWidget()
 
-    if not os.path.exists(f"{os.path.abspath(os.path.dirname(__file__))}/src/utility/ebook_database.db"):
-        # Create database and structure
-        connection_obj = connect_to_database()
-        create_file_name_tables(connection_obj)
-        close_database(connection_obj)
+    # Create database and structure - also adds any tables missing from databases made by older versions
+    connection_obj = connect_to_database()
+    create_file_name_tables(connection_obj)
+    close_database(connection_obj)
 
-    if not os.path.exists(f"{os.path.abspath(os.path.dirname(__file__))}/src/utility/settings.json"):
+    if not os.path.exists(settings_manager.settings_file):
         if settings_manager.get_setting('allow_CRKN') == "True":
             reply = QMessageBox.question(None, 'Update CRKN' if language == "English" else "Mettre à jour de RCDR",
                                      'Would you like to update CRKN database before proceeding?' if language == "English" else "Souhaitez-vous mettre à jour la base de données du RCDR avant de continuer ?", QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
@@ -59,7 +84,34 @@ def main():
             if reply == QMessageBox.StandardButton.Yes:
                 scrapeCRKN()
 
-    sys.exit(app.exec())
+    background_threads = []
+
+    # Upload the files dropped into the watch folder in the background
+    watch_thread = start_watch_folder()
+    if watch_thread is not None:
+        app.aboutToQuit.connect(watch_thread.stop)
+        background_threads.append(watch_thread)
+
+    # Update CRKN in the background on the schedule set in the settings
+    refresh_thread = start_scheduled_refresh()
+    if refresh_thread is not None:
+        app.aboutToQuit.connect(refresh_thread.stop)
+        background_threads.append(refresh_thread)
+
+    # Answer searches from other library systems, if the search API is turned on in the settings
+    search_server = start_search_api()
+    if search_server is not None:
+        app.aboutToQuit.connect(search_server.stop)
+
+    exit_code = app.exec()
+    # The window is closed by now. Qt aborts if a thread is destroyed while running, so one that is still running
+    # is left behind by ending the process directly - which skips the atexit handlers, so the settings not written
+    # yet are written first
+    if not wait_for_background_threads(background_threads):
+        settings_manager.flush()
+        logging.shutdown()
+        os._exit(exit_code)
+    sys.exit(exit_code)
 
 
 if __name__ == "__main__":
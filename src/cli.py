@@ -0,0 +1,343 @@
+"""
+Command line for scripting ePat without the application - for cron jobs and batch pipelines.
+
+    python -m src.cli scrape [--yes] [--scheduled]
+    python -m src.cli upload FILE [FILE ...] [--replace] [--add-institutions]
+    python -m src.cli search TERM [TERM ...] [--field FIELD] [--operator OR|AND|NOT] [--format tsv|csv] [--limit N]
+    python -m src.cli export TERM [TERM ...] --output PATH [--field FIELD] [--operator OR|AND|NOT]
+    python -m src.cli report --output PATH
+    python -m src.cli serve [--host HOST] [--port PORT]
+    python -m src.cli history (IDENTIFIER | --table TABLE) [--date DATE] [--institution NAME] [--format tsv|csv]
+
+A search term can name its own field, as in OCN:12345 (see database.SEARCH_FIELDS). The settings and database are
+the ones of the application. Nothing here imports Qt, and each command only imports the modules it needs, so a
+search starts without loading pandas or openpyxl. Only scrape and upload add the tables missing from a database
+made by an older version, so the commands that read start without checking them. Progress is shown on stderr when
+it is a terminal.
+
+Exit status: 0 when the command succeeded, 1 when it failed or some files could not be loaded, 2 for a usage error.
+"""
+import argparse
+import csv
+import os
+import sys
+from src.data_processing import database
+from src.data_processing.database import SEARCH_FIELDS
+from src.utility.settings_manager import Settings
+
+settings_manager = Settings()
+
+
+def english():
+    return settings_manager.get_setting("language") == "English"
+
+
+def show_progress(percent, status):
+    """
+    Show the progress of a command on one line of stderr, when stderr is a terminal.
+    :param percent: percentage done
+    :param status: status line
+    """
+    if sys.stderr.isatty():
+        sys.stderr.write(f"\r{percent:3d}% {status}"[:120].ljust(120))
+        if percent >= 100:
+            sys.stderr.write("\n")
+        sys.stderr.flush()
+
+
+def show_error(message):
+    print(message, file=sys.stderr)
+
+
+def ask_file_changes(file_changes):
+    """
+    Ask on the terminal whether to update the CRKN files - no when nobody can answer.
+    :param file_changes: number of files to add, update or remove
+    :return: True to go ahead
+    """
+    question = (f"There {'is' if file_changes == 1 else 'are'} {file_changes} {'file' if file_changes == 1 else 'files'} "
+                "to update in the database. Would you like to do the update now? [y/N] " if english() else
+                f"Il y a {file_changes} {'fichier' if file_changes == 1 else 'fichers'} à mettre à jour dans la base de "
+                "données. Souhaitez-vous effectuer la mise à jour maintenant ? [o/N] ")
+    try:
+        answer = input(question)
+    except EOFError:
+        return False
+    return answer.strip().lower() in ("y", "yes", "o", "oui")
+
+
+def show_access_changes(path, counts):
+    print((f"Titles added: {counts.get('Added', 0)}, removed: {counts.get('Removed', 0)}, "
+           f"access changed: {counts.get('Access changed', 0)}\nReport: {path}") if english() else
+          (f"Titres ajoutés: {counts.get('Added', 0)}, retirés: {counts.get('Removed', 0)}, "
+           f"accès modifié: {counts.get('Access changed', 0)}\nRapport: {path}"))
+
+
+def scrape(args):
+    """
+    Update the CRKN files, as the Update CRKN button does.
+    """
+    # Only what the command uses is imported
+    from src.data_processing import Scraping
+    if settings_manager.get_setting("allow_CRKN") != "True":
+        show_error("CRKN is turned off in the settings." if english() else "Le RCDR est désactivé dans les paramètres.")
+        return 1
+    if args.scheduled:
+        update = Scraping.ScheduledRefresh(show_progress, show_error, show_access_changes)
+        if not update.run_if_due():
+            print("No scheduled CRKN update is due." if english() else "Aucune mise à jour planifiée du RCDR n'est due.")
+            return 0
+    else:
+        update = Scraping.CRKNUpdate(show_progress, show_error, None if args.yes else ask_file_changes,
+                                     show_access_changes)
+        update.update_database()
+    if update.errors:
+        return 1
+    print(f"{update.files_changed} CRKN files updated." if english() else
+          f"{update.files_changed} fichiers du RCDR mis à jour.")
+    return 0
+
+
+def upload(args):
+    """
+    Upload local files, answering the questions of the file dialog with the options given.
+    """
+    from src.utility.upload import LocalUpload
+    local_upload = LocalUpload(args.files, (args.replace, args.add_institutions), show_progress,
+                               inform=lambda title, body: print(body), error=lambda title, body: show_error(body))
+    local_upload.process_files()
+    return 1 if local_upload.batch.failed_jobs() or not local_upload.batch.loaded_files() else 0
+
+
+def search_terms(args):
+    """
+    :param args: parsed arguments of search or export
+    :return: (terms, search types, operators) for database.search_database
+    """
+    terms, search_types, operators = [], [], []
+    for term in args.terms:
+        field, _, rest = term.partition(":")
+        if rest and field in SEARCH_FIELDS:
+            search_types.append(field)
+            terms.append(rest)
+        else:
+            search_types.append(args.field)
+            terms.append(term)
+        # The operator joins the terms after the first, a NOT on the first would negate it
+        operators.append(args.operator if operators else "OR")
+    return terms, search_types, operators
+
+
+def run_search(args, limit=None):
+    """
+    :param args: parsed arguments of search or export
+    :param limit: most rows found, or None for all
+    :return: (headers, rows) of the results, or None if no institution is selected or there are too many terms
+    """
+    institution = settings_manager.get_setting("institution")
+    if not institution:
+        show_error("You have no institution selected. Please select an institution in the settings." if english() else
+                   "Vous n'avez sélectionné aucun institut. Veuillez sélectionner un institut dans les paramètres.")
+        return None
+    if len(args.terms) > database.MAX_SEARCH_TERMS:
+        show_error(f"At most {database.MAX_SEARCH_TERMS} search terms." if english() else
+                   f"Au plus {database.MAX_SEARCH_TERMS} termes de recherche.")
+        return None
+    connection = database.connect_to_database()
+    try:
+        results = database.search_database(connection, database.search_query(institution), *search_terms(args),
+                                           limit=limit)
+    finally:
+        database.close_database(connection)
+    return ["Access"] + database.RESULT_COLUMNS, results
+
+
+def search(args):
+    """
+    Search the database for the selected institution and write the results to stdout.
+    """
+    found = run_search(args, args.limit)
+    if found is None:
+        return 1
+    headers, results = found
+    writer = csv.writer(sys.stdout, delimiter="\t" if args.format == "tsv" else ",", lineterminator="\n")
+    writer.writerow(headers)
+    writer.writerows(results)
+    return 0
+
+
+def export(args):
+    """
+    Search the database for the selected institution and export the results to a TSV, CSV or XLSX file.
+    """
+    from src.utility.streaming_export import write_rows, export_path
+    found = run_search(args)
+    if found is None:
+        return 1
+    headers, results = found
+    path = export_path(args.output)
+    write_rows(results, headers, path)
+    print(f"File has been exported to:\n{path}" if english() else f"Le fichier a été exporté vers:\n{path}")
+    return 0
+
+
+def report(args):
+    """
+    Export the holdings report of the selected institution, as Ctrl+R does on the start screen.
+    """
+    from src.data_processing.holdings_report import HoldingsReport, REPORT_COLUMNS, TOTAL_COLUMNS, totals_path
+    from src.utility.streaming_export import write_rows, export_path
+    institution = settings_manager.get_setting("institution")
+    if not institution:
+        show_error("You have no institution selected. Please select an institution in the settings." if english() else
+                   "Vous n'avez sélectionné aucun institut. Veuillez sélectionner un institut dans les paramètres.")
+        return 1
+    path = export_path(args.output)
+    holdings = HoldingsReport(institution)
+    write_rows(holdings.rows(), REPORT_COLUMNS, path)
+    platform_totals = totals_path(path)
+    write_rows(holdings.totals(), TOTAL_COLUMNS, platform_totals, "csv")
+    print((f"{holdings.total()} titles from {holdings.tables} files have been exported to:\n{path}\n"
+           f"{holdings.duplicates} titles found in more than one file were listed once.\n"
+           f"Titles by platform: {platform_totals}") if english() else
+          (f"{holdings.total()} titres de {holdings.tables} fichiers ont été exportés vers:\n{path}\n"
+           f"{holdings.duplicates} titres trouvés dans plusieurs fichiers ont été listés une seule fois.\n"
+           f"Titres par plateforme: {platform_totals}"))
+    return 0
+
+
+def show_history(args):
+    """
+    Write from the version history (see history.py) the access each file gave to a title on a date, or the rows a
+    file table had then.
+    """
+    from src.data_processing import history
+    writer = csv.writer(sys.stdout, delimiter="\t" if args.format == "tsv" else ",", lineterminator="\n")
+    connection = database.connect_to_database()
+    try:
+        if args.table:
+            rows = history.table_as_of(connection, args.table, args.date)
+            # Columns in the order they first appear, the table may have changed columns between loads
+            headers = list(dict.fromkeys(column for row in rows for column in row))
+            writer.writerow(headers)
+            writer.writerows([row.get(column) for column in headers] for row in rows)
+            return 0
+        institution = args.institution or settings_manager.get_setting("institution")
+        if not institution:
+            show_error("You have no institution selected. Please select an institution in the settings." if english() else
+                       "Vous n'avez sélectionné aucun institut. Veuillez sélectionner un institut dans les paramètres.")
+            return 1
+        writer.writerow(["File_Name", "Title", institution, "Valid_From", "Valid_To"])
+        writer.writerows([version["file_table"], version["values"].get("Title"), version["values"].get(institution),
+                          version["valid_from"], version["valid_to"]]
+                         for version in history.versions_as_of(connection, args.identifier, args.date))
+        return 0
+    finally:
+        database.close_database(connection)
+
+
+def serve(args):
+    """
+    Run the search API (see search_api.py) until interrupted.
+    """
+    import sqlite3
+    from src.utility.search_api import SearchServer
+    if not settings_manager.get_setting("institution"):
+        show_error("You have no institution selected. Please select an institution in the settings." if english() else
+                   "Vous n'avez sélectionné aucun institut. Veuillez sélectionner un institut dans les paramètres.")
+        return 1
+    try:
+        server = SearchServer(args.host, args.port)
+    except (OSError, sqlite3.Error) as e:
+        show_error(f"Unable to start the search API: {e}" if english() else f"Impossible de démarrer l'API de recherche: {e}")
+        return 1
+    print(f"Search API listening on {server.url()}" if english() else f"API de recherche à l'écoute sur {server.url()}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.api.close()
+    return 0
+
+
+def make_parser():
+    """
+    :return: argparse parser of the commands
+    """
+    parser = argparse.ArgumentParser(prog="python -m src.cli", description="ePat eBook perpetual access tracker")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    scrape_parser = commands.add_parser("scrape", help="update the CRKN files")
+    scrape_parser.add_argument("--yes", action="store_true", help="update without asking")
+    scrape_parser.add_argument("--scheduled", action="store_true",
+                               help="update only if the update schedule in the settings says it is due")
+    scrape_parser.set_defaults(run=scrape, writes=True)
+
+    upload_parser = commands.add_parser("upload", help="upload local files")
+    upload_parser.add_argument("files", nargs="+", help="xlsx, csv or tsv files")
+    upload_parser.add_argument("--replace", action="store_true",
+                               help="replace local files already in the database with the same name")
+    upload_parser.add_argument("--add-institutions", action="store_true",
+                               help="add the institutions of the files that are not known yet")
+    upload_parser.set_defaults(run=upload, writes=True)
+
+    for name, run, help_text in (("search", search, "search and write the results to stdout"),
+                                 ("export", export, "search and export the results to a file")):
+        search_parser = commands.add_parser(name, help=help_text)
+        search_parser.add_argument("terms", nargs="+", help="search terms, as TERM or FIELD:TERM")
+        search_parser.add_argument("--field", choices=SEARCH_FIELDS, default="Title",
+                                   help="field of the terms that do not name one (default Title)")
+        search_parser.add_argument("--operator", choices=["OR", "AND", "NOT"], default="OR",
+                                   help="how the terms after the first are joined (default OR)")
+        if name == "search":
+            search_parser.add_argument("--format", choices=["tsv", "csv"], default="tsv")
+            search_parser.add_argument("--limit", type=int, help="most results written")
+        else:
+            search_parser.add_argument("--output", required=True, help="path of the tsv, csv or xlsx file")
+        search_parser.set_defaults(run=run)
+
+    report_parser = commands.add_parser("report", help="export the holdings report of the selected institution")
+    report_parser.add_argument("--output", required=True, help="path of the tsv, csv or xlsx file")
+    report_parser.set_defaults(run=report)
+
+    serve_parser = commands.add_parser("serve", help="run the read-only search API")
+    serve_parser.add_argument("--host", help="address listened on (default search_api_host setting)")
+    serve_parser.add_argument("--port", type=int, help="port listened on (default search_api_port setting)")
+    serve_parser.set_defaults(run=serve)
+
+    history_parser = commands.add_parser("history", help="access to a title, or the rows of a file, on a date")
+    wanted = history_parser.add_mutually_exclusive_group(required=True)
+    wanted.add_argument("identifier", nargs="?", help="eISBN (ISBN-10 or ISBN-13) or OCN of the title")
+    wanted.add_argument("--table", help="file table whose rows are written")
+    history_parser.add_argument("--date", help="date, or date and time, as YYYY-MM-DD[THH:MM:SS] (default now)")
+    history_parser.add_argument("--institution", help="institution whose access is shown (default the selected one)")
+    history_parser.add_argument("--format", choices=["tsv", "csv"], default="tsv")
+    history_parser.set_defaults(run=show_history)
+    # Commands that only read leave the tables as they are
+    parser.set_defaults(writes=False)
+    return parser
+
+
+def main(argv=None):
+    """
+    :param argv: arguments, by default the command line
+    :return: exit status
+    """
+    args = make_parser().parse_args(argv)
+    # Adds any tables missing from databases made by older versions, as the application does when it starts, before
+    # a command that writes to the database - or that reads one that does not exist yet
+    if args.writes or not os.path.exists(settings_manager.get_setting("database_name")):
+        connection = database.connect_to_database()
+        database.create_file_name_tables(connection)
+        database.close_database(connection)
+    try:
+        return args.run(args)
+    finally:
+        # Settings changed by the command are written before the process ends
+        settings_manager.flush()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,37 +3,132 @@ This file includes functions for scraping from the CRKN website and uploading th
 Some functions can also be re-used for the local file uploads (compare_file)
 
 I tested new files and the same files, but not when the file has a newer date (to update)
+
+This module has no Qt - the update runs through CRKNUpdate with plain callbacks, and the threads and dialogs of the
+application are in scraping_ui.py.
 """
 import requests.exceptions
+import sqlite3
+import threading
 import time
+from datetime import datetime
 from bs4 import BeautifulSoup
 import requests
 import pandas as pd
+import openpyxl
 from src.utility.settings_manager import Settings
-from src.data_processing import database
-from PyQt6.QtCore import QTimer, QThread, pyqtSignal
+from src.data_processing import database, changesets, refresh_journal
+from src.data_processing.access_changes import AccessChangeReport
+from src.data_processing.institutions import registry
+from src.data_processing.refresh_journal import RefreshJournal
+from src.data_processing.source_store import keep_source, retire_source
 from src.utility.logger import m_logger
+from src.utility import refresh_schedule
+from src.utility.progress import ProgressReporter
+from src.utility.response_channel import ResponseChannel, RequestCancelled
 import os
 
 settings_manager = Settings()
 
+# Share of each file's progress that is the download, and the download and parse together (the rest is the upload)
+DOWNLOAD_SHARE = 0.5
+PARSE_SHARE = 0.8
+
+# Rows at the top of a file - the platform in A1, a second row, then the header row
+HEADER_ROWS = 3
+
+# Separators of the text file types
+TEXT_SEPARATORS = {"csv": ",", "tsv": "\t"}
+
+# Held while a CRKN update runs - a scheduled update and one started by the user would load the same files
+REFRESH_LOCK = threading.Lock()
+
+# Seconds between checks of the update schedule
+SCHEDULE_CHECK_SECONDS = 300
+
 """
 Ethan Penney
 March 18, 2024
 Created a class variant of scraping functions that are threaded and emit signals in tandem with scraping_ui.py to update loading bar. 
+The signals are now plain callbacks, so the update also runs without Qt (see cli.py) - scraping_ui.ScrapingThread
+connects them to its signals.
 """
 
 
-class ScrapingThread(QThread):
-    def __init__(self):
-        super().__init__()
+def no_callback(*args):
+    pass
 
-    def run(self):
-        self.scrapeCRKN()
 
-    progress_update = pyqtSignal(int)
-    file_changes_signal = pyqtSignal(int)
-    error_signal = pyqtSignal(str)
+class CRKNUpdate:
+    # What started the update, recorded in refresh_runs
+    trigger = refresh_schedule.MANUAL
+    # Most bytes per second to download, or None for no limit
+    bandwidth_limit = None
+
+    def __init__(self, progress=None, error=None, confirm=None, access_changes=None):
+        """
+        :param progress: optional function called with (percent, status line)
+        :param error: optional function called with each error message
+        :param confirm: optional function called with the number of files to change before changing them, returning
+                        True to go ahead - without it the update goes ahead without asking
+        :param access_changes: optional function called with the path of the access change report and the number of
+                               changes of each kind
+        """
+        self.on_progress = progress or no_callback
+        self.on_error = error or no_callback
+        self.confirm = confirm
+        self.on_access_changes = access_changes or no_callback
+        # Cancellation, and questions from a thread to the UI
+        self.channel = ResponseChannel()
+        self.reporter = None
+        # Titles added, removed or whose access changed in this update
+        self.access_changes = None
+        # Errors reported, files loaded or removed, and whether the user said no to the update
+        self.errors = []
+        self.files_changed = 0
+        self.declined = False
+
+    def update_database(self):
+        """
+        Run a CRKN update, unless one is already running, and record how it went in refresh_runs.
+        """
+        if not REFRESH_LOCK.acquire(blocking=False):
+            self.report_error("A CRKN update is already running, please try again once it is done."
+                              if settings_manager.get_setting("language") == "English" else
+                              "Une mise à jour du RCDR est déjà en cours, veuillez réessayer une fois terminée.")
+            return
+        self.errors = []
+        self.files_changed = 0
+        self.declined = False
+        started = datetime.now()
+        try:
+            self.scrapeCRKN()
+        except Exception as e:
+            self.errors.append(str(e))
+            raise
+        finally:
+            REFRESH_LOCK.release()
+            self.record_run(started)
+
+    def record_run(self, started):
+        """
+        Record the update in the refresh_runs table, for the start screen and the schedule.
+        :param started: datetime the update started
+        """
+        status = refresh_schedule.run_status(self.errors, self.channel.cancelled or self.declined, self.files_changed)
+        try:
+            connection = database.connect_to_database()
+            try:
+                database.record_refresh_run(connection, self.trigger, started, datetime.now(), status,
+                                            self.files_changed, "\n".join(self.errors))
+            finally:
+                database.close_database(connection)
+        except sqlite3.Error as e:
+            m_logger.error(f"Unable to record the CRKN update: {e}")
+
+    def report_error(self, error_message):
+        self.errors.append(error_message)
+        self.on_error(error_message)
 
     def retry_scrape(self, attempt, max_attempt=3):
         """ Attempt to scrape again if connection is lost in the middle of scraping"""
@@ -43,21 +138,50 @@ class ScrapingThread(QThread):
         time.sleep(1)
         return True
 
+    def make_reporter(self):
+        """
+        Create the progress reporter of a CRKN update - its stages are named in the current language.
+        :return: ProgressReporter
+        """
+        english = settings_manager.get_setting("language") == "English"
+        self.stage_names = {"connect": "Connecting to CRKN" if english else "Connexion au RCDR",
+                            "check": "Checking files" if english else "Vérification des fichiers",
+                            "download": "Downloading files" if english else "Téléchargement des fichiers",
+                            "remove": "Removing files" if english else "Suppression des fichiers"}
+        return ProgressReporter(self.report_progress,
+                                [(self.stage_names["connect"], 5), (self.stage_names["check"], 5),
+                                 (self.stage_names["download"], 80), (self.stage_names["remove"], 10)],
+                                settings_manager.get_setting("language"))
+
+    def report_progress(self, percent, status):
+        self.on_progress(percent, status)
+
     def scrapeCRKN(self):
-        crkn_url = settings_manager.get_setting('CRKN_url')
-        self.progress_update.emit(0)
         """Scrape the CRKN website for listed ebook files."""
+        crkn_url = settings_manager.get_setting('CRKN_url')
         error = ""
         error_message = ""
         attempt = 0
 
         # Show the user scraping has started
-        self.progress_update.emit(5)
+        self.reporter = self.make_reporter()
+
+        # An update that was interrupted is carried on, without reading the CRKN page again
+        connection = database.connect_to_database()
+        journal = RefreshJournal(connection)
+        if journal.resumable():
+            m_logger.info("Carrying on with the interrupted CRKN update")
+            self.refresh(journal, connection)
+            self.finish_update(connection)
+            return
+        database.close_database(connection)
+
+        self.reporter.start(self.stage_names["connect"], 1)
 
         while attempt < 3:
             try:
                 # Make a request to the CRKN website
-                response = requests.get(crkn_url)
+                response = requests.get(crkn_url, timeout=refresh_journal.REQUEST_TIMEOUT_SECONDS)
                 # Check if request was successful (status 200)
                 response.raise_for_status()
                 # If request successful, process text
@@ -113,7 +237,7 @@ class ScrapingThread(QThread):
         # Log and display error message
         if page_text is None:
             m_logger.error(f"An error occurred: {error}")
-            self.error_signal.emit(error_message)
+            self.report_error(error_message)
             return
 
         # Get list of links that end in xlsx, csv, or tsv from the CRKN website link
@@ -121,6 +245,7 @@ class ScrapingThread(QThread):
         links = soup.find_all('a', href=lambda href: href and (href.endswith('.xlsx') or href.endswith('.csv') or href.endswith('.tsv')))
 
         connection = database.connect_to_database()
+        journal = RefreshJournal(connection)
 
         # List of files that need to be updated/added to the local database
         files_to_update = []
@@ -128,107 +253,253 @@ class ScrapingThread(QThread):
         files_to_remove = [file for file in database.get_tables(connection) if not file.startswith("local_")]
 
         # Check if links on CRKN website need to be added/updated in local database
+        self.reporter.start(self.stage_names["check"], len(links))
         i = 0
         for link in links:
             i += 1
-            progress = 10 + int((i / len(links)) * 20)
-            self.progress_update.emit(progress)
+            self.reporter.update(i, 1, "files")
             file_link = link.get("href")
             file_first, file_date = split_CRKN_file_name(file_link)
             result = compare_file([file_first, file_date], "CRKN", connection)
 
             # If result (update or insert into), add to update list
             if result:
-                files_to_update.append([link, result])
+                files_to_update.append([file_link, file_first, file_date, result])
 
             try:
                 files_to_remove.remove(file_first)
             except ValueError:
                 pass
 
-        # Ask user if they want to perform scraping (slightly time-consuming)
-        file_changes = len(files_to_update) + len(files_to_remove)
-        if file_changes > 0:
-            self.file_changes_signal.emit(file_changes)
-            ans = self.wait_for_response()
-            if ans == "Y":
-                if len(files_to_update) > 0:
-                    self.download_files(files_to_update, connection)
-                if len(files_to_remove) > 0:
-                    i = 0
-                    for file in files_to_remove:
-                        i += 1
-                        progress = 90 + int((i / len(files_to_remove)) * 9)
-                        self.progress_update.emit(progress)
-                        update_tables([file], "CRKN", connection, "DELETE")
-
-        # Scrape CRKN institution list from a CRKN file in the database
-        crkn_tables = connection.execute("SELECT file_name FROM CRKN_file_names;").fetchall()
-        # strip the apostrophes/parentheses from formatting
-        crkn_tables = [row[0] for row in crkn_tables]
+        if len(files_to_update) + len(files_to_remove) > 0:
+            confirmed = self.confirm_changes(files_to_update, files_to_remove)
+            if confirmed is not None:
+                # Written down first, so an interrupted update carries on from where it stopped
+                journal.start(*confirmed)
+                self.refresh(journal, connection)
 
-        if len(crkn_tables) > 0:
-            institutions = connection.cursor().execute(f'select * from [{crkn_tables[0]}]')
-            institutions = [description[0] for description in institutions.description[8:-2]]
-        else:
-            institutions = []
-        settings_manager.set_CRKN_institutions(institutions)
+        self.finish_update(connection)
+
+    def confirm_changes(self, files_to_update, files_to_remove):
+        """
+        Ask the user if they want to perform the update (slightly time-consuming).
+        :param files_to_update: list of [file link, file name, date/version, INSERT INTO or UPDATE] to download
+        :param files_to_remove: list of the names of the CRKN files to remove
+        :return: (files to download, files to remove) to go ahead with, or None to leave the database as it is
+        """
+        if self.confirm is None:
+            return files_to_update, files_to_remove
+        try:
+            ans = self.confirm(len(files_to_update) + len(files_to_remove))
+        except RequestCancelled:
+            ans = False
+        if not ans:
+            self.declined = True
+            return None
+        return files_to_update, files_to_remove
+
+    def refresh(self, journal, connection):
+        """
+        Download and remove the files of the journal that are not done yet, then write the access change report.
+        :param journal: RefreshJournal of the update
+        :param connection: database connection object
+        """
+        self.access_changes = AccessChangeReport()
+        files = journal.pending_downloads()
+        if len(files) > 0:
+            self.download_files(files, journal, connection)
+        files_to_remove = journal.pending_removals()
+        if len(files_to_remove) > 0 and not self.channel.cancelled:
+            if self.reporter is None:
+                self.reporter = self.make_reporter()
+            self.reporter.start(self.stage_names["remove"], len(files_to_remove))
+            i = 0
+            for position, file in files_to_remove:
+                if self.channel.cancelled:
+                    break
+                i += 1
+                self.access_changes.compare(connection, file, file, None)
+                if update_tables([file], "CRKN", connection, "DELETE"):
+                    self.access_changes.keep(file)
+                    journal.set_state(position, refresh_journal.LOADED)
+                    self.files_changed += 1
+                else:
+                    self.load_failed(journal, position, file)
+                self.reporter.update(i, 1, "files")
+        if journal.finish():
+            m_logger.info("CRKN update done")
+        self.write_access_changes()
+
+    def finish_update(self, connection):
+        """
+        Update the CRKN institutions from the files in the database, and close the connection.
+        :param connection: database connection object
+        """
+        # CRKN institution list from the institution columns of every CRKN file in the database
+        crkn_tables = connection.execute("SELECT file_name FROM CRKN_file_names;").fetchall()
+        institutions = [institution for row in crkn_tables
+                        for institution in database.get_institution_columns(connection, row[0])]
+        registry.set_CRKN_institutions(institutions, connection)
 
         database.close_database(connection)
-        self.progress_update.emit(100)
+        self.reporter.finish()
 
-    def wait_for_response(self):
-        # This function halts the execution of the thread until response is received
-        self.response = None
-        while self.response is None:
-            self.msleep(100)  # Sleep to avoid busy waiting
-        return self.response
+    def write_access_changes(self):
+        """
+        Write the access change report of the update, and send its path to the UI.
+        """
+        try:
+            path = self.access_changes.write()
+        except OSError as e:
+            m_logger.error(f"Unable to write the access change report: {e}")
+            return
+        if path:
+            self.on_access_changes(path, dict(self.access_changes.counts))
 
-    def receive_response(self, response):
-        self.response = response
+    def cancel(self):
+        # Stops after the chunk being downloaded, and stops waiting for a response
+        self.channel.cancel()
     
-    def download_files(self, files, connection):        
+    def load_failed(self, journal, position, file_name):
+        """
+        Count a file that could not be loaded (see RefreshJournal.fail), and report it once it is rejected.
+        :param journal: RefreshJournal of the update
+        :param position: position of the file in the journal
+        :param file_name: name of the file, for the report
+        """
+        if not journal.fail(position):
+            m_logger.warning(f"{file_name} could not be loaded, it is tried again by the next update")
+            return
+        m_logger.error(f"{file_name} could not be loaded after {refresh_journal.MAX_ATTEMPTS} attempts, so it was not uploaded.")
+        if settings_manager.get_setting("language") == "English":
+            self.report_error(f"{file_name}\nThe file could not be loaded after {refresh_journal.MAX_ATTEMPTS} attempts, so it was not uploaded.")
+        else:
+            self.report_error(f"{file_name}\nLe fichier n'a pas pu être chargé après {refresh_journal.MAX_ATTEMPTS} tentatives, il n'a donc pas été téléversé.")
+
+    def download(self, file, journal, files_done):
+        """
+        Download a file in chunks, carrying on from a partial download, and report the bytes received.
+        :param file: journal entry of the file (see RefreshJournal.pending_downloads)
+        :param journal: RefreshJournal of the update
+        :param files_done: number of files already downloaded, for the progress
+        """
+        def progress(received, length, chunk):
+            fraction = min(received / length, 1.0) if length else 0.0
+            self.reporter.update(files_done + DOWNLOAD_SHARE * fraction, chunk, "bytes")
+
+        os.makedirs(os.path.dirname(file["download_path"]), exist_ok=True)
+        refresh_journal.resume_download(settings_manager.get_setting("CRKN_root_url") + file["file_link"],
+                                        file["download_path"], file["validator"],
+                                        lambda validator: journal.set_validator(file["position"], validator),
+                                        progress, self.bandwidth_limit, self.channel.wait_cancelled)
+        journal.set_state(file["position"], refresh_journal.DOWNLOADED)
+        self.reporter.update(files_done + DOWNLOAD_SHARE)
+
+    def download_files(self, files, journal, connection):
         """
         For all files that need downloading from CRKN, do so and store in local database.
-        :param files: list of files to download from CRKN
+        :param files: journal entries of the files to download from CRKN (see RefreshJournal.pending_downloads)
+        :param journal: RefreshJournal of the update, updated as each file gets further
         :param connection: database connection object
         """
+        # chunked_ingest imports this module
+        from src.data_processing import chunked_ingest
         language = settings_manager.get_setting("language")
+        if self.reporter is None:
+            self.reporter = self.make_reporter()
+        if self.access_changes is None:
+            self.access_changes = AccessChangeReport()
+        self.reporter.start(self.stage_names["download"], len(files))
         try:
             i = 0
-            for [link, command] in files:
+            for file in files:
+                if self.channel.cancelled:
+                    m_logger.info("CRKN update cancelled")
+                    break
                 i += 1
-                progress = 30 + int((i / len(files)) * 30)
-                self.progress_update.emit(progress)
-                file_link = link.get("href")
+                file_link = file["file_link"]
+                position = file["position"]
 
                 # Get which type of file it is (xlsx, csv, or tsv)
                 file_type = file_link.split(".")[-1]
 
                 # Platform, date/version number
-                file_first, file_date = split_CRKN_file_name(file_link)
-
-                # Write file to temporary local file
-                with open(f"{os.path.abspath(os.path.dirname(__file__))}/temp.{file_type}", 'wb') as file:
-                    response = requests.get(settings_manager.get_setting("CRKN_root_url") + file_link)
-                    file.write(response.content)
+                file_first, file_date = file["file_name"], file["file_date"]
+
+                # Write file to the downloads folder, unless it was downloaded before the update was interrupted
+                temp_path = file["download_path"]
+                if file["state"] == refresh_journal.LISTED or not os.path.exists(temp_path):
+                    self.download(file, journal, i - 1)
+
+                # Loaded before the update was interrupted, but not marked as loaded
+                command = file["command"]
+                if file["state"] != refresh_journal.LISTED:
+                    command = compare_file([file_first, file_date], "CRKN", connection)
+                    if not command:
+                        journal.set_state(position, refresh_journal.LOADED)
+                        self.reporter.update(i)
+                        continue
+
+                # Reject a bad header before parsing the whole file
+                valid_header = check_file_header(file_link.split("/")[-1], temp_path)
+                if valid_header is not True:
+                    m_logger.error(f"{file_link.split('/')[-1]} - The file was not in the correct format, so it was not uploaded.\n{valid_header}")
+                    self.report_error(f"{file_link.split('/')[-1]}\nThe file was not in the correct format, so it was not uploaded.\n{valid_header}")
+                    journal.set_state(position, refresh_journal.REJECTED)
+                    self.reporter.update(i)
+                    continue
+
+                # Large CSV/TSV files are checked and loaded a chunk at a time
+                if chunked_ingest.should_stream(temp_path):
+                    valid_format, rows = chunked_ingest.load_file_in_chunks(
+                        file_link.split("/")[-1], temp_path, file_first, connection,
+                        lambda chunk_rows: self.reporter.update(i - 1 + DOWNLOAD_SHARE, chunk_rows, "rows"),
+                        self.access_changes.before_swap(file_first))
+                    if valid_format is True:
+                        if update_tables([file_first, file_date], "CRKN", connection, command):
+                            self.access_changes.keep(file_first)
+                            keep_source(temp_path, "CRKN", file_first, file_date, file_link.split("/")[-1])
+                            journal.set_state(position, refresh_journal.LOADED)
+                            self.files_changed += 1
+                        else:
+                            self.load_failed(journal, position, file_link.split("/")[-1])
+                        self.reporter.update(i)
+                    else:
+                        m_logger.error(f"{file_link.split('/')[-1]} - The file was not in the correct format, so it was not uploaded.\n{valid_format}")
+                        self.report_error(f"{file_link.split('/')[-1]}\nThe file was not in the correct format, so it was not uploaded.\n{valid_format}")
+                        journal.set_state(position, refresh_journal.REJECTED)
+                    continue
 
                 # Convert file into dataframe
                 if file_type == "xlsx":
-                    file_df = file_to_dataframe_excel(file_link.split("/")[-1], f"{os.path.abspath(os.path.dirname(__file__))}/temp.xlsx")
+                    file_df = file_to_dataframe_excel(file_link.split("/")[-1], temp_path)
                 elif file_type == "tsv":
-                    file_df = file_to_dataframe_tsv(file_link.split("/")[-1], f"{os.path.abspath(os.path.dirname(__file__))}/temp.tsv")
+                    file_df = file_to_dataframe_tsv(file_link.split("/")[-1], temp_path)
                 else:
-                    file_df = file_to_dataframe_csv(file_link.split("/")[-1], f"{os.path.abspath(os.path.dirname(__file__))}/temp.csv")
+                    file_df = file_to_dataframe_csv(file_link.split("/")[-1], temp_path)
 
                 # Check if in correct format, if it is, upload and update tables
                 valid_format = check_file_format(file_df)
+                self.reporter.update(i - 1 + PARSE_SHARE)
                 if valid_format is True:
-                    upload_to_database(file_df, file_first, connection)
-                    update_tables([file_first, file_date], "CRKN", connection, command)
+                    journal.set_state(position, refresh_journal.PARSED)
+                    uploaded = upload_to_database(file_df, file_first, connection,
+                                                  self.access_changes.before_swap(file_first))
+                    if uploaded and update_tables([file_first, file_date], "CRKN", connection, command):
+                        self.access_changes.keep(file_first)
+                        keep_source(temp_path, "CRKN", file_first, file_date, file_link.split("/")[-1])
+                        journal.set_state(position, refresh_journal.LOADED)
+                        self.files_changed += 1
+                    else:
+                        self.load_failed(journal, position, file_link.split("/")[-1])
+                    self.reporter.update(i, len(file_df), "rows")
                 else:
                     m_logger.error(f"{file_link.split('/')[-1]} - The file was not in the correct format, so it was not uploaded.\n{valid_format}")
-                    self.error_signal.emit(f"{file_link.split('/')[-1]}\nThe file was not in the correct format, so it was not uploaded.\n{valid_format}")
+                    self.report_error(f"{file_link.split('/')[-1]}\nThe file was not in the correct format, so it was not uploaded.\n{valid_format}")
+                    journal.set_state(position, refresh_journal.REJECTED)
+
+        except refresh_journal.DownloadCancelled:
+            m_logger.info("CRKN update cancelled")
 
         # Handle connection loss in middle of scraping
         except requests.exceptions.HTTPError as http_err:
@@ -238,7 +509,7 @@ class ScrapingThread(QThread):
             else:
                 error_message = ("Erreur de Connexion Internet : La connexion su serveur a été perdue. Tous les fichiers n'ont pas été récupérés. Veuillez réessayer de mettre  à jour RCDR de nouveau.")
             m_logger.error(http_err)
-            self.error_signal.emit(error_message)
+            self.report_error(error_message)
         except requests.exceptions.ConnectionError as conn_err:
             # Handle errors like refused connections
             if language == "English":
@@ -247,7 +518,7 @@ class ScrapingThread(QThread):
                 error_message = (
                     "Erreur de Connexion Internet : La connexion à l'internet a été perdue. Tous les fichiers n'ont pas été récupérés avec succès. Veuillez réessayer de mettre à jour RCDR de nouveau.")
             m_logger.error(conn_err)
-            self.error_signal.emit(error_message)
+            self.report_error(error_message)
         except requests.exceptions.Timeout as timeout_err:
             # Handle request timeout
             if language == "English":
@@ -255,7 +526,7 @@ class ScrapingThread(QThread):
             else:
                 error_message = "Expiration de la Connexion : Le serveur a mis trop de temps à répondre. Tous les fichiers n'ont pas été récupérés avec succès. Veuillez réessayer de mettre  à jour RCDR de nouveau."
             m_logger.error(timeout_err)
-            self.error_signal.emit(error_message)
+            self.report_error(error_message)
         except Exception as e:
             # Handle any other exceptions
             if language == "English":
@@ -264,21 +535,70 @@ class ScrapingThread(QThread):
             else:
                 error_message = "Erreur inattendue : Tous les fichiers n'ont pas été récupérés avec succès. Veuillez réessayer de mettre  à jour RCDR de nouveau."
             m_logger.error(e)
-            self.error_signal.emit(error_message)
+            self.report_error(error_message)
 
-        # Remove temp.xlsx used for uploading files
-        try:
-            os.remove(f"{os.path.abspath(os.path.dirname(__file__))}/temp.xlsx")
-        except FileNotFoundError:
-            pass
+        # The files not loaded yet are kept in the downloads folder, for the next update to carry on with
+
+
+class ScheduledRefresh(CRKNUpdate):
+    """
+    Runs the CRKN update whenever the schedule says it is due (see refresh_schedule.py). Nobody is asked - new and
+    updated files are loaded, and files CRKN no longer lists are removed if the scheduled_refresh_remove_policy
+    setting is Remove. Downloads are held to the bandwidth limit.
+    """
+    trigger = refresh_schedule.SCHEDULED
+
+    def __init__(self, progress=None, error=None, access_changes=None):
+        super().__init__(progress, error, None, access_changes)
+        self.bandwidth_limit = refresh_schedule.bandwidth_limit()
+
+    def run_schedule(self):
+        """
+        Check the schedule every SCHEDULE_CHECK_SECONDS and run the update when it is due, until cancelled.
+        """
+        m_logger.info("Scheduled CRKN updates are on")
+        while True:
+            self.run_if_due()
+            if self.channel.wait_cancelled(SCHEDULE_CHECK_SECONDS):
+                break
+
+    def run_if_due(self):
+        """
+        Run the update if it is due. An error is logged rather than raised, so the next one still runs.
+        :return: True if the update was due and was run
+        """
+        if not self.is_due():
+            return False
+        m_logger.info("Starting the scheduled CRKN update")
         try:
-            os.remove(f"{os.path.abspath(os.path.dirname(__file__))}/temp.csv")
-        except FileNotFoundError:
-            pass
+            self.update_database()
+        except Exception as e:
+            # Already recorded in refresh_runs as Failed
+            m_logger.error(f"The scheduled CRKN update failed: {e}")
+        return True
+
+    def is_due(self):
+        """
+        :return: True if the schedule says an update should start now
+        """
         try:
-            os.remove(f"{os.path.abspath(os.path.dirname(__file__))}/temp.tsv")
-        except FileNotFoundError:
-            pass
+            connection = database.connect_to_database()
+            try:
+                last_run = database.get_last_refresh_run(connection, refresh_schedule.SUCCESSFUL)
+            finally:
+                database.close_database(connection)
+        except sqlite3.Error as e:
+            m_logger.error(f"Unable to check the CRKN update schedule: {e}")
+            return False
+        return refresh_schedule.schedule_due(last_run)
+
+    def confirm_changes(self, files_to_update, files_to_remove):
+        if settings_manager.get_setting("scheduled_refresh_remove_policy") != "Remove" and files_to_remove:
+            m_logger.info(f"Keeping {len(files_to_remove)} CRKN files no longer listed, as set in the settings")
+            files_to_remove = []
+        if not files_to_update and not files_to_remove:
+            return None
+        return files_to_update, files_to_remove
 
 
 def compare_file(file, method, connection):
@@ -322,6 +642,7 @@ def update_tables(file, method, connection, command):
     :param method: CRKN or local
     :param connection: database connection object
     :param command: INSERT INTO, UPDATE, or DELETE
+    :return: True if the tables were updated, False if not
     """
     if method != "CRKN" and method != "local":
         raise Exception("Incorrect method type (CRKN or local) to indicate type/location of file")
@@ -333,25 +654,37 @@ def update_tables(file, method, connection, command):
         if command == "INSERT INTO":
             cursor.execute(f"INSERT INTO {method}_file_names (file_name, file_date) VALUES ('{file[0]}', '{file[1]}')")
             m_logger.info(f"file name inserted - {file[0]}, {file[1]}")
+            changesets.record_load(connection, changesets.file_table_name(file[0], method), method, file[0], file[1])
 
         # File exists, but needs to be updated, change date/version
         elif command == "UPDATE":
             cursor.execute(f"UPDATE {method}_file_names SET file_date = '{file[1]}' WHERE file_name = '{file[0]}';")
             m_logger.info(f"file name updated - {file[0]}, {file[1]}")
+            changesets.record_load(connection, changesets.file_table_name(file[0], method), method, file[0], file[1])
 
         # Delete file from {method}_file_names table and drop the table as well.
         elif command == "DELETE":
             cursor.execute(f"DELETE from {method}_file_names WHERE file_name = '{file[0]}'")
             if method == "CRKN":
                 cursor.execute(f"DROP TABLE {file[0]}")
+                database.delete_title_keys(connection, file[0])
+                database.delete_facets(connection, file[0])
             else:
                 cursor.execute(f"DROP TABLE [local_{file[0]}]")
+                database.delete_title_keys(connection, f"local_{file[0]}")
+                database.delete_facets(connection, f"local_{file[0]}")
+            changesets.record_delete(connection, changesets.file_table_name(file[0], method), method, file[0])
         # Commit changes on successful operation
         connection.commit()
+        if command == "DELETE":
+            # A rebuild from the source store does not load it again
+            retire_source(method, file[0])
+        return True
     except Exception as e:
         # Rollback if changes fail
         connection.rollback()
         m_logger.error(f"Failed to {command} data for {file[0]}: {e}. Database remains unchanged")
+        return False
 
 
 def split_CRKN_file_name(file_name):
@@ -461,31 +794,127 @@ def file_to_dataframe_tsv(file_name, file):
         return "PA-Rights"
 
 
-def upload_to_database(df, table_name, connection):
+def read_file_header(file_name, file):
     """
-    Upload file dataframe to table in database.
+    Read only the platform cell (A1) and the header row of a local file, without parsing its data.
+    Excel files are opened read-only so only the first rows of the sheet are loaded.
+    :param file_name: the file name being uploaded (name.ext)
+    :param file: local file to read
+    :return: dataframe with the header row as its columns (plus Platform and File_Name) and no rows, or error string
+             (same as file_to_dataframe_*)
+    """
+    file_type = file_name.split(".")[-1].lower()
+    try:
+        if file_type == "xlsx":
+            workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+            try:
+                if "PA-Rights" not in workbook.sheetnames:
+                    m_logger.error("Incorrect sheet name in excel file (PA-Rights did not exist).")
+                    return "PA-Rights"
+                rows = [list(row) for row in workbook["PA-Rights"].iter_rows(max_row=HEADER_ROWS, values_only=True)]
+            finally:
+                workbook.close()
+            header = rows[-1] if len(rows) == HEADER_ROWS else []
+            # Trailing empty cells are not columns, as in pd.read_excel
+            while header and header[-1] is None:
+                header.pop()
+            platform = rows[0][0] if rows and rows[0] else None
+        else:
+            rows = pd.read_csv(file, sep=TEXT_SEPARATORS.get(file_type, ","), header=None, nrows=HEADER_ROWS,
+                               dtype=str)
+            header = rows.iloc[-1].to_list() if len(rows) == HEADER_ROWS else []
+            platform = rows.iat[0, 0] if len(rows) else None
+    except Exception as e:
+        m_logger.error(f"Unable to read the header of {file_name}: {e}")
+        return "PA-Rights"
+
+    if platform is None or pd.isna(platform):
+        m_logger.error("File to Dataframe failed - No Platform listed.")
+        return "No Platform"
+    return pd.DataFrame(columns=header + ["Platform", "File_Name"])
+
+
+def check_file_header(file_name, file):
+    """
+    Check the platform cell, the fixed header columns and the institution columns of a file from its first rows,
+    so a badly formatted file is rejected before it is parsed. Passing does not check the data rows - use
+    check_file_format on the full file for that.
+    :param file_name: the file name being uploaded (name.ext)
+    :param file: local file to check
+    :return: True if valid, error string if not (same as check_file_format)
+    """
+    start = time.perf_counter()
+    valid_header = check_file_format(read_file_header(file_name, file))
+    m_logger.info(f"Checked header of {file_name} in {(time.perf_counter() - start) * 1000:.1f}ms")
+    return valid_header
+
+
+def upload_to_database(df, table_name, connection, before_swap=None):
+    """
+    Upload file dataframe to table in database. The rows are written to a staging table that then replaces the table.
     :param df: dataframe with data
     :param table_name: table to insert data into
     :param connection: database connection object
+    :param before_swap: optional function called with (connection, table name, staging table name) before the
+                        staging table replaces the table
+    :return: True if the data was uploaded, False if not
     """
-
+    staging_table = f"staging_{table_name}"
     try:
         df.to_sql(
-            name=table_name,
+            name=staging_table,
             con=connection,
             if_exists="replace",
             index=False
         )
-        cursor = connection.cursor()
-        # Fixes the date format in the database directly; removes the seconds
-        cursor.execute(f'''UPDATE {table_name}
-                    SET title_metadata_last_modified = strftime('%Y-%m-%d', title_metadata_last_modified)''')
-
+        swap_table(staging_table, table_name, connection, before_swap)
         connection.commit()
+        return True
     except Exception as e:
         # Rollback in case of error
         connection.rollback()
+        connection.execute(f"DROP TABLE IF EXISTS [{staging_table}];")
+        connection.commit()
         m_logger.error(f"Failed to upload data to {table_name}: {e}. Database remains unchanged.")
+        return False
+
+
+def swap_table(staging_table, table_name, connection, before_swap=None):
+    """
+    Replace a file table with a newly loaded staging table in one transaction, and finish it (see prepare_table).
+    Does not commit.
+    :param staging_table: name of the staging table
+    :param table_name: name of the file table, which may not exist yet
+    :param connection: database connection object
+    :param before_swap: optional function called with (connection, table name, staging table name) first, while
+                        both tables are there
+    """
+    if before_swap is not None:
+        before_swap(connection, table_name, staging_table)
+    if not connection.in_transaction:
+        connection.execute("BEGIN")
+    connection.execute(f"DROP TABLE IF EXISTS [{table_name}];")
+    connection.execute(f"ALTER TABLE [{staging_table}] RENAME TO [{table_name}];")
+    prepare_table(table_name, connection)
+
+
+def prepare_table(table_name, connection, title_keys=None):
+    """
+    Finish a newly loaded file table - fix its dates and build its title keys, facet counts and indexes.
+    Does not commit.
+    :param table_name: name of the file table
+    :param connection: database connection object
+    :param title_keys: optional iterable of (rowid, title key) already built for the table
+    """
+    cursor = connection.cursor()
+    # Fixes the date format in the database directly; removes the seconds
+    cursor.execute(f'''UPDATE [{table_name}]
+                SET title_metadata_last_modified = strftime('%Y-%m-%d', title_metadata_last_modified)''')
+
+    # Normalized title keys for accent/case-insensitive Title searches, facet counts and identifier indexes
+    database.index_title_keys(connection, table_name, title_keys)
+    database.index_facets(connection, table_name)
+    database.create_search_indexes(connection, table_name)
 
 
 def check_file_format(file_df):
@@ -507,6 +936,13 @@ def check_file_format(file_df):
         if len(headers) < 8:
             m_logger.error("Missing columns in the header row")
             return f"Missing columns in the header row."
+        # Institution columns become table columns, whose names are not case sensitive
+        seen = set()
+        for header in headers[8:-2]:
+            if str(header).lower() in seen:
+                m_logger.error("Duplicate column in the header row")
+                return f"Duplicate column '{header}' in the header row."
+            seen.add(str(header).lower())
 
         # Title, ISBN and Y/N Column complete
         df_series = file_df.count()
@@ -0,0 +1,183 @@
+"""
+Access changes of a CRKN update - which titles were added or removed, and which gained or lost perpetual access for
+the institutions followed.
+
+When a CRKN file replaces its table (see Scraping.swap_table), the old table and the new one are both in the database
+for a moment. Each is read once, grouped by title identifier (the eISBN and OCN, or the title and publisher if a row
+has neither - see changesets.row_identifier) as it is read, with only the identifier, title and institution columns,
+and the two are joined on a dictionary of identifiers:
+- Added: a title only in the new table
+- Removed: a title only in the old table, or in a CRKN file that was removed
+- Access changed: a title in both whose Y/N changed for one of the institutions
+A title with several rows has access if any of them is Y.
+
+The changes of a file are kept once its table has been replaced, and those of the whole update are written to one
+CSV file (see streaming_export.py), in the access_change_folder setting or an access_changes folder next to the
+database. The institutions followed are the access_change_institutions setting, or the selected institution.
+"""
+from collections import Counter
+from datetime import datetime
+import os
+from src.data_processing.changesets import row_identifier, table_exists
+from src.utility.logger import m_logger
+from src.utility.settings_manager import Settings
+from src.utility.streaming_export import cursor_rows, write_rows
+
+settings_manager = Settings()
+
+ADDED = "Added"
+REMOVED = "Removed"
+ACCESS_CHANGED = "Access changed"
+
+# Columns of the report before the institution columns
+REPORT_COLUMNS = ["File_Name", "Change", "Title", "Publisher", "Platform_eISBN", "OCN"]
+
+TITLE_COLUMNS = ["Title", "Publisher", "Platform_eISBN", "OCN"]
+
+
+def report_institutions():
+    """
+    :return: list of the institutions whose access changes are reported
+    """
+    institutions = settings_manager.get_setting("access_change_institutions")
+    if institutions:
+        return list(institutions)
+    institution = settings_manager.get_setting("institution")
+    return [institution] if institution else []
+
+
+def report_folder():
+    """
+    :return: folder the access change reports are written to
+    """
+    folder = settings_manager.get_setting("access_change_folder")
+    if folder:
+        return folder
+    return os.path.join(os.path.dirname(os.path.abspath(settings_manager.get_setting("database_name"))),
+                        "access_changes")
+
+
+def read_access(connection, table_name, institutions):
+    """
+    Read the titles of a file table and whether each institution has access to them.
+    :param connection: database connection object
+    :param table_name: name of the file table, or None
+    :param institutions: list of institution names
+    :return: dictionary of identifier: (title columns, access), access being a tuple with 1/0 (True/False) for each
+             institution, or None for an institution the table has no column for
+    """
+    if table_name is None or not table_exists(connection, table_name):
+        return {}
+    columns = [row[1] for row in connection.execute(f"PRAGMA table_info([{table_name}]);").fetchall()]
+    titles = ", ".join(f"[{column}]" if column in columns else "NULL" for column in TITLE_COLUMNS)
+    access = "".join(f", ifnull([{institution}], '') = 'Y'" if institution in columns else ", NULL"
+                     for institution in institutions)
+    cursor = connection.execute(f"SELECT {titles}{access} FROM [{table_name}];")
+    fixed = len(TITLE_COLUMNS)
+    # Grouped here rather than with GROUP BY, which sorts the whole table
+    found = {}
+    for row in cursor_rows(cursor):
+        title_name, publisher, isbn, ocn = row[:fixed]
+        identifier = row_identifier(isbn, ocn, title_name, publisher)
+        title = found.get(identifier)
+        if title is None:
+            found[identifier] = (row[:fixed], row[fixed:])
+        elif row[fixed:] != title[1]:
+            found[identifier] = (title[0], tuple(None if was is None else bool(was or now)
+                                                 for was, now in zip(title[1], row[fixed:])))
+    return found
+
+
+def access_value(value):
+    """
+    :param value: access from read_access - true, false or None
+    :return: Y, N, or an empty string for an institution without a column
+    """
+    if value is None:
+        return ""
+    return "Y" if value else "N"
+
+
+def compare_access(old, new):
+    """
+    Join the titles of two versions of a file table on their identifiers.
+    :param old: read_access of the old table
+    :param new: read_access of the new table
+    :return: list of (change, title columns, access values) - access values being Y, N or "old → new" for each
+             institution
+    """
+    changes = []
+    for identifier, (titles, access) in new.items():
+        before = old.get(identifier)
+        if before is None:
+            changes.append((ADDED, titles, [access_value(value) for value in access]))
+        elif any(bool(was) != bool(now) for was, now in zip(before[1], access)):
+            changes.append((ACCESS_CHANGED, titles,
+                            [access_value(now) if bool(was) == bool(now)
+                             else f"{access_value(was) or 'N'} → {access_value(now) or 'N'}"
+                             for was, now in zip(before[1], access)]))
+    for identifier, (titles, access) in old.items():
+        if identifier not in new:
+            changes.append((REMOVED, titles, [access_value(value) for value in access]))
+    return changes
+
+
+class AccessChangeReport:
+    """
+    Collects the access changes of the files of a CRKN update.
+    """
+
+    def __init__(self, institutions=None):
+        """
+        :param institutions: list of the institutions to report on, by default report_institutions()
+        """
+        self.institutions = report_institutions() if institutions is None else list(institutions)
+        # File name: changes computed before its table was replaced
+        self.pending = {}
+        self.rows = []
+        self.counts = Counter()
+
+    def compare(self, connection, file_name, old_table, new_table):
+        """
+        Compare two versions of a file's table. The changes are kept once keep() is called, after the table has
+        been replaced.
+        :param connection: database connection object
+        :param file_name: name of the file, for the report
+        :param old_table: name of the table being replaced, which may not exist yet
+        :param new_table: name of the table replacing it, or None if the file is removed
+        """
+        self.pending[file_name] = compare_access(read_access(connection, old_table, self.institutions),
+                                                 read_access(connection, new_table, self.institutions))
+
+    def before_swap(self, file_name):
+        """
+        :param file_name: name of the file
+        :return: function to give Scraping.upload_to_database or chunked_ingest.load_file_in_chunks as before_swap
+        """
+        return lambda connection, table_name, staging_table: self.compare(connection, file_name, table_name,
+                                                                          staging_table)
+
+    def keep(self, file_name):
+        """
+        Keep the changes of a file once its table has been replaced.
+        :param file_name: name of the file
+        """
+        for change, titles, access in self.pending.pop(file_name, []):
+            self.rows.append([file_name, change, *titles, *access])
+            self.counts[change] += 1
+
+    def write(self, folder=None):
+        """
+        Write the changes kept to a CSV file named after the current time.
+        :param folder: folder of the file, by default report_folder()
+        :return: path of the file, or None if there were no changes
+        """
+        if not self.rows:
+            return None
+        folder = folder or report_folder()
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"access_changes_{datetime.now().strftime('%Y-%m-%d_%H%M%S')}.csv")
+        write_rows(self.rows, REPORT_COLUMNS + self.institutions, path, "csv")
+        m_logger.info(f"Access changes written to {path}: {self.counts[ADDED]} added, {self.counts[REMOVED]} "
+                      f"removed, {self.counts[ACCESS_CHANGED]} access changed")
+        return path
@@ -0,0 +1,773 @@
+"""
+Changesets - keeping the file tables of several workstations in sync without copying the whole database.
+
+Every load and removal of a file table (see Scraping.update_tables) is recorded in the changesets table (see
+database.py), in the same transaction:
+- LOAD: the keys of the rows removed, the rows added, and the changed columns of the rows changed, with the columns
+  of the table and its digest before and after
+- DELETE: the table was removed
+Rows are matched by key - their normalized eISBN and OCN (or title and publisher if they have neither, see
+row_identifier) and their occurrence among the rows with those - and compared by a 32-bit hash of each of their columns as of the last changeset
+(changeset_rows), so no copy of the file tables is kept. The columns are hashed a block of rows at a time with
+pandas' hash_array, which gives the same hashes on every workstation. The hashes of the values most columns have
+(blank, Y and N - the institution columns) and the most frequent values of the table are kept as 4 bits
+(compact_hashes). The first changeset of a table
+has no base and holds every row.
+The same row diff adds a version of each row added or changed to the history of the table, and ends the versions
+of the rows removed or changed (see history.py).
+
+The changesets are exported to a file and applied on another workstation in order. An export can hold only the
+changesets made after a sequence, by default the last one exported for the same workstation (changeset_exports).
+Applying is idempotent:
+- a changeset whose id is already there (made there or applied before) is skipped
+- a LOAD is applied if the table is in the state it was based on, skipped if the table is already in the state it
+  leads to, and refused otherwise - the workstations have diverged and one needs a snapshot (see snapshot.py).
+  A LOAD with no base replaces the table whatever its state
+- a DELETE removes the table if it is there
+Each changeset is applied in its own transaction, and the table it gives is checked against its digest. Its table
+is created from its column names and types (database.create_table_sql).
+"""
+from datetime import datetime
+from collections import Counter
+import gzip
+import hashlib
+import itertools
+import json
+import os
+import struct
+import uuid
+import zlib
+import numpy as np
+import pandas as pd
+from src.data_processing import database, history
+from src.data_processing.institutions import registry, CRKN, LOCAL
+from src.data_processing.normalization import canonical_isbn, normalize_identifier
+from src.utility.logger import m_logger
+from src.utility.streaming_export import cursor_rows
+
+LOAD = "LOAD"
+DELETE = "DELETE"
+
+CHANGESET_VERSION = 1
+
+# Columns the key of a row is made of
+KEY_COLUMNS = ["Platform_eISBN", "OCN", "Title", "Publisher"]
+
+# Rows hashed at a time
+HASH_ROWS = 10000
+
+# Rowids looked up in one statement, under SQLite's limit on the number of variables
+MAX_VARIABLES = 900
+
+
+class ChangesetError(Exception):
+    """
+    Raised when a changeset file can not be read or a changeset does not fit the database.
+    """
+
+
+def hash_columns(columns):
+    """
+    Hash every value of a block of rows, one column at a time.
+    :param columns: list of the columns of the rows, each a sequence of values
+    :return: list of the column hashes of each row, as bytes
+    """
+    hashes = np.column_stack([pd.util.hash_array(np.array(column, dtype=object), categorize=False)
+                              for column in columns])
+    return [row.tobytes() for row in (hashes & 0xFFFFFFFF).astype("<u4")]
+
+
+def unpack_hashes(hashes):
+    """
+    :param hashes: column hashes of a row, as bytes
+    :return: tuple of the hash of each column
+    """
+    return struct.unpack(f"<{len(hashes) // 4}I", hashes)
+
+
+# Hash of a column a row does not have, so adding an empty column does not change the rows
+MISSING_HASH = unpack_hashes(hash_columns([(None,)])[0])[0]
+
+# Values kept as 4 bits in changeset_rows, by their hash - the bits are their position in the values of the table
+COMMON_VALUES = (None, "", "Y", "N")
+COMMON_HASHES = hash_columns([COMMON_VALUES])
+# Other values of a table kept as 4 bits - its most frequent ones, e.g. its Platform and File_Name, picked from its
+# first rows when its state is first saved
+TABLE_VALUES = 11
+SAMPLE_ROWS = 1000
+# Bits of any other value, whose hash follows
+OTHER_VALUE = 0xF
+
+
+def frequent_hashes(rows):
+    """
+    :param rows: {key: column hashes} of the rows of a file table
+    :return: list of the hashes, as bytes, of the values of the table kept as 4 bits besides the COMMON_VALUES
+    """
+    counts = Counter()
+    for hashes in itertools.islice(rows.values(), SAMPLE_ROWS):
+        counts.update(hashes[position:position + 4] for position in range(0, len(hashes), 4))
+    return [value for value, count in counts.most_common(len(COMMON_HASHES) + TABLE_VALUES)
+            if count > 1 and value not in COMMON_HASHES][:TABLE_VALUES]
+
+
+def compact_hashes(hashes, values):
+    """
+    Get the column hashes of a row as they are kept in changeset_rows - 4 bits for each column, the position of its
+    hash in values or OTHER_VALUE, then the 4 byte hashes of the other values.
+    :param hashes: column hashes of a row, as bytes
+    :param values: {hash: position} of the values of the table kept as 4 bits
+    :return: bytes
+    """
+    codes = []
+    others = bytearray()
+    for position in range(0, len(hashes), 4):
+        value = hashes[position:position + 4]
+        code = values.get(value)
+        if code is None:
+            code = OTHER_VALUE
+            others += value
+        codes.append(code)
+    if len(codes) % 2:
+        codes.append(0)
+    return bytes(codes[i] << 4 | codes[i + 1] for i in range(0, len(codes), 2)) + bytes(others)
+
+
+def expand_hashes(compact, count, values):
+    """
+    :param compact: column hashes of a row as kept in changeset_rows, from compact_hashes
+    :param count: number of columns of the row
+    :param values: list of the hashes of the values of the table kept as 4 bits
+    :return: column hashes of the row, as bytes
+    """
+    hashes = bytearray()
+    position = (count + 1) // 2
+    for column in range(count):
+        code = compact[column // 2] >> 4 if column % 2 == 0 else compact[column // 2] & 0xF
+        if code == OTHER_VALUE:
+            hashes += compact[position:position + 4]
+            position += 4
+        else:
+            hashes += values[code]
+    return bytes(hashes)
+
+
+def table_values(table_hashes):
+    """
+    :param table_hashes: the frequent_hashes of a table, joined as kept in changeset_tables
+    :return: list of the hashes of the values of the table kept as 4 bits
+    """
+    return COMMON_HASHES + [table_hashes[position:position + 4] for position in range(0, len(table_hashes), 4)]
+
+
+def key_columns_sql(columns):
+    """
+    :param columns: column names of a file table
+    :return: SQL of the KEY_COLUMNS, NULL for the ones the table does not have
+    """
+    return ", ".join(f"[{column}]" if column in columns else "NULL" for column in KEY_COLUMNS)
+
+
+def row_identifier(isbn, ocn, title, publisher):
+    """
+    Identify a row by its eISBN (as ISBN-13) and OCN, or its title and publisher if it has neither. The identifiers
+    are normalized, so a row gets the same identifier however a file writes them (hyphens, ISBN-10, number or text).
+    :param isbn: Platform_eISBN value
+    :param ocn: OCN value
+    :param title: Title value
+    :param publisher: Publisher value
+    :return: identifier string
+    """
+    isbn = canonical_isbn(isbn)
+    ocn = normalize_identifier(ocn)
+    if isbn or ocn:
+        return f"id:{isbn}|{ocn}"
+    return f"title:{'' if title is None else title}|{'' if publisher is None else publisher}"
+
+
+def file_table_name(file_name, method):
+    """
+    :param file_name: name in the {method}_file_names table
+    :param method: CRKN or local
+    :return: name of the file table
+    """
+    return file_name if method == CRKN else f"local_{file_name}"
+
+
+def table_exists(connection, table_name):
+    """
+    :param connection: database connection object
+    :param table_name: name of the table
+    :return: True if the table exists
+    """
+    return connection.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name = ?;",
+                              (table_name,)).fetchone() is not None
+
+
+def table_columns(connection, table_name):
+    """
+    :param connection: database connection object
+    :param table_name: name of the table
+    :return: list of [name, declared type] of its columns
+    """
+    return [[row[1], row[2]] for row in connection.execute(f"PRAGMA table_info([{table_name}]);").fetchall()]
+
+
+def read_rows(connection, table_name):
+    """
+    Key the rows of a file table and hash their columns. Rows with the same identifiers are numbered in the order of
+    their hashes, so the keys do not depend on the order of the rows.
+    :param connection: database connection object
+    :param table_name: name of the file table
+    :return: tuple of (column names, {key: column hashes}, {key: rowid})
+    """
+    columns = [row[1] for row in connection.execute(f"PRAGMA table_info([{table_name}]);").fetchall()]
+    cursor = connection.execute(f"SELECT rowid, {key_columns_sql(columns)}, * FROM [{table_name}];")
+    fixed = 1 + len(KEY_COLUMNS)
+    first = {}
+    repeated = {}
+    while True:
+        block = cursor.fetchmany(HASH_ROWS)
+        if not block:
+            break
+        values = list(zip(*block))
+        identifiers = [row_identifier(*row[1:fixed]) for row in block]
+        for identifier, hashes, rowid in zip(identifiers, hash_columns(values[fixed:]), values[0]):
+            if identifier in first:
+                repeated.setdefault(identifier, []).append((hashes, rowid))
+            else:
+                first[identifier] = (hashes, rowid)
+
+    rows = {}
+    rowids = {}
+    for identifier, (hashes, rowid) in first.items():
+        if identifier in repeated:
+            group = sorted([(hashes, rowid)] + repeated[identifier])
+        else:
+            group = [(hashes, rowid)]
+        for occurrence, (hashes, rowid) in enumerate(group, 1):
+            key = f"{identifier}#{occurrence}"
+            rows[key] = hashes
+            rowids[key] = rowid
+    return columns, rows, rowids
+
+
+def state_digest(columns, rows):
+    """
+    :param columns: column names of a file table
+    :param rows: {key: column hashes} of its rows
+    :return: SHA-256 of the columns and rows, whatever their order
+    """
+    digest = hashlib.sha256(json.dumps(columns).encode("utf-8"))
+    for key in sorted(rows):
+        digest.update(key.encode("utf-8") + b"\0" + rows[key])
+    return digest.hexdigest()
+
+
+def load_state(connection, table_name):
+    """
+    Read the state of a file table as of its last changeset.
+    :param connection: database connection object
+    :param table_name: name of the file table
+    :return: tuple of (column names, digest, {key: column hashes}) - (None, None, {}) if it has no changeset
+    """
+    row = connection.execute("""SELECT table_id, columns, digest, common_hashes FROM changeset_tables
+                                WHERE file_table = ?;""", (table_name,)).fetchone()
+    if row is None:
+        return None, None, {}
+    columns = json.loads(row[1])
+    values = table_values(row[3])
+    rows = {key: expand_hashes(compact, len(columns), values) for key, compact in connection.execute(
+        "SELECT row_key, column_hashes FROM changeset_rows WHERE table_id = ?;", (row[0],))}
+    return columns, row[2], rows
+
+
+def save_state(connection, table_name, columns, digest, rows, old_rows):
+    """
+    Write the state of a file table, only changing the rows that changed. Does not commit.
+    :param connection: database connection object
+    :param table_name: name of the file table
+    :param columns: column names
+    :param digest: digest of the columns and rows
+    :param rows: {key: column hashes} of the rows
+    :param old_rows: {key: column hashes} of the rows as of the last state
+    """
+    row = connection.execute("SELECT table_id, common_hashes FROM changeset_tables WHERE file_table = ?;",
+                             (table_name,)).fetchone()
+    if row is None:
+        table_hashes = b"".join(frequent_hashes(rows))
+        table_id = connection.execute("""INSERT INTO changeset_tables (file_table, columns, digest, common_hashes)
+                                         VALUES (?, ?, ?, ?);""",
+                                      (table_name, json.dumps(columns), digest, table_hashes)).lastrowid
+    else:
+        # The rows not changed are kept as they are, so the table keeps its id and values
+        table_id, table_hashes = row
+        connection.execute("UPDATE changeset_tables SET columns = ?, digest = ? WHERE table_id = ?;",
+                           (json.dumps(columns), digest, table_id))
+    values = {hashes: code for code, hashes in enumerate(table_values(table_hashes))}
+    connection.executemany("DELETE FROM changeset_rows WHERE table_id = ? AND row_key = ?;",
+                           [(table_id, key) for key in old_rows if key not in rows])
+    connection.executemany("INSERT OR REPLACE INTO changeset_rows (table_id, row_key, column_hashes) VALUES (?, ?, ?);",
+                           [(table_id, key, compact_hashes(hashes, values)) for key, hashes in rows.items()
+                            if old_rows.get(key) != hashes])
+
+
+def delete_state(connection, table_name):
+    """
+    Remove the state of a file table. Does not commit.
+    :param connection: database connection object
+    :param table_name: name of the file table
+    """
+    connection.execute("""DELETE FROM changeset_rows WHERE table_id IN (
+                          SELECT table_id FROM changeset_tables WHERE file_table = ?);""", (table_name,))
+    connection.execute("DELETE FROM changeset_tables WHERE file_table = ?;", (table_name,))
+
+
+def rebuild_state(connection, tables, when=None):
+    """
+    Replace the state of every file table with the state of the given tables as they are now, e.g. after a snapshot
+    was imported, and record the rows that changed in the history. Does not commit.
+    :param connection: database connection object
+    :param tables: names of the file tables
+    :param when: time of the change, ISO string, by default now
+    """
+    when = when or datetime.now().isoformat(timespec="seconds")
+    for table, in connection.execute("SELECT file_table FROM changeset_tables;").fetchall():
+        if table not in tables:
+            delete_state(connection, table)
+    for table, in connection.execute("SELECT DISTINCT file_table FROM title_history WHERE valid_to IS NULL;").fetchall():
+        if table not in tables:
+            history.close_table(connection, table, when)
+    for table in tables:
+        old_columns, base, old_rows = load_state(connection, table)
+        columns, rows, rowids = read_rows(connection, table)
+        removed, added, changed = diff_rows(old_columns, old_rows, columns, rows)
+        record_history(connection, table, columns, rows, rowids, removed, added, changed, when, replace=base is None)
+        save_state(connection, table, columns, state_digest(columns, rows), rows, old_rows)
+
+
+def changed_columns(old_columns, old_hashes, columns, hashes):
+    """
+    :param old_columns: column names of the row before
+    :param old_hashes: column hashes of the row before
+    :param columns: column names of the row now
+    :param hashes: column hashes of the row now
+    :return: list of the names of the columns whose value changed or that were added with a value
+    """
+    before = dict(zip(old_columns, unpack_hashes(old_hashes)))
+    return [column for column, value in zip(columns, unpack_hashes(hashes)) if before.get(column, MISSING_HASH) != value]
+
+
+def diff_rows(old_columns, old_rows, columns, rows):
+    """
+    :param old_columns: column names of a file table as of its last state
+    :param old_rows: {key: column hashes} of its rows as of its last state
+    :param columns: column names of the table now
+    :param rows: {key: column hashes} of its rows now
+    :return: tuple of (keys of the rows removed, keys of the rows added, {key: changed column names} of the rows
+             changed)
+    """
+    removed = [key for key in old_rows if key not in rows]
+    added = [key for key in rows if key not in old_rows]
+    changed = {}
+    for key, hashes in rows.items():
+        old_hashes = old_rows.get(key)
+        if old_hashes is not None and (old_hashes != hashes or old_columns != columns):
+            names = changed_columns(old_columns, old_hashes, columns, hashes)
+            if names:
+                changed[key] = names
+    return removed, added, changed
+
+
+def read_values(connection, table_name, keys, rowids, total):
+    """
+    Read the values of some rows of a file table - by rowid if there are few of them, else in one pass.
+    :param connection: database connection object
+    :param table_name: name of the file table
+    :param keys: keys of the rows
+    :param rowids: {key: rowid} of the rows of the table
+    :param total: number of rows of the table
+    :return: {key: tuple of the row values}
+    """
+    wanted = {rowids[key]: key for key in keys}
+    values = {}
+    if len(wanted) * 10 < total:
+        ids = list(wanted)
+        for start in range(0, len(ids), MAX_VARIABLES):
+            block = ids[start:start + MAX_VARIABLES]
+            for row in connection.execute(f"SELECT rowid, * FROM [{table_name}] WHERE rowid IN "
+                                          f"({', '.join('?' * len(block))});", block):
+                values[wanted[row[0]]] = row[1:]
+    elif wanted:
+        for row in cursor_rows(connection.execute(f"SELECT rowid, * FROM [{table_name}];")):
+            key = wanted.get(row[0])
+            if key is not None:
+                values[key] = row[1:]
+    return values
+
+
+def record_history(connection, table_name, columns, rows, rowids, removed, added, changed, when, values=None,
+                   replace=False):
+    """
+    Add versions of the rows of a file table that changed to its history (see history.py). Does not commit.
+    :param connection: database connection object
+    :param table_name: name of the file table
+    :param columns: column names of the table
+    :param rows: {key: column hashes} of its rows
+    :param rowids: {key: rowid} of its rows
+    :param removed: keys of the rows removed
+    :param added: keys of the rows added
+    :param changed: {key: changed column names} of the rows changed
+    :param when: time of the changes, ISO string
+    :param values: {key: row values} already read, the others are read from the table
+    :param replace: True if the rows before are not known - every row gets a new version
+    """
+    # A table loaded before the history was kept gets a version of every row
+    replace = replace or not history.has_versions(connection, table_name)
+    keys = list(rows) if replace else list(added) + list(changed)
+    values = dict(values or {})
+    missing = [key for key in keys if key not in values]
+    if missing:
+        values.update(read_values(connection, table_name, missing, rowids, len(rows)))
+    history.record_changes(connection, table_name, columns, removed, changed, {key: values[key] for key in keys},
+                           when, replace)
+
+
+def insert_changeset(connection, changeset, body, applied=None):
+    """
+    Add a changeset to the changesets table. Does not commit.
+    :param connection: database connection object
+    :param changeset: changeset dictionary - id, created, file_table, method, file_name, file_date, operation
+    :param body: body dictionary
+    :param applied: when it was applied, for a changeset from another workstation
+    """
+    connection.execute("""INSERT INTO changesets (changeset_id, created, file_table, method, file_name, file_date,
+                          operation, body, applied) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);""",
+                       (changeset["id"], changeset["created"], changeset["file_table"], changeset["method"],
+                        changeset["file_name"], changeset["file_date"], changeset["operation"],
+                        zlib.compress(json.dumps(body).encode("utf-8")), applied))
+
+
+def new_changeset(table_name, method, file_name, file_date, operation):
+    """
+    :param table_name: name of the file table
+    :param method: CRKN or local
+    :param file_name: name in the {method}_file_names table
+    :param file_date: date/version in the {method}_file_names table, None for a DELETE
+    :param operation: LOAD or DELETE
+    :return: changeset dictionary with a new id
+    """
+    return {"id": uuid.uuid4().hex, "created": datetime.now().isoformat(timespec="seconds"), "file_table": table_name,
+            "method": method, "file_name": file_name, "file_date": file_date, "operation": operation}
+
+
+def record_load(connection, table_name, method, file_name, file_date):
+    """
+    Record the changes of a file table since its last changeset, once it has been loaded. Does not commit.
+    :param connection: database connection object
+    :param table_name: name of the file table
+    :param method: CRKN or local
+    :param file_name: name in the {method}_file_names table
+    :param file_date: date/version in the {method}_file_names table
+    :return: changeset dictionary
+    """
+    old_columns, base, old_rows = load_state(connection, table_name)
+    columns, rows, rowids = read_rows(connection, table_name)
+    digest = state_digest(columns, rows)
+
+    if base is None:
+        removed, added, changed = [], list(rows), {}
+    else:
+        removed, added, changed = diff_rows(old_columns, old_rows, columns, rows)
+
+    values = read_values(connection, table_name, added + list(changed), rowids, len(rows))
+    positions = {column: position for position, column in enumerate(columns)}
+    body = {"columns": table_columns(connection, table_name), "base": base, "digest": digest, "removed": removed,
+            "added": {key: list(values[key]) for key in added},
+            "changed": {key: {column: values[key][positions[column]] for column in names}
+                        for key, names in changed.items()}}
+
+    changeset = new_changeset(table_name, method, file_name, file_date, LOAD)
+    insert_changeset(connection, changeset, body)
+    record_history(connection, table_name, columns, rows, rowids, removed, added, changed, changeset["created"],
+                   values, replace=base is None)
+    save_state(connection, table_name, columns, digest, rows, old_rows)
+    m_logger.info(f"Changeset of {table_name}: {len(added)} rows added, {len(changed)} changed, "
+                  f"{len(removed)} removed")
+    return changeset
+
+
+def record_delete(connection, table_name, method, file_name):
+    """
+    Record the removal of a file table. Does not commit.
+    :param connection: database connection object
+    :param table_name: name of the file table
+    :param method: CRKN or local
+    :param file_name: name in the {method}_file_names table
+    :return: changeset dictionary
+    """
+    changeset = new_changeset(table_name, method, file_name, None, DELETE)
+    insert_changeset(connection, changeset, {})
+    delete_state(connection, table_name)
+    history.close_table(connection, table_name, changeset["created"])
+    return changeset
+
+
+def get_export_sequence(connection, peer):
+    """
+    :param connection: database connection object
+    :param peer: name of another workstation
+    :return: sequence of the last changeset exported for it, 0 if none were
+    """
+    row = connection.execute("SELECT sequence FROM changeset_exports WHERE peer = ?;", (peer,)).fetchone()
+    return row[0] if row else 0
+
+
+def export_changesets(connection, path, since=None, peer=None):
+    """
+    Write the changesets of the database made after a sequence, the ones made here and the ones applied from other
+    workstations, to a gzip-compressed file of one JSON object per line - a header, then the changesets in order.
+    :param connection: database connection object
+    :param path: path of the file, replaced if it exists
+    :param since: sequence of the last changeset the other workstation has, 0 for all of them - by default the last
+                  one exported for peer, or 0
+    :param peer: optional name of the workstation the file is for - the last changeset written is kept for it
+    :return: number of changesets written
+    """
+    if since is None:
+        since = get_export_sequence(connection, peer) if peer else 0
+    count, last = connection.execute("SELECT COUNT(*), MAX(sequence) FROM changesets WHERE sequence > ?;",
+                                     (since,)).fetchone()
+    last = last or since
+    directory, name = os.path.split(os.path.abspath(path))
+    partial = os.path.join(directory, f".{name}.part")
+    cursor = connection.execute("""SELECT changeset_id, created, file_table, method, file_name, file_date, operation,
+                                   body FROM changesets WHERE sequence > ? ORDER BY sequence;""", (since,))
+    try:
+        with gzip.open(partial, "wt", encoding="utf-8") as file:
+            file.write(json.dumps({"version": CHANGESET_VERSION, "created": datetime.now().isoformat(timespec="seconds"),
+                                   "changesets": count, "since": since, "last_sequence": last}) + "\n")
+            for changeset_id, created, file_table, method, file_name, file_date, operation, body in cursor_rows(cursor):
+                file.write(json.dumps({"id": changeset_id, "created": created, "file_table": file_table,
+                                       "method": method, "file_name": file_name, "file_date": file_date,
+                                       "operation": operation, "body": json.loads(zlib.decompress(body))}) + "\n")
+        os.replace(partial, path)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    if peer:
+        connection.execute("INSERT OR REPLACE INTO changeset_exports (peer, sequence, exported) VALUES (?, ?, ?);",
+                           (peer, last, datetime.now().isoformat(timespec="seconds")))
+        connection.commit()
+    m_logger.info(f"Exported {count} changesets made after {since} to {path}")
+    return count
+
+
+def read_changesets(path):
+    """
+    Read a changeset file.
+    :param path: path of the file
+    :return: tuple of (header dictionary, generator of changeset dictionaries)
+    :raise ChangesetError: if it is not a changeset file or is of a newer version
+    """
+    try:
+        file = gzip.open(path, "rt", encoding="utf-8")
+        header = json.loads(file.readline())
+    except (OSError, ValueError, EOFError) as e:
+        raise ChangesetError(f"Not a changeset file: {e}")
+    if not isinstance(header, dict) or "changesets" not in header:
+        file.close()
+        raise ChangesetError("Not a changeset file.")
+    if header.get("version", 0) > CHANGESET_VERSION:
+        file.close()
+        raise ChangesetError("These changesets were made by a newer version and can not be applied.")
+
+    def changesets():
+        with file:
+            try:
+                for line in file:
+                    if line.strip():
+                        yield json.loads(line)
+            except (OSError, ValueError, EOFError) as e:
+                raise ChangesetError(f"Unable to read the changesets: {e}")
+
+    return header, changesets()
+
+
+def apply_changesets(connection, path, progress=None):
+    """
+    Apply the changesets of a file, in order. The changesets applied before one that does not fit stay applied.
+    :param connection: database connection object
+    :param path: path of the changeset file
+    :param progress: optional function called with (changesets done, number of changesets)
+    :return: tuple of (changesets applied, changesets skipped)
+    :raise ChangesetError: if the file can not be read or a changeset does not fit the database
+    """
+    header, changesets = read_changesets(path)
+    applied = skipped = 0
+    sources = set()
+    try:
+        for done, changeset in enumerate(changesets, 1):
+            if apply_changeset(connection, changeset):
+                applied += 1
+                sources.add(changeset["method"])
+            else:
+                skipped += 1
+            if progress:
+                progress(done, header["changesets"])
+    finally:
+        changesets.close()
+        update_registry(connection, sources)
+
+    m_logger.info(f"Changesets of {path}: {applied} applied, {skipped} skipped")
+    return applied, skipped
+
+
+def update_registry(connection, sources):
+    """
+    Add the institutions of the tables changed by changesets to the registry.
+    :param connection: database connection object
+    :param sources: set of the methods (CRKN, local) of the changesets applied
+    """
+    if CRKN in sources:
+        crkn_tables = connection.execute("SELECT file_name FROM CRKN_file_names;").fetchall()
+        registry.set_CRKN_institutions([institution for row in crkn_tables
+                                        for institution in database.get_institution_columns(connection, row[0])],
+                                       connection)
+    if LOCAL in sources:
+        registry.add([institution for table in database.get_local_tables(connection)
+                      for institution in database.get_institution_columns(connection, table)], LOCAL, connection)
+
+
+def apply_changeset(connection, changeset):
+    """
+    Apply one changeset in its own transaction and record it.
+    :param connection: database connection object
+    :param changeset: changeset dictionary, as read from a changeset file
+    :return: True if the database was changed, False if the changeset was already applied
+    :raise ChangesetError: if the changeset is not valid or does not fit the database
+    """
+    try:
+        changeset_id = changeset["id"]
+        method = changeset["method"]
+        table_name = changeset["file_table"]
+        operation = changeset["operation"]
+        body = changeset["body"]
+    except (KeyError, TypeError):
+        raise ChangesetError("A changeset of the file is not valid.")
+    if (method not in (CRKN, LOCAL) or operation not in (LOAD, DELETE)
+            or table_name != file_table_name(changeset.get("file_name"), method)):
+        raise ChangesetError(f"Changeset {changeset_id} is not valid.")
+
+    if connection.execute("SELECT 1 FROM changesets WHERE changeset_id = ?;", (changeset_id,)).fetchone():
+        return False
+
+    if connection.in_transaction:
+        connection.commit()
+    connection.execute("BEGIN")
+    try:
+        if operation == LOAD:
+            changed = apply_load(connection, changeset, body)
+        else:
+            changed = apply_delete(connection, changeset)
+        insert_changeset(connection, changeset, body, datetime.now().isoformat(timespec="seconds"))
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+    return changed
+
+
+def apply_load(connection, changeset, body):
+    """
+    Rebuild a file table from its rows and a LOAD changeset. Does not commit.
+    :param connection: database connection object
+    :param changeset: changeset dictionary
+    :param body: body of the changeset
+    :return: True if the table was changed, False if it was already in the state the changeset leads to
+    :raise ChangesetError: if the table is not in the state the changeset is based on
+    """
+    # Scraping imports this module
+    from src.data_processing import Scraping
+
+    table_name = changeset["file_table"]
+    method = changeset["method"]
+    _, _, old_rows = load_state(connection, table_name)
+    exists = table_exists(connection, table_name)
+    old_columns, rows, rowids = read_rows(connection, table_name) if exists else ([], {}, {})
+    digest = state_digest(old_columns, rows) if exists else None
+    if digest == body["digest"]:
+        save_state(connection, table_name, old_columns, digest, rows, old_rows)
+        return False
+    if body["base"] is not None and digest != body["base"]:
+        raise ChangesetError(f"{table_name} is not in the state changeset {changeset['id']} was made from - "
+                             f"import a snapshot of the other workstation first.")
+
+    columns = [name for name, _ in body["columns"]]
+    staging_table = f"staging_{table_name}"
+    try:
+        create_sql = database.create_table_sql(staging_table, body["columns"])
+    except (ValueError, TypeError) as e:
+        raise ChangesetError(f"Changeset {changeset['id']} is not valid: {e}")
+    connection.execute(f"DROP TABLE IF EXISTS [{staging_table}];")
+    connection.execute(create_sql)
+    insert = (f"INSERT INTO [{staging_table}] ({', '.join(f'[{name}]' for name in columns)}) "
+              f"VALUES ({', '.join('?' * len(columns))});")
+    if exists and body["base"] is not None:
+        # The rows kept, with their changed columns
+        removed = set(body["removed"])
+        changed = body["changed"]
+        keys = {rowid: key for key, rowid in rowids.items()}
+
+        def kept_rows():
+            for row in cursor_rows(connection.execute(f"SELECT rowid, * FROM [{table_name}];")):
+                key = keys[row[0]]
+                if key not in removed:
+                    values = dict(zip(old_columns, row[1:]))
+                    values.update(changed.get(key, {}))
+                    yield [values.get(column) for column in columns]
+
+        connection.executemany(insert, kept_rows())
+    connection.executemany(insert, body["added"].values())
+
+    if exists:
+        connection.execute(f"DROP TABLE [{table_name}];")
+        database.delete_title_keys(connection, table_name)
+        database.delete_facets(connection, table_name)
+    connection.execute(f"ALTER TABLE [{staging_table}] RENAME TO [{table_name}];")
+    Scraping.prepare_table(table_name, connection)
+    connection.execute(f"DELETE FROM {method}_file_names WHERE file_name = ?;", (changeset["file_name"],))
+    connection.execute(f"INSERT INTO {method}_file_names (file_name, file_date) VALUES (?, ?);",
+                       (changeset["file_name"], changeset["file_date"]))
+    database.mark_data_changed(connection)
+
+    new_columns, new_rows, new_rowids = read_rows(connection, table_name)
+    if state_digest(new_columns, new_rows) != body["digest"]:
+        raise ChangesetError(f"Changeset {changeset['id']} did not give the rows of {table_name} it was made from.")
+    # Versions dated as on the workstation the changeset was made on
+    record_history(connection, table_name, new_columns, new_rows, new_rowids, body["removed"], body["added"],
+                   body["changed"], changeset["created"], replace=not exists or body["base"] is None)
+    save_state(connection, table_name, new_columns, body["digest"], new_rows, old_rows)
+    m_logger.info(f"Applied changeset {changeset['id']} to {table_name}")
+    return True
+
+
+def apply_delete(connection, changeset):
+    """
+    Remove a file table for a DELETE changeset. Does not commit.
+    :param connection: database connection object
+    :param changeset: changeset dictionary
+    :return: True if the table was removed, False if it was not there
+    """
+    table_name = changeset["file_table"]
+    exists = table_exists(connection, table_name)
+    if exists:
+        connection.execute(f"DROP TABLE [{table_name}];")
+        database.delete_title_keys(connection, table_name)
+        database.delete_facets(connection, table_name)
+    connection.execute(f"DELETE FROM {changeset['method']}_file_names WHERE file_name = ?;", (changeset["file_name"],))
+    delete_state(connection, table_name)
+    history.close_table(connection, table_name, changeset["created"])
+    m_logger.info(f"Applied changeset {changeset['id']}, {table_name} removed")
+    return exists
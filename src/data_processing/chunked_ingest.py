@@ -0,0 +1,225 @@
+"""
+Constant-memory ingest of large CSV/TSV files.
+
+Scraping.file_to_dataframe_csv/_tsv read the whole file and then rebuild it around the header row, so a large file
+takes several times its size in memory. Here the platform cell (A1) and the header row are read first, then the
+rows are read, checked with Scraping.check_file_format and loaded a chunk at a time. Chunks go into a staging table
+that only replaces the file table once every chunk has passed, so a bad row near the end of a file leaves the
+database as it was.
+
+Chunk sizes start at the ingest_chunk_rows setting and are lowered if a chunk would use more than its share of the
+ingest_memory_budget_mb setting.
+"""
+import os
+import sys
+import pandas as pd
+from src.data_processing import Scraping
+from src.utility.logger import m_logger
+from src.utility.settings_manager import Settings
+
+settings_manager = Settings()
+
+# File extensions that can be read in chunks, and their separators
+CHUNKED_SEPARATORS = {"csv": ",", "tsv": "\t"}
+
+# Rough ratio of the memory a file takes once parsed to its size on disk - larger files are read in chunks
+PARSE_EXPANSION = 5
+
+# Share of the memory budget a chunk's dataframe can use - the rest covers parsing buffers and the SQL insert
+CHUNK_BUDGET_SHARE = 0.25
+
+# Fewest rows read at a time, whatever the budget
+MIN_CHUNK_ROWS = 1000
+
+# Rows before the data - the platform in A1, a second row, then the header row
+HEAD_ROWS = 3
+
+
+def peak_rss():
+    """
+    Get the peak resident memory of this process.
+    :return: bytes, or None if it can not be measured on this platform (the resource module is Unix only)
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def memory_budget():
+    """
+    :return: ingest memory budget in bytes
+    """
+    return float(settings_manager.get_setting("ingest_memory_budget_mb")) * 1024 * 1024
+
+
+def should_stream(file_path):
+    """
+    Check if a file should be read in chunks - a CSV or TSV file too large to parse whole within the memory budget.
+    :param file_path: path to the file
+    :return: True or False
+    """
+    extension = file_path.split(".")[-1].lower()
+    if extension not in CHUNKED_SEPARATORS:
+        return False
+    return os.path.getsize(file_path) * PARSE_EXPANSION > memory_budget()
+
+
+class ChunkedFile:
+    """
+    A CSV/TSV file read a chunk of rows at a time, each chunk laid out like the dataframes of
+    Scraping.file_to_dataframe_csv (header row as the columns, plus Platform and File_Name).
+    """
+
+    def __init__(self, file_name, file_path):
+        """
+        :param file_name: the file name being uploaded (name.ext)
+        :param file_path: path to the file
+        """
+        self.file_name = file_name
+        self.file_path = file_path
+        self.chunk_rows = int(settings_manager.get_setting("ingest_chunk_rows"))
+        self.rows = 0
+        self.reader = None
+        self.platform = None
+        self.headers = []
+
+    def open(self):
+        """
+        Read the platform cell and the header row.
+        :return: True, or the error string of Scraping.file_to_dataframe_csv (No Platform, PA-Rights)
+        """
+        separator = CHUNKED_SEPARATORS[self.file_path.split(".")[-1].lower()]
+        try:
+            # Every value is read as text, the same as a whole-file read where each column holds its header
+            self.reader = pd.read_csv(self.file_path, sep=separator, header=None, dtype=str, iterator=True)
+            head = self.reader.get_chunk(HEAD_ROWS)
+        except Exception as e:
+            m_logger.error(f"File to Dataframe failed - Unable to read file: {e}")
+            self.close()
+            return "PA-Rights"
+        if len(head) < HEAD_ROWS or pd.isna(head.iat[0, 0]):
+            m_logger.error("File to Dataframe failed - No Platform listed.")
+            self.close()
+            return "No Platform"
+        self.platform = head.iat[0, 0]
+        self.headers = head.iloc[2].to_list()
+        return True
+
+    def chunks(self):
+        """
+        Read the rows a chunk at a time.
+        :return: generator of dataframes
+        """
+        budget = memory_budget() * CHUNK_BUDGET_SHARE
+        chunk_rows = self.chunk_rows
+        while True:
+            try:
+                chunk = self.reader.get_chunk(chunk_rows)
+            except StopIteration:
+                return
+            chunk.columns = self.headers
+            chunk["Platform"] = self.platform
+            chunk["File_Name"] = self.file_name
+            chunk.index = range(self.rows, self.rows + len(chunk))
+            self.rows += len(chunk)
+
+            # Fewer rows next time if this chunk went over its share of the budget
+            row_bytes = chunk.memory_usage(deep=True).sum() / max(len(chunk), 1)
+            chunk_rows = max(MIN_CHUNK_ROWS, min(self.chunk_rows, int(budget / row_bytes)))
+            yield chunk
+
+    def close(self):
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+
+
+def validate_file_in_chunks(file_name, file_path, report=None):
+    """
+    Check a whole file with Scraping.check_file_format, one chunk at a time, without keeping the rows.
+    :param file_name: the file name being uploaded (name.ext)
+    :param file_path: path to the file
+    :param report: optional quality_report.QualityReport - every chunk is added to it, even after an invalid one
+    :return: tuple of (True or error string, number of rows, header row)
+    """
+    chunked_file = ChunkedFile(file_name, file_path)
+    opened = chunked_file.open()
+    if opened is not True:
+        return Scraping.check_file_format(opened), 0, []
+    valid_file = True
+    try:
+        for chunk in chunked_file.chunks():
+            if valid_file is True:
+                valid_file = Scraping.check_file_format(chunk)
+            if report is not None:
+                report.check(chunk)
+            elif valid_file is not True:
+                break
+        return valid_file, chunked_file.rows, chunked_file.headers + ["Platform", "File_Name"]
+    finally:
+        chunked_file.close()
+
+
+def load_file_in_chunks(file_name, file_path, table_name, connection, progress=None, before_swap=None):
+    """
+    Check and load a file one chunk at a time into a staging table, then replace the file table with it.
+    The file table is only replaced if every chunk is valid.
+    :param file_name: the file name being uploaded (name.ext)
+    :param file_path: path to the file
+    :param table_name: file table to replace
+    :param connection: database connection object
+    :param progress: optional function called with the number of rows of each chunk once it is loaded
+    :param before_swap: optional function called with (connection, table name, staging table name) before the
+                        staging table replaces the file table
+    :return: tuple of (True or error string, number of rows)
+    """
+    staging_table = f"staging_{table_name}"
+    chunked_file = ChunkedFile(file_name, file_path)
+    opened = chunked_file.open()
+    if opened is not True:
+        return Scraping.check_file_format(opened), 0
+
+    try:
+        connection.execute(f"DROP TABLE IF EXISTS [{staging_table}];")
+        for chunk in chunked_file.chunks():
+            valid_file = Scraping.check_file_format(chunk)
+            if valid_file is not True:
+                discard_staging_table(staging_table, connection)
+                return valid_file, chunked_file.rows
+            chunk.to_sql(name=staging_table, con=connection, if_exists="append", index=False)
+            if progress:
+                progress(len(chunk))
+        if chunked_file.rows == 0:
+            # A file with no rows still gets its table
+            pd.DataFrame(columns=chunked_file.headers + ["Platform", "File_Name"]).to_sql(
+                name=staging_table, con=connection, if_exists="append", index=False)
+
+        # Swap the tables in one transaction
+        Scraping.swap_table(staging_table, table_name, connection, before_swap)
+        connection.commit()
+    except Exception as e:
+        m_logger.error(f"Failed to upload data to {table_name}: {e}. Database remains unchanged.")
+        discard_staging_table(staging_table, connection)
+        return f"An error occurred during file processing: {e}", chunked_file.rows
+    finally:
+        chunked_file.close()
+
+    peak = peak_rss()
+    m_logger.info(f"Loaded {chunked_file.rows} rows of {file_name} in chunks"
+                  + (f", peak memory {peak / 1024 / 1024:.0f} MB" if peak else ""))
+    return True, chunked_file.rows
+
+
+def discard_staging_table(staging_table, connection):
+    """
+    Roll back and drop the staging table of a failed chunked load.
+    :param staging_table: name of the staging table
+    :param connection: database connection object
+    """
+    connection.rollback()
+    connection.execute(f"DROP TABLE IF EXISTS [{staging_table}];")
+    connection.commit()
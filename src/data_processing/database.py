@@ -12,18 +12,126 @@ Table 2: local_file_names: (file_name, file_date)
         - file_name = entire file name that is uploaded (without the extension)
         - file_date = the actual date that the file was uploaded to the database
 
+Table 3: title_keys: (file_table, row_id, title_key)
+        - Normalized title keys (see normalization.py) for every row of every file table, built at ingest
+        - file_table = actual table name of the file table (including "local_" for local files)
+        - row_id = rowid of the row in that file table
+        - title_key = normalized title, indexed for exact and prefix Title searches
+
+Table 4: title_key_ids: (key_id, title_key)
+        - Every distinct title key, with an id that is used as the rowid of title_trigrams
+        - Keys are removed once no file table has them anymore
+
+Table 5: title_trigrams: FTS5 virtual table (title_key), tokenize='trigram'
+        - Trigram index of the distinct title keys (padded with a space on each side) for fuzzy Title searches
+        - rowid = key_id from title_key_ids
+        - title_trigram_vocab is the fts5vocab table over it, giving how many keys contain each trigram
+        - Not created if the SQLite library has no FTS5 trigram tokenizer - fuzzy searches then scan title_key_ids
+
+Table 6: data_version: (version)
+        - Single row counter, increased every time a file table is loaded or removed
+        - Lets in-memory structures built from the file tables (e.g. search suggestions) know to rebuild
+
+Table 7: facet_counts: (facet, value, file_table, count)
+        - Number of rows of each file table per Platform, Publisher, collection_name and Platform_YOP value
+        - Built at ingest and removed with the file table, so facet totals never need a GROUP BY over the file tables
+
+Table 8: watched_files: (path, size, mtime_ns, sha256, status, checked)
+        - Every file seen in the watch folder (see watch_folder.py) and what happened to it
+        - size/mtime_ns = file size and modification time when it was last processed - a file is processed again
+          once they change
+        - sha256 = hash of the file contents, a file with the same contents as a loaded file is skipped
+        - status = Loaded, Duplicate, or the reason the file was not uploaded (see batch_upload.py)
+
+Table 9: institutions: (institution_id, name, source)
+        - Every known institution (see institutions.py), the institution columns of the file tables
+        - institution_id = stable id, kept as long as the institution is known
+        - source = CRKN (a column of the CRKN files, replaced after each CRKN update) or local (added by a local
+          upload or the user)
+
+Table 10: institution_aliases: (alias, institution_id)
+        - Other names of an institution, e.g. an older spelling used in some files
+
+Table 11: changesets: (sequence, changeset_id, created, file_table, method, file_name, file_date, operation, body,
+                       applied)
+        - Every load and removal of a file table, as a changeset that can be applied on another workstation
+          (see changesets.py)
+        - changeset_id = unique id, the same on every workstation it is applied on
+        - operation = LOAD or DELETE
+        - body = zlib-compressed JSON of the rows removed, added and changed (changed columns only)
+        - applied = when it was applied, for changesets from another workstation, NULL for the ones made here
+
+Table 12: changeset_tables: (table_id, file_table, columns, digest, common_hashes)
+        - Columns and digest of each file table as of its last changeset, the base of its next one
+        - table_id = id of the file table in changeset_rows
+        - common_hashes = hashes of the most frequent values of the table, kept as 4 bits in changeset_rows
+
+Table 13: changeset_rows: (table_id, row_key, column_hashes)
+        - Key (identifiers and occurrence) and hash of each column of every row as of the last changeset,
+          so the next one only holds what changed
+        - column_hashes = 4 bits per column for the values most columns have (blank, Y, N and the common_hashes of
+          the table), and the 4 byte hash of the other values (see changesets.compact_hashes)
+
+Table 14: title_history: (history_id, file_table, row_key, isbn, ocn, valid_from, valid_to, columns_id,
+                          row_values)
+        - Every version of every row of the file tables (see history.py) - a row only gets a new version when it
+          changes
+        - isbn/ocn = eISBN as ISBN-13 and OCN of the row, NULL if it has none
+        - valid_from/valid_to = when the version was loaded and replaced, valid_to is NULL for current versions
+        - columns_id = columns of the table when the version was loaded, in history_columns
+        - row_values = JSON list of the values of the row when it was added, or JSON of column: value of only the
+          columns that changed since its previous version. Versions recorded before columns_id was added have
+          columns_id NULL and every column: value
+
+Table 15: refresh_journal: (position, file_link, file_name, file_date, command, state, download_path, validator,
+                            attempts, started, updated)
+        - The files of the last CRKN update and how far each one got, so an interrupted update carries on where it
+          stopped (see refresh_journal.py) - empty once an update is done
+        - command = INSERT INTO, UPDATE, or DELETE for a file to remove
+        - state = Listed, Downloaded, Parsed, Loaded or Rejected
+        - validator = ETag or Last-Modified of a file being downloaded, to continue it with a Range request
+        - attempts = number of times the file failed to load, it is Rejected after MAX_ATTEMPTS
+
+Table 16: refresh_runs: (run_id, trigger, started, finished, seconds, status, files_changed, detail)
+        - Every CRKN update, started by the user or by the schedule (see refresh_schedule.py)
+        - trigger = Manual or Scheduled
+        - status = Completed, Up to date, Cancelled or Failed, with the error in detail
+
+Table 17: title_key_setting: (strip_articles)
+        - Single row, the strip_title_articles setting ("True"/"False") the title keys were built with
+        - Search terms are normalized the same way, and the keys are built again when the setting changes
+          (see update_title_keys)
+
+Table 18: changeset_exports: (peer, sequence, exported)
+        - The last changeset exported for each other workstation, so the next export only holds the ones made since
+          (see changesets.export_changesets)
+        - peer = name of the other workstation, sequence = sequence in changesets
+
+Table 19: history_columns: (columns_id, columns)
+        - Every list of column names a file table had when rows of it got a version, as JSON, so they are not
+          repeated in each version
+
 Other Tables:
         - All other tables are tables listed in the two tables above
         - For CRKN_file_names - direct references (file_name)
         - For local_file_names - "local_" + file_name
 """
 
+from contextlib import contextmanager
+import os
+import pathlib
+import re
 import sqlite3
+from src.data_processing.normalization import (normalize_title, prefix_upper_bound, trigrams, trigram_similarity,
+                                               normalize_identifier, LEADING_ARTICLES)
 from src.utility.logger import m_logger
 from src.utility.settings_manager import Settings
 
 settings_manager = Settings()
 
+# Declared types the columns of file tables can be created with - the ones DataFrame.to_sql uses, and none
+COLUMN_TYPES = ("TEXT", "INTEGER", "REAL", "TIMESTAMP", "DATE", "TIME", "")
+
 
 def connect_to_database():
     """
@@ -35,6 +143,77 @@ def connect_to_database():
     return sqlite3.connect(database_name)
 
 
+class BatchConnection(sqlite3.Connection):
+    """
+    Connection for loading several files in a row. Inside transaction(), commit() and rollback() calls made by the
+    helpers (and by DataFrame.to_sql) are held back, so everything done for one file is committed or rolled back
+    as a whole.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.in_transaction_block = False
+        self.failed = False
+
+    def commit(self):
+        if not self.in_transaction_block:
+            super().commit()
+
+    def rollback(self):
+        if self.in_transaction_block:
+            # A helper failed - the whole transaction is rolled back when the block ends
+            self.failed = True
+        else:
+            super().rollback()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run a block in one transaction. Yields a list that is set to [True] if the transaction was committed, or
+        [False] if anything in the block failed or called rollback().
+        """
+        committed = [False]
+        if self.in_transaction:
+            super().commit()
+        self.execute("BEGIN")
+        self.in_transaction_block = True
+        self.failed = False
+        try:
+            yield committed
+        except Exception as e:
+            m_logger.error(f"Transaction failed: {e}")
+            self.failed = True
+        finally:
+            self.in_transaction_block = False
+            if self.failed:
+                super().rollback()
+            else:
+                super().commit()
+                committed[0] = True
+
+
+def connect_for_batch():
+    """
+    Connect to local database with a BatchConnection, for loading several files through one connection.
+    :return: database connection object
+    """
+    m_logger.info(f"Opening batch connection to the database.")
+    database_name = settings_manager.get_setting('database_name')
+    return sqlite3.connect(database_name, factory=BatchConnection)
+
+
+def connect_read_only():
+    """
+    Connect to local database read-only, for the search API (see search_api.py). The connection can be used from any
+    thread, one thread at a time.
+    :return: database connection object
+    """
+    m_logger.info(f"Opening read-only connection to the database.")
+    database_name = settings_manager.get_setting('database_name')
+    return sqlite3.connect(f"{pathlib.Path(os.path.abspath(database_name)).as_uri()}?mode=ro", uri=True,
+                           check_same_thread=False)
+
+
 def close_database(connection):
     """
     Close connection to local database.
@@ -80,6 +259,35 @@ def get_tables(connection):
     return get_CRKN_tables(connection) + get_local_tables(connection)
 
 
+def get_all_tables(connection):
+    """
+    Gets the names of all file tables, including CRKN tables when allow_CRKN is False. For maintenance.
+    :param connection: database connection object
+    :return: list of all CRKN/local file name tables
+    """
+    crkn_tables = connection.execute("SELECT file_name FROM CRKN_file_names;").fetchall()
+    return [row[0] for row in crkn_tables] + get_local_tables(connection)
+
+
+def get_data_signature(connection):
+    """
+    Get a value that changes whenever file tables are added, replaced or removed (or allow_CRKN changes).
+    Used to know when in-memory data built from the database is out of date.
+    :param connection: database connection object
+    :return: tuple signature of the current data
+    """
+    version = connection.execute("SELECT version FROM data_version;").fetchone()[0]
+    return settings_manager.get_setting("allow_CRKN"), version
+
+
+def mark_data_changed(connection):
+    """
+    Increase the data version, so anything built from the file tables knows to rebuild. Does not commit.
+    :param connection: database connection object
+    """
+    connection.execute("UPDATE data_version SET version = version + 1;")
+
+
 def create_file_name_tables(connection):
     """
     Create default database tables - CRKN_file_names and local_file_names
@@ -110,6 +318,29 @@ def create_file_name_tables(connection):
         if not list_of_tables:
             m_logger.info("local_file_names table does not exist, creating new one")
             cursor.execute("CREATE TABLE local_file_names(file_name VARCHAR(255), file_date VARCHAR(255));")
+
+        list_of_tables = cursor.execute(
+            """SELECT name FROM sqlite_master WHERE type='table'
+            AND name='data_version'; """).fetchall()
+
+        # If table does not exist, create the data version counter
+        if not list_of_tables:
+            m_logger.info("data_version table does not exist, creating new one")
+            cursor.execute("CREATE TABLE data_version(version INTEGER);")
+            cursor.execute("INSERT INTO data_version (version) VALUES (0);")
+
+        create_title_key_table(connection)
+        update_title_keys(connection)
+        create_facet_table(connection)
+        create_watch_table(connection)
+        create_institution_tables(connection)
+        create_changeset_tables(connection)
+        create_history_table(connection)
+        create_refresh_journal_table(connection)
+        create_refresh_run_table(connection)
+        # Identifier indexes for file tables loaded before they were added
+        for table in get_all_tables(connection):
+            create_search_indexes(connection, table)
         # Commit changes
         connection.commit()
     except sqlite3.Error as e:
@@ -118,48 +349,734 @@ def create_file_name_tables(connection):
         connection.rollback()
 
 
-def search_database(connection, query, terms, searchTypes):
+# Number of trigrams of a fuzzy search used to find candidates - the rarest ones pick out matches best
+FUZZY_QUERY_TRIGRAMS = 8
+
+
+def create_title_key_table(connection):
+    """
+    Create the title_keys, title_key_ids and title_trigrams tables and their indexes if they do not exist yet.
+    If the keys are new, they are built for any file tables that were loaded before they existed.
+    :param connection: database connection object
+    """
+    existing = [row[0] for row in connection.execute(
+        """SELECT name FROM sqlite_master WHERE type='table'
+        AND name IN ('title_keys', 'title_key_ids', 'title_trigrams', 'title_key_setting');""").fetchall()]
+
+    if "title_keys" not in existing:
+        m_logger.info("title_keys table does not exist, creating new one")
+        connection.execute("CREATE TABLE title_keys(file_table VARCHAR(255), row_id INTEGER, title_key TEXT);")
+        connection.execute("CREATE INDEX title_keys_lookup ON title_keys(title_key, file_table);")
+        connection.execute("CREATE INDEX title_keys_file_table ON title_keys(file_table);")
+    if "title_key_ids" not in existing:
+        m_logger.info("title_key_ids table does not exist, creating new one")
+        connection.execute("CREATE TABLE title_key_ids(key_id INTEGER PRIMARY KEY, title_key TEXT UNIQUE);")
+    if "title_trigrams" not in existing:
+        try:
+            connection.execute("CREATE VIRTUAL TABLE title_trigrams USING fts5(title_key, tokenize='trigram', detail='none');")
+            connection.execute("CREATE VIRTUAL TABLE title_trigram_vocab USING fts5vocab(title_trigrams, 'row');")
+            m_logger.info("title_trigrams table does not exist, creating new one")
+            # Keys that are already there (the table is new, but the keys are not)
+            connection.execute("INSERT INTO title_trigrams (rowid, title_key) SELECT key_id, ' ' || title_key || ' ' FROM title_key_ids;")
+        except sqlite3.OperationalError as e:
+            m_logger.warning(f"SQLite has no FTS5 trigram tokenizer, fuzzy Title searches will scan all titles: {e}")
+    if "title_key_setting" not in existing:
+        m_logger.info("title_key_setting table does not exist, creating new one")
+        connection.execute("CREATE TABLE title_key_setting(strip_articles TEXT);")
+        # Keys that are already there were built with the current setting
+        connection.execute("INSERT INTO title_key_setting (strip_articles) VALUES (?);",
+                           (settings_manager.get_setting("strip_title_articles"),))
+    if "title_keys" in existing and "title_key_ids" in existing:
+        return
+
+    # Existing database from before title keys - build them for every file table
+    for table in get_all_tables(connection):
+        index_title_keys(connection, table)
+
+
+def get_title_key_articles(connection):
+    """
+    Check if the title keys were built with leading articles stripped - search terms are normalized the same way,
+    even if the strip_title_articles setting changed since (until update_title_keys builds them again).
+    :param connection: database connection object
+    :return: True if leading articles are stripped from the title keys
+    """
+    row = connection.execute("SELECT strip_articles FROM title_key_setting;").fetchone()
+    return (row[0] if row else settings_manager.get_setting("strip_title_articles")) == "True"
+
+
+def update_title_keys(connection):
+    """
+    Build the title keys of every file table again if the strip_title_articles setting changed since they were
+    built. Does not commit.
+    :param connection: database connection object
+    :return: True if the keys were built again
+    """
+    setting = settings_manager.get_setting("strip_title_articles")
+    if connection.execute("SELECT strip_articles FROM title_key_setting;").fetchone()[0] == setting:
+        return False
+    m_logger.info(f"strip_title_articles changed to {setting}, building the title keys again")
+    connection.execute("UPDATE title_key_setting SET strip_articles = ?;", (setting,))
+    for table in get_all_tables(connection):
+        index_title_keys(connection, table)
+    # Suggestions and cached searches are built again too
+    mark_data_changed(connection)
+    return True
+
+
+def has_trigram_index(connection):
+    """
+    Check if the title_trigrams FTS5 index exists (it needs SQLite's trigram tokenizer).
+    :param connection: database connection object
+    :return: True if it exists, else False
+    """
+    return bool(connection.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name='title_trigrams';").fetchall())
+
+
+def index_title_keys(connection, table_name, keys=None):
+    """
+    Build the normalized title keys for every row of a file table, replacing any existing keys for it, and add
+    keys that are new to the database to the trigram index. Does not commit - called as part of the upload that
+    created the table.
+    :param connection: database connection object
+    :param table_name: name of the file table
+    :param keys: optional iterable of (rowid, title key) already built for the table (e.g. from a snapshot), used
+                 instead of normalizing every title again
+    """
+    delete_title_keys(connection, table_name)
+    if keys is None:
+        strip_articles = get_title_key_articles(connection)
+        rows = connection.execute(f"SELECT rowid, Title FROM [{table_name}];")
+        keys = ((row_id, normalize_title(title, strip_articles)) for row_id, title in rows)
+    connection.executemany("INSERT INTO title_keys (file_table, row_id, title_key) VALUES (?, ?, ?);",
+                           ((table_name, row_id, key) for row_id, key in keys))
+
+    # New ids are always above the current largest one
+    last_key_id = connection.execute("SELECT COALESCE(MAX(key_id), 0) FROM title_key_ids;").fetchone()[0]
+    connection.execute("""INSERT OR IGNORE INTO title_key_ids (title_key)
+                          SELECT DISTINCT title_key FROM title_keys WHERE file_table = ?;""", (table_name,))
+    if has_trigram_index(connection):
+        connection.execute("""INSERT INTO title_trigrams (rowid, title_key)
+                              SELECT key_id, ' ' || title_key || ' ' FROM title_key_ids WHERE key_id > ?;""",
+                           (last_key_id,))
+
+
+def delete_title_keys(connection, table_name):
+    """
+    Remove the title keys of a file table, and the ids/trigrams of keys no other file table uses. Does not commit.
+    :param connection: database connection object
+    :param table_name: name of the file table
+    """
+    unused_keys = connection.execute(
+        """SELECT key_id FROM title_key_ids
+        WHERE title_key IN (SELECT title_key FROM title_keys WHERE file_table = ?)
+        AND NOT EXISTS (SELECT 1 FROM title_keys AS other
+                        WHERE other.title_key = title_key_ids.title_key AND other.file_table != ?);""",
+        (table_name, table_name)).fetchall()
+    if has_trigram_index(connection):
+        connection.executemany("DELETE FROM title_trigrams WHERE rowid = ?;", unused_keys)
+    connection.executemany("DELETE FROM title_key_ids WHERE key_id = ?;", unused_keys)
+    connection.execute("DELETE FROM title_keys WHERE file_table = ?;", (table_name,))
+    mark_data_changed(connection)
+
+
+def find_similar_title_keys(connection, title, threshold=None, limit=50):
+    """
+    Typo-tolerant title lookup through the title_trigrams index.
+    Candidates are the keys best matching the rarest trigrams of the title, which are then ranked by similarity.
+    :param connection: database connection object
+    :param title: title as typed by the user
+    :param threshold: minimum similarity (0-1), defaults to the fuzzy_title_threshold setting
+    :param limit: maximum number of title keys to return
+    :return: dictionary of title key to similarity, best match first
+    """
+    if threshold is None:
+        threshold = float(settings_manager.get_setting("fuzzy_title_threshold"))
+    strip_articles = get_title_key_articles(connection)
+    search_trigrams = trigrams(normalize_title(title, strip_articles))
+    if not search_trigrams:
+        return {}
+
+    if has_trigram_index(connection):
+        placeholders = ", ".join("?" * len(search_trigrams))
+        key_counts = dict(connection.execute(
+            f"SELECT term, doc FROM title_trigram_vocab WHERE term IN ({placeholders});", list(search_trigrams)).fetchall())
+        # Trigrams no key contains (e.g. from the typo) are left out
+        rare_trigrams = sorted(key_counts, key=key_counts.get)[:FUZZY_QUERY_TRIGRAMS]
+        if not rare_trigrams:
+            return {}
+        match = " OR ".join('"' + trigram.replace('"', '""') + '"' for trigram in rare_trigrams)
+        candidates = [row[0][1:-1] for row in connection.execute(
+            "SELECT title_key FROM title_trigrams WHERE title_trigrams MATCH ? ORDER BY rank LIMIT ?;",
+            (match, limit * 4))]
+    else:
+        candidates = [row[0] for row in connection.execute("SELECT title_key FROM title_key_ids;")]
+
+    scores = {key: trigram_similarity(search_trigrams, trigrams(key)) for key in candidates}
+    ranked = sorted((item for item in scores.items() if item[1] >= threshold), key=lambda item: -item[1])
+    return dict(ranked[:limit])
+
+
+# Fields that can be searched - field names are put directly into the SQL, so only these are allowed
+SEARCH_FIELDS = ["Title", "Fuzzy_Title", "Platform_eISBN", "OCN", "Publisher", "Platform", "Platform_YOP",
+                 "agreement_code", "collection_name"]
+
+# Columns that have facet counts, in the order shown on the search display
+FACET_COLUMNS = ["Platform", "Publisher", "collection_name", "Platform_YOP"]
+
+
+def create_facet_table(connection):
+    """
+    Create the facet_counts table if it does not exist yet, and build the counts of any existing file tables.
+    :param connection: database connection object
+    """
+    list_of_tables = connection.execute(
+        """SELECT name FROM sqlite_master WHERE type='table'
+        AND name='facet_counts'; """).fetchall()
+    if list_of_tables:
+        return
+
+    m_logger.info("facet_counts table does not exist, creating new one")
+    connection.execute("""CREATE TABLE facet_counts(facet VARCHAR(255), value TEXT, file_table VARCHAR(255),
+                          count INTEGER);""")
+    connection.execute("CREATE INDEX facet_counts_lookup ON facet_counts(facet, file_table);")
+    connection.execute("CREATE INDEX facet_counts_file_table ON facet_counts(file_table);")
+    for table in get_all_tables(connection):
+        index_facets(connection, table)
+
+
+def index_facets(connection, table_name):
+    """
+    Count the rows of a file table per facet value, replacing any existing counts for it. Does not commit - called
+    as part of the upload that created the table.
+    :param connection: database connection object
+    :param table_name: name of the file table
+    """
+    delete_facets(connection, table_name)
+    for column in FACET_COLUMNS:
+        connection.execute(f"""INSERT INTO facet_counts (facet, value, file_table, count)
+                               SELECT ?, [{column}], ?, COUNT(*) FROM [{table_name}] GROUP BY [{column}];""",
+                           (column, table_name))
+
+
+def delete_facets(connection, table_name):
+    """
+    Remove the facet counts of a file table. Does not commit.
+    :param connection: database connection object
+    :param table_name: name of the file table
+    """
+    connection.execute("DELETE FROM facet_counts WHERE file_table = ?;", (table_name,))
+
+
+def get_facet_counts(connection, facet):
+    """
+    Get the number of rows per value of a facet, over the file tables that are searched (see get_tables).
+    :param connection: database connection object
+    :param facet: one of FACET_COLUMNS
+    :return: dictionary of value: number of rows
+    """
+    tables = get_tables(connection)
+    counts = {}
+    # Chunked to stay under SQLite's limit on the number of parameters
+    for i in range(0, len(tables), MAX_COMPOUND_SELECT):
+        chunk = tables[i:i + MAX_COMPOUND_SELECT]
+        placeholders = ", ".join("?" * len(chunk))
+        rows = connection.execute(f"""SELECT value, SUM(count) FROM facet_counts
+                                      WHERE facet = ? AND file_table IN ({placeholders}) GROUP BY value;""",
+                                  [facet] + chunk)
+        for value, count in rows:
+            counts[value] = counts.get(value, 0) + count
+    return counts
+
+
+# How each search operator joins its condition to the ones before it
+SEARCH_OPERATORS = {"OR": " OR ", "AND": " AND ", "NOT": " AND "}
+
+# Columns indexed in every file table, for identifier searches
+INDEXED_COLUMNS = ["Platform_eISBN", "OCN"]
+
+# Columns of a search result, after the institution's access column
+RESULT_COLUMNS = ["File_Name", "Platform", "Title", "Publisher", "Platform_YOP", "Platform_eISBN", "OCN",
+                  "agreement_code", "collection_name", "title_metadata_last_modified"]
+
+# SQLite limit on the number of SELECTs joined with UNION ALL in one statement
+MAX_COMPOUND_SELECT = 500
+
+# SQLite limit on the number of parameters of one statement (SQLITE_MAX_VARIABLE_NUMBER of older versions) - the
+# tables of a search are split into statements that stay under it
+MAX_VARIABLES = 999
+
+# Most terms in one search - the search screen has up to 5, the command line and search API are held to this
+MAX_SEARCH_TERMS = 20
+
+
+def create_watch_table(connection):
+    """
+    Create the watched_files table if it does not exist yet.
+    :param connection: database connection object
+    """
+    list_of_tables = connection.execute(
+        """SELECT name FROM sqlite_master WHERE type='table'
+        AND name='watched_files'; """).fetchall()
+    if not list_of_tables:
+        m_logger.info("watched_files table does not exist, creating new one")
+        connection.execute("""CREATE TABLE watched_files(path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER,
+                              sha256 TEXT, status VARCHAR(255), checked VARCHAR(255));""")
+        connection.execute("CREATE INDEX watched_files_sha256 ON watched_files(sha256);")
+
+
+def get_watched_files(connection):
+    """
+    Get the files of the watch folder that have been processed.
+    :param connection: database connection object
+    :return: dictionary of path: (size, mtime_ns, sha256, status)
+    """
+    rows = connection.execute("SELECT path, size, mtime_ns, sha256, status FROM watched_files;").fetchall()
+    return {row[0]: tuple(row[1:]) for row in rows}
+
+
+def record_watched_file(connection, path, size, mtime_ns, sha256, status):
+    """
+    Record what happened to a file of the watch folder, replacing any earlier record of it. Commits.
+    :param connection: database connection object
+    :param path: path to the file
+    :param size: file size when it was processed
+    :param mtime_ns: file modification time when it was processed
+    :param sha256: hash of the file contents
+    :param status: Loaded, Duplicate, or the reason the file was not uploaded
+    """
+    connection.execute("""INSERT OR REPLACE INTO watched_files (path, size, mtime_ns, sha256, status, checked)
+                          VALUES (?, ?, ?, ?, ?, datetime('now'));""", (path, size, mtime_ns, sha256, status))
+    connection.commit()
+
+
+def create_institution_tables(connection):
+    """
+    Create the institutions and institution_aliases tables if they do not exist yet. A new institutions table is
+    filled from the CRKN_institutions and local_institutions lists that older versions kept in settings.json.
+    :param connection: database connection object
+    """
+    list_of_tables = connection.execute(
+        """SELECT name FROM sqlite_master WHERE type='table'
+        AND name='institutions'; """).fetchall()
+    if not list_of_tables:
+        m_logger.info("institutions table does not exist, creating new one")
+        connection.execute("""CREATE TABLE institutions(institution_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                              name TEXT UNIQUE NOT NULL, source VARCHAR(255) NOT NULL);""")
+        for source, setting in (("CRKN", "CRKN_institutions"), ("local", "local_institutions")):
+            connection.executemany("INSERT OR IGNORE INTO institutions (name, source) VALUES (?, ?);",
+                                   [(name, source) for name in settings_manager.get_setting(setting) or []])
+
+    list_of_tables = connection.execute(
+        """SELECT name FROM sqlite_master WHERE type='table'
+        AND name='institution_aliases'; """).fetchall()
+    if not list_of_tables:
+        m_logger.info("institution_aliases table does not exist, creating new one")
+        connection.execute("CREATE TABLE institution_aliases(alias TEXT PRIMARY KEY, institution_id INTEGER NOT NULL);")
+
+
+def create_changeset_tables(connection):
+    """
+    Create the changesets, changeset_tables, changeset_rows and changeset_exports tables if they do not exist yet.
+    Tables loaded before have no rows in them - their next changeset holds every row. The same goes for the rows
+    kept in the first layout of changeset_rows (one text file_table and 4 bytes per column on every row), which is
+    replaced.
+    :param connection: database connection object
+    """
+    list_of_tables = connection.execute(
+        """SELECT name FROM sqlite_master WHERE type='table'
+        AND name='changesets'; """).fetchall()
+    if not list_of_tables:
+        m_logger.info("changesets table does not exist, creating new one")
+        connection.execute("""CREATE TABLE changesets(sequence INTEGER PRIMARY KEY AUTOINCREMENT,
+                              changeset_id TEXT UNIQUE NOT NULL, created TEXT, file_table VARCHAR(255),
+                              method VARCHAR(255), file_name VARCHAR(255), file_date VARCHAR(255),
+                              operation VARCHAR(255), body BLOB, applied TEXT);""")
+
+    columns = [row[1] for row in connection.execute("PRAGMA table_info(changeset_rows);").fetchall()]
+    if "file_table" in columns:
+        m_logger.info("changeset_rows has the first layout, replacing it")
+        connection.execute("DROP TABLE changeset_rows;")
+        connection.execute("DROP TABLE changeset_tables;")
+        columns = []
+    if not columns:
+        connection.execute("""CREATE TABLE changeset_tables(table_id INTEGER PRIMARY KEY,
+                              file_table VARCHAR(255) UNIQUE NOT NULL, columns TEXT, digest TEXT,
+                              common_hashes BLOB);""")
+        connection.execute("""CREATE TABLE changeset_rows(table_id INTEGER, row_key TEXT, column_hashes BLOB,
+                              PRIMARY KEY (table_id, row_key)) WITHOUT ROWID;""")
+
+    list_of_tables = connection.execute(
+        """SELECT name FROM sqlite_master WHERE type='table'
+        AND name='changeset_exports'; """).fetchall()
+    if not list_of_tables:
+        m_logger.info("changeset_exports table does not exist, creating new one")
+        connection.execute("CREATE TABLE changeset_exports(peer TEXT PRIMARY KEY, sequence INTEGER, exported TEXT);")
+
+
+def create_history_table(connection):
+    """
+    Create the title_history and history_columns tables and their indexes if they do not exist yet. Tables loaded
+    before have no versions - their next load adds a version of every row. The indexes of the first layout are
+    replaced by smaller ones.
+    :param connection: database connection object
+    """
+    list_of_tables = connection.execute(
+        """SELECT name FROM sqlite_master WHERE type='table'
+        AND name='title_history'; """).fetchall()
+    if not list_of_tables:
+        m_logger.info("title_history table does not exist, creating new one")
+        connection.execute("""CREATE TABLE title_history(history_id INTEGER PRIMARY KEY, file_table VARCHAR(255),
+                              row_key TEXT, isbn TEXT, ocn TEXT, valid_from TEXT, valid_to TEXT, columns_id INTEGER,
+                              row_values TEXT);""")
+    elif "columns_id" not in [row[1] for row in connection.execute("PRAGMA table_info(title_history);")]:
+        connection.execute("ALTER TABLE title_history ADD COLUMN columns_id INTEGER;")
+
+    list_of_tables = connection.execute(
+        """SELECT name FROM sqlite_master WHERE type='table'
+        AND name='history_columns'; """).fetchall()
+    if not list_of_tables:
+        m_logger.info("history_columns table does not exist, creating new one")
+        connection.execute("CREATE TABLE history_columns(columns_id INTEGER PRIMARY KEY, columns TEXT UNIQUE);")
+
+    for index in ("title_history_isbn", "title_history_ocn", "title_history_table", "title_history_current"):
+        connection.execute(f"DROP INDEX IF EXISTS {index};")
+    # A title has few versions, so the identifiers alone find them
+    connection.execute("""CREATE INDEX IF NOT EXISTS title_history_by_isbn ON title_history (isbn)
+                          WHERE isbn IS NOT NULL;""")
+    connection.execute("""CREATE INDEX IF NOT EXISTS title_history_by_ocn ON title_history (ocn)
+                          WHERE ocn IS NOT NULL;""")
+    # The versions of a row, and of a whole file table
+    connection.execute("CREATE INDEX IF NOT EXISTS title_history_row ON title_history (file_table, row_key);")
+
+
+def create_refresh_journal_table(connection):
+    """
+    Create the refresh_journal table if it does not exist yet.
+    :param connection: database connection object
+    """
+    list_of_tables = connection.execute(
+        """SELECT name FROM sqlite_master WHERE type='table'
+        AND name='refresh_journal'; """).fetchall()
+    if not list_of_tables:
+        m_logger.info("refresh_journal table does not exist, creating new one")
+        connection.execute("""CREATE TABLE refresh_journal(position INTEGER PRIMARY KEY, file_link TEXT,
+                              file_name VARCHAR(255), file_date VARCHAR(255), command VARCHAR(255),
+                              state VARCHAR(255), download_path TEXT, validator TEXT, attempts INTEGER DEFAULT 0,
+                              started TEXT, updated TEXT);""")
+    elif not any(column[1] == "attempts" for column in connection.execute("PRAGMA table_info(refresh_journal);")):
+        # Journal of an earlier version
+        connection.execute("ALTER TABLE refresh_journal ADD COLUMN attempts INTEGER DEFAULT 0;")
+
+
+def create_refresh_run_table(connection):
+    """
+    Create the refresh_runs table if it does not exist yet.
+    :param connection: database connection object
+    """
+    list_of_tables = connection.execute(
+        """SELECT name FROM sqlite_master WHERE type='table'
+        AND name='refresh_runs'; """).fetchall()
+    if not list_of_tables:
+        m_logger.info("refresh_runs table does not exist, creating new one")
+        connection.execute("""CREATE TABLE refresh_runs(run_id INTEGER PRIMARY KEY, trigger VARCHAR(255), started TEXT,
+                              finished TEXT, seconds REAL, status VARCHAR(255), files_changed INTEGER, detail TEXT);""")
+
+
+def record_refresh_run(connection, trigger, started, finished, status, files_changed, detail=""):
+    """
+    Record a CRKN update. Commits.
+    :param connection: database connection object
+    :param trigger: Manual or Scheduled
+    :param started: datetime the update started
+    :param finished: datetime the update finished
+    :param status: Completed, Up to date, Cancelled or Failed
+    :param files_changed: number of files loaded or removed
+    :param detail: error of a failed update
+    """
+    connection.execute("""INSERT INTO refresh_runs (trigger, started, finished, seconds, status, files_changed, detail)
+                          VALUES (?, ?, ?, ?, ?, ?, ?);""",
+                       (trigger, started.isoformat(timespec="seconds"), finished.isoformat(timespec="seconds"),
+                        (finished - started).total_seconds(), status, files_changed, detail))
+    connection.commit()
+
+
+def get_last_refresh_run(connection, statuses=None):
+    """
+    Get the last CRKN update.
+    :param connection: database connection object
+    :param statuses: optional list of the statuses to look for
+    :return: dictionary of trigger, started, finished, seconds, status, files_changed and detail, or None if there
+             was none
+    """
+    sql = "SELECT trigger, started, finished, seconds, status, files_changed, detail FROM refresh_runs"
+    if statuses:
+        sql += f" WHERE status IN ({', '.join('?' * len(statuses))})"
+    row = connection.execute(sql + " ORDER BY run_id DESC LIMIT 1;", list(statuses or [])).fetchone()
+    if row is None:
+        return None
+    return dict(zip(["trigger", "started", "finished", "seconds", "status", "files_changed", "detail"], row))
+
+
+def get_institution_columns(connection, table_name):
+    """
+    Get the institution columns of a file table - the columns between the 8 fixed columns and Platform/File_Name.
+    :param connection: database connection object
+    :param table_name: name of the file table
+    :return: list of institution names
+    """
+    columns = [row[1] for row in connection.execute(f"PRAGMA table_info([{table_name}]);").fetchall()]
+    return columns[8:-2]
+
+
+def create_table_sql(table_name, columns):
+    """
+    Build the CREATE TABLE statement of a file table received from another workstation (see snapshot.py and
+    changesets.py), from its column names and types rather than running SQL that came with it.
+    :param table_name: name of the table
+    :param columns: list of [name, declared type] of its columns
+    :return: CREATE TABLE statement
+    :raise ValueError: if a name can not be quoted or a type is not one of COLUMN_TYPES
+    """
+    if not columns:
+        raise ValueError(f"{table_name} has no columns")
+    for name in [table_name] + [name for name, _ in columns]:
+        if not isinstance(name, str) or not name.strip() or "]" in name:
+            raise ValueError(f"{name!r} can not be used as a table or column name")
+    for name, kind in columns:
+        if not isinstance(kind, str) or kind.upper() not in COLUMN_TYPES:
+            raise ValueError(f"{kind!r} is not a column type, for the column {name} of {table_name}")
+    definitions = ", ".join(f"[{name}] {kind.upper()}".rstrip() for name, kind in columns)
+    return f"CREATE TABLE [{table_name}] ({definitions});"
+
+
+def identifier_key_sql(column):
+    """
+    Get the SQL of the normalized form of an identifier column - upper case, without hyphens or spaces, and without
+    the .0 of a number read as a float - the form normalization.normalize_identifier gives the usual spellings.
+    Identifier searches compare it with the normalized term, through an index on the same expression.
+    :param column: Platform_eISBN or OCN
+    :return: SQL expression
+    """
+    value = f"replace(replace(upper(CAST([{column}] AS TEXT)), '-', ''), ' ', '')"
+    return f"(CASE WHEN substr({value}, -2) = '.0' THEN substr({value}, 1, length({value}) - 2) ELSE {value} END)"
+
+
+def create_search_indexes(connection, table_name):
+    """
+    Index the normalized identifier columns of a file table if they are not already. Does not commit.
+    :param connection: database connection object
+    :param table_name: name of the file table
+    """
+    for column in INDEXED_COLUMNS:
+        # Index of older versions, on the column as it is
+        connection.execute(f"DROP INDEX IF EXISTS [{table_name}_{column}];")
+        connection.execute(f"CREATE INDEX IF NOT EXISTS [{table_name}_{column}_key] "
+                           f"ON [{table_name}]({identifier_key_sql(column)});")
+
+
+def compile_condition(connection, field, term, strip_articles, fuzzy_scores):
+    """
+    Compile one search box into an SQL condition.
+    :param connection: database connection object
+    :param field: one of SEARCH_FIELDS
+    :param term: text searched for - * is a wildcard, and Platform_YOP accepts ranges like 2010-2015
+    :param strip_articles: strip_title_articles setting for title keys
+    :param fuzzy_scores: dictionary that Fuzzy_Title searches add their title key similarities to
+    :return: tuple of (SQL condition, list of parameters) - None parameters are the name of the table searched
+    """
+    if field not in SEARCH_FIELDS:
+        raise ValueError(f"Unknown search field {field}")
+
+    is_prefix = term.endswith("*") and term.count("*") == 1
+    year_range = re.fullmatch(r"\s*(\d{4})?\s*-\s*(\d{4})?\s*", term) if field == "Platform_YOP" else None
+
+    if field == "Fuzzy_Title":
+        scores = find_similar_title_keys(connection, term)
+        for key, score in scores.items():
+            fuzzy_scores[key] = max(score, fuzzy_scores.get(key, 0))
+        placeholders = ", ".join("?" * len(scores))
+        return (f"rowid IN (SELECT row_id FROM title_keys WHERE file_table = ? AND title_key IN ({placeholders}))",
+                [None, *scores])
+    if field == "Title" and ('*' not in term or is_prefix):
+        key = normalize_title(term.rstrip("*"), strip_articles)
+        if is_prefix:
+            # A term that is only an article (The*, L'*) - the article is stripped from the keys, so the titles
+            # starting with it are found on the Title column
+            article_only = strip_articles and key in LEADING_ARTICLES
+            # Keep a trailing word break, so "Bread *" does not match "Breadth"
+            if len(term) > 1 and not term[-2].isalnum() and key:
+                key += " "
+            condition = ("rowid IN (SELECT row_id FROM title_keys WHERE title_key >= ? AND title_key < ? "
+                         "AND file_table = ?)")
+            if article_only:
+                return f"({condition} OR Title LIKE ?)", [key, prefix_upper_bound(key), None, term.replace("*", "%")]
+            return condition, [key, prefix_upper_bound(key), None]
+        return "rowid IN (SELECT row_id FROM title_keys WHERE title_key = ? AND file_table = ?)", [key, None]
+    if '*' in term:
+        return f"{field} LIKE ?", [term.replace("*", "%")]
+    if year_range and (year_range.group(1) or year_range.group(2)):
+        return ("CAST(Platform_YOP AS INTEGER) BETWEEN ? AND ?",
+                [int(year_range.group(1) or 0), int(year_range.group(2) or 9999)])
+    if field in INDEXED_COLUMNS and normalize_identifier(term):
+        # Compared in normalized form, so hyphens and spacing do not matter (and suggestions, which are normalized,
+        # are found), through the index on the same expression
+        return f"{identifier_key_sql(field)} = ?", [normalize_identifier(term)]
+    if field in INDEXED_COLUMNS:
+        return f"{field} = ?", [term]
+    return f"{field} = ? COLLATE NOCASE", [term]
+
+
+def compile_search(connection, query, terms, searchTypes, operators=None):
+    """
+    Compile a search into one statement covering every file table that has the selected institution, joined with
+    UNION ALL (split into several statements only past SQLite's compound SELECT or parameter limits).
+    Operators follow SQL precedence - NOT is AND NOT, and AND binds tighter than OR, so A NOT B OR C is
+    (A AND NOT B) OR C, and A OR B AND C is A OR (B AND C). A first term with NOT matches the rows it does not
+    match, so NOT A OR B is (NOT A) OR B.
+    :param connection: database connection object
+    :param query: SQL query - base query without any actual search terms, selecting FROM table_name
+    :param terms: list of terms being searched
+    :param searchTypes: list of searchTypes (SEARCH_FIELDS) for each corresponding term
+    :param operators: list of OR/AND/NOT for each term, joining it to the terms before it - the first one only
+                      counts if it is NOT. All OR if not given.
+    :return: tuple of (list of (SQL, parameters) statements, dictionary of fuzzy title key similarities)
+    :raise ValueError: for an unknown field or more than MAX_SEARCH_TERMS terms
+    """
+    if len(terms) > MAX_SEARCH_TERMS:
+        raise ValueError(f"At most {MAX_SEARCH_TERMS} search terms")
+    strip_articles = get_title_key_articles(connection)
+    if operators is None:
+        operators = ["OR"] * len(terms)
+
+    # Similarity of each title key matched by a Fuzzy_Title search
+    fuzzy_scores = {}
+    conditions = ""
+    # Parameters for each table - None is replaced with the name of the table being searched
+    table_terms = []
+
+    # Constructs the final condition with all terms
+    for i in range(len(terms)):
+        condition, condition_terms = compile_condition(connection, searchTypes[i], terms[i], strip_articles, fuzzy_scores)
+        # initial term has nothing before it, NOT on its own negates it
+        if i == 0:
+            conditions += f"({condition}) IS NOT 1" if operators[0] == "NOT" else f"({condition})"
+        elif operators[i] == "NOT":
+            # IS NOT 1 keeps rows where the condition is NULL (empty cell) as well as false
+            conditions += f"{SEARCH_OPERATORS[operators[i]]}({condition}) IS NOT 1"
+        else:
+            conditions += f"{SEARCH_OPERATORS[operators[i]]}({condition})"
+        table_terms.extend(condition_terms)
+
+    # Only search tables that have the institution
+    list_of_tables = []
+    cursor = connection.cursor()
+    for table in get_tables(connection):
+        # Get institutions from each table
+        institutions = cursor.execute(f'select * from [{table}]')
+        institutions = [description[0] for description in institutions.description[8:-2]]
+        if settings_manager.get_setting("institution") in institutions:
+            list_of_tables.append(table)
+
+    statements = []
+    # Every table repeats the parameters of the conditions
+    tables_per_statement = max(1, min(MAX_COMPOUND_SELECT, MAX_VARIABLES // max(1, len(table_terms))))
+    for start in range(0, len(list_of_tables), tables_per_statement):
+        tables = list_of_tables[start:start + tables_per_statement]
+        statement = " UNION ALL ".join(query.replace("table_name", f"[{table}]") + conditions for table in tables)
+        statement_terms = [table if term is None else term for table in tables for term in table_terms]
+        statements.append((statement, statement_terms))
+    return statements, fuzzy_scores
+
+
+def search_query(institution):
+    """
+    Get the base query of a search - the institution's access column and RESULT_COLUMNS of each file table.
+    :param institution: institution searched for
+    :return: SQL query, for search_database
+    """
+    return f"SELECT [{institution}], {', '.join(RESULT_COLUMNS)} FROM table_name WHERE "
+
+
+def search_database(connection, query, terms, searchTypes, operators=None, limit=None):
     """
     Database searching functionality.
+    Title searches without wildcards, or with a single trailing * (prefix search), go through the title_keys
+    index so they are accent/case-insensitive. Other wildcard searches use LIKE.
+    Fuzzy_Title searches match similar titles through the title_trigrams index, and results are then ranked by
+    how similar their title is (if the query selects the Title column).
     :param connection: database connection object
     :param query: SQL query - base query without any actual search terms
     :param terms: list of terms being searched
     :param searchTypes: list of searchTypes for each corresponding term
+    :param operators: list of OR/AND/NOT for each term (see compile_search), all OR if not given
+    :param limit: most results returned, or None for all - SQLite stops once it has found them, except for fuzzy
+                  searches, which are ranked first
     :return: list of all matching results throughout all tables
     """
     results = []
+    columns = []
     cursor = connection.cursor()
+    strip_articles = get_title_key_articles(connection)
 
-    list_of_tables = get_tables(connection)
+    statements, fuzzy_scores = compile_search(connection, query, terms, searchTypes, operators)
+    for statement, statement_terms in statements:
+        if limit is not None and not fuzzy_scores:
+            if len(results) >= limit:
+                break
+            # Applies to the whole UNION ALL
+            statement += f" LIMIT {int(limit) - len(results)}"
+        cursor.execute(statement, statement_terms)
+        results.extend(cursor.fetchall())
+        columns = [description[0] for description in cursor.description]
 
-    # Constructs the final query with all terms
-    for i in range(len(terms)):
-        # initial query won't use OR
-        if i > 0:
-            query += " OR "
-        if '*' in terms[i]:
-            terms[i] = terms[i].replace("*", "%")
-            query += f"{searchTypes[i]} LIKE ?"
-        else:
-            if searchTypes[i] == "Title":
-                query += f"LOWER({searchTypes[i]}) = LOWER(?)"
-            else:
-                query += f"{searchTypes[i]} = ?"
+    # Best fuzzy matches first
+    if fuzzy_scores and "Title" in columns:
+        title_column = columns.index("Title")
+        results.sort(key=lambda row: -fuzzy_scores.get(normalize_title(row[title_column], strip_articles), 0))
+    return results if limit is None else results[:limit]
 
-    # Searches for matching items through each table one by one and adds any matches to the list
-    for table in list_of_tables:
-        # Get institutions from each table
-        institutions = cursor.execute(f'select * from [{table}]')
-        institutions = [description[0] for description in institutions.description[8:-2]]
 
-        # Only search table if it has the institution
-        if settings_manager.get_setting("institution") in institutions:
-            formatted_query = query.replace("table_name", f"[{table}]")
-            # executes the final fully-formatted query
-            cursor.execute(formatted_query, terms)
+def count_search(connection, query, terms, searchTypes, operators=None):
+    """
+    Count the results of a search without reading them, for a search whose results are limited.
+    :param connection: database connection object
+    :param query: SQL query - base query without any actual search terms
+    :param terms: list of terms being searched
+    :param searchTypes: list of searchTypes for each corresponding term
+    :param operators: list of OR/AND/NOT for each term (see compile_search), all OR if not given
+    :return: number of matching results throughout all tables
+    """
+    statements, _ = compile_search(connection, query, terms, searchTypes, operators)
+    return sum(connection.execute(f"SELECT COUNT(*) FROM ({statement});", statement_terms).fetchone()[0]
+               for statement, statement_terms in statements)
+
+
+def explain_search(connection, query, terms, searchTypes, operators=None):
+    """
+    Get the compiled SQL of a search and SQLite's query plan for it, for power users checking index use.
+    :param connection: database connection object
+    :param query: SQL query - base query without any actual search terms
+    :param terms: list of terms being searched
+    :param searchTypes: list of searchTypes for each corresponding term
+    :param operators: list of OR/AND/NOT for each term (see compile_search)
+    :return: string with each statement followed by its EXPLAIN QUERY PLAN tree
+    """
+    statements, _ = compile_search(connection, query, terms, searchTypes, operators)
+    explanation = []
+    for statement, statement_terms in statements:
+        explanation.append(statement)
+        explanation.append(f"Parameters: {statement_terms}")
+        # Rows are (id, parent, notused, detail) - indent each step under its parent
+        depth = {0: 0}
+        for step_id, parent, _, detail in connection.execute(f"EXPLAIN QUERY PLAN {statement}", statement_terms):
+            depth[step_id] = depth.get(parent, 0) + 1
+            explanation.append("  " * depth[step_id] + detail)
+        explanation.append("")
+    return "\n".join(explanation)
+
 
-            results.extend(cursor.fetchall())
-    return results
 def get_table_data(connection, table_name):
     """
     Retrieve information from a specific table in the database.
@@ -0,0 +1,76 @@
+"""
+Facet filtering of search results on the search display.
+
+The results of a search are already in memory, so narrowing them down by Platform, Publisher, collection or year
+is a filter over the rows rather than a new query. Counts for the database as a whole come from the facet_counts
+table (see database.get_facet_counts).
+"""
+from collections import Counter
+from src.data_processing.database import FACET_COLUMNS
+
+
+class FacetFilter:
+    """
+    Selected facet values for one result set. Values selected within a facet are alternatives (OR), and each facet
+    with a selection must match (AND).
+    """
+
+    def __init__(self, results, column_labels):
+        """
+        :param results: list of result rows
+        :param column_labels: column name of each position in a row
+        """
+        self.results = results
+        self.columns = {facet: column_labels.index(facet) for facet in FACET_COLUMNS}
+        self.selections = {facet: set() for facet in FACET_COLUMNS}
+
+    def set_selected(self, facet, value, selected):
+        """
+        Select or deselect one value of a facet.
+        :param facet: one of FACET_COLUMNS
+        :param value: value as it appears in the results
+        :param selected: True to select, False to deselect
+        """
+        if selected:
+            self.selections[facet].add(value)
+        else:
+            self.selections[facet].discard(value)
+
+    def clear(self):
+        """Deselect every value."""
+        for values in self.selections.values():
+            values.clear()
+
+    def failed_facets(self, row):
+        """
+        Get the facets with a selection that the row does not match.
+        :param row: result row
+        :return: list of facets
+        """
+        return [facet for facet, values in self.selections.items()
+                if values and row[self.columns[facet]] not in values]
+
+    def filtered_results(self):
+        """
+        Get the rows that match every facet selection.
+        :return: list of result rows
+        """
+        if not any(self.selections.values()):
+            return self.results
+        return [row for row in self.results if not self.failed_facets(row)]
+
+    def counts(self):
+        """
+        Count the rows per value of every facet, in one pass over the results. The counts of a facet take the
+        selections of the other facets into account but not its own, so its other values can still be added.
+        :return: dictionary of facet: Counter of value: number of rows
+        """
+        counts = {facet: Counter() for facet in FACET_COLUMNS}
+        for row in self.results:
+            failed = self.failed_facets(row)
+            if not failed:
+                for facet, column in self.columns.items():
+                    counts[facet][row[column]] += 1
+            elif len(failed) == 1:
+                counts[failed[0]][row[self.columns[failed[0]]]] += 1
+        return counts
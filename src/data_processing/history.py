@@ -0,0 +1,245 @@
+"""
+Version history of the file tables, for audits - "did we have access to this title as of this date".
+
+The file tables only hold the latest version of each file. Every row version is also kept in the title_history
+table (see database.py) with the time it became valid and the time it stopped being valid (NULL while it is
+current). Only the rows that changed get a new version (see changesets.py, which finds them for every load), so the
+table grows with the changes rather than with a full copy of each version:
+- a row added opens a version
+- a row changed closes its version and opens a new one
+- a row removed, or every row of a removed table, closes its version
+A version of a row added holds the list of its values, and the column names are kept once in history_columns. A
+version of a row changed only holds the columns that changed, so the values of a version are those of the last
+version of the row that holds all of them with the changes after it applied (version_values).
+
+Versions are found by eISBN (as ISBN-13), OCN or file table through indexes, so a point-in-time query reads only the
+versions of that title. The queries are run with "python -m src.cli history" (see cli.py).
+"""
+from datetime import datetime
+import json
+from src.data_processing.normalization import canonical_isbn, normalize_identifier
+
+
+def version_time(value=None):
+    """
+    Get the time a history query is for. A date alone means the end of that day.
+    :param value: datetime, ISO date or date and time string, or None for now
+    :return: ISO date and time string, comparable with valid_from and valid_to
+    """
+    if value is None:
+        value = datetime.now()
+    if isinstance(value, datetime):
+        return value.isoformat(timespec="seconds")
+    value = str(value).strip()
+    if len(value) == 10:
+        return value + "T23:59:59"
+    return value.replace(" ", "T")
+
+
+def has_versions(connection, table_name):
+    """
+    :param connection: database connection object
+    :param table_name: name of the file table
+    :return: True if the table has current versions - False for a table loaded before the history was kept
+    """
+    return connection.execute("SELECT 1 FROM title_history WHERE file_table = ? AND valid_to IS NULL LIMIT 1;",
+                              (table_name,)).fetchone() is not None
+
+
+def close_versions(connection, table_name, keys, when):
+    """
+    End the current versions of rows of a file table. Does not commit.
+    :param connection: database connection object
+    :param table_name: name of the file table
+    :param keys: row keys (see changesets.read_rows)
+    :param when: time they stopped being valid, ISO string
+    """
+    connection.executemany("""UPDATE title_history SET valid_to = ?
+                              WHERE file_table = ? AND row_key = ? AND valid_to IS NULL;""",
+                           [(when, table_name, key) for key in keys])
+
+
+def close_table(connection, table_name, when):
+    """
+    End the current versions of every row of a file table. Does not commit.
+    :param connection: database connection object
+    :param table_name: name of the file table
+    :param when: time they stopped being valid, ISO string
+    """
+    connection.execute("UPDATE title_history SET valid_to = ? WHERE file_table = ? AND valid_to IS NULL;",
+                       (when, table_name))
+
+
+def columns_id(connection, columns):
+    """
+    :param connection: database connection object
+    :param columns: column names of a file table
+    :return: id of the column names in history_columns, added if they are not there yet
+    """
+    names = json.dumps(columns)
+    connection.execute("INSERT OR IGNORE INTO history_columns (columns) VALUES (?);", (names,))
+    return connection.execute("SELECT columns_id FROM history_columns WHERE columns = ?;", (names,)).fetchone()[0]
+
+
+def add_versions(connection, table_name, columns, rows, when, changed=None):
+    """
+    Add the current versions of rows of a file table. Does not commit.
+    :param connection: database connection object
+    :param table_name: name of the file table
+    :param columns: column names of the table
+    :param rows: dictionary of row key: row values
+    :param when: time they became valid, ISO string
+    :param changed: optional dictionary of row key: names of the columns changed since the previous version of the
+                    row, whose version only holds those
+    """
+    changed = changed or {}
+    positions = {column: position for position, column in enumerate(columns)}
+    isbn = positions.get("Platform_eISBN")
+    ocn = positions.get("OCN")
+    names_id = columns_id(connection, columns)
+    connection.executemany("""INSERT INTO title_history (file_table, row_key, isbn, ocn, valid_from, columns_id,
+                              row_values) VALUES (?, ?, ?, ?, ?, ?, ?);""",
+                           [(table_name, key, (canonical_isbn(values[isbn]) or None) if isbn is not None else None,
+                             (normalize_identifier(values[ocn]) or None) if ocn is not None else None, when, names_id,
+                             json.dumps({column: values[positions[column]] for column in changed[key]}
+                                        if key in changed else list(values), separators=(",", ":")))
+                            for key, values in rows.items()])
+
+
+def record_changes(connection, table_name, columns, removed, changed, rows, when, replace=False):
+    """
+    Record the changes of a file table. Does not commit.
+    :param connection: database connection object
+    :param table_name: name of the file table
+    :param columns: column names of the table
+    :param removed: keys of the rows removed
+    :param changed: dictionary of row key: names of the columns changed, of the rows changed
+    :param rows: dictionary of row key: row values of the rows changed and added
+    :param when: time of the changes, ISO string
+    :param replace: True if the rows before are not known - every current version is ended
+    """
+    if replace:
+        close_table(connection, table_name, when)
+        changed = {}
+    else:
+        close_versions(connection, table_name, list(removed) + list(changed), when)
+    add_versions(connection, table_name, columns, rows, when, changed)
+
+
+def valid_at():
+    """
+    :return: SQL condition of the versions valid at a time given twice as parameters
+    """
+    return "valid_from <= ? AND (valid_to IS NULL OR valid_to > ?)"
+
+
+class VersionValues:
+    """
+    Puts the values of versions back together from the versions before them, reading the column names of
+    history_columns once.
+    """
+
+    def __init__(self, connection):
+        self.columns = {names_id: json.loads(names) for names_id, names in
+                        connection.execute("SELECT columns_id, columns FROM history_columns;")}
+
+    def apply(self, values, names_id, row_values):
+        """
+        :param values: dictionary of column: value of the previous version of the row, None if there is none
+        :param names_id: columns_id of the version
+        :param row_values: row_values of the version
+        :return: dictionary of column: value of the version
+        """
+        stored = json.loads(row_values)
+        if names_id is None:
+            # Recorded before columns_id was added, with every column
+            return stored
+        columns = self.columns[names_id]
+        if isinstance(stored, list):
+            return dict(zip(columns, stored))
+        values = values or {}
+        version = {column: values.get(column) for column in columns}
+        version.update(stored)
+        return version
+
+
+def version_values(connection, rebuild, file_table, row_key, history_id):
+    """
+    :param connection: database connection object
+    :param rebuild: VersionValues
+    :param file_table: name of the file table of a version
+    :param row_key: row key of the version
+    :param history_id: id of the version
+    :return: dictionary of column: value of the version
+    """
+    values = None
+    for names_id, row_values in connection.execute(
+            """SELECT columns_id, row_values FROM title_history WHERE file_table = ? AND row_key = ?
+               AND history_id <= ? ORDER BY history_id;""", (file_table, row_key, history_id)):
+        values = rebuild.apply(values, names_id, row_values)
+    return values
+
+
+def versions_as_of(connection, identifier, when=None):
+    """
+    Get the versions of a title valid at a time, in every file table.
+    :param connection: database connection object
+    :param identifier: eISBN (ISBN-10 or ISBN-13) or OCN
+    :param when: time, see version_time
+    :return: list of dictionaries with file_table, valid_from, valid_to and values (column: value)
+    """
+    when = version_time(when)
+    isbn = canonical_isbn(identifier)
+    ocn = normalize_identifier(identifier)
+    versions = connection.execute(
+        f"""SELECT history_id, file_table, row_key, valid_from, valid_to FROM title_history
+            WHERE isbn = ? AND {valid_at()}
+            UNION
+            SELECT history_id, file_table, row_key, valid_from, valid_to FROM title_history
+            WHERE ocn = ? AND {valid_at()}
+            ORDER BY 2, 1;""", (isbn, when, when, ocn, when, when)).fetchall()
+    rebuild = VersionValues(connection)
+    return [{"file_table": file_table, "valid_from": valid_from, "valid_to": valid_to,
+             "values": version_values(connection, rebuild, file_table, row_key, history_id)}
+            for history_id, file_table, row_key, valid_from, valid_to in versions]
+
+
+def access_as_of(connection, identifier, institution, when=None):
+    """
+    Find whether an institution had access to a title at a time.
+    :param connection: database connection object
+    :param identifier: eISBN (ISBN-10 or ISBN-13) or OCN
+    :param institution: institution column
+    :param when: time, see version_time
+    :return: dictionary of file table: Y, N, or None if the file had no column for the institution - empty if no
+             file had the title then
+    """
+    access = {}
+    for version in versions_as_of(connection, identifier, when):
+        value = version["values"].get(institution)
+        # A title listed twice in a file has access if either row is Y
+        if access.get(version["file_table"]) != "Y":
+            access[version["file_table"]] = value
+    return access
+
+
+def table_as_of(connection, table_name, when=None):
+    """
+    Get the rows a file table had at a time.
+    :param connection: database connection object
+    :param table_name: name of the file table
+    :param when: time, see version_time
+    :return: list of dictionaries of column: value
+    """
+    when = version_time(when)
+    rebuild = VersionValues(connection)
+    latest = {}
+    rows = {}
+    # Every version up to then, in the order they were added, each built on the one before it
+    for history_id, row_key, valid_to, names_id, row_values in connection.execute(
+            """SELECT history_id, row_key, valid_to, columns_id, row_values FROM title_history
+               WHERE file_table = ? AND valid_from <= ? ORDER BY history_id;""", (table_name, when)):
+        latest[row_key] = rebuild.apply(latest.get(row_key), names_id, row_values)
+        if valid_to is None or valid_to > when:
+            rows[history_id] = latest[row_key]
+    return list(rows.values())
@@ -0,0 +1,131 @@
+"""
+Holdings report - every title an institution has perpetual access to, across all CRKN and local files.
+
+The rows are read from one file table at a time straight from the cursor - only the rows where the institution's
+column is Y - and given to the export (see streaming_export) as they come, so the report never holds the rows in
+memory. A title found in more than one file is reported once, the first time it is found (CRKN files first), by its
+canonical identifier:
+1) the ISBN-13 of its eISBN, so the ISBN-10 and ISBN-13 of a book match
+2) its OCN, if it has no eISBN
+3) its title key (see normalization.py) and publisher, if it has neither
+Only the identifiers seen so far are kept, and the total of each platform is counted in the same pass.
+"""
+from collections import Counter
+import os
+from src.data_processing import database
+from src.data_processing.institutions import use_connection
+from src.data_processing.normalization import canonical_isbn, normalize_identifier, normalize_title
+from src.utility.logger import m_logger
+from src.utility.streaming_export import cursor_rows
+
+# Columns of the report, in order
+REPORT_COLUMNS = ["Title", "Publisher", "Platform", "Platform_YOP", "Platform_eISBN", "OCN", "agreement_code",
+                  "collection_name", "title_metadata_last_modified", "File_Name"]
+
+TOTAL_COLUMNS = ["Platform", "Titles"]
+
+_TITLE = REPORT_COLUMNS.index("Title")
+_PUBLISHER = REPORT_COLUMNS.index("Publisher")
+_PLATFORM = REPORT_COLUMNS.index("Platform")
+_ISBN = REPORT_COLUMNS.index("Platform_eISBN")
+_OCN = REPORT_COLUMNS.index("OCN")
+
+
+def identifier_key(row):
+    """
+    Get the key a title is de-duplicated by.
+    :param row: report row, REPORT_COLUMNS
+    :return: key string, or None if the row has no identifier or title
+    """
+    isbn = canonical_isbn(row[_ISBN])
+    if isbn:
+        return "isbn:" + isbn
+    ocn = normalize_identifier(row[_OCN])
+    if ocn:
+        return "ocn:" + ocn
+    title = normalize_title(row[_TITLE])
+    if title:
+        return f"title:{title}|{normalize_title(row[_PUBLISHER], False)}"
+    return None
+
+
+class HoldingsReport:
+    """
+    Streams the holdings of an institution and counts them by platform.
+    """
+
+    def __init__(self, institution, connection=None):
+        """
+        :param institution: institution column to report on
+        :param connection: database connection object, or None to open one when the rows are read - for reading
+                           them on another thread
+        """
+        self.institution = institution
+        self.connection = connection
+        self.platform_totals = Counter()
+        # Rows found in an earlier file
+        self.duplicates = 0
+        self.tables = 0
+
+    def file_tables(self, connection):
+        """
+        :param connection: database connection object
+        :return: list of the file tables that have the institution's column, CRKN tables first
+        """
+        return [table for table in database.get_tables(connection)
+                if self.institution in database.get_institution_columns(connection, table)]
+
+    def count(self):
+        """
+        Count the rows with access before de-duplication, for the progress bar.
+        :return: number of rows
+        """
+        with use_connection(self.connection) as connection:
+            return sum(connection.execute(f"SELECT COUNT(*) FROM [{table}] WHERE [{self.institution}] = 'Y';")
+                       .fetchone()[0] for table in self.file_tables(connection))
+
+    def rows(self):
+        """
+        Read the rows with access, skipping the titles already reported.
+        :return: generator of report rows (REPORT_COLUMNS)
+        """
+        self.platform_totals = Counter()
+        self.duplicates = 0
+        seen = set()
+        columns = ", ".join(f"[{column}]" for column in REPORT_COLUMNS)
+        with use_connection(self.connection) as connection:
+            tables = self.file_tables(connection)
+            self.tables = len(tables)
+            for table in tables:
+                cursor = connection.execute(f"SELECT {columns} FROM [{table}] WHERE [{self.institution}] = 'Y';")
+                for row in cursor_rows(cursor):
+                    key = identifier_key(row)
+                    if key is not None:
+                        if key in seen:
+                            self.duplicates += 1
+                            continue
+                        seen.add(key)
+                    self.platform_totals[row[_PLATFORM]] += 1
+                    yield row
+        m_logger.info(f"Holdings report of {self.institution}: {self.total()} titles from {self.tables} files, "
+                      f"{self.duplicates} duplicates left out")
+
+    def total(self):
+        """
+        :return: number of titles reported
+        """
+        return sum(self.platform_totals.values())
+
+    def totals(self):
+        """
+        :return: list of (platform, titles), most titles first
+        """
+        return sorted(self.platform_totals.items(), key=lambda item: (-item[1], str(item[0])))
+
+
+def totals_path(report_path):
+    """
+    :param report_path: path of the holdings report
+    :return: path of its platform totals, next to it - name_totals.csv
+    """
+    return os.path.splitext(report_path)[0] + "_totals.csv"
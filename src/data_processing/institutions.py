@@ -0,0 +1,206 @@
+"""
+Registry of the known institutions.
+
+The institutions are the institution columns of the file tables. They are kept in the institutions table with a
+stable id and their source - CRKN (the columns of the CRKN files, replaced after each CRKN update) or local (added
+by a local upload or the user) - and other names for them in institution_aliases (see database.py).
+
+The tables are read once into dictionaries, so checking every column of an uploaded file is a set lookup, and
+changes are written in one statement for any number of institutions. Use the shared registry:
+    from src.data_processing.institutions import registry
+    registry.unknown(headers)
+"""
+from contextlib import contextmanager
+import threading
+from src.data_processing import database
+from src.utility.logger import m_logger
+
+CRKN = "CRKN"
+LOCAL = "local"
+
+
+@contextmanager
+def use_connection(connection):
+    """
+    Use the given connection, or a new one that is closed afterwards.
+    :param connection: database connection object, or None
+    """
+    if connection is not None:
+        yield connection
+        return
+    connection = database.connect_to_database()
+    try:
+        yield connection
+    finally:
+        database.close_database(connection)
+
+
+class InstitutionRegistry:
+    """
+    In-memory copy of the institutions and institution_aliases tables.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # name: (institution_id, source), in id order
+        self._institutions = None
+        # alias: name
+        self._aliases = {}
+
+    def load(self, connection=None):
+        """
+        Read the tables, replacing what was read before.
+        :param connection: database connection object, or None to open one
+        """
+        with self._lock, use_connection(connection) as connection:
+            rows = connection.execute("SELECT name, institution_id, source FROM institutions "
+                                      "ORDER BY institution_id;").fetchall()
+            self._institutions = {name: (institution_id, source) for name, institution_id, source in rows}
+            ids = {institution_id: name for name, institution_id, _ in rows}
+            self._aliases = {alias: ids[institution_id] for alias, institution_id in connection.execute(
+                "SELECT alias, institution_id FROM institution_aliases;").fetchall() if institution_id in ids}
+
+    def _loaded(self, connection=None):
+        """
+        :param connection: database connection object used if the tables have not been read yet
+        :return: dictionary of name: (institution_id, source)
+        """
+        if self._institutions is None:
+            self.load(connection)
+        return self._institutions
+
+    def names(self, source=None, connection=None):
+        """
+        Get the institution names, local ones first then CRKN ones.
+        :param source: CRKN or LOCAL for the institutions of one source only, or None for all of them
+        :param connection: database connection object used if the tables have not been read yet
+        :return: list of names
+        """
+        with self._lock:
+            institutions = self._loaded(connection)
+            sources = [source] if source else [LOCAL, CRKN]
+            return [name for wanted in sources for name, (_, name_source) in institutions.items()
+                    if name_source == wanted]
+
+    def resolve(self, name, connection=None):
+        """
+        :param name: institution name or alias
+        :param connection: database connection object used if the tables have not been read yet
+        :return: the institution's name, or None if it is not known
+        """
+        with self._lock:
+            if name in self._loaded(connection):
+                return name
+            return self._aliases.get(name)
+
+    def is_known(self, name, connection=None):
+        """
+        :param name: institution name or alias
+        :param connection: database connection object used if the tables have not been read yet
+        :return: True if the institution is known
+        """
+        return self.resolve(name, connection) is not None
+
+    def unknown(self, names, connection=None):
+        """
+        Get the names that are not known institutions or aliases.
+        :param names: list of names, e.g. the institution columns of a file
+        :param connection: database connection object used if the tables have not been read yet
+        :return: list of the unknown names, blank ones left out
+        """
+        with self._lock:
+            institutions = self._loaded(connection)
+            return [name for name in names if isinstance(name, str) and name.strip()
+                    and name not in institutions and name not in self._aliases]
+
+    def add(self, names, source=LOCAL, connection=None):
+        """
+        Add institutions. Names that are already known are left as they are.
+        :param names: list of names
+        :param source: CRKN or LOCAL
+        :param connection: database connection object, or None to open one
+        :return: list of the names added
+        """
+        with self._lock, use_connection(connection) as connection:
+            new = list(dict.fromkeys(self.unknown(names, connection)))
+            if new:
+                connection.executemany("INSERT OR IGNORE INTO institutions (name, source) VALUES (?, ?);",
+                                       [(name, source) for name in new])
+                connection.commit()
+                m_logger.info(f"Added {len(new)} {source} institutions")
+                self.load(connection)
+            return new
+
+    def remove(self, names, connection=None):
+        """
+        Remove institutions and their aliases.
+        :param names: list of names
+        :param connection: database connection object, or None to open one
+        """
+        with self._lock, use_connection(connection) as connection:
+            institutions = self._loaded(connection)
+            ids = [(institutions[name][0],) for name in dict.fromkeys(names) if name in institutions]
+            if ids:
+                connection.executemany("DELETE FROM institution_aliases WHERE institution_id = ?;", ids)
+                connection.executemany("DELETE FROM institutions WHERE institution_id = ?;", ids)
+                connection.commit()
+                m_logger.info(f"Removed {len(ids)} institutions")
+                self.load(connection)
+
+    def set_CRKN_institutions(self, names, connection=None):
+        """
+        Replace the CRKN institutions with the institution columns of the CRKN files. Institutions that stay keep
+        their ids, and local institutions found in the CRKN files become CRKN ones. CRKN institutions that are no
+        longer in the CRKN files but are still columns of local files become local ones again instead of being
+        removed.
+        :param names: list of names
+        :param connection: database connection object, or None to open one
+        """
+        with self._lock, use_connection(connection) as connection:
+            names = [name for name in dict.fromkeys(names) if isinstance(name, str) and name.strip()]
+            in_use = {institution for table in database.get_local_tables(connection)
+                      for institution in database.get_institution_columns(connection, table)}
+            connection.execute("CREATE TEMP TABLE IF NOT EXISTS new_CRKN_institutions(name TEXT PRIMARY KEY);")
+            connection.execute("DELETE FROM new_CRKN_institutions;")
+            connection.executemany("INSERT INTO new_CRKN_institutions (name) VALUES (?);", [(name,) for name in names])
+            kept = connection.execute("""SELECT name FROM institutions WHERE source = ?
+                                         AND name NOT IN (SELECT name FROM new_CRKN_institutions);""",
+                                      (CRKN,)).fetchall()
+            kept = [(LOCAL, name) for name, in kept if name in in_use]
+            if kept:
+                connection.executemany("UPDATE institutions SET source = ? WHERE name = ?;", kept)
+                m_logger.info(f"Kept {len(kept)} institutions removed from CRKN that local files still use")
+            connection.execute("""DELETE FROM institution_aliases WHERE institution_id IN (
+                                  SELECT institution_id FROM institutions WHERE source = ?
+                                  AND name NOT IN (SELECT name FROM new_CRKN_institutions));""", (CRKN,))
+            connection.execute("""DELETE FROM institutions WHERE source = ?
+                                  AND name NOT IN (SELECT name FROM new_CRKN_institutions);""", (CRKN,))
+            connection.execute("UPDATE institutions SET source = ? WHERE name IN (SELECT name FROM new_CRKN_institutions);",
+                               (CRKN,))
+            connection.execute("""INSERT OR IGNORE INTO institutions (name, source)
+                                  SELECT name, ? FROM new_CRKN_institutions;""", (CRKN,))
+            connection.execute("DROP TABLE new_CRKN_institutions;")
+            connection.commit()
+            self.load(connection)
+
+    def add_alias(self, alias, name, connection=None):
+        """
+        Add another name for an institution.
+        :param alias: other name
+        :param name: institution name
+        :param connection: database connection object, or None to open one
+        :return: True if added, False if the institution is not known or the alias is already an institution
+        """
+        with self._lock, use_connection(connection) as connection:
+            institutions = self._loaded(connection)
+            if name not in institutions or alias in institutions:
+                return False
+            connection.execute("INSERT OR REPLACE INTO institution_aliases (alias, institution_id) VALUES (?, ?);",
+                               (alias, institutions[name][0]))
+            connection.commit()
+            self.load(connection)
+            return True
+
+
+# Shared registry of the application
+registry = InstitutionRegistry()
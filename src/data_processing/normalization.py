@@ -0,0 +1,112 @@
+"""
+Normalization helpers for building search keys out of the raw spreadsheet values.
+
+The title key is what the Title search compares against, so English and French titles match regardless of
+case, accents, punctuation or spacing. The keys are computed once at ingest and stored in the title_keys table
+(see database.py), never at search time.
+"""
+import re
+import unicodedata
+
+# Articles removed from the start of a title key, e.g. "The Art of War" and "L'Art de la guerre"
+LEADING_ARTICLES = {"the", "le", "la", "les", "l"}
+
+# Letters that do not decompose into a base letter + accent under NFKD
+_SPECIAL_LETTERS = str.maketrans({"œ": "oe", "æ": "ae", "ø": "o", "đ": "d", "ł": "l", "ħ": "h", "ı": "i"})
+
+_NON_ALPHANUMERIC = re.compile(r"[\W_]+")
+
+
+def normalize_title(title, strip_articles=True):
+    """
+    Build the normalized key for a title.
+    Unicode casefold, accents stripped, punctuation and whitespace collapsed to single spaces.
+    :param title: raw title string (None/NaN values give an empty key)
+    :param strip_articles: remove a leading the/le/la/les/l' from the key
+    :return: normalized title key string
+    """
+    if not isinstance(title, str):
+        return ""
+
+    # Casefold first so that e.g. "ß" becomes "ss" before accents are removed
+    key = unicodedata.normalize("NFKD", title.casefold()).translate(_SPECIAL_LETTERS)
+    key = "".join(char for char in key if not unicodedata.combining(char))
+    key = _NON_ALPHANUMERIC.sub(" ", key).strip()
+
+    if strip_articles:
+        words = key.split(" ", 1)
+        # Never strip the article if it is the entire title
+        if len(words) == 2 and words[0] in LEADING_ARTICLES:
+            key = words[1]
+    return key
+
+
+def prefix_upper_bound(prefix):
+    """
+    Get a string greater than every key starting with prefix, so a prefix search can be
+    written as an index range (key >= prefix AND key < bound) instead of a LIKE scan.
+    :param prefix: normalized key prefix
+    :return: exclusive upper bound string
+    """
+    return prefix + "\U0010ffff"
+
+
+def trigrams(key):
+    """
+    Get the set of trigrams (3 character substrings) of a normalized key, padded with a space on each side so
+    the start and end of the title count as well. Used for the typo-tolerant Title search.
+    :param key: normalized title key
+    :return: set of trigram strings (empty for an empty key)
+    """
+    if not key:
+        return set()
+    padded = f" {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def trigram_similarity(first, second):
+    """
+    Jaccard similarity between the trigram sets of two keys, from 0 (nothing shared) to 1 (identical).
+    :param first: set of trigrams
+    :param second: set of trigrams
+    :return: float similarity
+    """
+    if not first or not second:
+        return 0.0
+    shared = len(first & second)
+    return shared / (len(first) + len(second) - shared)
+
+
+def normalize_identifier(value):
+    """
+    Normalize an ISBN or OCN value to its digits (and a trailing ISBN-10 check character X).
+    Spreadsheets give these as strings with hyphens/spaces, integers or floats (also as text, "123.0") depending
+    on the file.
+    :param value: raw identifier value
+    :return: identifier string, or empty string if missing
+    """
+    if isinstance(value, float):
+        if value != value:
+            return ""
+        if value.is_integer():
+            value = int(value)
+    if value is None:
+        return ""
+    value = str(value).upper()
+    if value.endswith(".0"):
+        value = value[:-2]
+    return re.sub(r"[^0-9X]", "", value)
+
+
+def canonical_isbn(value):
+    """
+    Get the ISBN-13 form of an ISBN, so the ISBN-10 and ISBN-13 of a book give the same key.
+    :param value: raw ISBN value
+    :return: 13 digit ISBN string, the normalized value if it is not a 10 digit ISBN, or empty string if missing
+    """
+    isbn = normalize_identifier(value)
+    if len(isbn) != 10 or not isbn[:9].isdigit():
+        return isbn
+    digits = "978" + isbn[:9]
+    check = -sum(int(digit) * (3 if position % 2 else 1) for position, digit in enumerate(digits)) % 10
+    return digits + str(check)
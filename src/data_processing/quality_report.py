@@ -0,0 +1,266 @@
+"""
+Data-quality report of an uploaded file.
+
+Scraping.check_file_format stops at the first problem and does not say where it is. The report runs every check
+over whole columns at once and lists every problem with its spreadsheet coordinates (row number and column
+letter as shown in Excel), so a file can be fixed in one go:
+- errors - the problems check_file_format rejects a file for (missing title, missing Y/N)
+- warnings - values that are loaded but are likely wrong (Y/N values other than Y or N, ISBN with a bad check
+  digit, non-numeric year, identifier already used on an earlier row, date that can not be read)
+
+A file can be checked whole or a chunk at a time (see chunked_ingest), duplicate identifiers are found across
+chunks.
+"""
+import os
+import numpy as np
+import pandas as pd
+from openpyxl.utils import get_column_letter
+from src.data_processing import Scraping
+
+# End of the name of a report, written next to the checked file
+REPORT_SUFFIX = "_report.csv"
+
+ERROR = "Error"
+WARNING = "Warning"
+
+MISSING_TITLE = "Missing title"
+MISSING_ACCESS = "Missing Y/N value"
+BAD_ACCESS = "Y/N value is not Y or N"
+BAD_ISBN = "Invalid ISBN"
+BAD_YOP = "Non-numeric year"
+DUPLICATE_IDENTIFIER = "Duplicate identifier"
+BAD_DATE = "Unreadable date"
+
+# Columns checked for identifiers used on more than one row
+IDENTIFIER_COLUMNS = ["Platform_eISBN", "OCN"]
+
+REPORT_COLUMNS = ["Row", "Column", "Header", "Severity", "Issue", "Value"]
+
+# Spreadsheet row of the first data row (index 0) - after A1, the second row and the header row
+FIRST_DATA_ROW = Scraping.HEADER_ROWS + 1
+
+_ISBN_13_WEIGHTS = np.array([1, 3] * 6 + [1])
+_ISBN_10_WEIGHTS = np.arange(10, 0, -1)
+
+
+def as_text(column):
+    """
+    Get a column as strings, whatever it was read as - Excel numbers like 9780000000000.0 lose the .0. Strings are
+    kept as they are, spaces included (the checks that care about spacing, like valid_isbns, ignore it themselves)
+    :param column: pandas series
+    :return: series of strings, missing values stay missing
+    """
+    if pd.api.types.is_string_dtype(column):
+        return column
+    text = column.astype(object).where(column.isna(), column.astype(str))
+    whole_numbers = text.str.endswith(".0").fillna(False).astype(bool)
+    if whole_numbers.any():
+        text[whole_numbers] = text[whole_numbers].str[:-2]
+    return text
+
+
+def digit_matrix(values, length):
+    """
+    Get strings of the same length as a matrix of digits.
+    :param values: series of strings, all of the given length
+    :param length: length of the strings
+    :return: tuple of (integer matrix, one row per value - X is 10, boolean series True for the rows that are digits
+             with an X allowed only last)
+    """
+    matrix = np.array(values.tolist(), dtype=f"U{length}").view(np.uint32).reshape(-1, length).astype(np.int64)
+    matrix -= ord("0")
+    is_digit = (matrix >= 0) & (matrix <= 9)
+    matrix[:, -1][matrix[:, -1] == ord("X") - ord("0")] = 10
+    ok = is_digit[:, :-1].all(axis=1) & (matrix[:, -1] >= 0) & (matrix[:, -1] <= 10)
+    return matrix, pd.Series(ok, index=values.index)
+
+
+def normalize_isbns(isbns):
+    """
+    Remove the hyphens and spaces of ISBNs.
+    :param isbns: series of ISBN strings
+    :return: series of ISBN strings, upper case
+    """
+    # Most values are plain ISBN-13s - only the others are cleaned up
+    plain = isbns.str.len() == 13
+    others = isbns[~plain]
+    if others.empty:
+        return isbns
+    others = others.str.replace("-", "", regex=False).str.replace(" ", "", regex=False).str.upper()
+    return pd.concat([isbns[plain], others]).reindex(isbns.index)
+
+
+def valid_isbns(isbns):
+    """
+    Check the check digit of ISBN-10 and ISBN-13 values.
+    :param isbns: series of ISBN strings (hyphens and spaces are ignored)
+    :return: boolean series, True for an ISBN with a correct check digit
+    """
+    valid = pd.Series(False, index=isbns.index)
+    digits = normalize_isbns(isbns)
+    lengths = digits.str.len()
+
+    for length, weights, modulus in ((13, _ISBN_13_WEIGHTS, 10), (10, _ISBN_10_WEIGHTS, 11)):
+        values = digits[lengths == length]
+        if len(values):
+            matrix, ok = digit_matrix(values, length)
+            # X is only a check digit of an ISBN-10
+            ok &= (matrix[:, -1] < 10) | (length == 10)
+            valid[values.index] = ok & ((matrix @ weights) % modulus == 0)
+    return valid
+
+
+def readable_dates(dates):
+    """
+    :param dates: series of date strings
+    :return: boolean series, True for a value that can be read as a date
+    """
+    parsed = pd.to_datetime(dates, format="ISO8601", errors="coerce")
+    # Only the values that are not ISO dates are parsed one by one
+    others = parsed.isna() & dates.notna()
+    if others.any():
+        parsed[others] = pd.to_datetime(dates[others], format="mixed", errors="coerce")
+    return parsed.notna()
+
+
+class QualityReport:
+    """
+    Problems found in a file, by row and column.
+    """
+
+    def __init__(self, file_name):
+        """
+        :param file_name: the file name being checked (name.ext)
+        """
+        self.file_name = file_name
+        self.rows = 0
+        self._issues = []
+        # identifier column: {identifier: spreadsheet row it was first seen on}
+        self._first_rows = {column: {} for column in IDENTIFIER_COLUMNS}
+
+    def check(self, file_df):
+        """
+        Check a file dataframe, or the next chunk of one, and add its problems to the report.
+        :param file_df: dataframe laid out like Scraping.file_to_dataframe_csv, its index the row number from 0
+        """
+        headers = file_df.columns.to_list()
+        rows = pd.Series(file_df.index + FIRST_DATA_ROW, index=file_df.index)
+        self.rows += len(file_df)
+
+        if "Title" in headers:
+            title = file_df["Title"]
+            self.add(rows, headers, "Title", title.isna(), ERROR, MISSING_TITLE, title)
+            blank = title.notna() & (title.astype(str).str.strip() == "")
+            self.add(rows, headers, "Title", blank, WARNING, MISSING_TITLE, title)
+
+        # Institution columns, between the 8 fixed columns and Platform/File_Name
+        for position in range(8, len(headers) - 2):
+            access = file_df.iloc[:, position]
+            self.add(rows, headers, position, access.isna(), ERROR, MISSING_ACCESS, access)
+            self.add(rows, headers, position, access.notna() & ~access.isin(["Y", "N"]), WARNING, BAD_ACCESS, access)
+
+        identifiers = {column: as_text(file_df[column]) for column in IDENTIFIER_COLUMNS if column in headers}
+        if "Platform_eISBN" in identifiers:
+            isbn = identifiers["Platform_eISBN"]
+            self.add(rows, headers, "Platform_eISBN", isbn.notna() & ~valid_isbns(isbn.fillna("")), WARNING,
+                     BAD_ISBN, isbn)
+
+        if "Platform_YOP" in headers:
+            yop = as_text(file_df["Platform_YOP"])
+            self.add(rows, headers, "Platform_YOP", yop.notna() & pd.to_numeric(yop, errors="coerce").isna(),
+                     WARNING, BAD_YOP, yop)
+
+        if "title_metadata_last_modified" in headers:
+            dates = file_df["title_metadata_last_modified"]
+            self.add(rows, headers, "title_metadata_last_modified", dates.notna() & ~readable_dates(dates), WARNING,
+                     BAD_DATE, dates)
+
+        for column, values in identifiers.items():
+            # The same ISBN written with or without hyphens is a duplicate
+            normalized = normalize_isbns(values) if column == "Platform_eISBN" else values
+            self.check_duplicates(rows, headers, column, normalized, values)
+
+    def check_duplicates(self, rows, headers, column, identifiers, values):
+        """
+        Add the rows whose identifier was already used on an earlier row, in this chunk or an earlier one.
+        :param rows: series of spreadsheet row numbers
+        :param headers: column headers of the dataframe
+        :param column: identifier column
+        :param identifiers: series of identifier strings, normalized
+        :param values: series of the values as they are in the file, shown in the report
+        """
+        identifiers = identifiers[identifiers.notna() & (identifiers != "")]
+        if identifiers.empty:
+            return
+        first_rows = self._first_rows[column]
+        duplicate = identifiers.duplicated(keep="first") | identifiers.isin(first_rows.keys())
+        # Identifiers seen for the first time
+        new = identifiers[~duplicate]
+        first_rows.update(zip(new.tolist(), rows[new.index].tolist()))
+        if duplicate.any():
+            first_row = identifiers[duplicate].map(first_rows).astype(int).astype(str)
+            self.add(rows, headers, column, duplicate.reindex(rows.index, fill_value=False), WARNING,
+                     DUPLICATE_IDENTIFIER, values, "first used on row " + first_row)
+
+    def add(self, rows, headers, column, mask, severity, issue, values, note=None):
+        """
+        Add the rows matching a mask as problems.
+        :param rows: series of spreadsheet row numbers
+        :param headers: column headers of the dataframe
+        :param column: header or position of the column
+        :param mask: boolean series, True for the rows with the problem
+        :param severity: ERROR or WARNING
+        :param issue: description of the problem
+        :param values: series of the values, shown in the report
+        :param note: optional series of text added after the value
+        """
+        mask = mask.fillna(False).astype(bool)
+        if not mask.any():
+            return
+        position = column if isinstance(column, int) else headers.index(column)
+        value = values[mask].astype("string").fillna("")
+        if note is not None:
+            value = value + " (" + note + ")"
+        self._issues.append(pd.DataFrame({"Row": rows[mask], "Column": get_column_letter(position + 1),
+                                          "Header": headers[position], "Severity": severity, "Issue": issue,
+                                          "Value": value}))
+
+    def issues(self):
+        """
+        :return: dataframe of every problem (REPORT_COLUMNS), by row then column
+        """
+        if not self._issues:
+            return pd.DataFrame(columns=REPORT_COLUMNS)
+        issues = pd.concat(self._issues, ignore_index=True)
+        issues["order"] = issues["Column"].str.len()
+        issues = issues.sort_values(["Row", "order", "Column"], kind="stable").drop(columns="order")
+        return issues.reset_index(drop=True)
+
+    def counts(self):
+        """
+        :return: dictionary of (severity, issue): number of problems
+        """
+        return {key: len(group) for key, group in self.issues().groupby(["Severity", "Issue"], sort=False)}
+
+    def has_errors(self):
+        """
+        :return: True if a problem would make check_file_format reject the file
+        """
+        return any(ERROR in set(issues["Severity"]) for issues in self._issues)
+
+    def write(self, path):
+        """
+        Write the report as a CSV file.
+        :param path: path of the report
+        :return: path written
+        """
+        self.issues().to_csv(path, index=False)
+        return path
+
+
+def report_path(file_path):
+    """
+    :param file_path: path of the checked file
+    :return: path of its report, next to it - name_report.csv
+    """
+    return os.path.splitext(file_path)[0] + REPORT_SUFFIX
@@ -0,0 +1,256 @@
+"""
+Refresh journal - lets a CRKN update that was interrupted (connection lost, cancelled, application closed) carry on
+where it stopped instead of starting over.
+
+Once the user has agreed to an update, every file to download and every file to remove is written to the
+refresh_journal table (see database.py) in order, and each one's state is updated as it goes:
+    Listed -> Downloaded -> Parsed -> Loaded, or Rejected for a file that is not in the right format
+The next update finds the files that are not Loaded or Rejected and carries on from the first of them, without
+reading the CRKN page or comparing the files again. A file that fails to load (a database error rather than a file in
+the wrong format) is tried again by the next update, and Rejected once it has failed MAX_ATTEMPTS times, so the
+journal can be dropped. A journal older than JOURNAL_MAX_AGE_HOURS is dropped, and the
+update starts over.
+
+Files are downloaded to a crkn_downloads folder next to the database, and a file that was partly downloaded is
+continued with an HTTP Range request where the server supports it - with If-Range set to its ETag or
+Last-Modified, so a file that changed on the server is downloaded again from the start. A partial file without an
+ETag or Last-Modified can not be checked, and is downloaded again from the start. A download can be held to
+a number of bytes per second, for scheduled updates (see refresh_schedule.py). A download that is cancelled stops
+after the chunk being written, and keeps its bytes for the next update.
+"""
+from datetime import datetime, timedelta
+import os
+import time
+import requests
+from src.utility.logger import m_logger
+from src.utility.settings_manager import Settings
+
+settings_manager = Settings()
+
+LISTED = "Listed"
+DOWNLOADED = "Downloaded"
+PARSED = "Parsed"
+LOADED = "Loaded"
+REJECTED = "Rejected"
+
+# States of a file that is done with
+DONE = (LOADED, REJECTED)
+
+DELETE = "DELETE"
+
+# Number of times a file may fail to load before it is Rejected
+MAX_ATTEMPTS = 3
+
+# Age after which an unfinished update is started over, as CRKN may have published other files since
+JOURNAL_MAX_AGE_HOURS = 24
+
+# Bytes read at a time when downloading a file
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Seconds to wait for the server to connect, or to send the next bytes
+REQUEST_TIMEOUT_SECONDS = 30
+
+
+class DownloadCancelled(Exception):
+    """Raised by resume_download when the download is cancelled part way."""
+
+
+def download_folder():
+    """
+    :return: folder the CRKN files are downloaded to
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(settings_manager.get_setting("database_name"))),
+                        "crkn_downloads")
+
+
+def resume_download(url, path, validator=None, on_response=None, progress=None, max_bytes_per_second=None,
+                    wait_cancelled=None):
+    """
+    Download a file, carrying on from the bytes already in path if the server supports Range requests.
+    :param url: link to the file
+    :param path: path of the file, possibly partly downloaded
+    :param validator: ETag or Last-Modified of the partly downloaded file, sent as If-Range - without it the file is
+                      downloaded from the start
+    :param on_response: optional function called with the ETag or Last-Modified of the response before the file is
+                        written, to keep with the partial file
+    :param progress: optional function called with (bytes received, total bytes or 0 if not known, bytes of the
+                     chunk) as the file is written
+    :param max_bytes_per_second: optional download rate not to go over
+    :param wait_cancelled: optional function called with a number of seconds to wait, returning True once the
+                           download is cancelled (see ResponseChannel.wait_cancelled) - checked after every chunk
+    :raise requests.exceptions.RequestException: if the download fails - the bytes written so far are kept
+    :raise DownloadCancelled: if the download is cancelled - the bytes written so far are kept
+    """
+    # Without a validator, the bytes already there may be from another version of the file
+    offset = os.path.getsize(path) if validator and os.path.exists(path) else 0
+    headers = {}
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+        headers["If-Range"] = validator
+
+    with requests.get(url, stream=True, headers=headers, timeout=REQUEST_TIMEOUT_SECONDS) as response:
+        if response.status_code == 416 and offset:
+            # The range is past the end of the file - whatever was there is not the file anymore
+            os.remove(path)
+            return resume_download(url, path, None, on_response, progress, max_bytes_per_second, wait_cancelled)
+        response.raise_for_status()
+        if response.status_code == 206:
+            mode = "ab"
+            m_logger.info(f"Resuming the download of {url} at {offset} bytes")
+        else:
+            # Range not supported, or the file changed - downloaded from the start
+            mode = "wb"
+            offset = 0
+        if on_response:
+            on_response(response.headers.get("ETag") or response.headers.get("Last-Modified"))
+        length = int(response.headers.get("Content-Length", 0))
+        total = offset + length if length else 0
+        received = offset
+        started = time.monotonic()
+        with open(path, mode) as file:
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                file.write(chunk)
+                received += len(chunk)
+                ahead = 0
+                if max_bytes_per_second:
+                    # Wait until the bytes received so far are within the rate
+                    ahead = (received - offset) / max_bytes_per_second - (time.monotonic() - started)
+                if wait_cancelled:
+                    if wait_cancelled(max(ahead, 0)):
+                        m_logger.info(f"Download of {url} cancelled at {received} bytes")
+                        raise DownloadCancelled()
+                elif ahead > 0:
+                    time.sleep(ahead)
+                if progress:
+                    progress(received, total, len(chunk))
+
+
+class RefreshJournal:
+    """
+    The files of a CRKN update and how far each one got.
+    """
+
+    def __init__(self, connection, clock=datetime.now):
+        """
+        :param connection: database connection object
+        :param clock: function returning the current datetime
+        """
+        self.connection = connection
+        self.clock = clock
+
+    def now(self):
+        return self.clock().isoformat(timespec="seconds")
+
+    def start(self, files, removals):
+        """
+        Start the journal of an update, replacing any earlier one.
+        :param files: list of (file link, file name, date/version, INSERT INTO or UPDATE) of the files to download
+        :param removals: list of the names of the CRKN files to remove
+        """
+        self.clear()
+        now = self.now()
+        folder = download_folder()
+        self.connection.executemany(
+            """INSERT INTO refresh_journal (position, file_link, file_name, file_date, command, state, download_path,
+               started, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);""",
+            [(position, file_link, file_name, file_date, command, LISTED,
+              os.path.join(folder, file_link.split("/")[-1]), now, now)
+             for position, (file_link, file_name, file_date, command) in enumerate(files)]
+            + [(len(files) + position, None, file_name, None, DELETE, LISTED, None, now, now)
+               for position, file_name in enumerate(removals)])
+        self.connection.commit()
+
+    def resumable(self):
+        """
+        Check for an update that was interrupted and can be carried on. One that is too old is dropped.
+        :return: True if there are files left to do
+        """
+        row = self.connection.execute(
+            f"""SELECT MIN(started) FROM refresh_journal
+                WHERE state NOT IN ({', '.join('?' * len(DONE))});""", DONE).fetchone()
+        if row[0] is None:
+            return False
+        if row[0] < (self.clock() - timedelta(hours=JOURNAL_MAX_AGE_HOURS)).isoformat(timespec="seconds"):
+            m_logger.info(f"The CRKN update started {row[0]} is too old to carry on, it is started over")
+            self.clear()
+            return False
+        return True
+
+    def pending_downloads(self):
+        """
+        :return: list of dictionaries of the files left to download and load, in order - position, file_link,
+                 file_name, file_date, command, state, download_path, validator
+        """
+        cursor = self.connection.execute(
+            f"""SELECT position, file_link, file_name, file_date, command, state, download_path, validator
+                FROM refresh_journal WHERE command != ? AND state NOT IN ({', '.join('?' * len(DONE))})
+                ORDER BY position;""", (DELETE, *DONE))
+        names = [description[0] for description in cursor.description]
+        return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+    def pending_removals(self):
+        """
+        :return: list of (position, file name) of the files left to remove, in order
+        """
+        return self.connection.execute(
+            f"""SELECT position, file_name FROM refresh_journal WHERE command = ?
+                AND state NOT IN ({', '.join('?' * len(DONE))}) ORDER BY position;""", (DELETE, *DONE)).fetchall()
+
+    def set_state(self, position, state):
+        """
+        :param position: position of the file in the journal
+        :param state: new state of the file
+        """
+        self.connection.execute("UPDATE refresh_journal SET state = ?, updated = ? WHERE position = ?;",
+                                (state, self.now(), position))
+        self.connection.commit()
+        if state in DONE:
+            path = self.connection.execute("SELECT download_path FROM refresh_journal WHERE position = ?;",
+                                           (position,)).fetchone()[0]
+            if path and os.path.exists(path):
+                os.remove(path)
+
+    def fail(self, position):
+        """
+        Count a failed load of a file, and reject it once it has failed MAX_ATTEMPTS times.
+        :param position: position of the file in the journal
+        :return: True if the file was rejected, False if it is tried again by the next update
+        """
+        self.connection.execute("UPDATE refresh_journal SET attempts = ifnull(attempts, 0) + 1, updated = ? "
+                                "WHERE position = ?;", (self.now(), position))
+        self.connection.commit()
+        attempts = self.connection.execute("SELECT attempts FROM refresh_journal WHERE position = ?;",
+                                           (position,)).fetchone()[0]
+        if attempts < MAX_ATTEMPTS:
+            return False
+        self.set_state(position, REJECTED)
+        return True
+
+    def set_validator(self, position, validator):
+        """
+        :param position: position of the file in the journal
+        :param validator: ETag or Last-Modified of the file being downloaded
+        """
+        self.connection.execute("UPDATE refresh_journal SET validator = ?, updated = ? WHERE position = ?;",
+                                (validator, self.now(), position))
+        self.connection.commit()
+
+    def finish(self):
+        """
+        Drop the journal once every file is done with.
+        :return: True if it was dropped, False if files are left for the next update
+        """
+        if self.resumable():
+            return False
+        self.clear()
+        return True
+
+    def clear(self):
+        """
+        Drop the journal and the files it downloaded.
+        """
+        for path, in self.connection.execute("SELECT download_path FROM refresh_journal;").fetchall():
+            if path and os.path.exists(path):
+                os.remove(path)
+        self.connection.execute("DELETE FROM refresh_journal;")
+        self.connection.commit()
@@ -0,0 +1,404 @@
+"""
+Snapshot of the whole rights database, to bring another workstation up to date without scraping CRKN and parsing
+every spreadsheet again.
+
+A snapshot is one zip file with:
+- manifest.json - the CRKN_file_names and local_file_names rows, and for each file table its columns with their
+  declared types, number of rows and the SHA-256 checksum of its members
+- manifest.sha256 - the SHA-256 checksum of manifest.json
+- two members per file table, the table's columns (with its rowids) and its title keys, each column stored one
+  after the other (columnar):
+    - Parquet (zstd) if pyarrow is installed
+    - otherwise NumPy .npz (zlib) - numbers as int64/float64 arrays, text as one UTF-8 byte array with the
+      character offset of each value, and a mask of the missing values. Nothing is pickled
+The members are already compressed, so they are stored in the zip as they are.
+
+Importing checks every checksum, and that every table is one of the listed files with known column types, before
+changing anything. The tables are created from their columns (database.create_table_sql), no SQL is taken from the
+snapshot. It then replaces all file tables in one transaction and
+builds their facet counts and indexes (Scraping.prepare_table) and the institution registry. The title keys are
+taken from the snapshot rather than normalizing every title again, unless the snapshot was made with another
+strip_title_articles setting. The changesets made afterwards (see changesets.py) are based on the imported tables,
+and the rows the import changed get a new version in the history (see history.py).
+"""
+from datetime import datetime
+import hashlib
+import io
+import json
+import zipfile
+import numpy as np
+from src.data_processing import database, changesets, Scraping
+from src.data_processing.institutions import registry, CRKN, LOCAL
+from src.utility.logger import m_logger
+from src.utility.settings_manager import Settings
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+settings_manager = Settings()
+
+# Version 1 had no manifest checksum, and kept the CREATE TABLE statements instead of the declared column types
+SNAPSHOT_VERSION = 2
+MANIFEST = "manifest.json"
+MANIFEST_CHECKSUM = "manifest.sha256"
+
+PARQUET = "parquet"
+NPZ = "npz"
+
+# Type of a column, from its values
+INTEGER = "integer"
+REAL = "real"
+TEXT = "text"
+
+
+class SnapshotError(Exception):
+    """
+    Raised when a snapshot can not be read or does not match its checksums.
+    """
+
+
+def default_format():
+    """
+    :return: PARQUET if pyarrow is installed, else NPZ
+    """
+    return PARQUET if pyarrow is not None else NPZ
+
+
+def column_type(values):
+    """
+    Get the type a column can be stored as - SQLite columns can hold values of any type.
+    :param values: list of values, None for missing
+    :return: INTEGER, REAL or TEXT
+    """
+    types = {type(value) for value in values if value is not None}
+    if types <= {int}:
+        return INTEGER
+    if types <= {int, float}:
+        return REAL
+    return TEXT
+
+
+def encode_column(values, kind):
+    """
+    Get a column as NumPy arrays.
+    :param values: list of values, None for missing
+    :param kind: INTEGER, REAL or TEXT
+    :return: dictionary of array name suffix: array
+    """
+    missing = np.fromiter((value is None for value in values), dtype=bool, count=len(values))
+    if kind == TEXT:
+        text = ["" if value is None else str(value) for value in values]
+        offsets = np.zeros(len(text) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in text], out=offsets[1:])
+        return {"data": np.frombuffer("".join(text).encode("utf-8"), dtype=np.uint8), "offsets": offsets,
+                "missing": missing}
+    dtype = np.int64 if kind == INTEGER else np.float64
+    return {"data": np.array([0 if value is None else value for value in values], dtype=dtype), "missing": missing}
+
+
+def decode_column(arrays, kind):
+    """
+    Get a column back from its NumPy arrays.
+    :param arrays: dictionary of array name suffix: array, from encode_column
+    :param kind: INTEGER, REAL or TEXT
+    :return: list of values, None for missing
+    """
+    missing = arrays["missing"].tolist()
+    if kind == TEXT:
+        # Decoded once, then cut at the character offsets
+        text = arrays["data"].tobytes().decode("utf-8")
+        offsets = arrays["offsets"].tolist()
+        return [None if is_missing else text[start:end]
+                for is_missing, start, end in zip(missing, offsets, offsets[1:])]
+    return [None if is_missing else value for value, is_missing in zip(arrays["data"].tolist(), missing)]
+
+
+def write_table(columns, kinds, file_format):
+    """
+    Write the columns of a file table as a snapshot member.
+    :param columns: dictionary of column name: list of values
+    :param kinds: dictionary of column name: INTEGER, REAL or TEXT
+    :param file_format: PARQUET or NPZ
+    :return: bytes of the member
+    """
+    buffer = io.BytesIO()
+    if file_format == PARQUET:
+        types = {INTEGER: pyarrow.int64(), REAL: pyarrow.float64(), TEXT: pyarrow.string()}
+        table = pyarrow.table({name: pyarrow.array([value if value is None or kinds[name] != TEXT else str(value)
+                                                    for value in values], type=types[kinds[name]])
+                               for name, values in columns.items()})
+        pyarrow.parquet.write_table(table, buffer, compression="zstd")
+    else:
+        # Arrays are named by column position, column names can be anything
+        arrays = {}
+        for position, (name, values) in enumerate(columns.items()):
+            for suffix, array in encode_column(values, kinds[name]).items():
+                arrays[f"{position}_{suffix}"] = array
+        np.savez_compressed(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def read_table(member, names, kinds, file_format):
+    """
+    Read the columns of a snapshot member.
+    :param member: bytes of the member
+    :param names: list of column names, in order
+    :param kinds: dictionary of column name: INTEGER, REAL or TEXT
+    :param file_format: PARQUET or NPZ
+    :return: list of columns, each a list of values
+    """
+    if file_format == PARQUET:
+        if pyarrow is None:
+            raise SnapshotError("This snapshot is in Parquet format, which needs pyarrow to be installed.")
+        table = pyarrow.parquet.read_table(io.BytesIO(member))
+        return [table.column(name).to_pylist() for name in names]
+    with np.load(io.BytesIO(member), allow_pickle=False) as arrays:
+        return [decode_column({suffix: arrays[f"{position}_{suffix}"]
+                               for suffix in ("data", "offsets", "missing") if f"{position}_{suffix}" in arrays},
+                              kinds[name])
+                for position, name in enumerate(names)]
+
+
+def checksum(data):
+    """
+    :param data: bytes
+    :return: hex SHA-256 string
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def write_member(bundle, member_name, columns, file_format):
+    """
+    Add columns to a snapshot as a member.
+    :param bundle: ZipFile of the snapshot, open for writing
+    :param member_name: name of the member
+    :param columns: dictionary of column name: list of values
+    :param file_format: PARQUET or NPZ
+    :return: dictionary of the member for the manifest - its name, columns with their types and checksum
+    """
+    kinds = {name: column_type(values) for name, values in columns.items()}
+    member = write_table(columns, kinds, file_format)
+    bundle.writestr(member_name, member)
+    return {"member": member_name, "columns": [[name, kinds[name]] for name in columns], "sha256": checksum(member)}
+
+
+def read_member(bundle, entry, file_format, rows):
+    """
+    Read a snapshot member, checking it against its checksum.
+    :param bundle: open ZipFile of the snapshot
+    :param entry: dictionary of the member in the manifest, from write_member
+    :param file_format: PARQUET or NPZ
+    :param rows: number of rows each column should have
+    :return: list of columns, each a list of values
+    :raise SnapshotError: if the member does not match its checksum or number of rows
+    """
+    member = bundle.read(entry["member"])
+    if checksum(member) != entry["sha256"]:
+        raise SnapshotError(f"{entry['member']} does not match its checksum.")
+    names = [name for name, _ in entry["columns"]]
+    columns = read_table(member, names, dict(entry["columns"]), file_format)
+    if any(len(values) != rows for values in columns):
+        raise SnapshotError(f"{entry['member']} does not have the number of rows of the manifest.")
+    return columns
+
+
+def export_snapshot(connection, path, file_format=None, progress=None):
+    """
+    Write every file table and the file name tables to a snapshot, one table at a time.
+    :param connection: database connection object
+    :param path: path of the snapshot file
+    :param file_format: PARQUET or NPZ, by default PARQUET if pyarrow is installed
+    :param progress: optional function called with (tables done, number of tables)
+    :return: manifest dictionary
+    """
+    file_format = file_format or default_format()
+    crkn_files = connection.execute("SELECT file_name, file_date FROM CRKN_file_names;").fetchall()
+    local_files = connection.execute("SELECT file_name, file_date FROM local_file_names;").fetchall()
+    tables = [file_name for file_name, _ in crkn_files] + [f"local_{file_name}" for file_name, _ in local_files]
+    manifest = {"version": SNAPSHOT_VERSION, "created": datetime.now().isoformat(timespec="seconds"),
+                "format": file_format, "strip_title_articles": settings_manager.get_setting("strip_title_articles"),
+                "CRKN_file_names": crkn_files, "local_file_names": local_files, "tables": []}
+
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_STORED) as bundle:
+        for done, table in enumerate(tables):
+            if not changesets.table_exists(connection, table):
+                m_logger.error(f"{table} is listed but does not exist, it is not in the snapshot")
+                continue
+            cursor = connection.execute(f"SELECT rowid, * FROM [{table}] ORDER BY rowid;")
+            # The rowid is kept, the title keys refer to it
+            names = ["rowid"] + [column[0] for column in cursor.description[1:]]
+            rows = cursor.fetchall()
+            data = write_member(bundle, f"tables/{done}.{file_format}",
+                                {name: list(values) for name, values in zip(names, zip(*rows) if rows else
+                                                                            [[]] * len(names))}, file_format)
+            keys = connection.execute("SELECT row_id, title_key FROM title_keys WHERE file_table = ? ORDER BY row_id;",
+                                      (table,)).fetchall()
+            title_keys = write_member(bundle, f"tables/{done}_title_keys.{file_format}",
+                                      {"row_id": [row_id for row_id, _ in keys], "title_key": [key for _, key in keys]},
+                                      file_format)
+            manifest["tables"].append({"name": table, "columns": changesets.table_columns(connection, table),
+                                       "rows": len(rows), "data": data, "title_keys": title_keys,
+                                       "title_key_rows": len(keys)})
+            if progress:
+                progress(done + 1, len(tables))
+        manifest_data = json.dumps(manifest, indent=4).encode("utf-8")
+        bundle.writestr(MANIFEST, manifest_data)
+        bundle.writestr(MANIFEST_CHECKSUM, checksum(manifest_data))
+
+    m_logger.info(f"Snapshot of {len(manifest['tables'])} tables written to {path} ({file_format})")
+    return manifest
+
+
+def read_manifest(bundle):
+    """
+    Read and check the manifest of an open snapshot.
+    :param bundle: open ZipFile of the snapshot
+    :return: manifest dictionary
+    :raise SnapshotError: if it is not a snapshot, is of a newer version or does not match its checksum
+    """
+    try:
+        manifest_data = bundle.read(MANIFEST)
+        manifest = json.loads(manifest_data)
+    except (KeyError, ValueError) as e:
+        raise SnapshotError(f"Not a snapshot file: {e}")
+    if manifest.get("version", 0) > SNAPSHOT_VERSION:
+        raise SnapshotError("This snapshot was made by a newer version and can not be imported.")
+    if MANIFEST_CHECKSUM in bundle.namelist() or manifest.get("version", 0) >= 2:
+        try:
+            expected = bundle.read(MANIFEST_CHECKSUM).decode("ascii")
+        except (KeyError, UnicodeDecodeError) as e:
+            raise SnapshotError(f"The manifest has no checksum: {e}")
+        if checksum(manifest_data) != expected:
+            raise SnapshotError("The manifest does not match its checksum.")
+    return manifest
+
+
+def table_columns(table):
+    """
+    :param table: dictionary of a file table in the manifest
+    :return: list of [name, declared type] of its columns - snapshots of version 1 only have the type of the values
+    """
+    if "columns" in table:
+        return table["columns"]
+    return [[name, kind.upper()] for name, kind in table["data"]["columns"][1:]]
+
+
+def check_tables(manifest):
+    """
+    Check that every table of a manifest is a listed file table, and build its CREATE TABLE statement.
+    :param manifest: manifest dictionary
+    :return: dictionary of table name: CREATE TABLE statement
+    :raise SnapshotError: if a table is not one of the listed files, is there twice, or can not be created
+    """
+    listed = ({file_name for file_name, _ in manifest["CRKN_file_names"]}
+              | {f"local_{file_name}" for file_name, _ in manifest["local_file_names"]})
+    statements = {}
+    for table in manifest["tables"]:
+        name = table["name"]
+        if name not in listed or name in statements or name.lower().startswith("sqlite_"):
+            raise SnapshotError(f"{name} is not one of the files of the snapshot.")
+        columns = table_columns(table)
+        if [column for column, _ in table["data"]["columns"]] != ["rowid"] + [column for column, _ in columns]:
+            raise SnapshotError(f"The data of {name} does not have the columns of the table.")
+        try:
+            statements[name] = database.create_table_sql(name, columns)
+        except ValueError as e:
+            raise SnapshotError(f"{name} can not be created: {e}")
+    return statements
+
+
+def verify_snapshot(path):
+    """
+    Check every member of a snapshot against its checksum.
+    :param path: path of the snapshot file
+    :return: manifest dictionary
+    :raise SnapshotError: if the snapshot can not be read, a member does not match its checksum or a table is not
+    one of the listed files
+    """
+    try:
+        with zipfile.ZipFile(path) as bundle:
+            manifest = read_manifest(bundle)
+            check_tables(manifest)
+            for table in manifest["tables"]:
+                for entry in (table["data"], table["title_keys"]):
+                    if checksum(bundle.read(entry["member"])) != entry["sha256"]:
+                        raise SnapshotError(f"The data of {table['name']} does not match its checksum.")
+    except (OSError, zipfile.BadZipFile, KeyError, TypeError, ValueError) as e:
+        raise SnapshotError(f"Unable to read the snapshot: {e}")
+    return manifest
+
+
+def import_snapshot(connection, path, progress=None):
+    """
+    Replace every file table with the ones of a snapshot. Nothing is changed if the snapshot does not match its
+    checksums or anything fails.
+    :param connection: database connection object
+    :param path: path of the snapshot file
+    :param progress: optional function called with (tables done, number of tables)
+    :return: manifest dictionary
+    :raise SnapshotError: if the snapshot can not be read, does not match its checksums or has a table that is not
+    one of its files
+    """
+    manifest = verify_snapshot(path)
+    tables = manifest["tables"]
+    statements = check_tables(manifest)
+    # Title keys built with another strip_title_articles setting are built again
+    same_keys = (manifest.get("strip_title_articles") == "True") == database.get_title_key_articles(connection)
+    try:
+        with zipfile.ZipFile(path) as bundle:
+            if connection.in_transaction:
+                connection.commit()
+            connection.execute("BEGIN")
+            for table in database.get_all_tables(connection):
+                connection.execute(f"DROP TABLE IF EXISTS [{table}];")
+                database.delete_title_keys(connection, table)
+                database.delete_facets(connection, table)
+            connection.execute("DELETE FROM CRKN_file_names;")
+            connection.execute("DELETE FROM local_file_names;")
+            # A file table named like one of the other tables of the database
+            taken = {name.lower() for name, in connection.execute("SELECT name FROM sqlite_master;").fetchall()}
+            for name in statements:
+                if name.lower() in taken:
+                    raise SnapshotError(f"{name} is the name of another table of the database.")
+
+            for done, table in enumerate(tables):
+                # Checked again, in case the file was changed since it was verified
+                columns = read_member(bundle, table["data"], manifest["format"], table["rows"])
+                names = ", ".join(f"[{name}]" for name, _ in table["data"]["columns"])
+                connection.execute(statements[table["name"]])
+                connection.executemany(f"INSERT INTO [{table['name']}] ({names}) VALUES "
+                                       f"({', '.join('?' * len(columns))});", zip(*columns))
+                title_keys = None
+                if same_keys:
+                    title_keys = zip(*read_member(bundle, table["title_keys"], manifest["format"],
+                                                  table["title_key_rows"]))
+                Scraping.prepare_table(table["name"], connection, title_keys)
+                if progress:
+                    progress(done + 1, len(tables))
+
+            connection.executemany("INSERT INTO CRKN_file_names (file_name, file_date) VALUES (?, ?);",
+                                   manifest["CRKN_file_names"])
+            connection.executemany("INSERT INTO local_file_names (file_name, file_date) VALUES (?, ?);",
+                                   manifest["local_file_names"])
+            # Changesets made after this are based on the imported tables
+            changesets.rebuild_state(connection, [table["name"] for table in tables])
+            database.mark_data_changed(connection)
+            connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+
+    # Institutions of the imported tables
+    crkn_tables = {file_name for file_name, _ in manifest["CRKN_file_names"]}
+    institutions = {CRKN: [], LOCAL: []}
+    for table in tables:
+        columns = [name for name, _ in table["data"]["columns"]][1:]
+        institutions[CRKN if table["name"] in crkn_tables else LOCAL].extend(columns[8:-2])
+    registry.set_CRKN_institutions(institutions[CRKN], connection)
+    registry.add(institutions[LOCAL], LOCAL, connection)
+
+    m_logger.info(f"Snapshot of {len(tables)} tables imported from {path}, made {manifest['created']}")
+    return manifest
@@ -0,0 +1,354 @@
+"""
+Source store - the CRKN and local files that were loaded, kept so the database can be rebuilt without downloading
+them again, e.g. after a change to parsing or normalization.
+
+When the source_store_enabled setting is True, each file is stored once by the SHA-256 of its contents, compressed
+(the source_store_compression setting, gzip or lzma), in the source_store_folder setting or a source_store folder
+next to the database:
+    {folder}/{first two characters of the hash}/{hash}.gz or .xz
+An index.db in the same folder lists the blobs (hash, size, compressed size, when they were last used) and the file
+versions they hold (CRKN or local, file name, date/version, name of the file). The index is in the store rather
+than in the database, so the database can be rebuilt from it even if it was lost. The latest version of a file is
+current until a newer one is stored or the file is removed, and a rebuild loads the current version of every file.
+
+Once the blobs take more than source_store_max_mb, the least recently used ones that only hold older versions are
+evicted. A blob that holds the current version of a file is never evicted, since a rebuild needs it - if the current
+files alone take more than source_store_max_mb, a warning is logged instead.
+
+A rebuild decompresses and parses the files in a pool of worker processes (see batch_upload.parse_file), then loads
+them one after another, each in its own transaction, through the same path as an update - only the rows that
+changed get a changeset and a new version in the history.
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+import gzip
+import hashlib
+import lzma
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import tempfile
+from src.utility.logger import m_logger
+from src.utility.settings_manager import Settings
+
+settings_manager = Settings()
+
+# Suffix of the blobs of each compression
+COMPRESSIONS = {"gzip": ".gz", "lzma": ".xz"}
+
+# Bytes read at a time when storing and extracting a file
+COPY_BLOCK_SIZE = 1024 * 1024
+
+# Most worker processes used to parse files when rebuilding - each can hold a whole file in memory
+MAX_REBUILD_WORKERS = 4
+
+# Errors of a blob that is missing or damaged
+READ_ERRORS = (OSError, EOFError, lzma.LZMAError)
+
+
+def store_enabled():
+    """
+    :return: True if loaded files are kept in the source store (the source_store_enabled setting)
+    """
+    return settings_manager.get_setting("source_store_enabled") == "True"
+
+
+def store_folder():
+    """
+    :return: folder of the source store
+    """
+    folder = settings_manager.get_setting("source_store_folder")
+    if folder:
+        return folder
+    return os.path.join(os.path.dirname(os.path.abspath(settings_manager.get_setting("database_name"))),
+                        "source_store")
+
+
+def open_blob(path, compression, mode):
+    """
+    :param path: path of the blob
+    :param compression: gzip or lzma
+    :param mode: rb or wb
+    :return: file object reading or writing the uncompressed contents
+    """
+    if compression == "lzma":
+        return lzma.open(path, mode)
+    return gzip.open(path, mode)
+
+
+def extract_and_parse(blob_path, compression, file_path):
+    """
+    Decompress a stored file and parse it - runs in a worker process.
+    :param blob_path: path of the blob
+    :param compression: gzip or lzma
+    :param file_path: path to write the file to, with its original name
+    :return: tuple returned by batch_upload.parse_file
+    """
+    # batch_upload imports Scraping, which imports this module
+    from src.utility.batch_upload import parse_file
+    with open_blob(blob_path, compression, "rb") as source, open(file_path, "wb") as target:
+        shutil.copyfileobj(source, target, COPY_BLOCK_SIZE)
+    return parse_file(file_path)
+
+
+class SourceStore:
+    """
+    Content-addressed store of the files loaded into the database.
+    """
+
+    def __init__(self, folder=None, max_bytes=None, compression=None):
+        """
+        :param folder: folder of the store, by default store_folder()
+        :param max_bytes: most bytes of blobs kept, by default the source_store_max_mb setting
+        :param compression: gzip or lzma, by default the source_store_compression setting
+        """
+        self.folder = folder or store_folder()
+        if max_bytes is None:
+            max_bytes = int(float(settings_manager.get_setting("source_store_max_mb") or 0) * 1024 * 1024)
+        self.max_bytes = max_bytes
+        compression = compression or settings_manager.get_setting("source_store_compression")
+        self.compression = compression if compression in COMPRESSIONS else "gzip"
+        os.makedirs(self.folder, exist_ok=True)
+        self.index = sqlite3.connect(os.path.join(self.folder, "index.db"))
+        self.index.execute("""CREATE TABLE IF NOT EXISTS blobs(sha256 TEXT PRIMARY KEY, size INTEGER,
+                              stored_size INTEGER, compression TEXT, added TEXT, last_used TEXT);""")
+        self.index.execute("""CREATE TABLE IF NOT EXISTS sources(method TEXT, file_name TEXT, file_date TEXT,
+                              original_name TEXT, sha256 TEXT, stored TEXT, current INTEGER,
+                              PRIMARY KEY (method, file_name, file_date));""")
+        self.index.commit()
+
+    def close(self):
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def blob_path(self, sha256, compression):
+        """
+        :param sha256: hash of the contents
+        :param compression: gzip or lzma
+        :return: path of the blob
+        """
+        return os.path.join(self.folder, sha256[:2], sha256 + COMPRESSIONS[compression])
+
+    def put(self, file_path, method, file_name, file_date, original_name=None):
+        """
+        Store a file that was loaded as the current version of its file. A file with the same contents as a stored
+        one is not stored again.
+        :param file_path: path to the file
+        :param method: CRKN or local
+        :param file_name: name in the {method}_file_names table
+        :param file_date: date/version in the {method}_file_names table
+        :param original_name: name of the file, by default the name of file_path
+        :return: hex SHA-256 of the file
+        """
+        now = datetime.now().isoformat(timespec="seconds")
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as file:
+            for block in iter(lambda: file.read(COPY_BLOCK_SIZE), b""):
+                digest.update(block)
+        sha256 = digest.hexdigest()
+
+        if self.index.execute("SELECT 1 FROM blobs WHERE sha256 = ?;", (sha256,)).fetchone():
+            self.index.execute("UPDATE blobs SET last_used = ? WHERE sha256 = ?;", (now, sha256))
+        else:
+            path = self.blob_path(sha256, self.compression)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            partial = path + ".part"
+            try:
+                with open(file_path, "rb") as source, open_blob(partial, self.compression, "wb") as target:
+                    shutil.copyfileobj(source, target, COPY_BLOCK_SIZE)
+                os.replace(partial, path)
+            except BaseException:
+                if os.path.exists(partial):
+                    os.remove(partial)
+                raise
+            self.index.execute("""INSERT INTO blobs (sha256, size, stored_size, compression, added, last_used)
+                                  VALUES (?, ?, ?, ?, ?, ?);""",
+                               (sha256, os.path.getsize(file_path), os.path.getsize(path), self.compression, now, now))
+
+        self.index.execute("UPDATE sources SET current = 0 WHERE method = ? AND file_name = ?;", (method, file_name))
+        self.index.execute("""INSERT OR REPLACE INTO sources (method, file_name, file_date, original_name, sha256,
+                              stored, current) VALUES (?, ?, ?, ?, ?, ?, 1);""",
+                           (method, file_name, file_date, original_name or os.path.basename(file_path), sha256, now))
+        self.index.commit()
+        self.evict()
+        return sha256
+
+    def retire(self, method, file_name):
+        """
+        Mark a file removed from the database, so it is not loaded by a rebuild. Its blobs are kept until evicted.
+        :param method: CRKN or local
+        :param file_name: name in the {method}_file_names table
+        """
+        self.index.execute("UPDATE sources SET current = 0 WHERE method = ? AND file_name = ?;", (method, file_name))
+        self.index.commit()
+
+    def stored_bytes(self):
+        """
+        :return: total size of the blobs
+        """
+        return self.index.execute("SELECT ifnull(SUM(stored_size), 0) FROM blobs;").fetchone()[0]
+
+    def current_sources(self):
+        """
+        :return: list of (method, file_name, file_date, original_name, sha256, compression) of the current version
+                 of every file whose blob is still stored
+        """
+        return self.index.execute("""SELECT method, file_name, file_date, original_name, sources.sha256, compression
+                                     FROM sources JOIN blobs ON blobs.sha256 = sources.sha256
+                                     WHERE current = 1 ORDER BY method, file_name;""").fetchall()
+
+    def evict(self):
+        """
+        Remove the least recently used blobs until they fit in max_bytes. Only blobs that hold no current file are
+        removed, a warning is logged if they still do not fit.
+        :return: number of blobs removed
+        """
+        if self.max_bytes <= 0:
+            return 0
+        total = self.stored_bytes()
+        if total <= self.max_bytes:
+            return 0
+        candidates = self.index.execute("""SELECT sha256, stored_size, compression FROM blobs
+                                           WHERE NOT EXISTS (SELECT 1 FROM sources WHERE sources.sha256 = blobs.sha256
+                                                             AND current = 1)
+                                           ORDER BY last_used, added;""").fetchall()
+        removed = 0
+        for sha256, stored_size, compression in candidates:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self.blob_path(sha256, compression))
+            except FileNotFoundError:
+                pass
+            self.index.execute("DELETE FROM blobs WHERE sha256 = ?;", (sha256,))
+            self.index.execute("DELETE FROM sources WHERE sha256 = ?;", (sha256,))
+            total -= stored_size
+            removed += 1
+        self.index.commit()
+        m_logger.info(f"Source store over {self.max_bytes} bytes, {removed} files evicted")
+        if total > self.max_bytes:
+            m_logger.warning(f"The current files in the source store take {total} bytes, more than "
+                             f"source_store_max_mb ({self.max_bytes} bytes) - they are kept for rebuilds")
+        return removed
+
+    def rebuild(self, connection, progress=None, max_workers=None):
+        """
+        Load the current version of every stored file again, without downloading anything.
+        :param connection: database.BatchConnection object
+        :param progress: optional function called with (files done, number of files)
+        :param max_workers: number of worker processes used to parse the files, by default one per file up to
+                            MAX_REBUILD_WORKERS and the number of CPUs
+        :return: tuple of (number of files loaded, list of the names of the files that failed)
+        """
+        # These import Scraping, which imports this module
+        from src.data_processing import Scraping, chunked_ingest, changesets
+
+        sources = self.current_sources()
+        if max_workers is None:
+            max_workers = min(len(sources), MAX_REBUILD_WORKERS, os.cpu_count() or 1)
+        loaded = 0
+        failed = []
+        methods = set()
+        with tempfile.TemporaryDirectory() as directory:
+            jobs = []
+            for number, (method, file_name, file_date, original_name, sha256, compression) in enumerate(sources):
+                os.makedirs(os.path.join(directory, str(number)))
+                jobs.append((method, file_name, file_date, original_name, self.blob_path(sha256, compression),
+                             compression, os.path.join(directory, str(number), original_name)))
+
+            results = {}
+            if len(jobs) > 1 and max_workers > 1:
+                # spawn, since this is called from a thread of a Qt application
+                with ProcessPoolExecutor(max_workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+                    futures = {pool.submit(extract_and_parse, job[4], job[5], job[6]): number
+                               for number, job in enumerate(jobs)}
+                    for future in as_completed(futures):
+                        try:
+                            results[futures[future]] = future.result()
+                        except READ_ERRORS as e:
+                            results[futures[future]] = e
+            else:
+                for number, job in enumerate(jobs):
+                    try:
+                        results[number] = extract_and_parse(job[4], job[5], job[6])
+                    except READ_ERRORS as e:
+                        results[number] = e
+
+            for number, (method, file_name, file_date, original_name, _, _, file_path) in enumerate(jobs):
+                result = results.pop(number)
+                if isinstance(result, READ_ERRORS):
+                    m_logger.error(f"Unable to read {original_name} from the source store: {result}")
+                    failed.append(original_name)
+                    continue
+                file_df, _, _, error, error_detail = result[:5]
+                if error is not None:
+                    m_logger.error(f"{original_name} from the source store could not be loaded: {error} {error_detail}")
+                    failed.append(original_name)
+                    continue
+
+                table_name = changesets.file_table_name(file_name, method)
+                known = connection.execute(f"SELECT 1 FROM {method}_file_names WHERE file_name = ?;",
+                                           (file_name,)).fetchone()
+                with connection.transaction() as committed:
+                    if file_df is None:
+                        valid_file, _ = chunked_ingest.load_file_in_chunks(original_name, file_path, table_name,
+                                                                           connection)
+                        uploaded = valid_file is True
+                    else:
+                        uploaded = Scraping.upload_to_database(file_df, table_name, connection)
+                    if not (uploaded and Scraping.update_tables([file_name, file_date], method, connection,
+                                                                "UPDATE" if known else "INSERT INTO")):
+                        connection.rollback()
+                if committed[0]:
+                    loaded += 1
+                    methods.add(method)
+                else:
+                    failed.append(original_name)
+                os.remove(file_path)
+                if progress:
+                    progress(number + 1, len(jobs))
+
+        changesets.update_registry(connection, methods)
+        m_logger.info(f"Rebuilt {loaded} files from the source store, {len(failed)} failed")
+        return loaded, failed
+
+
+def keep_source(file_path, method, file_name, file_date, original_name=None):
+    """
+    Store a file that was loaded, if the store is enabled. A file that can not be stored is logged, and does not
+    stop the load.
+    :param file_path: path to the file
+    :param method: CRKN or local
+    :param file_name: name in the {method}_file_names table
+    :param file_date: date/version in the {method}_file_names table
+    :param original_name: name of the file, by default the name of file_path
+    """
+    if not store_enabled():
+        return
+    try:
+        with SourceStore() as store:
+            store.put(file_path, method, file_name, file_date, original_name)
+    except (OSError, sqlite3.Error) as e:
+        m_logger.error(f"Unable to keep {original_name or file_path} in the source store: {e}")
+
+
+def retire_source(method, file_name):
+    """
+    Mark a file removed from the database in the store, if the store is enabled. A store that can not be opened is
+    logged.
+    :param method: CRKN or local
+    :param file_name: name in the {method}_file_names table
+    """
+    if not store_enabled():
+        return
+    try:
+        with SourceStore() as store:
+            store.retire(method, file_name)
+    except (OSError, sqlite3.Error) as e:
+        m_logger.error(f"Unable to mark {file_name} removed in the source store: {e}")
@@ -0,0 +1,104 @@
+"""
+Search-as-you-type suggestions for the start screen.
+
+Each searchable field has a sorted array of (key, value) pairs kept in memory, so a prefix lookup is a bisect
+plus a short scan instead of a database query. The arrays are built the first time a field is used, and
+rebuilt when database.get_data_signature says the file tables changed.
+"""
+from bisect import bisect_left
+import time
+from src.data_processing import database
+from src.data_processing.normalization import normalize_title, normalize_identifier
+from src.utility.logger import m_logger
+
+# Fields that have suggestions
+SUGGESTION_FIELDS = ["Title", "Platform_eISBN", "OCN"]
+
+
+class PrefixIndex:
+    """
+    Sorted prefix arrays for the suggestion fields, built lazily from the file tables.
+    """
+
+    def __init__(self):
+        self.signature = None
+        # field: (sorted list of keys, list of values in the same order)
+        self.fields = {}
+
+    def suggest(self, connection, field, text, limit=10):
+        """
+        Get suggestions for the text typed so far.
+        :param connection: database connection object
+        :param field: Title, Platform_eISBN or OCN
+        :param text: text typed by the user
+        :param limit: maximum number of suggestions
+        :return: list of distinct values starting with the text (compared by normalized key)
+        """
+        if field not in SUGGESTION_FIELDS:
+            return []
+        prefix = self.make_key(connection, field, text)
+        if not prefix:
+            return []
+
+        signature = database.get_data_signature(connection)
+        if signature != self.signature:
+            self.fields = {}
+            self.signature = signature
+        if field not in self.fields:
+            self.fields[field] = self.build(connection, field)
+        keys, values = self.fields[field]
+
+        suggestions = []
+        i = bisect_left(keys, prefix)
+        while i < len(keys) and keys[i].startswith(prefix) and len(suggestions) < limit:
+            if values[i] not in suggestions:
+                suggestions.append(values[i])
+            i += 1
+        return suggestions
+
+    def build(self, connection, field):
+        """
+        Build the sorted prefix array of one field from every file table.
+        :param connection: database connection object
+        :param field: Title, Platform_eISBN or OCN
+        :return: tuple of (sorted keys, values)
+        """
+        start = time.perf_counter()
+        entries = set()
+        for table in database.get_tables(connection):
+            if field == "Title":
+                # Title keys are already computed in title_keys
+                rows = connection.execute(f"""SELECT keys.title_key, file.Title FROM title_keys AS keys
+                                              JOIN [{table}] AS file ON file.rowid = keys.row_id
+                                              WHERE keys.file_table = ?;""", (table,))
+                entries.update((key, title) for key, title in rows if key)
+            else:
+                rows = connection.execute(f"SELECT DISTINCT [{field}] FROM [{table}];")
+                for (value,) in rows:
+                    key = normalize_identifier(value)
+                    if key:
+                        entries.add((key, key))
+        entries = sorted(entries)
+        m_logger.info(f"Built {field} suggestions ({len(entries)} entries) in {time.perf_counter() - start:.2f}s")
+        return [entry[0] for entry in entries], [entry[1] for entry in entries]
+
+    def make_key(self, connection, field, text):
+        """
+        Normalize typed text the same way as the stored keys of the field.
+        :param connection: database connection object
+        :param field: Title, Platform_eISBN or OCN
+        :param text: text typed by the user
+        :return: key prefix string
+        """
+        if field == "Title":
+            return normalize_title(text, database.get_title_key_articles(connection))
+        return normalize_identifier(text)
+
+    def invalidate(self):
+        """Drop all the arrays, they are rebuilt on the next suggestion."""
+        self.signature = None
+        self.fields = {}
+
+
+# Shared by every start screen instance
+prefix_index = PrefixIndex()
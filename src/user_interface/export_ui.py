@@ -0,0 +1,203 @@
+from PyQt6.QtWidgets import QFileDialog, QApplication, QMessageBox, QDialog, QVBoxLayout, QProgressBar, QPushButton, QLabel
+from PyQt6.QtCore import Qt, QThread, pyqtSignal
+import sys
+from src.data_processing.holdings_report import HoldingsReport, REPORT_COLUMNS, TOTAL_COLUMNS, totals_path
+from src.utility.logger import m_logger
+from src.utility.progress import ProgressReporter
+from src.utility.settings_manager import Settings
+from src.utility.streaming_export import write_rows, export_format, export_path, ExportCancelled
+
+
+settings_manager = Settings()
+
+
+def export_data(data, headers, total=None):
+    """
+    Export the data in the form of a tsv, csv or xlsx file, chosen by the user. The rows are written one at a time
+    on a background thread (see streaming_export.py).
+    :param data: data to export - a list of rows, or any iterable of rows such as streaming_export.cursor_rows
+    :param headers: headers of the columns - in the form of a list
+    :param total: number of rows, for the progress bar, if data is not a list
+    """
+    language = settings_manager.get_setting("language")
+    app = QApplication.instance()  # Try to get the existing application instance
+    if app is None:  # If no instance exists, create a new one
+        app = QApplication(sys.argv)
+
+    # Get the file path to save the file
+    save_path = get_save_path()
+
+    if save_path:
+        save_path = export_path(save_path)
+        if run_export(data, headers, save_path, len(data) if total is None and hasattr(data, "__len__") else total):
+            QMessageBox.information(None, "File Export" if language == "English" else "Exportation de fichiers", f"File has been exported to:\n{save_path}" if language == "English" else f"Le fichier a été exporté vers:\n{save_path}", QMessageBox.StandardButton.Ok)
+
+
+def export_holdings_report():
+    """
+    Export every title the selected institution has perpetual access to, across all CRKN and local files, with the
+    number of titles of each platform next to it (see holdings_report.py).
+    """
+    language = settings_manager.get_setting("language")
+    institution = settings_manager.get_setting("institution")
+    if not institution:
+        QMessageBox.information(None, "No institution selected" if language == "English" else "Aucun établissement sélectionné",
+                                "You have no institution selected. Please select an institution on the settings page." if language == "English" else
+                                "Vous n'avez sélectionné aucun institut. Veuillez sélectionner un institut sur la page des paramètres.")
+        return
+
+    save_path = get_save_path()
+    if not save_path:
+        return
+    save_path = export_path(save_path)
+
+    # The rows are read on the export thread, through its own connection
+    report = HoldingsReport(institution)
+    if not run_export(report.rows(), REPORT_COLUMNS, save_path, report.count()):
+        return
+    platform_totals = totals_path(save_path)
+    write_rows(report.totals(), TOTAL_COLUMNS, platform_totals, "csv")
+
+    totals = "\n".join(f"{platform}: {titles}" for platform, titles in report.totals()[:10])
+    if len(report.platform_totals) > 10:
+        totals += "\n..."
+    QMessageBox.information(None, "Holdings Report" if language == "English" else "Rapport des fonds",
+                            (f"{report.total()} titles from {report.tables} files have been exported to:\n{save_path}\n"
+                             f"{report.duplicates} titles found in more than one file were listed once.\n\n"
+                             f"Titles by platform ({platform_totals}):\n{totals}") if language == "English" else
+                            (f"{report.total()} titres de {report.tables} fichiers ont été exportés vers:\n{save_path}\n"
+                             f"{report.duplicates} titres trouvés dans plusieurs fichiers ont été listés une seule fois.\n\n"
+                             f"Titres par plateforme ({platform_totals}):\n{totals}"), QMessageBox.StandardButton.Ok)
+
+
+def run_export(data, headers, save_path, total=None):
+    """
+    Export rows on a background thread, showing its progress until it is complete, and any error.
+    :param data: iterable of rows
+    :param headers: headers of the columns
+    :param save_path: path of the file
+    :param total: number of rows, for the progress bar
+    :return: True if the file was exported, False if it was cancelled or failed
+    """
+    language = settings_manager.get_setting("language")
+    exportUI = ExportUI(data, headers, save_path, total)
+    exportUI.exec()
+    if exportUI.error is not None:
+        QMessageBox.critical(None, "Error" if language == "English" else "Erreur",
+                             f"An error occurred during the export: {exportUI.error}" if language == "English" else
+                             f"Une erreur s'est produite lors de l'exportation: {exportUI.error}", QMessageBox.StandardButton.Ok)
+    return exportUI.completed
+
+
+def get_save_path():
+    """
+    Get the save path of the file to export. This is a path selected by the user in their file structure.
+    :return: The save path.
+    """
+    language = settings_manager.get_setting("language")
+    options = QFileDialog.Option.ReadOnly
+    save_path, _ = QFileDialog.getSaveFileName(None, "Save Data" if language == "English" else "Enregistrer le fichier", "",
+                                               "TSV Files (*.tsv);;CSV Files (*.csv);;Excel Files (*.xlsx);;All Files (*)" if language == "English" else
+                                               "Fichiers TSV (*.tsv);;Fichiers CSV (*.csv);;Fichiers Excel (*.xlsx);;Tous les fichiers (*)", options=options)
+
+    return save_path
+
+
+class ExportUI(QDialog):
+    def __init__(self, data, headers, save_path, total=None):
+        super().__init__()
+        language = settings_manager.get_setting("language")
+        self.setWindowTitle("Exporting File..." if language == "English" else "Exportation du fichier...")
+        self.setWindowFlags(Qt.WindowType.Dialog | Qt.WindowType.CustomizeWindowHint | Qt.WindowType.WindowTitleHint)
+
+        layout = QVBoxLayout(self)
+
+        self.progress_bar = QProgressBar(self)
+        self.progress_bar.setRange(0, 100)
+        layout.addWidget(self.progress_bar)
+
+        # Throughput and time left
+        self.status_label = QLabel(self)
+        layout.addWidget(self.status_label)
+
+        self.cancel_button = QPushButton("Cancel" if language == "English" else "Annuler", self)
+        self.cancel_button.clicked.connect(self.cancel)
+        layout.addWidget(self.cancel_button)
+
+        self.completed = False
+        self.error = None
+        self.export_finished = False
+
+        self.export_thread = ExportThread(data, headers, save_path, total)
+        self.export_thread.progress_update.connect(self.progress_bar.setValue)
+        self.export_thread.progress_status.connect(self.status_label.setText)
+        self.export_thread.export_done.connect(self.export_done)
+        self.export_thread.start()
+
+    def cancel(self):
+        # The dialog closes once the thread has stopped and removed the partial file
+        self.cancel_button.setEnabled(False)
+        self.export_thread.cancel()
+
+    def reject(self):
+        # Escape cancels the export rather than closing the dialog while the thread is running
+        if self.export_finished:
+            super().reject()
+        else:
+            self.cancel()
+
+    def export_done(self, completed, error):
+        self.export_thread.wait()
+        self.completed = completed
+        self.error = error or None
+        self.export_finished = True
+        self.close()
+
+
+class ExportThread(QThread):
+    def __init__(self, data, headers, save_path, total=None):
+        super().__init__()
+        self.data = data
+        self.headers = headers
+        self.save_path = save_path
+        self.total = total
+        self.cancelled = False
+
+    progress_update = pyqtSignal(int)
+    progress_status = pyqtSignal(str)
+    # (completed, error message)
+    export_done = pyqtSignal(bool, str)
+
+    def run(self):
+        language = settings_manager.get_setting("language")
+        exporting = "Exporting rows" if language == "English" else "Exportation des lignes"
+        reporter = ProgressReporter(self.report_progress, [(exporting, 1)], language)
+        reporter.start(exporting, self.total or 0)
+        # Rows written at the last update, for throughput
+        written = [0]
+
+        def progress(rows):
+            reporter.update(rows, rows - written[0], "rows")
+            written[0] = rows
+
+        try:
+            write_rows(self.data, self.headers, self.save_path, export_format(self.save_path), progress,
+                       lambda: self.cancelled)
+        except ExportCancelled:
+            m_logger.info("Export cancelled")
+            self.export_done.emit(False, "")
+            return
+        except Exception as e:
+            m_logger.error(f"Export to {self.save_path} failed: {e}")
+            self.export_done.emit(False, str(e))
+            return
+        reporter.finish()
+        self.export_done.emit(True, "")
+
+    def report_progress(self, percent, status):
+        self.progress_update.emit(percent)
+        self.progress_status.emit(status)
+
+    def cancel(self):
+        # Stops at the next block of rows
+        self.cancelled = True
@@ -1,7 +1,12 @@
-from PyQt6.QtWidgets import QDialog, QPushButton, QLabel, QFrame, QMessageBox
+from PyQt6.QtWidgets import QDialog, QPushButton, QLabel, QFrame, QMessageBox, QFileDialog, QApplication, QInputDialog
+from PyQt6.QtCore import Qt
 from PyQt6.uic import loadUi
-from src.utility.upload import upload_and_process_file
-from src.data_processing.database import get_local_tables, connect_to_database, close_database, get_table_data
+from src.user_interface.upload_ui import upload_and_process_file
+from src.data_processing.database import get_local_tables, connect_to_database, connect_for_batch, close_database, get_table_data
+from src.data_processing.snapshot import export_snapshot, import_snapshot
+from src.data_processing.changesets import export_changesets, apply_changesets
+from src.data_processing.source_store import SourceStore
+from src.utility.logger import m_logger
 from src.utility.settings_manager import Settings
 import os
 
@@ -19,6 +24,25 @@ class ManageLocalDatabasesPopup(QDialog):
 
         self.uploadButton = self.findChild(QPushButton, 'uploadButton')
         self.uploadButton.clicked.connect(self.upload_local_databases)
+
+        # Snapshot of the whole database, to bring another workstation up to date
+        self.exportSnapshotButton = QPushButton("Export Snapshot" if self.language_value == "English" else "Exporter un instantané", self)
+        self.exportSnapshotButton.clicked.connect(self.export_snapshot)
+        self.horizontalLayout.insertWidget(1, self.exportSnapshotButton)
+        self.importSnapshotButton = QPushButton("Import Snapshot" if self.language_value == "English" else "Importer un instantané", self)
+        self.importSnapshotButton.clicked.connect(self.import_snapshot)
+        self.horizontalLayout.insertWidget(2, self.importSnapshotButton)
+        # Changes since the snapshot, to keep workstations in sync
+        self.exportChangesButton = QPushButton("Export Changes" if self.language_value == "English" else "Exporter les modifications", self)
+        self.exportChangesButton.clicked.connect(self.export_changes)
+        self.horizontalLayout.insertWidget(3, self.exportChangesButton)
+        self.applyChangesButton = QPushButton("Apply Changes" if self.language_value == "English" else "Appliquer les modifications", self)
+        self.applyChangesButton.clicked.connect(self.apply_changes)
+        self.horizontalLayout.insertWidget(4, self.applyChangesButton)
+        # Loads the stored copies of the loaded files again, without downloading them
+        self.rebuildButton = QPushButton("Rebuild from Store" if self.language_value == "English" else "Reconstruire depuis le dépôt", self)
+        self.rebuildButton.clicked.connect(self.rebuild_from_store)
+        self.horizontalLayout.insertWidget(5, self.rebuildButton)
                 
         self.populate_table_information()  # Populate the table information initially
         
@@ -77,4 +101,136 @@ class ManageLocalDatabasesPopup(QDialog):
 
     def upload_local_databases(self):
         upload_and_process_file()
-        self.populate_table_information()
\ No newline at end of file
+        self.populate_table_information()
+
+    def export_snapshot(self):
+        english = self.language_value == "English"
+        path, _ = QFileDialog.getSaveFileName(self, "Export Snapshot" if english else "Exporter un instantané", "ePat_snapshot.zip",
+                                              "Snapshot (*.zip)" if english else "Instantané (*.zip)")
+        if not path:
+            return
+        connection = connect_to_database()
+        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+        try:
+            manifest = export_snapshot(connection, path)
+        except Exception as e:
+            m_logger.error(f"Snapshot export failed: {e}")
+            QApplication.restoreOverrideCursor()
+            QMessageBox.critical(self, "Error" if english else "Erreur", f"The snapshot could not be exported: {e}" if english else f"L'instantané n'a pas pu être exporté: {e}")
+            return
+        finally:
+            close_database(connection)
+        QApplication.restoreOverrideCursor()
+        QMessageBox.information(self, "Export Snapshot" if english else "Exporter un instantané",
+                                f"{len(manifest['tables'])} tables have been exported to:\n{path}" if english else f"{len(manifest['tables'])} tables ont été exportées vers:\n{path}")
+
+    def import_snapshot(self):
+        english = self.language_value == "English"
+        path, _ = QFileDialog.getOpenFileName(self, "Import Snapshot" if english else "Importer un instantané", "",
+                                              "Snapshot (*.zip)" if english else "Instantané (*.zip)")
+        if not path:
+            return
+        confirm = QMessageBox.question(self, "Confirmation",
+                                       "All CRKN and local files in the database will be replaced by the ones of the snapshot. Continue?" if english else
+                                       "Tous les fichiers du RCDR et locaux de la base de données seront remplacés par ceux de l'instantané. Continuer?",
+                                       QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
+        if confirm != QMessageBox.StandardButton.Yes:
+            return
+        connection = connect_to_database()
+        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+        try:
+            manifest = import_snapshot(connection, path)
+        except Exception as e:
+            m_logger.error(f"Snapshot import failed: {e}")
+            QApplication.restoreOverrideCursor()
+            QMessageBox.critical(self, "Error" if english else "Erreur", f"The snapshot could not be imported, the database was not changed: {e}" if english else
+                                 f"L'instantané n'a pas pu être importé, la base de données n'a pas été modifiée: {e}")
+            return
+        finally:
+            close_database(connection)
+        QApplication.restoreOverrideCursor()
+        self.populate_table_information()
+        QMessageBox.information(self, "Import Snapshot" if english else "Importer un instantané",
+                                f"{len(manifest['tables'])} tables made on {manifest['created']} have been imported." if english else
+                                f"{len(manifest['tables'])} tables créées le {manifest['created']} ont été importées.")
+
+    def export_changes(self):
+        english = self.language_value == "English"
+        # Named workstations only get the changes made since their last export, blank exports every change
+        peer, ok_pressed = QInputDialog.getText(self, "Export Changes" if english else "Exporter les modifications",
+                                                "Workstation the changes are for (blank for all changes):" if english else
+                                                "Poste auquel les modifications sont destinées (vide pour toutes les modifications) :")
+        if not ok_pressed:
+            return
+        path, _ = QFileDialog.getSaveFileName(self, "Export Changes" if english else "Exporter les modifications", "ePat_changes.gz",
+                                              "Changes (*.gz)" if english else "Modifications (*.gz)")
+        if not path:
+            return
+        connection = connect_to_database()
+        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+        try:
+            count = export_changesets(connection, path, peer=peer.strip() or None)
+        except Exception as e:
+            m_logger.error(f"Changes export failed: {e}")
+            QApplication.restoreOverrideCursor()
+            QMessageBox.critical(self, "Error" if english else "Erreur", f"The changes could not be exported: {e}" if english else f"Les modifications n'ont pas pu être exportées: {e}")
+            return
+        finally:
+            close_database(connection)
+        QApplication.restoreOverrideCursor()
+        QMessageBox.information(self, "Export Changes" if english else "Exporter les modifications",
+                                f"{count} changes have been exported to:\n{path}" if english else f"{count} modifications ont été exportées vers:\n{path}")
+
+    def apply_changes(self):
+        english = self.language_value == "English"
+        path, _ = QFileDialog.getOpenFileName(self, "Apply Changes" if english else "Appliquer les modifications", "",
+                                              "Changes (*.gz)" if english else "Modifications (*.gz)")
+        if not path:
+            return
+        connection = connect_to_database()
+        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+        try:
+            applied, skipped = apply_changesets(connection, path)
+        except Exception as e:
+            m_logger.error(f"Applying changes failed: {e}")
+            QApplication.restoreOverrideCursor()
+            self.populate_table_information()
+            QMessageBox.critical(self, "Error" if english else "Erreur", f"The changes could not all be applied: {e}" if english else
+                                 f"Les modifications n'ont pas toutes pu être appliquées: {e}")
+            return
+        finally:
+            close_database(connection)
+        QApplication.restoreOverrideCursor()
+        self.populate_table_information()
+        QMessageBox.information(self, "Apply Changes" if english else "Appliquer les modifications",
+                                f"{applied} changes applied, {skipped} already up to date." if english else
+                                f"{applied} modifications appliquées, {skipped} déjà à jour.")
+
+    def rebuild_from_store(self):
+        english = self.language_value == "English"
+        confirm = QMessageBox.question(self, "Confirmation",
+                                       "Every file kept in the source store will be loaded again. Continue?" if english else
+                                       "Tous les fichiers conservés dans le dépôt seront chargés de nouveau. Continuer?",
+                                       QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
+        if confirm != QMessageBox.StandardButton.Yes:
+            return
+        connection = connect_for_batch()
+        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+        try:
+            with SourceStore() as store:
+                loaded, failed = store.rebuild(connection)
+        except Exception as e:
+            m_logger.error(f"Rebuild from the source store failed: {e}")
+            QApplication.restoreOverrideCursor()
+            self.populate_table_information()
+            QMessageBox.critical(self, "Error" if english else "Erreur", f"The database could not be rebuilt: {e}" if english else
+                                 f"La base de données n'a pas pu être reconstruite: {e}")
+            return
+        finally:
+            close_database(connection)
+        QApplication.restoreOverrideCursor()
+        self.populate_table_information()
+        message = f"{loaded} files have been loaded again." if english else f"{loaded} fichiers ont été chargés de nouveau."
+        if failed:
+            message += ("\nNot loaded: " if english else "\nNon chargés: ") + ", ".join(failed)
+        QMessageBox.information(self, "Rebuild from Store" if english else "Reconstruire depuis le dépôt", message)
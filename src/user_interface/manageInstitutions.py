@@ -1,7 +1,8 @@
 from PyQt6.QtWidgets import QDialog, QPushButton, QLabel, QInputDialog, QFrame, QMessageBox
 from PyQt6.uic import loadUi
-from src.utility.upload import upload_and_process_file
+from src.user_interface.upload_ui import upload_and_process_file
 from src.data_processing.database import get_local_tables, connect_to_database, close_database, get_table_data
+from src.data_processing.institutions import registry, LOCAL
 from src.utility.settings_manager import Settings
 import os
 
@@ -27,7 +28,7 @@ class ManageInstitutionsPopup(QDialog):
         
         # Get those tables
         connection = connect_to_database()
-        institutions = settings_manager.get_setting("local_institutions")
+        institutions = registry.names(LOCAL, connection)
 
         # Populate the scroll area with table information
         for institution in institutions:
@@ -53,8 +54,7 @@ class ManageInstitutionsPopup(QDialog):
         confirm = QMessageBox.question(self, "Confirmation", 
                                        f"Are you sure you want to remove {institution}?" if self.language_value == "English" else f"Êtes-vous sûr de vouloir supprimer {institution}?", QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
         if confirm == QMessageBox.StandardButton.Yes:
-            print(institution)
-            settings_manager.remove_local_institution(institution)
+            registry.remove([institution])
             self.populate_table_information() 
             QMessageBox.information(self, "Success" if self.language_value == "English" else "Succès", 
                                     f"{institution} has been removed successfully." if self.language_value == "English" else f"{institution} a été supprimé avec succès.")
@@ -72,10 +72,10 @@ class ManageInstitutionsPopup(QDialog):
     def upload_local_institution(self):
         institution, ok_pressed = QInputDialog.getText(self, "Add Institution" if self.language_value == "English" else "Ajouter un établissement", 
                                                        "Enter institution name:" if self.language_value == "English" else "Entrez le nom de l'établissement :")
-        if ok_pressed and institution.strip() and institution not in settings_manager.get_setting("local_institutions"): 
-            settings_manager.add_local_institution(institution)
+        if ok_pressed and institution.strip() and not registry.is_known(institution):
+            registry.add([institution], LOCAL)
             self.populate_table_information()
-        elif institution in settings_manager.get_institutions():
+        elif registry.is_known(institution):
             QMessageBox.warning(self, "Warning" if self.language_value == "English" else "Avertissement", 
                                 "Institution already saved." if self.language_value == "English" else "Établissement déjà enregistré.")
         else:
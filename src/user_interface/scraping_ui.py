@@ -1,11 +1,82 @@
-from PyQt6.QtCore import QTimer, Qt
-from PyQt6.QtWidgets import QDialog, QVBoxLayout, QProgressBar, QMessageBox
-from src.data_processing.Scraping import ScrapingThread
+from PyQt6.QtCore import QTimer, Qt, QThread, pyqtSignal
+from PyQt6.QtWidgets import QDialog, QVBoxLayout, QProgressBar, QMessageBox, QPushButton, QLabel
+from src.data_processing.Scraping import CRKNUpdate, ScheduledRefresh
+from src.utility.logger import m_logger
 from src.utility.settings_manager import Settings
 
 settings_manager = Settings()
 language = settings_manager.get_setting("language")
 
+
+class ScrapingThread(QThread):
+    """
+    Runs a CRKNUpdate on a thread, with its callbacks sent to the UI as signals.
+    """
+
+    progress_update = pyqtSignal(int)
+    progress_status = pyqtSignal(str)
+    file_changes_signal = pyqtSignal(int)
+    error_signal = pyqtSignal(str)
+    # Path of the access change report, and number of changes of each kind
+    access_changes_signal = pyqtSignal(str, dict)
+
+    def __init__(self):
+        super().__init__()
+        self.crkn_update = CRKNUpdate(self.report_progress, self.error_signal.emit, self.confirm_changes,
+                                      self.access_changes_signal.emit)
+
+    def run(self):
+        self.crkn_update.update_database()
+
+    def report_progress(self, percent, status):
+        self.progress_update.emit(percent)
+        self.progress_status.emit(status)
+
+    def confirm_changes(self, file_changes):
+        # Waits for the user to answer the file changes dialog
+        return self.crkn_update.channel.ask(lambda: self.file_changes_signal.emit(file_changes)) == "Y"
+
+    def receive_response(self, response):
+        self.crkn_update.channel.respond(response)
+
+    def cancel(self):
+        # Stops after the chunk being downloaded, and stops waiting for a response
+        self.crkn_update.cancel()
+
+
+class ScheduledRefreshThread(QThread):
+    """
+    Runs the scheduled CRKN updates (see refresh_schedule.py) in the background. Errors are only logged.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.scheduled_refresh = ScheduledRefresh(error=m_logger.error)
+
+    def run(self):
+        self.scheduled_refresh.run_schedule()
+
+    def stop(self):
+        # Stops after the chunk being downloaded - main.py waits for the thread once the window is closed
+        self.scheduled_refresh.cancel()
+
+
+def start_scheduled_refresh():
+    """
+    Start the scheduled CRKN updates in the background, if the scheduled_refresh setting is on.
+    :return: the running ScheduledRefreshThread, or None
+    """
+    if settings_manager.get_setting("scheduled_refresh") != "True":
+        return None
+    if settings_manager.get_setting("allow_CRKN") != "True":
+        m_logger.info("CRKN is turned off, the scheduled CRKN updates are not started")
+        return None
+    thread = ScheduledRefreshThread()
+    # Lowest priority, so searching is not slowed down while an update runs
+    thread.start(QThread.Priority.IdlePriority)
+    return thread
+
+
 def scrapeCRKN():
     global language 
     language = settings_manager.get_setting("language")
@@ -24,26 +95,55 @@ class LoadingPopup(QDialog):
         self.progress_bar.setRange(0, 100)
         layout.addWidget(self.progress_bar)
 
+        # Throughput and time left
+        self.status_label = QLabel(self)
+        layout.addWidget(self.status_label)
+
+        self.cancel_button = QPushButton("Cancel" if language == "English" else "Annuler", self)
+        self.cancel_button.clicked.connect(self.cancel)
+        layout.addWidget(self.cancel_button)
+
         self.loading_thread = ScrapingThread()
         self.loading_thread.progress_update.connect(self.update_progress)
+        self.loading_thread.progress_status.connect(self.status_label.setText)
         
         self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
         self.timer.timeout.connect(self.loading_thread.start)
         self.loading_thread.file_changes_signal.connect(self.handle_file_changes)
 
         self.loading_thread.error_signal.connect(self.handle_error)
+        self.loading_thread.access_changes_signal.connect(self.handle_access_changes)
+        self.access_changes = None
 
         self.timer.start(1000)
 
         self.finished = False
+        self.cancelled = False
 
     def update_progress(self, value):
         self.progress_bar.setValue(value)
         if value == 100 and not self.finished:
             self.finished = True
             self.loading_thread = None
-            self.show_popup_once()
+            if not self.cancelled:
+                self.show_popup_once()
             self.close()
+
+    def cancel(self):
+        # The popup closes once the thread has stopped and sent 100%
+        self.cancelled = True
+        self.cancel_button.setEnabled(False)
+        self.setWindowTitle("Cancelling..." if language == "English" else "Annulation en cours...")
+        if self.loading_thread is not None:
+            self.loading_thread.cancel()
+
+    def reject(self):
+        # Escape cancels the update rather than closing the popup while the thread is running
+        if self.finished:
+            super().reject()
+        else:
+            self.cancel()
     
     def handle_file_changes(self, file_changes):
         self.timer.stop()
@@ -67,10 +167,21 @@ class LoadingPopup(QDialog):
         self.finished = True
         self.close()
 
+    def handle_access_changes(self, path, counts):
+        # Shown with the completion message
+        self.access_changes = (path, counts)
+
     def show_popup_once(self):
         dialog = QMessageBox(self)
         dialog.setWindowTitle("Task Completed" if language == "English" else "Tâche terminée")
-        dialog.setText("Data retrieval complete." if language == "English" else "Récupération des données terminée.")
+        text = "Data retrieval complete." if language == "English" else "Récupération des données terminée."
+        if self.access_changes is not None:
+            path, counts = self.access_changes
+            text += (f"\n\nTitles added: {counts.get('Added', 0)}\nTitles removed: {counts.get('Removed', 0)}\n"
+                     f"Access changed: {counts.get('Access changed', 0)}\nReport: {path}") if language == "English" else \
+                    (f"\n\nTitres ajoutés: {counts.get('Added', 0)}\nTitres retirés: {counts.get('Removed', 0)}\n"
+                     f"Accès modifié: {counts.get('Access changed', 0)}\nRapport: {path}")
+        dialog.setText(text)
         dialog.setIcon(QMessageBox.Icon.Information)
         dialog.addButton(QMessageBox.StandardButton.Ok)
         dialog.exec()
@@ -1,13 +1,22 @@
 from PyQt6.uic import loadUi
-from PyQt6.QtWidgets import QDialog, QTableWidgetItem, QTextEdit, QComboBox, QWidget
-from src.utility.export import export_data
+from PyQt6.QtWidgets import QDialog, QTableWidgetItem, QTextEdit, QComboBox, QWidget, QTreeWidgetItem
+from src.data_processing import database
+from src.data_processing.database import FACET_COLUMNS
+from src.data_processing.facets import FacetFilter
+from src.user_interface.export_ui import export_data
+from src.utility.logger import m_logger
 from src.utility.settings_manager import Settings
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import Qt, QTimer
 import os
+import sqlite3
 
 
 settings_manager = Settings()
 
+# Sidebar heading of each facet, in English and French
+FACET_LABELS = {"Platform": ("Platform", "Plateforme"), "Publisher": ("Publisher", "Éditeur"),
+                "collection_name": ("Collection", "Collection"), "Platform_YOP": ("Year", "Année")}
+
 
 # this class defines the search page please add the search page code here
 class searchDisplay(QDialog):
@@ -31,7 +40,8 @@ class searchDisplay(QDialog):
 
     def __init__(self, widget, results):
         super(searchDisplay, self).__init__()
-        language_value = settings_manager.get_setting("language").lower()
+        self.language_value = settings_manager.get_setting("language")
+        language_value = self.language_value.lower()
         ui_file = os.path.join(os.path.dirname(__file__), f"{language_value}_searchDisplay.ui")
         loadUi(ui_file, self)
 
@@ -45,7 +55,14 @@ class searchDisplay(QDialog):
 
         self.tableWidget.itemSelectionChanged.connect(self.updateCellNameDisplay)
 
+        # Facet sidebar, filtering the results in memory
+        self.facet_filter = FacetFilter(self.results, self.column_labels)
+        self.database_facet_counts = self.load_database_facet_counts()
+        self.facetTree.itemChanged.connect(self.facetItemChanged)
+        self.clearFiltersButton.clicked.connect(self.clearFilters)
+
         self.display_results_in_table()
+        self.display_facets()
 
     # using this method to show the results of the clicked cell on the top of the page whenever clicked on cell.
     def updateCellNameDisplay(self):
@@ -62,19 +79,76 @@ class searchDisplay(QDialog):
 
 
     def display_results_in_table(self):
+        results = self.facet_filter.filtered_results()
         self.tableWidget.setRowCount(0) 
         self.tableWidget.setColumnCount(len(self.results[0])) if self.results else self.tableWidget.setColumnCount(0)
 
         if self.results:
             self.tableWidget.setHorizontalHeaderLabels(self.column_labels)
 
-        for row_number, row_data in enumerate(self.results):
+        for row_number, row_data in enumerate(results):
             self.tableWidget.insertRow(row_number)
             for column_number, data in enumerate(row_data):
                 self.tableWidget.setItem(row_number, column_number, QTableWidgetItem(str(data)))
 
+    # Gets the precomputed number of rows per facet value in the whole database, shown as tooltips
+    def load_database_facet_counts(self):
+        try:
+            connection = database.connect_to_database()
+            counts = {facet: database.get_facet_counts(connection, facet) for facet in FACET_COLUMNS}
+            database.close_database(connection)
+            return counts
+        except sqlite3.Error as e:
+            m_logger.error(f"Could not load facet counts: {e}")
+            return {}
+
+    # Rebuilds the facet sidebar with the counts of the current selection
+    def display_facets(self):
+        english = self.language_value == "English"
+        counts = self.facet_filter.counts()
+        expanded = {self.facetTree.topLevelItem(i).data(0, Qt.ItemDataRole.UserRole)
+                    for i in range(self.facetTree.topLevelItemCount()) if self.facetTree.topLevelItem(i).isExpanded()}
+
+        # Signals are blocked so setting the check states does not filter again
+        self.facetTree.blockSignals(True)
+        self.facetTree.clear()
+        for facet in FACET_COLUMNS:
+            facet_item = QTreeWidgetItem([FACET_LABELS[facet][0 if english else 1]])
+            facet_item.setData(0, Qt.ItemDataRole.UserRole, facet)
+            facet_item.setFlags(Qt.ItemFlag.ItemIsEnabled)
+            self.facetTree.addTopLevelItem(facet_item)
+
+            selected = self.facet_filter.selections[facet]
+            values = set(counts[facet]) | selected
+            totals = self.database_facet_counts.get(facet, {})
+            for value in sorted(values, key=lambda value: (-counts[facet][value], str(value))):
+                text = str(value) if value is not None else ("(none)" if english else "(aucune valeur)")
+                value_item = QTreeWidgetItem([f"{text} ({counts[facet][value]})"])
+                value_item.setData(0, Qt.ItemDataRole.UserRole, (facet, value))
+                value_item.setFlags(Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsUserCheckable)
+                value_item.setCheckState(0, Qt.CheckState.Checked if value in selected else Qt.CheckState.Unchecked)
+                if value in totals:
+                    value_item.setToolTip(0, f"In database: {totals[value]}" if english else f"Dans la base de données : {totals[value]}")
+                facet_item.addChild(value_item)
+            facet_item.setExpanded(facet in expanded or (not expanded and facet == FACET_COLUMNS[0]))
+        self.facetTree.blockSignals(False)
+
+    def facetItemChanged(self, item, column):
+        facet, value = item.data(0, Qt.ItemDataRole.UserRole)
+        self.facet_filter.set_selected(facet, value, item.checkState(0) == Qt.CheckState.Checked)
+        # The sidebar is rebuilt after this signal returns, since rebuilding deletes the item that sent it
+        QTimer.singleShot(0, self.applyFilters)
+
+    def clearFilters(self):
+        self.facet_filter.clear()
+        self.applyFilters()
+
+    def applyFilters(self):
+        self.display_results_in_table()
+        self.display_facets()
+
     def export_data_handler(self):
-        export_data(self.results, self.column_labels)
+        export_data(self.facet_filter.filtered_results(), self.column_labels)
 
     def update_all_sizes(self):
         original_width = 1200
@@ -112,7 +186,7 @@ class searchDisplay(QDialog):
         
         self.tableWidget.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOn)
 
-        table_width = int(0.8 * new_width)
+        table_width = int(0.725 * new_width)
         self.tableWidget.setFixedWidth(table_width)
 
         # Calculate the width for each column
@@ -3,7 +3,8 @@ from PyQt6.QtGui import QDesktopServices
 from PyQt6.uic import loadUi
 from PyQt6.QtWidgets import QDialog, QPushButton, QWidget, QTextEdit, QComboBox, QMessageBox, QCheckBox, QLineEdit
 from src.user_interface.scraping_ui import scrapeCRKN
-from src.utility.upload import upload_and_process_file
+from src.user_interface.upload_ui import upload_and_process_file
+from src.data_processing.institutions import registry
 from src.utility.settings_manager import Settings
 import os
 
@@ -129,8 +130,8 @@ class settingsPage(QDialog):
         # Clear the existing items in the combo box
         self.institutionSelection.clear()
 
-        # Get the list of institutions from the settings manager
-        institutions = settings_manager.get_institutions()
+        # Get the list of known institutions
+        institutions = registry.names()
         # print("institutions:", institutions)  # TEST to make sure
 
         # Populate the combo box with institution names
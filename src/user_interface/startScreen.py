@@ -1,13 +1,17 @@
+import sqlite3
 import urllib
 
-from PyQt6.QtCore import QTimer, Qt, QUrl
+from PyQt6.QtCore import QTimer, Qt, QUrl, QStringListModel
 from PyQt6.uic import loadUi
 from PyQt6.QtWidgets import QDialog, QButtonGroup, QPushButton, QLineEdit, QMessageBox, QComboBox, QSizePolicy, QWidget, \
-    QLabel
-from PyQt6.QtGui import QIcon, QPixmap, QTransform, QFontMetrics, QDesktopServices
+    QLabel, QCompleter, QApplication
+from PyQt6.QtGui import QIcon, QPixmap, QTransform, QFontMetrics, QDesktopServices, QKeySequence, QShortcut
 from src.user_interface.settingsPage import settingsPage
 from src.data_processing.database import connect_to_database, \
-    close_database, search_database
+    close_database, search_database, search_query, explain_search, get_last_refresh_run
+from src.data_processing.suggestions import prefix_index
+from src.user_interface.export_ui import export_holdings_report
+from src.utility.refresh_schedule import describe_run
 from src.utility.settings_manager import Settings
 import os
 
@@ -18,6 +22,19 @@ Feb 27, 2024
 """
 settings_manager = Settings()
 
+# Search type for each item of the booleanBoxRight combo box, in order
+SEARCH_TYPES = ["Title", "Platform_eISBN", "OCN", "Fuzzy_Title", "Publisher", "Platform", "Platform_YOP",
+                "agreement_code", "collection_name"]
+
+# Operator for each item of the operator combo boxes of the extra search fields, in order
+SEARCH_OPERATORS = ["OR", "AND", "NOT"]
+
+# Suggestions are requested once typing pauses for this long
+SUGGESTION_DELAY_MS = 150
+
+# The last CRKN update shown is checked this often, as scheduled updates run in the background
+REFRESH_STATUS_INTERVAL_MS = 60000
+
 class ClickableLabel(QLabel):
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -60,6 +77,8 @@ class startScreen(QDialog):
     
     @classmethod
     def replace_instance(cls, arg):
+        if cls._instance:
+            cls._instance.closeSuggestionConnection()
         cls._instance = cls(arg)
         return cls._instance
     
@@ -93,6 +112,20 @@ class startScreen(QDialog):
         self.textEdit.returnPressed.connect(self.search_button_clicked)
         self.institutionName = self.findChild(QLabel, "institutionName")
 
+        # Search-as-you-type suggestions for the main search box
+        self.suggestionModel = QStringListModel(self)
+        self.completer = QCompleter(self.suggestionModel, self)
+        # The suggestions are already matched by normalized key, so the completer should not filter them again
+        self.completer.setCompletionMode(QCompleter.CompletionMode.UnfilteredPopupCompletion)
+        self.textEdit.setCompleter(self.completer)
+        self.suggestionConnection = None
+        self.suggestionTimer = QTimer(self)
+        self.suggestionTimer.setSingleShot(True)
+        self.suggestionTimer.setInterval(SUGGESTION_DELAY_MS)
+        self.suggestionTimer.timeout.connect(self.updateSuggestions)
+        self.textEdit.textEdited.connect(self.suggestionTimer.start)
+        QApplication.instance().aboutToQuit.connect(self.closeSuggestionConnection)
+
         # Clear Button
         self.clearButton = self.findChild(QPushButton, "clearButton")
         self.clearButton.clicked.connect(self.clearSearch)
@@ -110,6 +143,13 @@ class startScreen(QDialog):
         self.search.clicked.connect(self.search_button_clicked)
         self.widget = widget  # Store the QStackedWidget reference
 
+        # Power users can see the compiled SQL and query plan of the current search
+        self.explainShortcut = QShortcut(QKeySequence("Ctrl+E"), self)
+        self.explainShortcut.activated.connect(self.explainSearch)
+        # Ctrl+R exports every title the institution has access to
+        self.holdingsShortcut = QShortcut(QKeySequence("Ctrl+R"), self)
+        self.holdingsShortcut.activated.connect(export_holdings_report)
+
         self.helpIcon = self.findChild(QLabel, 'helpIcon')
         self.helpIcon.setPixmap(QPixmap('resources/helpIcon.png'))
         clickable_help_icon = ClickableLabel(self)
@@ -133,6 +173,14 @@ class startScreen(QDialog):
 
         self.displayInstitutionName()
 
+        # Last CRKN update - when, what started it, how it went and how long it took
+        self.refreshStatus = QLabel(self)
+        self.refreshStatus.setGeometry(380, 750, 500, 31)
+        self.updateRefreshStatus()
+        self.refreshStatusTimer = QTimer(self)
+        self.refreshStatusTimer.timeout.connect(self.updateRefreshStatus)
+        self.refreshStatusTimer.start(REFRESH_STATUS_INTERVAL_MS)
+
         # Resizing Stuff
         self.original_widget_values = None 
         self.original_width = 1200
@@ -186,6 +234,44 @@ class startScreen(QDialog):
         # Set the minimum size for the label based on the text size
         self.institutionName.setMinimumSize(text_width, text_height)
 
+    # Shows the last CRKN update, hidden when CRKN is turned off
+    def updateRefreshStatus(self):
+        if settings_manager.get_setting("allow_CRKN") != "True":
+            self.refreshStatus.hide()
+            return
+        if self.suggestionConnection is None:
+            self.suggestionConnection = connect_to_database()
+        try:
+            last_run = get_last_refresh_run(self.suggestionConnection)
+        except sqlite3.Error:
+            # The status is left out rather than keeping the start screen from opening
+            last_run = None
+        self.refreshStatus.setText(describe_run(last_run, self.language_value))
+        self.refreshStatus.show()
+
+    # The connection kept for suggestions and the refresh status is closed with the start screen, or when the
+    # application quits (closing the main window does not close the start screen inside it)
+    def closeSuggestionConnection(self):
+        if self.suggestionConnection is not None:
+            close_database(self.suggestionConnection)
+            self.suggestionConnection = None
+
+    def closeEvent(self, event):
+        self.closeSuggestionConnection()
+        super().closeEvent(event)
+
+    def updateSuggestions(self):
+        searchType = SEARCH_TYPES[self.booleanSearchType.currentIndex()]
+        field = "Title" if searchType == "Fuzzy_Title" else searchType
+
+        if self.suggestionConnection is None:
+            self.suggestionConnection = connect_to_database()
+        suggestions = prefix_index.suggest(self.suggestionConnection, field, self.textEdit.text())
+
+        self.suggestionModel.setStringList(suggestions)
+        if suggestions:
+            self.completer.complete()
+
     # This method responsible for making the new text edit each time the plus sign is clicked.
     # Basically we are only having limit of 5 searches at the same time
     def duplicateTextEdit(self):
@@ -201,7 +287,7 @@ class startScreen(QDialog):
         new_text.show()
         
 
-        new_and_or_box = self.newOrLabel()
+        new_and_or_box = self.newOperatorBox()
         self.duplicateCombos.append(new_and_or_box)
         new_and_or_box.show()
 
@@ -264,25 +350,27 @@ class startScreen(QDialog):
 
         return new_text_edit
     
-    def newOrLabel(self):
+    def newOperatorBox(self):
         newY = self.orLabel.y() + (self.orLabel.height() + self.textOffsetY) * self.duplicateCount
 
-        # Duplicating the QComboBox when the text editor is duplicated.
-        new_or_label = QLabel(self)
-        new_or_label.setGeometry(self.orLabel.x(),newY,self.orLabel.width(),self.orLabel.height())
-
-        new_or_label.setFont(self.orLabel.font())
-        new_or_label.setStyleSheet(self.orLabel.styleSheet())
-        new_or_label.setText(self.orLabel.text())
-
-        new_or_label.setAlignment(self.orLabel.alignment())
-
-        self.original_widget_values[new_or_label] = {
-            'geometry': new_or_label.geometry(),
-            'font_size': new_or_label.font().pointSize() if isinstance(new_or_label, (QLineEdit, QComboBox)) else None
+        # Combo box for how the new search field joins the ones above it (OR/AND/NOT)
+        new_operator_box = QComboBox(self)
+        new_operator_box.setGeometry(self.orLabel.x(), newY, self.orLabel.width(), self.orLabel.height())
+
+        new_operator_box.setFont(self.booleanSearchType.font())
+        new_operator_box.setStyleSheet(self.booleanSearchType.styleSheet())
+        new_operator_box.addItems(["OR", "AND", "NOT"] if self.language_value == "English" else ["OU", "ET", "SAUF"])
+        # The operators follow SQL precedence (see database.compile_search)
+        new_operator_box.setToolTip("AND and NOT are applied before OR: A NOT B OR C finds (A and not B) or C"
+                                    if self.language_value == "English" else
+                                    "ET et SAUF sont appliqués avant OU : A SAUF B OU C trouve (A et pas B) ou C")
+
+        self.original_widget_values[new_operator_box] = {
+            'geometry': new_operator_box.geometry(),
+            'font_size': new_operator_box.font().pointSize() if isinstance(new_operator_box, (QLineEdit, QComboBox)) else None
         }
 
-        return new_or_label
+        return new_operator_box
     
     def newBooleanSearchType(self):
         newY = self.booleanSearchType.y() + (self.booleanSearchType.height() + self.textOffsetY) * self.duplicateCount
@@ -348,6 +436,31 @@ class startScreen(QDialog):
         self.widget.setCurrentIndex(self.widget.currentIndex() + 1)
         # search.display_results_in_table(results) 
 
+    # Gets the terms, search types and operators of every search field that has text
+    def getSearchFields(self):
+        terms = []
+        searchTypes = []
+        operators = []
+
+        searchText = self.textEdit.text().strip()
+        if searchText != "":
+            terms.append(searchText)
+            searchTypes.append(SEARCH_TYPES[self.booleanSearchType.currentIndex()])
+            operators.append("OR")
+
+        # grabs the terms, searchTypes and operators of each extra textbox for the search query - with the main box
+        # empty, a NOT on the first of them searches for the titles that do not match it:
+        for i in range(len(self.duplicateTextEdits)):
+            searchText = self.duplicateTextEdits[i].text().strip()
+            if searchText != "":
+                terms.append(searchText)
+                searchTypes.append(SEARCH_TYPES[self.duplicateSearchTypes[i].currentIndex()])
+                operators.append(SEARCH_OPERATORS[self.duplicateCombos[i].currentIndex()])
+        return terms, searchTypes, operators
+
+    def getSearchQuery(self):
+        return search_query(settings_manager.get_setting('institution'))
+
     # This method is responsible sending the text in the back end for the searching the value
     def search_button_clicked(self):
         institution = settings_manager.get_setting('institution')
@@ -357,34 +470,17 @@ class startScreen(QDialog):
             QMessageBox.information(self, "No institution selected" if self.language_value == "English" else "Aucun établissement sélectionné", "You have no institution selected. Please select an institution on the settings page." if self.language_value == "English" else "Vous n'avez sélectionné aucun institut. Veuillez sélectionner un institut sur la page des paramètres.")
             return
 
-        searchText = self.textEdit.text().strip()
-        if searchText != "":
-            terms = [searchText]
-        else:
-            terms = []
-        searchTypeIndex = self.booleanSearchType.currentIndex()
-        searchType = "Title" if searchTypeIndex == 0 else "Platform_eISBN" if searchTypeIndex == 1 else "OCN"
-        searchTypes = [searchType]
-        query = f"SELECT [{institution}], File_Name, Platform, Title, Publisher, Platform_YOP, Platform_eISBN, OCN, agreement_code, collection_name, title_metadata_last_modified FROM table_name WHERE "
-
         if self.sender() == self.textEdit:
             # Trigger the click event of the search button only if the sender is the textEdit
             self.pushButton.click()
-        # grabs the terms and searchTypes of each textbox for the search query:
-        for i in range(len(self.duplicateTextEdits)):
-            searchText = self.duplicateTextEdits[i].text().strip()
-            if searchText != "":
-                terms.append(searchText)
-            searchTypeIndex = self.duplicateSearchTypes[i].currentIndex()
-            searchType = "Title" if searchTypeIndex == 0 else "Platform_eISBN" if searchTypeIndex == 1 else "OCN"
-            searchTypes.append(searchType)
 
+        terms, searchTypes, operators = self.getSearchFields()
         if len(terms) == 0:
             QMessageBox.information(self, "No Search Items" if self.language_value == "English" else "Aucun Terme de Recherche", "There are no search items in the search boxes." if self.language_value == "English" else "Il n'y a aucun terme de recherche dans les cases de recherche.")
             return
 
         connection = connect_to_database()
-        results = search_database(connection, query, terms, searchTypes)
+        results = search_database(connection, self.getSearchQuery(), terms, searchTypes, operators)
         close_database(connection)
 
         # Do not go to results page if there are no results or no text in the search field.
@@ -393,6 +489,21 @@ class startScreen(QDialog):
             return
 
         self.searchToDisplay(results)
+
+    def explainSearch(self):
+        terms, searchTypes, operators = self.getSearchFields()
+        if len(terms) == 0:
+            return
+
+        connection = connect_to_database()
+        explanation = explain_search(connection, self.getSearchQuery(), terms, searchTypes, operators)
+        close_database(connection)
+
+        dialog = QMessageBox(self)
+        dialog.setWindowTitle("Query Plan" if self.language_value == "English" else "Plan de requête")
+        dialog.setText("The compiled search and its SQLite query plan are in the details." if self.language_value == "English" else "La recherche compilée et son plan de requête SQLite sont dans les détails.")
+        dialog.setDetailedText(explanation)
+        dialog.exec()
         
 
     
@@ -0,0 +1,178 @@
+from PyQt6.QtWidgets import QFileDialog, QApplication, QMessageBox, QDialog, QVBoxLayout, QProgressBar, QPushButton, QLabel
+from PyQt6.QtCore import Qt, QTimer, QThread, pyqtSignal
+import os
+import sys
+from src.utility.logger import m_logger
+from src.utility.settings_manager import Settings
+from src.utility.upload import LocalUpload, WatchFolderUpload
+
+
+settings_manager = Settings()
+language = settings_manager.get_setting("language")
+
+
+def upload_and_process_file():
+    global language 
+    """
+    Upload and process local files into local database
+    """
+    language = settings_manager.get_setting("language")
+    app = QApplication.instance()  # Try to get the existing application instance
+    if app is None:  # If no instance exists, create a new one
+        app = QApplication(sys.argv)
+
+    options = QFileDialog.Option.ReadOnly
+
+    file_paths, _ = QFileDialog.getOpenFileNames(None, "Open File" if language == "English" else "Ouvrir le fichier", "", 
+                                                "CSV TSV or Excel (*.csv *.tsv *.xlsx);;All Files (*)" if language == "English" else
+                                                "CSV TSV ou Excel (*.csv *.tsv *.xlsx);;Tous les fichiers (*)", options=options)
+
+    # Iterate through selected file(s) to process them
+    if file_paths:
+        uploadUI = UploadUI(file_paths)
+        uploadUI.exec()
+
+
+class UploadUI(QDialog):
+    def __init__(self, file_paths):
+        super().__init__()
+        self.setWindowTitle("Processing File..." if language == "English" else "Fichier en cours de traitement...")
+        self.setWindowFlags(Qt.WindowType.Dialog | Qt.WindowType.CustomizeWindowHint | Qt.WindowType.WindowTitleHint)
+                
+        layout = QVBoxLayout(self)
+        
+        self.progress_bar = QProgressBar(self)
+        self.progress_bar.setRange(0, 100)
+        layout.addWidget(self.progress_bar)
+
+        # Throughput and time left
+        self.status_label = QLabel(self)
+        layout.addWidget(self.status_label)
+
+        self.cancel_button = QPushButton("Cancel" if language == "English" else "Annuler", self)
+        self.cancel_button.clicked.connect(self.cancel)
+        layout.addWidget(self.cancel_button)
+
+        self.loading_thread = UploadThread(file_paths)
+        
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.loading_thread.start)
+
+        self.loading_thread.progress_update.connect(self.update_progress)
+        self.loading_thread.progress_status.connect(self.status_label.setText)
+        self.loading_thread.error_signal.connect(self.handle_error)
+        self.loading_thread.get_answer_yes_no.connect(self.get_answer_yes_no)
+        self.loading_thread.get_okay.connect(self.get_okay)
+
+        self.timer.start(1000)
+
+        self.finished = False
+
+    def cancel(self):
+        # The dialog closes once the thread has stopped and sent 100%
+        self.cancel_button.setEnabled(False)
+        self.setWindowTitle("Cancelling..." if language == "English" else "Annulation en cours...")
+        if self.loading_thread is not None:
+            self.loading_thread.cancel()
+
+    def reject(self):
+        # Escape cancels the upload rather than closing the dialog while the thread is running
+        if self.finished:
+            super().reject()
+        else:
+            self.cancel()
+
+    def handle_error(self, title, error_msg):
+        m_logger.error(error_msg)
+        QMessageBox.critical(None, title, error_msg, QMessageBox.StandardButton.Ok)
+        self.loading_thread.receive_response(True)
+
+    def update_progress(self, value):
+        self.progress_bar.setValue(value)
+        if value == 100 and not self.finished:
+            self.finished = True
+            self.loading_thread = None
+            self.close()
+
+    def get_answer_yes_no(self, title, body):
+        m_logger.info(body)
+        reply = QMessageBox.question(None, title, body, 
+                                    QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
+        self.loading_thread.receive_response(reply == QMessageBox.StandardButton.Yes)
+
+    def get_okay(self, title, body):
+        m_logger.info(body)
+        QMessageBox.information(None, title, body, QMessageBox.StandardButton.Ok)
+        self.loading_thread.receive_response(True)
+
+
+class UploadThread(QThread):
+    """
+    Runs a LocalUpload on a thread - its questions and messages are sent to the UI as signals, and it waits for the
+    answer.
+    """
+
+    progress_update = pyqtSignal(int)
+    progress_status = pyqtSignal(str)
+    error_signal = pyqtSignal(str, str)
+    get_answer_yes_no = pyqtSignal(str, str)
+    get_okay = pyqtSignal(str, str)
+
+    def __init__(self, file_paths):
+        super().__init__()
+        self.upload = LocalUpload(file_paths, None, self.report_progress,
+                                  lambda title, body: self.wait_for(self.get_answer_yes_no, title, body),
+                                  lambda title, body: self.wait_for(self.get_okay, title, body),
+                                  lambda title, body: self.wait_for(self.error_signal, title, body))
+
+    def run(self):
+        self.upload.process_files()
+
+    def report_progress(self, percent, status):
+        self.progress_update.emit(percent)
+        self.progress_status.emit(status)
+
+    def wait_for(self, signal, title, body):
+        # Shows the message and waits until the user has answered or closed it
+        return self.upload.channel.ask(lambda: signal.emit(title, body))
+
+    def receive_response(self, response):
+        self.upload.channel.respond(response)
+
+    def cancel(self):
+        # Stops before the next file is loaded, and stops waiting for a response
+        self.upload.cancel()
+
+
+class WatchFolderThread(QThread):
+    """
+    Uploads the files of the watch folder in the background (see upload.WatchFolderUpload).
+    """
+
+    def __init__(self, directory):
+        super().__init__()
+        self.upload = WatchFolderUpload(directory)
+
+    def run(self):
+        self.upload.watch()
+
+    def stop(self):
+        # Stops after the current file - does not wait for it, so quitting is not held up (see main.py)
+        self.upload.cancel()
+
+
+def start_watch_folder():
+    """
+    Start uploading the files of the watch folder in the background, if the watch_folder setting is set.
+    :return: the running WatchFolderThread, or None
+    """
+    directory = settings_manager.get_setting("watch_folder")
+    if not directory:
+        return None
+    if not os.path.isdir(directory):
+        m_logger.error(f"The watch folder {directory} does not exist, files will not be uploaded from it")
+        return None
+    thread = WatchFolderThread(directory)
+    thread.start()
+    return thread
@@ -7,6 +7,7 @@ import os
 from PyQt6.QtWidgets import QDialog, QComboBox, QPushButton, QLineEdit, QMessageBox
 from PyQt6.QtCore import QPropertyAnimation, QEasingCurve
 from PyQt6.uic import loadUi
+from src.data_processing.institutions import registry
 from src.utility.settings_manager import Settings
 
 settings_manager = Settings()
@@ -48,8 +49,8 @@ class WelcomePage(QDialog):
     def populate_institutions(self):
         # Clear the existing items in the combo box
         self.institutionSelection.clear()
-        # Get the list of institutions from the settings manager
-        institutions = settings_manager.get_institutions()
+        # Get the list of known institutions
+        institutions = registry.names()
         # Populate the combo box with institution names
         self.institutionSelection.addItems(institutions)
 
@@ -71,18 +72,18 @@ class WelcomePage(QDialog):
         selected_institution = self.institutionSelection.currentText()
         selected_language = self.findChild(QComboBox, 'languageSetting').currentText()
 
-        settings_manager.set_institution(selected_institution)
-        settings_manager.set_language(selected_language)
-
-        crkn_url = self.findChild(QLineEdit, 'crknURL').text()
-        if len(crkn_url.split("/")) < 3:
-            QMessageBox.warning(self, "Incorrect URL format",
-                                "Incorrect URL format.\nEnsure URL begins with URL format, eg) http:// or https://.",
-                                QMessageBox.StandardButton.Ok)
-            return
-        settings_manager.set_crkn_url(crkn_url)
-
-        settings_manager.save_settings()
+        # Written to settings.json once, at the end of the block - the first run is over once it exists (see main.py)
+        with settings_manager.batch():
+            settings_manager.set_institution(selected_institution)
+            settings_manager.set_language(selected_language)
+
+            crkn_url = self.findChild(QLineEdit, 'crknURL').text()
+            if len(crkn_url.split("/")) < 3:
+                QMessageBox.warning(self, "Incorrect URL format",
+                                    "Incorrect URL format.\nEnsure URL begins with URL format, eg) http:// or https://.",
+                                    QMessageBox.StandardButton.Ok)
+                return
+            settings_manager.set_crkn_url(crkn_url)
 
         # Close the come page
         self.accept()
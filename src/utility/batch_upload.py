@@ -0,0 +1,383 @@
+"""
+Batch upload of local files.
+
+Uploading several files is done in two phases so the user is only asked once:
+1) validate - every file is parsed and checked in a pool of worker processes, then compared against the database
+   for files that would be replaced and institutions that are not known yet
+2) load - after the user has confirmed, the files are loaded one after another through a single connection, each
+   in its own transaction
+
+CSV/TSV files too large to parse whole within the ingest memory budget are checked and loaded a chunk at a time
+(see chunked_ingest), so their rows are never all held in memory. The parsed files of a batch are kept between the
+two phases only while together they fit the budget - the others are dropped once validated and read again when
+they are loaded. A file rejected for its data gets a
+data-quality report listing every problem (see quality_report), written next to it.
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import datetime
+import multiprocessing
+import os
+import time
+import pandas as pd
+from src.data_processing import Scraping, chunked_ingest
+from src.data_processing.institutions import registry, LOCAL
+from src.data_processing.quality_report import QualityReport, report_path
+from src.data_processing.source_store import keep_source
+from src.utility.logger import m_logger
+from src.utility.settings_manager import Settings
+
+settings_manager = Settings()
+
+# Most worker processes used to parse files - each can hold a whole file in memory
+MAX_PARSE_WORKERS = 4
+
+# Reasons a file of a batch is not uploaded
+INVALID_TYPE = "Invalid File Type"
+INVALID_FORMAT = "Invalid File Format"
+DUPLICATE_NAME = "Duplicate File Name"
+NOT_CONFIRMED = "Not Confirmed"
+LOAD_FAILED = "Load Failed"
+CANCELLED = "Cancelled"
+
+
+def file_to_df(file_name, file_path):
+    """
+    Convert a file to a dataframe
+    :param file_name: A string of format name.ext
+    :param file_path: A string containing the file path.
+    :return: Dataframe or None
+    """
+    m_logger.info(f"Processing file: {file_path}")
+    file_extension = file_name.split(".")[-1]
+    # Convert file into dataframe
+    if file_extension == "csv":
+        file_df = Scraping.file_to_dataframe_csv(file_name, file_path)
+    elif file_extension == "xlsx":
+        file_df = Scraping.file_to_dataframe_excel(file_name, file_path)
+    elif file_extension == "tsv":
+        file_df = Scraping.file_to_dataframe_tsv(file_name, file_path)
+    else:
+        return None
+    return file_df
+
+
+def get_new_institutions(file_df, connection=None):
+    """
+    Get and return list of institutions that are not known institutions (see institutions.py) from a new file dataframe
+    :param file_df: file in the form of a pandas dataframe
+    :param connection: database connection object used if the institutions have not been read yet
+    :return: list of new string institutions
+    """
+
+    # If no dataframe, there's no new institutions
+    if file_df is None:
+        return []
+    # Institution section of dataframe, blank ones left out
+    return registry.unknown(file_df.columns.to_list()[8:-2], connection)
+
+
+def parse_file(file_path):
+    """
+    Parse and check one file - runs in a worker process.
+    :param file_path: string containing the path to the file
+    :return: tuple of (dataframe or None, number of rows, header row, error reason or None, error detail,
+             path of the data-quality report or None, seconds taken) - the dataframe is None for a file that is too
+             large and is loaded in chunks instead
+    """
+    start = time.perf_counter()
+    file_name_with_ext = os.path.basename(file_path)
+    try:
+        if file_name_with_ext.split(".")[-1] not in ("csv", "xlsx", "tsv"):
+            return None, 0, [], INVALID_TYPE, "", None, time.perf_counter() - start
+        # Reject a bad header before parsing the whole file
+        valid_header = Scraping.check_file_header(file_name_with_ext, file_path)
+        if valid_header is not True:
+            return None, 0, [], INVALID_FORMAT, valid_header, None, time.perf_counter() - start
+
+        report = QualityReport(file_name_with_ext)
+        if chunked_ingest.should_stream(file_path):
+            valid_file, rows, headers = chunked_ingest.validate_file_in_chunks(file_name_with_ext, file_path, report)
+            if valid_file is not True:
+                return (None, 0, [], INVALID_FORMAT, valid_file, write_report(report, file_path),
+                        time.perf_counter() - start)
+            return None, rows, headers, None, "", None, time.perf_counter() - start
+
+        file_df = file_to_df(file_name_with_ext, file_path)
+        if file_df is None:
+            return None, 0, [], INVALID_TYPE, "", None, time.perf_counter() - start
+        valid_file = Scraping.check_file_format(file_df)
+        if valid_file is not True:
+            # List every problem of the file, not only the first one
+            report.check(file_df)
+            return (None, 0, [], INVALID_FORMAT, valid_file, write_report(report, file_path),
+                    time.perf_counter() - start)
+        return file_df, len(file_df), file_df.columns.to_list(), None, "", None, time.perf_counter() - start
+    except Exception as e:
+        return None, 0, [], INVALID_FORMAT, str(e), None, time.perf_counter() - start
+
+
+def write_report(report, file_path):
+    """
+    Write the data-quality report of a file next to it.
+    :param report: QualityReport of the file
+    :param file_path: path to the file
+    :return: path of the report, or None if it could not be written
+    """
+    try:
+        return report.write(report_path(file_path))
+    except OSError as e:
+        m_logger.error(f"Unable to write the data-quality report of {file_path}: {e}")
+        return None
+
+
+class UploadJob:
+    """
+    One file of a batch upload.
+    """
+
+    def __init__(self, file_path, date):
+        self.file_path = file_path
+        self.file_name_with_ext = os.path.basename(file_path)
+        self.file_name = self.file_name_with_ext.split(".")[0]
+        self.date = date
+        self.df = None
+        self.rows = 0
+        self.headers = []
+        # True if the file is too large to hold in memory, and is loaded in chunks from file_path
+        self.streamed = False
+        # True if the dataframe was dropped after validation to stay within the memory budget, and is read again
+        # from file_path when the file is loaded
+        self.reread = False
+        # Scraping.compare_file result - INSERT INTO, or UPDATE if a file with the same name is already there
+        self.command = None
+        self.new_institutions = []
+        # Reason the file is not uploaded (one of the constants above), and the details
+        self.error = None
+        self.error_detail = ""
+        # Data-quality report written for a file with invalid data
+        self.report_path = None
+        self.loaded = False
+        self.parse_seconds = 0.0
+
+    def needs_confirmation(self):
+        """
+        :return: True if uploading this file replaces a file or adds institutions
+        """
+        return self.command == "UPDATE" or len(self.new_institutions) > 0
+
+
+class BatchUpload:
+    """
+    Validates and loads a list of local files.
+    """
+
+    def __init__(self, file_paths, max_workers=None):
+        """
+        :param file_paths: list of paths to the files
+        :param max_workers: number of worker processes used to parse the files, by default one per file up to
+                            MAX_PARSE_WORKERS and the number of CPUs
+        """
+        date = datetime.datetime.now().strftime("%Y_%m_%d")
+        self.jobs = [UploadJob(file_path, date) for file_path in file_paths]
+        if max_workers is None:
+            max_workers = min(len(self.jobs), MAX_PARSE_WORKERS, os.cpu_count() or 1)
+        self.max_workers = max(max_workers, 1)
+        self.validate_seconds = 0.0
+        self.load_seconds = 0.0
+        self.loaded_rows = 0
+        # Peak memory of the process in bytes after loading, if it can be measured
+        self.peak_rss = None
+        # Memory of the dataframes kept from validation for loading
+        self.held_bytes = 0
+
+    def ready_jobs(self):
+        """
+        :return: list of the jobs that have not failed or been skipped
+        """
+        return [job for job in self.jobs if job.error is None and not job.loaded]
+
+    def failed_jobs(self):
+        """
+        :return: list of the jobs that will not be or were not uploaded
+        """
+        return [job for job in self.jobs if job.error is not None]
+
+    def validate(self, connection, progress=None):
+        """
+        Parse and check every file, and find the files that replace an existing file or add new institutions.
+        :param connection: database connection object
+        :param progress: optional function called with (files done, number of files, rows parsed) as files are parsed
+        """
+        start = time.perf_counter()
+
+        # Files are stored by name without the extension, so two files can not share a name
+        names = set()
+        for job in self.jobs:
+            if job.file_name in names:
+                job.error = DUPLICATE_NAME
+            names.add(job.file_name)
+
+        jobs = self.ready_jobs()
+        if len(jobs) > 1 and self.max_workers > 1:
+            # spawn, since this is called from a thread of a Qt application
+            with ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+                futures = {pool.submit(parse_file, job.file_path): job for job in jobs}
+                for done, future in enumerate(as_completed(futures), 1):
+                    self.set_parse_result(futures[future], future.result())
+                    if progress:
+                        progress(done, len(jobs), futures[future].rows)
+        else:
+            for done, job in enumerate(jobs, 1):
+                self.set_parse_result(job, parse_file(job.file_path))
+                if progress:
+                    progress(done, len(jobs), job.rows)
+
+        for job in self.ready_jobs():
+            job.command = Scraping.compare_file([job.file_name, job.date], "local", connection)
+            job.new_institutions = get_new_institutions(pd.DataFrame(columns=job.headers), connection)
+
+        self.validate_seconds = time.perf_counter() - start
+        m_logger.info(f"Validated {len(self.jobs)} files in {self.validate_seconds:.2f}s with {self.max_workers} workers")
+
+    def set_parse_result(self, job, result):
+        """
+        Store the result of parse_file on a job.
+        :param job: UploadJob the file was parsed for
+        :param result: tuple returned by parse_file
+        """
+        job.df, job.rows, job.headers, job.error, job.error_detail, job.report_path, job.parse_seconds = result
+        job.streamed = job.df is None and job.error is None
+        if job.df is not None:
+            size = job.df.memory_usage(deep=True).sum()
+            if self.held_bytes + size > chunked_ingest.memory_budget():
+                # Read again when loading, rather than holding every file of the batch until then
+                job.df = None
+                job.reread = True
+            else:
+                self.held_bytes += size
+
+    def replaced_files(self):
+        """
+        :return: list of names of the files that replace a file already in the database
+        """
+        return [job.file_name_with_ext for job in self.ready_jobs() if job.command == "UPDATE"]
+
+    def new_institutions(self):
+        """
+        :return: list of the institutions that are new, over all the files, in order of first appearance
+        """
+        institutions = []
+        for job in self.ready_jobs():
+            for institution in job.new_institutions:
+                if institution not in institutions:
+                    institutions.append(institution)
+        return institutions
+
+    def skip_unconfirmed(self):
+        """Skip the files that would replace a file or add institutions, when the user did not confirm."""
+        for job in self.ready_jobs():
+            if job.needs_confirmation():
+                job.error = NOT_CONFIRMED
+                job.df = None
+
+    def apply_policy(self, replace_files, add_institutions):
+        """
+        Decide the files that need confirmation without asking, for uploads nobody is watching (watch folder).
+        :param replace_files: True to upload files that replace a file with the same name
+        :param add_institutions: True to upload files that add new institutions
+        """
+        for job in self.ready_jobs():
+            if (job.command == "UPDATE" and not replace_files) or (job.new_institutions and not add_institutions):
+                job.error = NOT_CONFIRMED
+                job.df = None
+
+    def load(self, connection, progress=None, cancelled=None):
+        """
+        Load the validated files, each in its own transaction. New institutions of a file are added once the file
+        is committed.
+        :param connection: database.BatchConnection object
+        :param progress: optional function called with (rows done, total rows, rows of the file) after each file
+        :param cancelled: optional function returning True to stop before the next file
+        """
+        start = time.perf_counter()
+        jobs = self.ready_jobs()
+        total_rows = sum(job.rows for job in jobs)
+        rows_done = 0
+
+        for job in jobs:
+            if cancelled and cancelled():
+                job.error = CANCELLED
+                job.df = None
+                continue
+            file_rows_done = rows_done
+
+            def chunk_loaded(rows):
+                nonlocal file_rows_done
+                file_rows_done += rows
+                if progress:
+                    progress(file_rows_done, total_rows, rows)
+
+            with connection.transaction() as committed:
+                if job.streamed:
+                    valid_file, _ = chunked_ingest.load_file_in_chunks(job.file_name_with_ext, job.file_path,
+                                                                       "local_" + job.file_name, connection,
+                                                                       chunk_loaded)
+                    if valid_file is not True:
+                        job.error_detail = valid_file
+                    uploaded = valid_file is True
+                else:
+                    if job.reread:
+                        job.df = self.read_again(job)
+                    uploaded = job.df is not None and Scraping.upload_to_database(job.df, "local_" + job.file_name,
+                                                                                   connection)
+                if not (uploaded
+                        and Scraping.update_tables([job.file_name, job.date], "local", connection, job.command)):
+                    connection.rollback()
+
+            if committed[0]:
+                job.loaded = True
+                self.loaded_rows += job.rows
+                registry.add(job.new_institutions, LOCAL, connection)
+                keep_source(job.file_path, LOCAL, job.file_name, job.date)
+            else:
+                job.error = LOAD_FAILED
+            # The dataframe is not needed anymore
+            job.df = None
+
+            rows_done += job.rows
+            if progress:
+                # The rows of a streamed file were reported chunk by chunk
+                progress(rows_done, total_rows, job.rows if job.loaded and not job.streamed else 0)
+
+        self.load_seconds = time.perf_counter() - start
+        self.peak_rss = chunked_ingest.peak_rss()
+        m_logger.info(f"Loaded {self.loaded_rows} rows in {self.load_seconds:.2f}s ({self.rows_per_second():.0f} rows/s)")
+
+    def read_again(self, job):
+        """
+        Parse a file dropped after validation again, checking it has not become invalid since.
+        :param job: UploadJob of the file
+        :return: dataframe, or None if the file can not be read or is not valid anymore
+        """
+        try:
+            file_df = file_to_df(job.file_name_with_ext, job.file_path)
+            valid_file = Scraping.check_file_format(file_df) if file_df is not None else "Invalid file type"
+        except Exception as e:
+            valid_file = str(e)
+        if valid_file is not True:
+            job.error_detail = valid_file
+            return None
+        return file_df
+
+    def loaded_files(self):
+        """
+        :return: list of the jobs that were uploaded
+        """
+        return [job for job in self.jobs if job.loaded]
+
+    def rows_per_second(self):
+        """
+        :return: rows uploaded per second over the whole batch (validation and load)
+        """
+        seconds = self.validate_seconds + self.load_seconds
+        return self.loaded_rows / seconds if seconds > 0 else 0.0
@@ -9,7 +9,8 @@ def setup_logging():
 
     # Determine the path to the log file
     log_directory = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'utility'))
-    log_file_path = os.path.join(log_directory, 'application.log')
+    # EPAT_LOG_FILE puts the log somewhere else, e.g. a temporary file for the tests
+    log_file_path = os.environ.get("EPAT_LOG_FILE") or os.path.join(log_directory, 'application.log')
 
     # Create a rotating file handler which logs debug messages
     fh = RotatingFileHandler(log_file_path, maxBytes=1024*1024, backupCount=5)  # Log file will rotate after 1MB, keeping up to 5 backup files
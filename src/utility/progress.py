@@ -0,0 +1,183 @@
+"""
+Progress reporting for long-running jobs (CRKN update, file upload).
+
+A job is planned as a list of weighted stages. Each stage counts its own units of work (files, bytes, rows), and
+the overall percentage is the weighted sum of the stages, so the bar moves with the real work instead of jumping
+between hard-coded percentages. Updates can be reported as often as the work allows - the callback is only called
+at most once per interval, with the percentage and a status line giving the throughput and time left.
+"""
+import time
+from src.utility.logger import m_logger
+
+# Seconds between two calls of the callback
+DEFAULT_INTERVAL = 0.1
+
+# Status line label of each unit of work, in English and French
+UNIT_LABELS = {"bytes": ("B", "o"), "rows": ("rows", "lignes"), "files": ("files", "fichiers")}
+
+
+def format_amount(amount, unit, language):
+    """
+    Format an amount of work for the status line - bytes are shown in KB/MB.
+    :param amount: number of units
+    :param unit: bytes, rows or files
+    :param language: English or French
+    :return: string
+    """
+    english = language == "English"
+    label = UNIT_LABELS.get(unit, (unit, unit))[0 if english else 1]
+    if unit == "bytes":
+        for prefix in ("", "K", "M", "G"):
+            if amount < 1024 or prefix == "G":
+                break
+            amount /= 1024
+        text = f"{amount:.1f} {prefix}{label}"
+    else:
+        text = f"{amount:.0f} {label}"
+    return text if english else text.replace(".", ",")
+
+
+def format_duration(seconds):
+    """
+    Format a number of seconds as hours and minutes, or minutes and seconds.
+    :param seconds: seconds
+    :return: string
+    """
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    if minutes >= 60:
+        return f"{minutes // 60} h {minutes % 60:02d} min"
+    if minutes:
+        return f"{minutes} min {seconds:02d} s"
+    return f"{seconds} s"
+
+
+class ProgressReporter:
+    """
+    Weighted stages of a job, reported through a rate-limited callback.
+    """
+
+    def __init__(self, callback, stages, language="English", interval=DEFAULT_INTERVAL, clock=time.monotonic):
+        """
+        :param callback: function called with (percent, status line)
+        :param stages: list of (stage name, weight) in the order they run - the name is shown in the status line
+        :param language: English or French, for the status line
+        :param interval: least number of seconds between two calls of the callback
+        :param clock: function returning the current time in seconds
+        """
+        self.callback = callback
+        self.language = language
+        self.interval = interval
+        self.clock = clock
+        total_weight = sum(weight for _, weight in stages) or 1
+        # stage name: (share of the whole job, share of the whole job done before it starts)
+        self.stages = {}
+        done_before = 0.0
+        for name, weight in stages:
+            self.stages[name] = (weight / total_weight, done_before)
+            done_before += weight / total_weight
+
+        self.started = self.clock()
+        self.last_report = None
+        self.stage = None
+        self.stage_total = 1
+        self.stage_done = 0
+        self.stage_started = self.started
+        # Work of the current stage by unit, for throughput
+        self.work = {}
+        self.last_unit = None
+        self.fraction = 0.0
+
+    def start(self, stage, total):
+        """
+        Start a stage.
+        :param stage: stage name, one of the planned stages
+        :param total: number of units in the stage (its done value when complete)
+        """
+        if self.stage is not None:
+            self.log_stage()
+        self.stage = stage
+        self.stage_total = max(total, 0)
+        self.stage_done = 0
+        self.stage_started = self.clock()
+        self.work = {}
+        self.last_unit = None
+        self.update(0)
+
+    def update(self, done, work=0, unit=None):
+        """
+        Report the position in the current stage.
+        :param done: units of the stage done so far (between 0 and the stage total)
+        :param work: amount of work done since the last update, for throughput (bytes, rows...)
+        :param unit: unit of the work
+        """
+        now = self.clock()
+        if unit is not None:
+            self.work[unit] = self.work.get(unit, 0) + work
+            self.last_unit = unit
+        self.stage_done = min(max(done, 0), self.stage_total)
+        share, done_before = self.stages[self.stage]
+        stage_fraction = self.stage_done / self.stage_total if self.stage_total else 1.0
+        # Never goes back, even if a stage total turns out larger than planned
+        self.fraction = max(self.fraction, min(done_before + share * stage_fraction, 1.0))
+
+        if self.last_report is None or now - self.last_report >= self.interval:
+            self.last_report = now
+            self.callback(self.percent(), self.status())
+
+    def finish(self):
+        """Report the job as complete, whatever the rate limit."""
+        if self.stage is not None:
+            self.log_stage()
+        self.fraction = 1.0
+        self.callback(100, self.status())
+        m_logger.info(f"Finished in {self.clock() - self.started:.2f}s")
+
+    def percent(self):
+        """
+        :return: percentage of the whole job done, 0 to 99 until finish is called
+        """
+        return min(int(self.fraction * 100), 99)
+
+    def throughput(self, unit=None):
+        """
+        :param unit: unit of work, by default the last one reported
+        :return: units of work per second in the current stage, or None if not known yet
+        """
+        unit = unit or self.last_unit
+        if unit not in self.work:
+            return None
+        seconds = self.clock() - self.stage_started
+        # Not enough time to give a meaningful rate
+        if seconds < self.interval:
+            return None
+        return self.work[unit] / seconds
+
+    def eta(self):
+        """
+        :return: estimated seconds left in the whole job, or None if not known yet
+        """
+        if self.fraction < 0.01:
+            return None
+        elapsed = self.clock() - self.started
+        return elapsed * (1 - self.fraction) / self.fraction
+
+    def status(self):
+        """
+        :return: status line with the stage, the throughput and the time left
+        """
+        english = self.language == "English"
+        parts = [self.stage or ""]
+        rate = self.throughput()
+        if rate is not None:
+            parts.append(f"{format_amount(rate, self.last_unit, self.language)}/s")
+        eta = self.eta()
+        if eta is not None and self.fraction < 1.0:
+            parts.append(f"about {format_duration(eta)} left" if english else
+                         f"environ {format_duration(eta)} restantes")
+        return " - ".join(part for part in parts if part)
+
+    def log_stage(self):
+        """Log how long the current stage took, and its throughput."""
+        seconds = self.clock() - self.stage_started
+        work = ", ".join(f"{format_amount(amount, unit, 'English')}" for unit, amount in self.work.items())
+        m_logger.info(f"{self.stage}: {self.stage_done:.0f}/{self.stage_total} in {seconds:.2f}s {work}".strip())
@@ -0,0 +1,135 @@
+"""
+Scheduled CRKN updates.
+
+With the scheduled_refresh setting on, the CRKN update runs in the background (see Scraping.ScheduledRefresh)
+once scheduled_refresh_hours have passed since the last update that got through, and only between
+scheduled_refresh_start and scheduled_refresh_end (HH:MM, the window can go past midnight) so it does not compete
+with searching during the day. Nobody is asked anything:
+- new and updated CRKN files are always loaded
+- files no longer listed by CRKN are removed only if scheduled_refresh_remove_policy is Remove
+Downloads are held to scheduled_refresh_bandwidth_kbps (0 for no limit), and the update thread runs at idle priority.
+
+Every update, scheduled or not, is recorded in the refresh_runs table (see database.py), and the last one is shown
+on the start screen. This module has no Qt - the update is Scraping.ScheduledRefresh, run on a thread by scraping_ui.py.
+"""
+from datetime import datetime, time, timedelta
+from src.utility.progress import format_duration
+from src.utility.settings_manager import Settings
+
+settings_manager = Settings()
+
+MANUAL = "Manual"
+SCHEDULED = "Scheduled"
+
+COMPLETED = "Completed"
+UP_TO_DATE = "Up to date"
+CANCELLED = "Cancelled"
+FAILED = "Failed"
+
+# Updates that got through - the next scheduled one is counted from the last of these
+SUCCESSFUL = [COMPLETED, UP_TO_DATE]
+
+
+def parse_time(value):
+    """
+    :param value: time of day as HH:MM
+    :return: datetime.time, midnight if the value is not a time
+    """
+    try:
+        hours, minutes = str(value).split(":")
+        return time(int(hours), int(minutes))
+    except ValueError:
+        return time(0, 0)
+
+
+def in_window(now, start, end):
+    """
+    :param now: datetime
+    :param start: datetime.time the window opens
+    :param end: datetime.time the window closes, before start for a window past midnight
+    :return: True if now is in the window - always if start and end are the same
+    """
+    if start == end:
+        return True
+    if start < end:
+        return start <= now.time() < end
+    return now.time() >= start or now.time() < end
+
+
+def is_due(last_started, now, interval_hours, start, end):
+    """
+    :param last_started: ISO datetime string the last successful update started, or None
+    :param now: datetime
+    :param interval_hours: hours between updates
+    :param start: datetime.time the window opens
+    :param end: datetime.time the window closes
+    :return: True if a scheduled update should start now
+    """
+    if not in_window(now, start, end):
+        return False
+    if last_started is None:
+        return True
+    return now - datetime.fromisoformat(last_started) >= timedelta(hours=float(interval_hours))
+
+
+def schedule_due(last_run, now=None):
+    """
+    Check the schedule settings against the last successful update.
+    :param last_run: database.get_last_refresh_run of the successful updates, or None
+    :param now: datetime, by default now
+    :return: True if the schedule is on and an update should start now
+    """
+    if settings_manager.get_setting("scheduled_refresh") != "True":
+        return False
+    if settings_manager.get_setting("allow_CRKN") != "True":
+        return False
+    return is_due(last_run["started"] if last_run else None, now or datetime.now(),
+                  settings_manager.get_setting("scheduled_refresh_hours"),
+                  parse_time(settings_manager.get_setting("scheduled_refresh_start")),
+                  parse_time(settings_manager.get_setting("scheduled_refresh_end")))
+
+
+def bandwidth_limit():
+    """
+    :return: most bytes per second for scheduled downloads, or None for no limit
+    """
+    kbps = float(settings_manager.get_setting("scheduled_refresh_bandwidth_kbps") or 0)
+    return kbps * 1024 if kbps > 0 else None
+
+
+def run_status(errors, cancelled, files_changed):
+    """
+    :param errors: error messages of the update
+    :param cancelled: True if the update was cancelled
+    :param files_changed: number of files loaded or removed
+    :return: status of the update
+    """
+    if errors:
+        return FAILED
+    if cancelled:
+        return CANCELLED
+    return COMPLETED if files_changed else UP_TO_DATE
+
+
+def describe_run(run, language="English"):
+    """
+    :param run: database.get_last_refresh_run, or None
+    :param language: English or French
+    :return: line about the last CRKN update for the start screen
+    """
+    english = language == "English"
+    if run is None:
+        return "No CRKN update yet" if english else "Aucune mise à jour du RCDR"
+    started = run["started"].replace("T", " ")[:16]
+    trigger = run["trigger"] if english else {MANUAL: "manuelle", SCHEDULED: "planifiée"}.get(run["trigger"], run["trigger"])
+    status = run["status"] if english else {COMPLETED: "Terminée", UP_TO_DATE: "À jour", CANCELLED: "Annulée",
+                                            FAILED: "Échec"}.get(run["status"], run["status"])
+    if english:
+        text = f"Last CRKN update: {started} ({trigger}) - {status}"
+        if run["files_changed"]:
+            text += f", {run['files_changed']} {'file' if run['files_changed'] == 1 else 'files'}"
+        return text + f" in {format_duration(run['seconds'])}"
+    text = f"Dernière mise à jour du RCDR: {started} ({trigger}) - {status}"
+    if run["files_changed"]:
+        text += f", {run['files_changed']} {'fichier' if run['files_changed'] == 1 else 'fichiers'}"
+    return text + f" en {format_duration(run['seconds'])}"
@@ -0,0 +1,111 @@
+"""
+Request/response channel between a worker thread and the UI.
+
+A worker thread that needs an answer from the user (replace this file? update now?) asks through the channel and
+blocks on a threading.Event until the UI responds, the wait times out, or the job is cancelled. The request is
+opened before the UI is asked, so an answer that arrives straight away is never lost, and an answer to an older
+request that timed out is ignored.
+
+Usage in a worker thread:
+    answer = self.channel.ask(lambda: self.get_answer_yes_no.emit(title, body))
+and in the UI, once the user has answered:
+    thread.channel.respond(answer)
+"""
+import threading
+
+
+class RequestCancelled(Exception):
+    """Raised in the worker thread when the job is cancelled while it waits for a response."""
+
+
+class ResponseChannel:
+    """
+    One question at a time from a worker thread to the UI, with timeouts and cancellation.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._answered = threading.Event()
+        self._request_id = 0
+        self._pending = False
+        self._response = None
+        self._cancelled = threading.Event()
+
+    def ask(self, send_request, timeout=None, default=None):
+        """
+        Ask the UI a question and wait for the response. Called from the worker thread.
+        :param send_request: function that shows the question to the user, usually by emitting a signal
+        :param timeout: seconds to wait for the response, or None to wait until answered or cancelled
+        :param default: value returned if the wait times out
+        :return: the response, or default on timeout
+        :raises RequestCancelled: if the job is cancelled before a response arrives
+        """
+        request_id = self.open_request()
+        send_request()
+        return self.wait(request_id, timeout, default)
+
+    def open_request(self):
+        """
+        Start a new request, dropping any unanswered one.
+        :return: id of the request, passed to wait
+        """
+        with self._lock:
+            self._request_id += 1
+            self._pending = True
+            self._response = None
+            self._answered.clear()
+            return self._request_id
+
+    def wait(self, request_id, timeout=None, default=None):
+        """
+        Wait for the response to a request opened with open_request.
+        :param request_id: id returned by open_request
+        :param timeout: seconds to wait, or None to wait until answered or cancelled
+        :param default: value returned if the wait times out
+        :return: the response, or default on timeout
+        :raises RequestCancelled: if the job is cancelled before a response arrives
+        """
+        answered = self._answered.wait(timeout)
+        with self._lock:
+            if self._cancelled.is_set():
+                self._pending = False
+                raise RequestCancelled()
+            if not answered or request_id != self._request_id:
+                # Timed out - a late response to this request is ignored
+                self._pending = False
+                return default
+            self._pending = False
+            return self._response
+
+    def respond(self, response):
+        """
+        Answer the open request. Called from the UI thread.
+        :param response: the answer
+        :return: True if a request was waiting for it, False if it came too late
+        """
+        with self._lock:
+            if not self._pending:
+                return False
+            self._response = response
+            self._pending = False
+            self._answered.set()
+            return True
+
+    def cancel(self):
+        """Cancel the job - a worker waiting for a response gets RequestCancelled, and cancelled becomes True."""
+        with self._lock:
+            self._cancelled.set()
+            self._answered.set()
+
+    def wait_cancelled(self, timeout):
+        """
+        Sleep until the job is cancelled, for jobs that wait between units of work. Called from the worker thread.
+        :param timeout: most seconds to wait
+        :return: True if the job is cancelled
+        """
+        return self._cancelled.wait(timeout)
+
+    @property
+    def cancelled(self):
+        """True once cancel has been called. Long-running jobs check it between units of work."""
+        return self._cancelled.is_set()
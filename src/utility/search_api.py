@@ -0,0 +1,493 @@
+"""
+Read-only HTTP/JSON search API, for the discovery layer and ILS to check perpetual access as they go.
+
+Off unless the search_api setting is True (then it runs alongside the application), or started with
+python -m src.cli serve. It listens on search_api_host:search_api_port - 127.0.0.1 by default, so only programs on
+the same computer can reach it. Searches are the ones of the start screen, for the institution selected in the
+settings, and rows are returned as JSON objects with Access and database.RESULT_COLUMNS:
+
+    GET  /search?OCN=12345                    one or more FIELD=TERM (database.SEARCH_FIELDS), as the search boxes
+    GET  /search?Title=Bread*&Platform_YOP=2010-2015&operator=AND&limit=20
+                                              operator joins the terms after the first, so NOT needs two or more
+    POST /batch  {"lookups": [{"field": "Platform_eISBN", "term": "9780000000001"}, ...]}
+                                              each lookup searched on its own, results in the same order
+    GET  /metrics                             requests, errors, p50/p99 latency per endpoint, cache and connections
+
+Requests are served on a thread each, through a pool of search_api_connections read-only SQLite connections, so
+searches run side by side and nothing sent to the API can change the database. A limit is passed on to SQLite, so
+only the rows returned are read, and the count is then taken with COUNT(*). Responses are cached, up to
+search_api_cache_rows rows in all, and the cache is emptied when database.get_data_signature says the file tables
+changed.
+This module has no Qt.
+"""
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import math
+import queue
+import sqlite3
+import threading
+import time
+from urllib.parse import urlsplit, parse_qsl
+from src.data_processing import database
+from src.data_processing.database import SEARCH_FIELDS, SEARCH_OPERATORS, RESULT_COLUMNS, MAX_SEARCH_TERMS
+from src.utility.logger import m_logger
+from src.utility.settings_manager import Settings
+
+settings_manager = Settings()
+
+# Most lookups in one batch request, and largest request body accepted
+MAX_BATCH_LOOKUPS = 1000
+MAX_BODY_BYTES = 1024 * 1024
+
+# Latencies kept per endpoint for the percentiles - the most recent requests
+LATENCY_WINDOW = 1000
+
+# Seconds a request waits for a free connection before it is answered 503
+CONNECTION_TIMEOUT = 10
+
+
+class APIError(Exception):
+    """
+    Request that can not be answered, sent back as {"error": message} with the HTTP status.
+    """
+
+    def __init__(self, status, message, allow=None):
+        """
+        :param status: HTTP status
+        :param message: error message
+        :param allow: methods the endpoint answers, for 405
+        """
+        super().__init__(message)
+        self.status = status
+        self.allow = allow
+
+
+class ConnectionPool:
+    """
+    Fixed number of read-only connections, lent to one request at a time.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.connections = queue.Queue()
+        for _ in range(size):
+            self.connections.put(database.connect_read_only())
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection for the with block.
+        """
+        try:
+            connection = self.connections.get(timeout=CONNECTION_TIMEOUT)
+        except queue.Empty:
+            raise APIError(503, "All database connections are busy")
+        try:
+            yield connection
+        finally:
+            self.connections.put(connection)
+
+    def available(self):
+        return self.connections.qsize()
+
+    def close(self):
+        while not self.connections.empty():
+            self.connections.get().close()
+
+
+class ResponseCache:
+    """
+    Least recently used cache of search results, held to a number of rows in all, emptied when the data changes.
+    """
+
+    def __init__(self, max_rows):
+        self.max_rows = max_rows
+        # key: (value, rows)
+        self.entries = OrderedDict()
+        self.rows = 0
+        self.signature = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, signature, key):
+        """
+        :param signature: database.get_data_signature of the data searched
+        :param key: hashable description of the search
+        :return: cached results, or None
+        """
+        with self.lock:
+            if signature != self.signature:
+                self.entries.clear()
+                self.rows = 0
+                self.signature = signature
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+            return None
+
+    def put(self, signature, key, value, rows):
+        """
+        :param signature: database.get_data_signature of the data searched
+        :param key: hashable description of the search
+        :param value: results to cache
+        :param rows: number of rows in the results - a search that found none still counts as one
+        """
+        rows = max(1, rows)
+        with self.lock:
+            # Results larger than the whole cache are not kept
+            if signature != self.signature or rows > self.max_rows:
+                return
+            if key in self.entries:
+                self.rows -= self.entries.pop(key)[1]
+            self.entries[key] = (value, rows)
+            self.rows += rows
+            while self.rows > self.max_rows:
+                self.rows -= self.entries.popitem(last=False)[1][1]
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self.entries), "rows": self.rows, "max_rows": self.max_rows, "hits": self.hits,
+                    "misses": self.misses, "hit_rate": round(self.hits / lookups, 3) if lookups else None}
+
+
+def percentile(values, fraction):
+    """
+    :param values: sorted list of numbers
+    :param fraction: 0-1, e.g. 0.99 for p99
+    :return: nearest-rank percentile, or None for no values
+    """
+    if not values:
+        return None
+    rank = max(1, math.ceil(len(values) * fraction))
+    return values[rank - 1]
+
+
+class LatencyMetrics:
+    """
+    Request counts and the latencies of the last LATENCY_WINDOW requests of each endpoint.
+    """
+
+    def __init__(self):
+        # endpoint: [requests, errors, deque of seconds]
+        self.endpoints = {}
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+    def record(self, endpoint, seconds, status):
+        with self.lock:
+            counts = self.endpoints.setdefault(endpoint, [0, 0, deque(maxlen=LATENCY_WINDOW)])
+            counts[0] += 1
+            if status >= 400:
+                counts[1] += 1
+            counts[2].append(seconds)
+
+    def stats(self):
+        with self.lock:
+            endpoints = {}
+            for endpoint, (requests, errors, latencies) in self.endpoints.items():
+                latencies = sorted(latencies)
+                endpoints[endpoint] = {"requests": requests, "errors": errors,
+                                       "p50_ms": round(percentile(latencies, 0.5) * 1000, 3),
+                                       "p99_ms": round(percentile(latencies, 0.99) * 1000, 3)}
+            return {"uptime_seconds": round(time.time() - self.started, 1), "endpoints": endpoints}
+
+
+def result_row(row):
+    """
+    :param row: row of database.search_database with database.search_query
+    :return: dictionary of column: value
+    """
+    return dict(zip(["Access"] + RESULT_COLUMNS, row))
+
+
+class SearchAPI:
+    """
+    What the endpoints do, apart from HTTP - the pool, cache and metrics shared by the request threads.
+    """
+
+    def __init__(self, connections=None, cache_rows=None):
+        """
+        :param connections: number of read-only connections, defaults to the search_api_connections setting
+        :param cache_rows: most rows of cached searches in all, defaults to the search_api_cache_rows setting
+        """
+        if connections is None:
+            connections = int(settings_manager.get_setting("search_api_connections"))
+        if cache_rows is None:
+            cache_rows = int(settings_manager.get_setting("search_api_cache_rows"))
+        self.pool = ConnectionPool(max(1, connections))
+        self.cache = ResponseCache(cache_rows)
+        self.metrics = LatencyMetrics()
+
+    def lookup(self, connection, institution, terms, search_types, operators, limit=None):
+        """
+        Search the database, or take the results from the cache.
+        :param connection: read-only connection from the pool
+        :param institution: institution selected in the settings
+        :param terms: list of terms
+        :param search_types: SEARCH_FIELDS of each term
+        :param operators: OR/AND/NOT of each term
+        :param limit: most rows returned, or None for all
+        :return: dictionary with the count and rows found
+        """
+        signature = database.get_data_signature(connection)
+        key = (institution, settings_manager.get_setting("strip_title_articles"), tuple(terms), tuple(search_types),
+               tuple(operators), limit)
+        found = self.cache.get(signature, key)
+        if found is None:
+            query = database.search_query(institution)
+            rows = [result_row(row) for row in database.search_database(
+                connection, query, terms, search_types, operators, limit)]
+            # Only counted apart when the limit may have left rows out
+            count = len(rows) if limit is None or len(rows) < limit else \
+                database.count_search(connection, query, terms, search_types, operators)
+            found = {"count": count, "results": rows}
+            self.cache.put(signature, key, found, len(rows))
+        return found
+
+    def search(self, parameters):
+        """
+        GET /search
+        :param parameters: list of (name, value) from the query string
+        :return: response dictionary
+        """
+        terms, search_types = [], []
+        operator, limit = "OR", None
+        for name, value in parameters:
+            if name == "operator":
+                operator = value.upper()
+            elif name == "limit":
+                limit = parse_limit(value)
+            elif name in SEARCH_FIELDS:
+                if value.strip():
+                    search_types.append(name)
+                    terms.append(value.strip())
+            else:
+                raise APIError(400, f"Unknown parameter {name}, search with one of {', '.join(SEARCH_FIELDS)}")
+        if operator not in SEARCH_OPERATORS:
+            raise APIError(400, f"Unknown operator {operator}, use OR, AND or NOT")
+        if not terms:
+            raise APIError(400, f"Nothing to search, search with one of {', '.join(SEARCH_FIELDS)}")
+        if len(terms) > MAX_SEARCH_TERMS:
+            raise APIError(400, f"At most {MAX_SEARCH_TERMS} search terms")
+        # A NOT on the first term would negate it (see database.compile_search) - not what one term and NOT asks
+        if operator == "NOT" and len(terms) == 1:
+            raise APIError(400, "NOT takes the terms after the first away from it, search with two or more terms")
+
+        institution = selected_institution()
+        operators = ["OR"] + [operator] * (len(terms) - 1)
+        with self.pool.connection() as connection:
+            found = self.lookup(connection, institution, terms, search_types, operators, limit)
+        return dict(institution=institution, **found)
+
+    def batch(self, body):
+        """
+        POST /batch
+        :param body: parsed JSON body, {"lookups": [{"field": ..., "term": ...}, ...], "limit": optional}
+        :return: response dictionary, with the results of each lookup in the order given
+        """
+        if not isinstance(body, dict) or not isinstance(body.get("lookups"), list):
+            raise APIError(400, 'Send {"lookups": [{"field": ..., "term": ...}, ...]}')
+        lookups = body["lookups"]
+        if len(lookups) > MAX_BATCH_LOOKUPS:
+            raise APIError(413, f"At most {MAX_BATCH_LOOKUPS} lookups in one batch")
+        limit = parse_limit(body["limit"]) if body.get("limit") is not None else None
+        for lookup in lookups:
+            if not isinstance(lookup, dict) or lookup.get("field") not in SEARCH_FIELDS \
+                    or not str(lookup.get("term", "")).strip():
+                raise APIError(400, f"Each lookup needs a field ({', '.join(SEARCH_FIELDS)}) and a term: {lookup}")
+
+        institution = selected_institution()
+        results = []
+        # One connection for the whole batch
+        with self.pool.connection() as connection:
+            for lookup in lookups:
+                term = str(lookup["term"]).strip()
+                found = self.lookup(connection, institution, [term], [lookup["field"]], ["OR"], limit)
+                results.append(dict(field=lookup["field"], term=term, **found))
+        return {"institution": institution, "results": results}
+
+    def stats(self):
+        """
+        GET /metrics
+        :return: response dictionary
+        """
+        return dict(self.metrics.stats(), cache=self.cache.stats(),
+                    connections={"size": self.pool.size, "available": self.pool.available()})
+
+    def close(self):
+        self.pool.close()
+
+
+def parse_limit(value):
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise APIError(400, f"limit must be a whole number, not {value}")
+    if limit < 0:
+        raise APIError(400, "limit can not be negative")
+    return limit
+
+
+def selected_institution():
+    institution = settings_manager.get_setting("institution")
+    if not institution:
+        raise APIError(503, "No institution is selected in the settings")
+    return institution
+
+
+class SearchRequestHandler(BaseHTTPRequestHandler):
+    """
+    Routes the requests to the SearchAPI of the server. Only GET and POST are answered, other methods get 405.
+    """
+    server_version = "ePat"
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/search":
+            self.respond("/search", lambda: self.server.api.search(parse_qsl(url.query)))
+        elif url.path == "/metrics":
+            self.respond("/metrics", self.server.api.stats)
+        elif url.path == "/batch":
+            self.respond("/batch", lambda: not_allowed("POST"))
+        else:
+            self.respond("other", not_found)
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path == "/batch":
+            self.respond("/batch", lambda: self.server.api.batch(self.read_json()))
+        elif url.path in ("/search", "/metrics"):
+            self.respond(url.path, lambda: not_allowed("GET"))
+        else:
+            self.respond("other", not_found)
+
+    def do_PUT(self):
+        # Nothing is changed through the API
+        self.respond("other", lambda: not_allowed("GET, POST"))
+
+    do_PATCH = do_DELETE = do_PUT
+
+    def read_json(self):
+        """
+        :return: parsed JSON body of the request
+        """
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            raise APIError(400, "Invalid Content-Length")
+        if length > MAX_BODY_BYTES:
+            raise APIError(413, f"The request body can be at most {MAX_BODY_BYTES} bytes")
+        try:
+            return json.loads(self.rfile.read(length) or b"null")
+        except ValueError:
+            raise APIError(400, "The request body is not valid JSON")
+
+    def respond(self, endpoint, handle):
+        """
+        Answer the request with the JSON of handle(), or with the error it raised, and record the latency.
+        :param endpoint: name of the endpoint in the metrics
+        :param handle: function returning the response dictionary
+        """
+        start = time.perf_counter()
+        headers = {}
+        try:
+            status, response = 200, handle()
+        except APIError as e:
+            status, response = e.status, {"error": str(e)}
+            if e.allow:
+                headers["Allow"] = e.allow
+        except Exception as e:
+            m_logger.error(f"Search API error on {self.path}: {e}")
+            status, response = 500, {"error": "An error occurred during the search"}
+        body = json.dumps(response, ensure_ascii=False).encode("utf-8")
+        if status >= 400:
+            # The request body may not have been read, so the connection is not used for another request
+            self.close_connection = True
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        for name, value in headers.items():
+            self.send_header(name, value)
+        # Recorded before the response is sent, so a client that reads /metrics next finds its request counted
+        self.server.api.metrics.record(endpoint, time.perf_counter() - start, status)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        m_logger.debug(f"Search API {self.address_string()} {format % args}")
+
+
+def not_allowed(method):
+    raise APIError(405, f"Use {method}", method)
+
+
+def not_found():
+    raise APIError(404, "Use /search, /batch or /metrics")
+
+
+class SearchServer(ThreadingHTTPServer):
+    """
+    HTTP server answering each request on its own thread through one SearchAPI.
+    """
+    daemon_threads = True
+
+    def __init__(self, host=None, port=None, api=None):
+        """
+        :param host: address listened on, defaults to the search_api_host setting
+        :param port: port listened on, defaults to the search_api_port setting - 0 for any free port
+        :param api: SearchAPI, made from the settings by default
+        """
+        if host is None:
+            host = settings_manager.get_setting("search_api_host")
+        if port is None:
+            port = int(settings_manager.get_setting("search_api_port"))
+        super().__init__((host, port), SearchRequestHandler)
+        try:
+            self.api = api if api is not None else SearchAPI()
+        except BaseException:
+            self.server_close()
+            raise
+
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """
+        Serve on a background thread.
+        :return: the thread
+        """
+        thread = threading.Thread(target=self.serve_forever, name="search-api", daemon=True)
+        thread.start()
+        m_logger.info(f"Search API listening on {self.url()}")
+        return thread
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self.api.close()
+        m_logger.info("Search API stopped")
+
+
+def start_search_api():
+    """
+    Start the search API in the background, if the search_api setting is True.
+    :return: the running SearchServer, or None
+    """
+    if settings_manager.get_setting("search_api") != "True":
+        return None
+    try:
+        server = SearchServer()
+    except (OSError, sqlite3.Error) as e:
+        m_logger.error(f"Unable to start the search API: {e}")
+        return None
+    server.start()
+    return server
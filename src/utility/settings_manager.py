@@ -1,5 +1,11 @@
+from contextlib import contextmanager
+import atexit
 import json
 import os
+import tempfile
+import threading
+import time
+from src.utility.logger import m_logger
 
 
 '''
@@ -18,6 +24,14 @@ settings_manager.update_setting('CRKN_url', new_url)
 To check the current applied setting use get_setting method and pass the key
 settings_manager.get_setting('institution')
 
+Changes are kept in memory and written a moment later (save_delay), so a burst of changes is one write. Changes made
+together can be written once at the end with batch():
+with settings_manager.batch():
+    settings_manager.set_institution(institution)
+    settings_manager.set_language(language)
+The file is written to a temporary file then renamed over settings.json, so it is never left half written, and
+changes made to settings.json outside the application are read back before the next write.
+
 '''
 
 
@@ -42,51 +56,218 @@ class Settings(metaclass=SingletonMeta):
         one instance manages the application settings.
         """
 
+    # Seconds between a change and the write of settings.json
+    save_delay = 1.0
+    # Seconds between checks of settings.json for changes made outside the application
+    reload_interval = 2.0
+    # Settings of older versions that are now kept elsewhere - the institution lists are in the database
+    # (see database.create_institution_tables), they are read from an older file but not written back
+    retired_settings = ("CRKN_institutions", "local_institutions")
+
     def __init__(self, settings_file=None):
         if not hasattr(self, 'initialized'):  # Avoid reinitialization
             if settings_file is None:
-                settings_file = f"{os.path.abspath(os.path.dirname(__file__))}/settings.json"
+                # EPAT_SETTINGS_FILE puts settings.json somewhere else, e.g. a temporary file for the tests
+                settings_file = (os.environ.get("EPAT_SETTINGS_FILE")
+                                 or f"{os.path.abspath(os.path.dirname(__file__))}/settings.json")
             self.settings_file = settings_file
+            self._lock = threading.RLock()
+            # Keys changed since the last write
+            self._changed = set()
+            self._timer = None
+            self._batches = 0
+            # Modification time of settings.json when it was last read or written
+            self._file_mtime = None
+            self._checked = time.monotonic()
             self.settings = self.load_settings()
             self.initialized = True
+            # Write the changes still waiting when the application exits
+            atexit.register(self.flush)
 
-    def load_settings(self):
-        """Load the current settings from the JSON file."""
+    def default_settings(self):
+        """
+        Get the default settings, used for a new settings.json and for keys missing from an older one.
+        :return: dictionary of default settings
+        """
+        default_db_path = os.path.join(os.path.dirname(self.settings_file), 'ebook_database.db')
+        settings = {
+            "language": "English",
+            "allow_CRKN": "True",
+            "institution": "Univ. of Prince Edward Island",
+            "CRKN_url": "https://library.upei.ca/test-page-ebooks-perpetual-access-project",
+            "CRKN_root_url": "https://library.upei.ca",
+            "database_name": default_db_path,
+            "github_link": "https://github.com/eppenney/eBook-Perpetual-Access-Rights-Tracker",
+            "strip_title_articles": "True",
+            "fuzzy_title_threshold": 0.4,
+            "ingest_chunk_rows": 50000,
+            "ingest_memory_budget_mb": 256,
+            "watch_folder": "",
+            "watch_interval_seconds": 10,
+            "watch_settle_seconds": 5,
+            "watch_replace_policy": "Replace",
+            "watch_institution_policy": "Add",
+            "access_change_institutions": [],
+            "access_change_folder": "",
+            "source_store_enabled": "True",
+            "source_store_folder": "",
+            "source_store_max_mb": 1024,
+            "source_store_compression": "gzip",
+            "scheduled_refresh": "False",
+            "scheduled_refresh_hours": 24,
+            "scheduled_refresh_start": "01:00",
+            "scheduled_refresh_end": "05:00",
+            "scheduled_refresh_bandwidth_kbps": 0,
+            "scheduled_refresh_remove_policy": "Remove",
+            "search_api": "False",
+            "search_api_host": "127.0.0.1",
+            "search_api_port": 8765,
+            "search_api_connections": 4,
+            "search_api_cache_rows": 100000
+        }
+        # Set the CRKN root url from the CRKN url
+        url_parts = settings["CRKN_url"].split('/')
+        settings["CRKN_root_url"] = '/'.join(url_parts[:3])
+        return settings
+
+    def file_mtime(self):
+        """
+        :return: modification time of settings.json in nanoseconds, or None if it does not exist
+        """
+        try:
+            return os.stat(self.settings_file).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def read_file(self):
+        """
+        Read settings.json.
+        :return: dictionary of settings, or None if the file does not exist or can not be read
+        """
+        mtime = self.file_mtime()
         try:
             with open(self.settings_file, 'r') as file:
                 settings = json.load(file)
         except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            # Kept as it is - the settings in memory are written over it
+            m_logger.error(f"Unable to read {self.settings_file}: {e}")
+            return None
+        self._file_mtime = mtime
+        return settings
+
+    def load_settings(self):
+        """Load the current settings from the JSON file."""
+        defaults = self.default_settings()
+        settings = self.read_file()
+        if settings is None:
             # Write default settings to a new settings.json
-            default_db_path = os.path.join(os.path.dirname(self.settings_file), 'ebook_database.db')
-            settings = {
-                "language": "English",
-                "allow_CRKN": "True",
-                "institution": "Univ. of Prince Edward Island",
-                "CRKN_url": "https://library.upei.ca/test-page-ebooks-perpetual-access-project",
-                "CRKN_root_url": "https://library.upei.ca",
-                "CRKN_institutions": [],
-                "local_institutions": [],
-                "database_name": default_db_path,
-                "github_link": "https://github.com/eppenney/eBook-Perpetual-Access-Rights-Tracker"
-            }
-            # Set the CRKN root url from the CRKN url
-            url_parts = settings["CRKN_url"].split('/')
-            settings["CRKN_root_url"] = '/'.join(url_parts[:3])
+            settings = defaults
+
+        # Settings added in newer versions get their default value
+        for key, value in defaults.items():
+            settings.setdefault(key, value)
         return settings
 
+    def reload_if_changed(self):
+        """
+        Read settings.json again if it was changed outside the application since it was last read or written.
+        Settings changed here and not written yet keep their new value.
+        :return: True if the file was read again
+        """
+        with self._lock:
+            self._checked = time.monotonic()
+            mtime = self.file_mtime()
+            if mtime is None or mtime == self._file_mtime:
+                return False
+            settings = self.read_file()
+            if settings is None:
+                return False
+            m_logger.info("settings.json was changed outside the application, reading it again")
+            for key, value in settings.items():
+                if key not in self._changed:
+                    self.settings[key] = value
+            return True
+
     def save_settings(self):
         """Save the current settings back to the JSON file."""
-        with open(self.settings_file, 'w') as file:
-            json.dump(self.settings, file, indent=4)
+        with self._lock:
+            self._cancel_timer()
+            self.reload_if_changed()
+            settings = {key: value for key, value in self.settings.items() if key not in self.retired_settings}
+            directory = os.path.dirname(os.path.abspath(self.settings_file))
+            # Write a temporary file next to settings.json then rename it over settings.json, so an interrupted
+            # write never leaves a half written file
+            descriptor, temporary = tempfile.mkstemp(prefix=".settings-", suffix=".tmp", dir=directory)
+            try:
+                with os.fdopen(descriptor, 'w') as file:
+                    json.dump(settings, file, indent=4)
+                    file.flush()
+                    os.fsync(file.fileno())
+                os.replace(temporary, self.settings_file)
+            except BaseException:
+                try:
+                    os.remove(temporary)
+                except OSError:
+                    pass
+                raise
+            self._file_mtime = self.file_mtime()
+            self._changed.clear()
+
+    def flush(self):
+        """
+        Write the changes not written yet, if any.
+        """
+        with self._lock:
+            if self._changed:
+                try:
+                    self.save_settings()
+                except OSError as e:
+                    m_logger.error(f"Unable to save {self.settings_file}: {e}")
+
+    @contextmanager
+    def batch(self):
+        """
+        Write the changes made in the with block once, at the end of the block.
+        """
+        with self._lock:
+            self._batches += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batches -= 1
+                if not self._batches:
+                    self.flush()
+
+    def _schedule_save(self):
+        """
+        Write the changes after save_delay, unless in a batch - a change made before then moves the write back.
+        """
+        self._cancel_timer()
+        if self._batches:
+            return
+        self._timer = threading.Timer(self.save_delay, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
 
     def update_setting(self, key, value):
         """
-        Update a specific setting and save the change.
+        Update a specific setting. The change is written to settings.json after save_delay, or at the end of the
+        batch it is made in.
         :param key: setting key to update
         :param value: value for new setting
         """
-        self.settings[key] = value
-        self.save_settings()
+        with self._lock:
+            self.settings[key] = value
+            self._changed.add(key)
+            self._schedule_save()
 
     def get_setting(self, key):
         """
@@ -94,6 +275,8 @@ class Settings(metaclass=SingletonMeta):
         :param key: setting to get
         :return: value of that setting
         """
+        if time.monotonic() - self._checked >= self.reload_interval:
+            self.reload_if_changed()
         return self.settings.get(key, None)
 
     def set_language(self, language):
@@ -115,9 +298,9 @@ class Settings(metaclass=SingletonMeta):
         Set the CRKN URL.
         :param url: new url
         """
-        self.update_setting('CRKN_url', url)
-        self.settings["CRKN_root_url"] = "/".join(url.split("/")[:3])
-        self.save_settings()
+        with self.batch():
+            self.update_setting('CRKN_url', url)
+            self.update_setting('CRKN_root_url', "/".join(url.split("/")[:3]))
 
     def set_github_link(self, link):
         """
@@ -133,36 +316,4 @@ class Settings(metaclass=SingletonMeta):
         """
         self.update_setting('institution', institution)
 
-    def add_local_institution(self, institution):
-        """
-        Add institution to local list.
-        :param institution: new institution
-        """
-        self.settings["local_institutions"].append(institution)
-        self.save_settings()
-
-    def remove_local_institution(self, institution):
-        """
-        Remove institution from local list.
-        :param institution: institution to remove
-        """
-        try:
-            self.settings["local_institutions"].remove(institution)
-            self.save_settings()
-        except ValueError:
-            pass
-
-    def set_CRKN_institutions(self, institutions):
-        """
-        Add CRKN institutions to CRKN_institutions if they are not already in it.
-        :param institutions: list of CRKN institutions from CRKN file
-        """
-        self.update_setting("CRKN_institutions", institutions)
-
-    def get_institutions(self):
-        """
-        Get combined list of CRKN and local institutions
-        :return: list - containing CRKN_institutions and local_institutions
-        """
-        return self.settings.get("local_institutions") + self.settings.get("CRKN_institutions")
     
\ No newline at end of file
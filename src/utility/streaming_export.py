@@ -0,0 +1,196 @@
+"""
+Streaming export of search results and database tables.
+
+Rows are written one at a time as they come from a list, a generator or a database cursor (read with fetchmany),
+so the memory used stays the same whatever the number of rows:
+- TSV and CSV with the csv module
+- XLSX with openpyxl's write-only mode, which writes each row to the file instead of keeping the worksheet in memory
+
+The file is written next to the chosen path and renamed over it once complete, so a cancelled or failed export never
+leaves a partial file. This module has no Qt - the export thread and dialog are in export_ui.py.
+"""
+import csv
+import os
+import openpyxl
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from src.utility.logger import m_logger
+
+# File types that can be exported, by extension
+SEPARATORS = {"tsv": "\t", "csv": ","}
+FORMATS = ("tsv", "csv", "xlsx")
+
+# Rows read from a cursor at a time
+FETCH_ROWS = 1000
+
+# Rows written between two calls of the progress callback
+PROGRESS_ROWS = 1000
+
+# Rows of an Excel worksheet, the header row included - the rows after that go on another worksheet
+XLSX_MAX_ROWS = 1048576
+
+
+class ExportCancelled(Exception):
+    """
+    Raised when an export is cancelled before it is complete.
+    """
+
+
+def export_format(path, default="tsv"):
+    """
+    Get the file type of an export from its extension.
+    :param path: path of the file
+    :param default: file type used if the extension is not one of FORMATS
+    :return: tsv, csv or xlsx
+    """
+    extension = os.path.splitext(path)[1][1:].lower()
+    return extension if extension in FORMATS else default
+
+
+def export_path(save_path):
+    """
+    Append ".tsv" if the file doesn't have an extension it can be exported as.
+    :param save_path: path chosen by the user
+    :return: path of the export
+    """
+    if os.path.splitext(save_path)[1][1:].lower() not in FORMATS:
+        save_path += '.tsv'
+    return save_path
+
+
+def cursor_rows(cursor, size=FETCH_ROWS):
+    """
+    Read the rows of a cursor a few at a time.
+    :param cursor: database cursor of an executed query
+    :param size: rows fetched at a time
+    :return: generator of rows
+    """
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            return
+        yield from rows
+
+
+def cursor_headers(cursor):
+    """
+    :param cursor: database cursor of an executed query
+    :return: list of the column names of the query
+    """
+    return [column[0] for column in cursor.description]
+
+
+def write_text(rows, headers, file, separator):
+    """
+    Write rows as TSV or CSV.
+    :param rows: iterable of rows
+    :param headers: list of column headers
+    :param file: text file open for writing
+    :param separator: tab or comma
+    :return: generator yielding after each row, for progress and cancelling
+    """
+    writer = csv.writer(file, delimiter=separator, lineterminator="\n")
+    writer.writerow(headers)
+    for row in rows:
+        writer.writerow(row)
+        yield
+
+
+def xlsx_value(value):
+    """
+    Remove the control characters Excel does not allow from a string value.
+    :param value: cell value
+    :return: value that can be written to a worksheet
+    """
+    if isinstance(value, str):
+        return ILLEGAL_CHARACTERS_RE.sub("", value)
+    return value
+
+
+def write_xlsx(rows, headers, path):
+    """
+    Write rows as an Excel file in write-only mode, continuing on another worksheet when one is full.
+    :param rows: iterable of rows
+    :param headers: list of column headers
+    :param path: path of the file
+    :return: generator yielding after each row, for progress and cancelling
+    """
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = None
+    sheet_rows = XLSX_MAX_ROWS
+    try:
+        for row in rows:
+            if sheet_rows >= XLSX_MAX_ROWS:
+                sheet = workbook.create_sheet(f"Export {len(workbook.worksheets) + 1}" if workbook.worksheets
+                                              else "Export")
+                sheet.append(headers)
+                sheet_rows = 1
+            sheet.append([xlsx_value(value) for value in row])
+            sheet_rows += 1
+            yield
+        if sheet is None:
+            workbook.create_sheet("Export").append(headers)
+    finally:
+        # Written even when cancelled, so openpyxl removes its temporary files - the partial file is removed after
+        workbook.save(path)
+
+
+def write_rows(rows, headers, path, file_format=None, progress=None, cancelled=None):
+    """
+    Export rows to a file, one row at a time.
+    :param rows: iterable of rows - a list, a generator or cursor_rows(cursor). A generator is closed at the end
+    :param headers: list of column headers
+    :param path: path of the file, replaced if it exists
+    :param file_format: tsv, csv or xlsx, by default from the extension of the path
+    :param progress: optional function called with the number of rows written so far
+    :param cancelled: optional function returning True once the export should stop
+    :return: number of rows written
+    :raise ExportCancelled: if cancelled, the file is not written
+    """
+    file_format = file_format or export_format(path)
+    directory, name = os.path.split(os.path.abspath(path))
+    partial = os.path.join(directory, f".{name}.part")
+    written = 0
+    try:
+        if file_format == "xlsx":
+            steps = write_xlsx(rows, headers, partial)
+            file = None
+        else:
+            file = open(partial, "w", newline="", encoding="utf-8")
+            steps = write_text(rows, headers, file, SEPARATORS[file_format])
+        try:
+            for _ in steps:
+                written += 1
+                if written % PROGRESS_ROWS == 0:
+                    if cancelled is not None and cancelled():
+                        raise ExportCancelled()
+                    if progress is not None:
+                        progress(written)
+        finally:
+            steps.close()
+            if file is not None:
+                file.close()
+            # A generator reading from the database closes its cursor now, on this thread, even when cancelled
+            if hasattr(rows, "close"):
+                rows.close()
+        os.replace(partial, path)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    if progress is not None:
+        progress(written)
+    m_logger.info(f"Exported {written} rows to {path}")
+    return written
+
+
+def export_cursor(cursor, path, file_format=None, progress=None, cancelled=None):
+    """
+    Export the rows of a query straight from its cursor.
+    :param cursor: database cursor of an executed query
+    :param path: path of the file
+    :param file_format: tsv, csv or xlsx, by default from the extension of the path
+    :param progress: optional function called with the number of rows written so far
+    :param cancelled: optional function returning True once the export should stop
+    :return: number of rows written
+    """
+    return write_rows(cursor_rows(cursor), cursor_headers(cursor), path, file_format, progress, cancelled)
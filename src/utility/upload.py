@@ -1,272 +1,272 @@
-from PyQt6.QtWidgets import QFileDialog, QApplication, QMessageBox, QDialog, QVBoxLayout, QProgressBar
-from PyQt6.QtCore import Qt, QTimer, QThread, pyqtSignal
+"""
+Uploading local files into the local database - files chosen by the user, or picked up from the watch folder.
+
+This module has no Qt - LocalUpload and WatchFolderUpload report through plain callbacks, so uploads also run without
+the application (see cli.py). The dialogs and threads of the application are in upload_ui.py.
+"""
 from src.data_processing import database, Scraping
-import sys
-import datetime
+from src.utility import batch_upload
+# file_to_df and get_new_institutions moved to batch_upload, imported here for existing callers
+from src.utility.batch_upload import BatchUpload, file_to_df, get_new_institutions
 from src.utility.logger import m_logger
+from src.utility.progress import ProgressReporter
+from src.utility.response_channel import ResponseChannel, RequestCancelled
 from src.utility.settings_manager import Settings
+from src.utility.watch_folder import FolderWatcher, file_signature, hash_file, LOADED, DUPLICATE
 
 
 settings_manager = Settings()
-language = settings_manager.get_setting("language")
-
-
-def upload_and_process_file():
-    global language 
-    """
-    Upload and process local files into local database
-    """
-    language = settings_manager.get_setting("language")
-    app = QApplication.instance()  # Try to get the existing application instance
-    if app is None:  # If no instance exists, create a new one
-        app = QApplication(sys.argv)
-
-    options = QFileDialog.Option.ReadOnly
-
-    file_paths, _ = QFileDialog.getOpenFileNames(None, "Open File" if language == "English" else "Ouvrir le fichier", "", 
-                                                "CSV TSV or Excel (*.csv *.tsv *.xlsx);;All Files (*)" if language == "English" else
-                                                "CSV TSV ou Excel (*.csv *.tsv *.xlsx);;Tous les fichiers (*)", options=options)
-
-    # Iterate through selected file(s) to process them
-    if file_paths:
-        uploadUI = UploadUI(file_paths)
-        uploadUI.exec()
 
 
-class UploadUI(QDialog):
-    def __init__(self, file_paths):
-        super().__init__()
-        self.setWindowTitle("Processing File..." if language == "English" else "Fichier en cours de traitement...")
-        self.setWindowFlags(Qt.WindowType.Dialog | Qt.WindowType.CustomizeWindowHint | Qt.WindowType.WindowTitleHint)
-                
-        layout = QVBoxLayout(self)
-        
-        self.progress_bar = QProgressBar(self)
-        self.progress_bar.setRange(0, 100)
-        layout.addWidget(self.progress_bar)
+# Weight of validating (parsing) and of loading the files on the progress bar
+VALIDATE_WEIGHT = 40
+LOAD_WEIGHT = 60
 
-        self.loading_thread = UploadThread(file_paths)
-        
-        self.timer = QTimer(self)
-        self.timer.timeout.connect(self.loading_thread.start)
+# Why a file was not uploaded, in English and French
+FAILURE_REASONS = {
+    batch_upload.INVALID_TYPE: ("Select only valid xlsx, csv or tsv files.",
+                                "Sélectionnez uniquement les fichiers xlsx, csv ou tsv valides."),
+    batch_upload.INVALID_FORMAT: ("Invalid file format.", "Format de fichier invalide."),
+    batch_upload.DUPLICATE_NAME: ("Another selected file has the same name.",
+                                  "Un autre fichier sélectionné porte le même nom."),
+    batch_upload.NOT_CONFIRMED: ("Not confirmed.", "Non confirmé."),
+    batch_upload.LOAD_FAILED: ("An error occurred during file processing.",
+                               "Une erreur s'est produite lors du traitement du fichier."),
+    batch_upload.CANCELLED: ("Cancelled.", "Annulé."),
+}
 
-        self.loading_thread.progress_update.connect(self.update_progress)
-        self.loading_thread.error_signal.connect(self.handle_error)
-        self.loading_thread.get_answer_yes_no.connect(self.get_answer_yes_no)
-        self.loading_thread.get_okay.connect(self.get_okay)
 
-        self.timer.start(1000)
-
-        self.finished = False
-
-    def handle_error(self, title, error_msg):
-        m_logger.error(error_msg)
-        QMessageBox.critical(None, title, error_msg, QMessageBox.StandardButton.Ok)
-        self.loading_thread.receive_response(True)
-
-    def update_progress(self, value):
-        m_logger.info(f"File upload progress at {value}%")
-        self.progress_bar.setValue(value)
-        if value == 100 and not self.finished:
-            self.finished = True
-            self.loading_thread = None
-            self.close()
-
-    def get_answer_yes_no(self, title, body):
-        m_logger.info(body)
-        reply = QMessageBox.question(None, title, body, 
-                                    QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
-        self.loading_thread.receive_response(reply == QMessageBox.StandardButton.Yes)
+def display_list(items, limit=5):
+    """
+    Get a display string of the first few items of a list, one per line.
+    :param items: list of strings
+    :param limit: number of items shown
+    :return: string
+    """
+    display = '\n'.join(items[:limit])
+    if len(items) > limit:
+        display += '\n...'
+    return display
 
-    def get_okay(self, title, body):
-        m_logger.info(body)
-        QMessageBox.information(None, title, body, QMessageBox.StandardButton.Ok)
-        self.loading_thread.receive_response(True)
 
+class LocalUpload:
+    """
+    Uploads local files into the local database, asking and telling the user through callbacks.
+    """
 
-class UploadThread(QThread):
-    def __init__(self, file_paths):
-        super().__init__()
+    def __init__(self, file_paths, policy=None, progress=None, ask=None, inform=None, error=None):
+        """
+        :param file_paths: list of paths to the files
+        :param policy: (replace files, add institutions) to upload without asking anything, for uploads nobody is
+                       watching - or None to ask
+        :param progress: optional function called with (percent, status line)
+        :param ask: function called with (title, question) returning True for yes, needed without a policy
+        :param inform: optional function called with (title, message) when files were uploaded
+        :param error: optional function called with (title, message) when no file was uploaded
+        """
         self.file_paths = file_paths
-        self.file_length = len(file_paths)
-        self.currentValue = 0
-        self.one_file_progress_value = (1 / self.file_length) * 100
-
-    progress_update = pyqtSignal(int)
-    error_signal = pyqtSignal(str, str) 
-    get_answer_yes_no = pyqtSignal(str, str) 
-    get_okay = pyqtSignal(str, str)
-
-    def run(self):
-        self.process_files()
+        # Questions to the UI and cancellation
+        self.channel = ResponseChannel()
+        self.policy = policy
+        self.on_progress = progress
+        self.ask = ask
+        self.inform = inform
+        self.error = error
+        self.batch = None
+        self.language = settings_manager.get_setting("language")
 
     def process_files(self):
-        for i in range(self.file_length):
-            self.currentValue = i * self.one_file_progress_value
-            self.progress_update.emit(int(self.currentValue))
-            self.process_file(self.file_paths[i])
-        self.progress_update.emit(100)
-
-    def process_file(self, file_path):
         """
-        Process file and store in local database - similar to Scraping.download_files, but for local files
-        :param file_path: string containing the path to the file 
+        Upload the selected files as one batch - all files are validated first, then the user is asked once about
+        replaced files and new institutions, then the files are loaded through one connection.
         """
-        app = QApplication.instance()  # Try to get the existing application instance
-        if app is None:  # If no instance exists, create a new one
-            app = QApplication(sys.argv)
-
-        connection = database.connect_to_database()
-
-        # Get file_name and date for table information
-        file_name_with_ext = file_path.split("/")[-1]
-        file_name = file_name_with_ext.split(".")
-        date = datetime.datetime.now()
-        date = date.strftime("%Y_%m_%d")
-
-        # Check if local file is already in database
-        result = Scraping.compare_file([file_name[0], date], "local", connection)
-
-        self.currentValue += self.one_file_progress_value / 7
-        self.progress_update.emit(int(self.currentValue))
-
-        # If result is update, check if they want to update it
-        if result == "UPDATE":
-            self.get_answer_yes_no.emit("Replace File" if language == "English" else "Remplacer le fichier",
-                                        f"{file_name_with_ext}\nA file with the same name is already in the local database. Would you like to replace it with the new file?" 
-                                        if language == "English" else f"{file_name_with_ext}\nUn fichier du même nom se trouve déjà dans la base de données locale. Souhaitez-vous le remplacer par le nouveau fichier ?")
-            reply = self.wait_for_response()
-            if reply == False:
-                print(language, language == "English")
-                self.error_signal.emit("File Upload Cancelled" if language == "English" else "Chargement de fichier annulé",
-                                        f"{file_name_with_ext}\n{'This file will not be uploaded' if language == 'English' else 'Ce fichier ne sera pas chargé'}")
-                self.wait_for_response()
-                database.close_database(connection)
-                return
-        
-        self.currentValue += self.one_file_progress_value / 7
-        self.progress_update.emit(int(self.currentValue))
-
+        language = self.language
+        english = language == "English"
+        validating = "Reading files" if english else "Lecture des fichiers"
+        loading = "Loading files" if english else "Chargement des fichiers"
+        reporter = ProgressReporter(self.report_progress, [(validating, VALIDATE_WEIGHT), (loading, LOAD_WEIGHT)], language)
+
+        batch = BatchUpload(self.file_paths)
+        self.batch = batch
+        connection = database.connect_for_batch()
         try:
-            # Get our dataframe, check if it's good
-            file_df = file_to_df(".".join(file_name), file_path)
-            if file_df is None:
-                self.error_signal.emit("Invalid File Type" if language == "English" else "Type de fichier invalide", 
-                                        f"{file_name_with_ext}\nSelect only valid xlsx, csv or tsv files." if language == "English" else f"{file_name_with_ext}\nSélectionnez uniquement les fichiers xlsx, csv ou tsv valides.")
-                self.wait_for_response()
-                database.close_database(connection)
-                return
-
-            # Check if in correct format
-            valid_file = Scraping.check_file_format(file_df)
-            if valid_file is not True:
-                self.error_signal.emit("Invalid File Format" if language == "English" else "Format de fichier invalide", 
-                                       f"{file_name_with_ext}\n{valid_file}\nUpload aborted." if language == "English" else 
-                                    f"{file_name_with_ext}\n{valid_file}\nChargement interrompu.")
-                self.wait_for_response()
-                database.close_database(connection)
-                return
-            
-            self.currentValue += self.one_file_progress_value / 7
-            self.progress_update.emit(int(self.currentValue))
-            
-            # If there are new institutions, check if the user wants to add them.
-            # If no, cancel upload of file
-            new_institutions = get_new_institutions(file_df)
-            if len(new_institutions) > 0: # Get a display string of 5 institutions
-                new_institutions_display = '\n'.join(new_institutions[:5]) 
-                if len(new_institutions) > 5:
-                    new_institutions_display += '...'
-                self.get_answer_yes_no.emit("New Institutions", f"{len(new_institutions)} institution name{'s' if len(new_institutions) > 1 else ''} found that " +
-                                            f"{'are' if len(new_institutions) > 1 else 'is'} not a CRKN institution and {'are' if len(new_institutions) > 1 else 'is'} not on the list of local institutions.\n\n" +
-                                            f"{new_institutions_display}\n" +
-                                            "Would you like to add them to the local list? \n'No' - The file will not be uploaded. \n'Yes' - The file will be uploaded, and the new institution names will be added as options" +
-                                            " and will be available in the settings menu.")
-                reply = self.wait_for_response()
-                if reply == False:
-                    self.error_signal.emit("File Upload Cancelled" if language == "English" else "Chargement de fichier annulé",
-                                        f"{file_name_with_ext}\n{'This file will not be uploaded' if language == 'English' else 'Ce fichier ne sera pas chargé'}")
-                    self.wait_for_response()
-                    database.close_database(connection)
-                    return
-            
-            self.currentValue += self.one_file_progress_value / 7
-            self.progress_update.emit(int(self.currentValue))
-            
-            # Add new institutions
-            for institution in new_institutions:
-                settings_manager.add_local_institution(institution)
-            self.currentValue += self.one_file_progress_value / 7
-            self.progress_update.emit(int(self.currentValue))
-
-            Scraping.upload_to_database(file_df, "local_" + file_name[0], connection)
-            self.currentValue += self.one_file_progress_value / 7
-            self.progress_update.emit(int(self.currentValue))
-
-            Scraping.update_tables([file_name[0], date], "local", connection, result)
-            self.currentValue += self.one_file_progress_value / 7
-            self.progress_update.emit(int(self.currentValue) - 1)
-            self.get_okay.emit("File Upload" if language == "English" else "Chargement de fichiers", f"{file_name_with_ext}\nYour file has been uploaded. {len(file_df)} rows have been added." if language == "English" else f"{file_name_with_ext}\nVotre fichier a été chargé. {len(file_df)} lignes ont été ajoutées.")
-            self.wait_for_response()
-
+            reporter.start(validating, len(self.file_paths))
+            batch.validate(connection, lambda done, total, rows: reporter.update(done, rows, "rows"))
+
+            if any(job.needs_confirmation() for job in batch.ready_jobs()):
+                if self.policy is not None:
+                    batch.apply_policy(*self.policy)
+                else:
+                    reply = self.ask("Confirm Upload" if language == "English" else "Confirmer le chargement",
+                                     self.confirmation_message(batch))
+                    if reply is False:
+                        batch.skip_unconfirmed()
+
+            reporter.start(loading, sum(job.rows for job in batch.ready_jobs()))
+            batch.load(connection, lambda done, total, rows: reporter.update(done, rows, "rows"),
+                       lambda: self.channel.cancelled)
+
+            if batch.loaded_files():
+                self.tell(self.inform, "File Upload" if language == "English" else "Chargement de fichiers",
+                          self.summary_message(batch))
+            elif not self.channel.cancelled:
+                self.tell(self.error, "File Upload Cancelled" if language == "English" else "Chargement de fichier annulé",
+                          self.summary_message(batch))
+        except RequestCancelled:
+            m_logger.info("File upload cancelled")
         except Exception as e:
-            self.error_signal.emit("Error" if language == "English" else "Erreur", f"{file_name_with_ext}\nAn error occurred during file processing: {str(e)}" if language == "English" else f"{file_name_with_ext}\nUne erreur s'est produite lors du traitement du fichier: {str(e)}")
-
-        database.close_database(connection)
-
-    def wait_for_response(self):
-        # This function halts the execution of the thread until response is received
-        self.response = None
-        while self.response is None:
-            self.msleep(100)  # Sleep to avoid busy waiting
-        return self.response
-    
-    def receive_response(self, response):
-        self.response = response
-
+            try:
+                self.tell(self.error, "Error" if language == "English" else "Erreur",
+                          f"An error occurred during file processing: {str(e)}" if language == "English" else
+                          f"Une erreur s'est produite lors du traitement du fichier: {str(e)}")
+            except RequestCancelled:
+                pass
+        finally:
+            database.close_database(connection)
+        reporter.finish()
+
+    def report_progress(self, percent, status):
+        if self.on_progress is not None:
+            self.on_progress(percent, status)
+
+    def tell(self, callback, title, body):
+        """
+        Show a message to the user - or only log it when nobody is watching the upload.
+        :param callback: inform or error
+        :param title: message title
+        :param body: message text
+        """
+        if callback is None:
+            m_logger.info(f"{title}: {body}")
+            return
+        callback(title, body)
 
-def get_new_institutions(file_df):
+    def confirmation_message(self, batch):
+        """
+        Get the one question asked for the whole batch - files that would be replaced and institutions that would
+        be added, along with the files that can not be uploaded.
+        :param batch: validated BatchUpload
+        :return: message string
+        """
+        english = self.language == "English"
+        sections = []
+        replaced = batch.replaced_files()
+        if replaced:
+            sections.append(("A file with the same name is already in the local database for these files. They will be replaced:\n"
+                             if english else "Un fichier du même nom se trouve déjà dans la base de données locale pour ces fichiers. Ils seront remplacés :\n")
+                            + display_list(replaced))
+        new_institutions = batch.new_institutions()
+        if new_institutions:
+            sections.append((f"{len(new_institutions)} institution name{'s' if len(new_institutions) > 1 else ''} found that "
+                             f"{'are' if len(new_institutions) > 1 else 'is'} not a CRKN institution and {'are' if len(new_institutions) > 1 else 'is'} not on the list of local institutions. "
+                             "They will be added as options and will be available in the settings menu:\n"
+                             if english else f"{len(new_institutions)} nom(s) d'établissement trouvé(s) qui ne sont ni des établissements du RCDR ni dans la liste des établissements locaux. "
+                             "Ils seront ajoutés comme options et seront disponibles dans le menu des paramètres :\n")
+                            + display_list(new_institutions))
+        failed = batch.failed_jobs()
+        if failed:
+            sections.append(("These files can not be uploaded:\n" if english else "Ces fichiers ne peuvent pas être chargés :\n")
+                            + display_list([job.file_name_with_ext for job in failed]))
+        sections.append("Would you like to continue? \n'No' - Only the files above that need no confirmation will be uploaded. \n'Yes' - All valid files will be uploaded."
+                        if english else "Souhaitez-vous continuer ? \n'Non' - Seuls les fichiers qui ne nécessitent aucune confirmation seront chargés. \n'Oui' - Tous les fichiers valides seront chargés.")
+        return "\n\n".join(sections)
+
+    def summary_message(self, batch):
+        """
+        Get the message shown at the end of the batch - the files uploaded with their rows and throughput, and the
+        files that were not uploaded with the reason.
+        :param batch: BatchUpload that was loaded
+        :return: message string
+        """
+        english = self.language == "English"
+        loaded = batch.loaded_files()
+        seconds = batch.validate_seconds + batch.load_seconds
+        lines = [f"{len(loaded)} of {len(batch.jobs)} files uploaded. {batch.loaded_rows} rows have been added in {seconds:.2f}s ({batch.rows_per_second():.0f} rows/s)."
+                 if english else f"{len(loaded)} fichiers sur {len(batch.jobs)} chargés. {batch.loaded_rows} lignes ont été ajoutées en {seconds:.2f}s ({batch.rows_per_second():.0f} lignes/s)."]
+        if batch.peak_rss:
+            peak = batch.peak_rss / 1024 / 1024
+            lines.append(f"Peak memory: {peak:.0f} MB" if english else f"Mémoire maximale : {peak:.0f} Mo")
+        for job in batch.failed_jobs():
+            reason = FAILURE_REASONS[job.error][0 if english else 1]
+            lines.append(f"{job.file_name_with_ext}: {reason} {job.error_detail}".strip())
+            m_logger.error(lines[-1])
+            if job.report_path:
+                lines.append(f"    All problems: {job.report_path}" if english else
+                             f"    Tous les problèmes : {job.report_path}")
+        return "\n".join(lines)
+
+    def cancel(self):
+        # Stops before the next file is loaded, and stops waiting for a response
+        self.channel.cancel()
+
+
+class WatchFolderUpload(LocalUpload):
     """
-    Get and return list of institutions that are not in either the CRKN or local list from a new file dataframe
-    :param file_df: file in the form of a pandas dataframe
-    :return: list of new string institutions
+    Polls the watch folder and uploads its new and changed files (see watch_folder.py).
     """
 
-    # If no dataframe, there's no new institutions
-    if file_df is None:
-        return []
-    headers = file_df.columns.to_list()
-    new_inst = []
-
-    # For institution in institution section of dataframe
-    for inst in headers[8:-2]:
-        if inst not in settings_manager.get_setting("CRKN_institutions"):
-            if inst not in settings_manager.get_setting("local_institutions"):
-                if inst.strip():
-                    # If not in either list and isn't blank, add to new list
-                    new_inst.append(inst)
-    return new_inst
+    def __init__(self, directory):
+        super().__init__([], (settings_manager.get_setting("watch_replace_policy") == "Replace",
+                              settings_manager.get_setting("watch_institution_policy") == "Add"))
+        self.directory = directory
 
-
-def file_to_df(file_name, file_path):
-    """
-    Convert a file to a dataframe
-    :param file_name: A string of format name.ext
-    :param file_path: A string containing the file path.
-    :return: Dataframe or None
-    """
-    m_logger.info(f"Processing file: {file_path}")
-    file_extension = file_name.split(".")[-1]
-    # Convert file into dataframe
-    if file_extension == "csv":
-        file_df = Scraping.file_to_dataframe_csv(file_name, file_path)
-    elif file_extension == "xlsx":
-        file_df = Scraping.file_to_dataframe_excel(file_name, file_path)
-    elif file_extension == "tsv":
-        file_df = Scraping.file_to_dataframe_tsv(file_name, file_path)
-    else:
-        return None
-    return file_df
+    def watch(self):
+        """
+        Upload the files of the watch folder as they are picked up, until cancelled.
+        """
+        connection = database.connect_to_database()
+        try:
+            watcher = FolderWatcher.from_database(self.directory, float(settings_manager.get_setting("watch_settle_seconds")),
+                                                  connection)
+        finally:
+            database.close_database(connection)
+        m_logger.info(f"Watching {self.directory} for new files")
+
+        interval = float(settings_manager.get_setting("watch_interval_seconds"))
+        while True:
+            ready = watcher.poll()
+            if ready:
+                self.upload_files(watcher, ready)
+            if self.channel.wait_cancelled(interval):
+                break
+
+    def upload_files(self, watcher, file_paths):
+        """
+        Upload the files picked up from the watch folder, skipping the ones with the same contents as a loaded file.
+        :param watcher: FolderWatcher the files come from
+        :param file_paths: list of paths to the files
+        """
+        connection = database.connect_to_database()
+        try:
+            # path: ((size, modification time), hash) - taken before uploading, so a file changed since is picked up again
+            files = {}
+            for file_path in file_paths:
+                try:
+                    files[file_path] = (file_signature(file_path), hash_file(file_path))
+                except OSError as e:
+                    m_logger.error(f"Unable to read {file_path} from the watch folder: {e}")
+                    continue
+                signature, sha256 = files[file_path]
+                if watcher.is_duplicate(sha256):
+                    m_logger.info(f"{file_path} has the same contents as a file already loaded, it was not uploaded")
+                    watcher.mark_processed(file_path, signature, sha256, DUPLICATE)
+                    database.record_watched_file(connection, file_path, *signature, sha256, DUPLICATE)
+                    del files[file_path]
+
+            if not files:
+                return
+            self.file_paths = list(files)
+            self.process_files()
+            for job in self.batch.jobs:
+                if job.error == batch_upload.CANCELLED:
+                    # Picked up again next time
+                    continue
+                signature, sha256 = files[job.file_path]
+                status = LOADED if job.loaded else job.error or batch_upload.LOAD_FAILED
+                watcher.mark_processed(job.file_path, signature, sha256, status)
+                database.record_watched_file(connection, job.file_path, *signature, sha256, status)
+        finally:
+            database.close_database(connection)
 
 
 def remove_local_file(file_name):
@@ -0,0 +1,162 @@
+"""
+Watch-folder ingestion of local files.
+
+Staff drop new PA-Rights spreadsheets into a shared folder (the watch_folder setting) and they are uploaded in the
+background, without the file dialog. The folder is polled every watch_interval_seconds:
+1) each file's size and modification time are compared with the last poll - a file is only picked up once they
+   have not changed for watch_settle_seconds, so a file that is still being copied or saved is left alone
+2) files whose size and modification time are the same as when they were last processed are skipped
+3) the contents are hashed, and a file with the same contents as a file already loaded is skipped
+4) the rest go through the same batch upload as the file dialog (see upload.WatchFolderUpload), with the
+   watch_replace_policy and watch_institution_policy settings answering the questions the user is asked there
+
+What happened to each file is kept in the watched_files table, so files are not uploaded again after a restart.
+This module has no Qt - the polling loop is upload.WatchFolderUpload, run on a thread by upload_ui.py.
+"""
+import hashlib
+import os
+import time
+from src.data_processing import database
+from src.data_processing.quality_report import REPORT_SUFFIX
+from src.utility.logger import m_logger
+
+# File types picked up from the watch folder
+WATCHED_EXTENSIONS = ("csv", "tsv", "xlsx")
+
+# Bytes read at a time when hashing a file
+HASH_BLOCK_SIZE = 1024 * 1024
+
+LOADED = "Loaded"
+DUPLICATE = "Duplicate"
+
+
+def is_watched_file(name):
+    """
+    Check if a file of the watch folder should be uploaded - not a hidden file, an Excel lock file (~$name.xlsx) or
+    the data-quality report written next to a file that was rejected (name_report.csv).
+    :param name: file name
+    :return: True or False
+    """
+    if name.startswith((".", "~$")) or name.lower().endswith(REPORT_SUFFIX):
+        return False
+    return name.split(".")[-1].lower() in WATCHED_EXTENSIONS
+
+
+def file_signature(path):
+    """
+    :param path: path to a file
+    :return: tuple of (size, modification time in nanoseconds)
+    """
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def hash_file(path):
+    """
+    Hash the contents of a file, a block at a time.
+    :param path: path to the file
+    :return: hex SHA-256 string
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class FolderWatcher:
+    """
+    Finds the new and changed files of a folder, once they have stopped changing.
+    """
+
+    def __init__(self, directory, settle_seconds, processed=None, loaded_hashes=None, clock=time.monotonic):
+        """
+        :param directory: folder to watch
+        :param settle_seconds: seconds a file's size and modification time must stay the same before it is picked up
+        :param processed: dictionary of path: (size, modification time) of the files already processed
+        :param loaded_hashes: set of content hashes of the files already loaded
+        :param clock: function returning the current time in seconds
+        """
+        self.directory = directory
+        self.settle_seconds = settle_seconds
+        self.processed = dict(processed or {})
+        self.loaded_hashes = set(loaded_hashes or ())
+        self.clock = clock
+        # path: (signature, time it was first seen with that signature)
+        self.pending = {}
+
+    @classmethod
+    def from_database(cls, directory, settle_seconds, connection, clock=time.monotonic):
+        """
+        Create a watcher that knows the files processed before, from the watched_files table.
+        :param directory: folder to watch
+        :param settle_seconds: seconds a file must stay the same before it is picked up
+        :param connection: database connection object
+        :param clock: function returning the current time in seconds
+        :return: FolderWatcher
+        """
+        watched = database.get_watched_files(connection)
+        return cls(directory, settle_seconds,
+                   {path: (size, mtime_ns) for path, (size, mtime_ns, _, _) in watched.items()},
+                   {sha256 for (_, _, sha256, status) in watched.values() if status == LOADED}, clock)
+
+    def poll(self):
+        """
+        Look at the folder once.
+        :return: list of paths of the new or changed files that have stopped changing, by name
+        """
+        now = self.clock()
+        ready = []
+        seen = set()
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError as e:
+            m_logger.error(f"Unable to read the watch folder {self.directory}: {e}")
+            return []
+
+        for entry in entries:
+            if not is_watched_file(entry.name):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+            except OSError:
+                # Removed or renamed since the folder was listed
+                continue
+            path = entry.path
+            signature = (stat.st_size, stat.st_mtime_ns)
+            seen.add(path)
+            if self.processed.get(path) == signature:
+                continue
+
+            pending = self.pending.get(path)
+            if pending is None or pending[0] != signature:
+                # New, or still changing - wait for it to settle
+                self.pending[path] = (signature, now)
+            elif signature[0] > 0 and now - pending[1] >= self.settle_seconds:
+                ready.append(path)
+
+        # Forget the files that are gone
+        self.pending = {path: pending for path, pending in self.pending.items() if path in seen}
+        return sorted(ready, key=os.path.basename)
+
+    def is_duplicate(self, sha256):
+        """
+        :param sha256: hash of a file's contents
+        :return: True if a file with the same contents was already loaded
+        """
+        return sha256 in self.loaded_hashes
+
+    def mark_processed(self, path, signature, sha256, status):
+        """
+        Remember that a file was processed, so it is only picked up again once it changes.
+        :param path: path to the file
+        :param signature: (size, modification time) of the file when it was processed
+        :param sha256: hash of the file's contents
+        :param status: LOADED, DUPLICATE, or the reason the file was not uploaded
+        """
+        self.processed[path] = signature
+        self.pending.pop(path, None)
+        if status == LOADED:
+            self.loaded_hashes.add(sha256)
@@ -0,0 +1,13 @@
+"""
+Keeps the tests from writing into the source tree - the log and settings.json go to a temporary folder, set before
+any module of the application is imported.
+"""
+import atexit
+import os
+import shutil
+import tempfile
+
+_directory = tempfile.mkdtemp(prefix="epat-tests-")
+atexit.register(shutil.rmtree, _directory, True)
+os.environ.setdefault("EPAT_LOG_FILE", os.path.join(_directory, "application.log"))
+os.environ.setdefault("EPAT_SETTINGS_FILE", os.path.join(_directory, "settings.json"))
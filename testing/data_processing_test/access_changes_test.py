@@ -0,0 +1,103 @@
+import csv
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+from src.data_processing import database, Scraping, chunked_ingest
+from src.data_processing.access_changes import AccessChangeReport, ADDED, REMOVED, ACCESS_CHANGED, REPORT_COLUMNS
+from testing.utility_testing.batch_upload_test import write_csv
+
+TEST_SETTINGS = {"allow_CRKN": "True", "institution": "Test University", "strip_title_articles": "True",
+                 "access_change_institutions": ["Test University", "Other University"], "ingest_chunk_rows": 2,
+                 "ingest_memory_budget_mb": 256}
+
+
+class TestAccessChanges(unittest.TestCase):
+    def setUp(self):
+        self.patcher = patch("src.utility.settings_manager.Settings.get_setting", side_effect=TEST_SETTINGS.get)
+        self.patcher.start()
+        self.directory = tempfile.TemporaryDirectory()
+        self.connection = sqlite3.connect(":memory:")
+        database.create_file_name_tables(self.connection)
+        self.write("first.csv", rows=4)
+        Scraping.upload_to_database(Scraping.file_to_dataframe_csv("first.csv", self.path("first.csv")), "Alpha",
+                                    self.connection)
+
+    def tearDown(self):
+        self.connection.close()
+        self.directory.cleanup()
+        self.patcher.stop()
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def write(self, name, rows, edit=None):
+        path = write_csv(self.directory.name, name, ("Test University", "Other University"), rows)
+        if edit:
+            with open(path) as file:
+                lines = file.readlines()
+            with open(path, "w") as file:
+                file.writelines(edit(lines))
+        return path
+
+    def second_version(self):
+        # Title 0 removed, Title 4 added, Title 2 loses access for Test University
+        return self.write("second.csv", rows=5, edit=lambda lines: [
+            line.replace(",Y,Y", ",N,Y") if line.startswith("Title 2,") else line
+            for line in lines if not line.startswith("Title 0,")])
+
+    def read_report(self, path):
+        with open(path, newline="", encoding="utf-8") as file:
+            rows = list(csv.reader(file))
+        self.assertEqual(rows[0], REPORT_COLUMNS + ["Test University", "Other University"])
+        return sorted((row[1], row[2], row[6], row[7]) for row in rows[1:])
+
+    def test_changes_of_a_replaced_file(self):
+        report = AccessChangeReport()
+        path = self.second_version()
+        self.assertTrue(Scraping.upload_to_database(Scraping.file_to_dataframe_csv("second.csv", path), "Alpha",
+                                                    self.connection, report.before_swap("Alpha")))
+        report.keep("Alpha")
+        self.assertEqual(self.read_report(report.write(self.path("reports"))),
+                         [(ACCESS_CHANGED, "Title 2", "Y → N", "Y"), (ADDED, "Title 4", "Y", "Y"),
+                          (REMOVED, "Title 0", "Y", "Y")])
+        self.assertEqual(report.counts, {ADDED: 1, REMOVED: 1, ACCESS_CHANGED: 1})
+
+    def test_identifiers_written_differently(self):
+        report = AccessChangeReport()
+        path = self.write("second.csv", rows=4, edit=lambda lines: [
+            line.replace(",9780000000001,1,", ",978-0-00-000000-1,1.0,") for line in lines])
+        Scraping.upload_to_database(Scraping.file_to_dataframe_csv("second.csv", path), "Alpha", self.connection,
+                                    report.before_swap("Alpha"))
+        report.keep("Alpha")
+        self.assertEqual(report.counts, {})
+
+    def test_chunked_load(self):
+        report = AccessChangeReport()
+        valid, _ = chunked_ingest.load_file_in_chunks("second.csv", self.second_version(), "Alpha", self.connection,
+                                                      before_swap=report.before_swap("Alpha"))
+        self.assertIs(valid, True)
+        report.keep("Alpha")
+        self.assertEqual(report.counts, {ADDED: 1, REMOVED: 1, ACCESS_CHANGED: 1})
+
+    def test_removed_file_and_no_changes(self):
+        report = AccessChangeReport()
+        report.compare(self.connection, "Alpha", "Alpha", "Alpha")
+        report.keep("Alpha")
+        self.assertIsNone(report.write(self.path("reports")))
+
+        report.compare(self.connection, "Alpha", "Alpha", None)
+        report.keep("Alpha")
+        self.assertEqual(report.counts, {REMOVED: 4})
+
+    def test_changes_not_kept_without_keep(self):
+        report = AccessChangeReport()
+        path = self.second_version()
+        Scraping.upload_to_database(Scraping.file_to_dataframe_csv("second.csv", path), "Alpha", self.connection,
+                                    report.before_swap("Alpha"))
+        self.assertIsNone(report.write(self.path("reports")))
+
+
+if __name__ == '__main__':
+    unittest.main()
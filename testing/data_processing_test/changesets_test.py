@@ -0,0 +1,176 @@
+import gzip
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+import zlib
+from unittest.mock import patch
+from src.data_processing import database, Scraping, changesets
+from src.data_processing.changesets import apply_changesets, export_changesets, ChangesetError
+from src.data_processing.institutions import registry, LOCAL
+from src.data_processing.snapshot import export_snapshot, import_snapshot
+from testing.utility_testing.batch_upload_test import write_csv
+
+TEST_SETTINGS = {"allow_CRKN": "True", "institution": "Test University", "strip_title_articles": "True"}
+
+
+class TestChangesets(unittest.TestCase):
+    def setUp(self):
+        self.patcher = patch("src.utility.settings_manager.Settings.get_setting", side_effect=TEST_SETTINGS.get)
+        self.patcher.start()
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "changes.gz")
+        self.source = self.database()
+
+    def tearDown(self):
+        self.source.close()
+        self.directory.cleanup()
+        self.patcher.stop()
+
+    def database(self):
+        connection = sqlite3.connect(":memory:")
+        database.create_file_name_tables(connection)
+        return connection
+
+    def load(self, connection, name, method, rows=5, edit=None, date="2024-01-01", institutions=("Test University",)):
+        path = write_csv(self.directory.name, f"{name}.csv", institutions, rows)
+        if edit:
+            with open(path) as file:
+                lines = file.readlines()
+            with open(path, "w") as file:
+                file.writelines(edit(lines))
+        table = changesets.file_table_name(name, method)
+        exists = changesets.table_exists(connection, table)
+        Scraping.upload_to_database(Scraping.file_to_dataframe_csv(f"{name}.csv", path), table, connection)
+        Scraping.update_tables([name, date], method, connection, "UPDATE" if exists else "INSERT INTO")
+
+    def bodies(self, connection):
+        return [json.loads(zlib.decompress(body)) for body, in
+                connection.execute("SELECT body FROM changesets ORDER BY sequence;").fetchall()]
+
+    def contents(self, connection, table):
+        return sorted(connection.execute(f"SELECT * FROM [{table}];").fetchall(), key=repr)
+
+    def test_only_changes_are_recorded(self):
+        self.load(self.source, "a", "local")
+        self.load(self.source, "a", "local", rows=6, date="2024-02-01",
+                  edit=lambda lines: [line.replace("Title 2,", "Title 2 revised,") for line in lines if "Title 1," not in line])
+        first, second = self.bodies(self.source)
+        self.assertIsNone(first["base"])
+        self.assertEqual(len(first["added"]), 5)
+        self.assertEqual(second["base"], first["digest"])
+        self.assertEqual(second["removed"], ["id:9780000000001|1#1"])
+        self.assertEqual(list(second["added"]), ["id:9780000000005|5#1"])
+        self.assertEqual(second["changed"], {"id:9780000000002|2#1": {"Title": "Title 2 revised"}})
+
+    def test_apply_on_another_workstation(self):
+        self.load(self.source, "crkn_a", "CRKN", rows=20, institutions=("Test University", "Other University"))
+        self.load(self.source, "b", "local")
+        self.load(self.source, "crkn_a", "CRKN", rows=21, date="2024-02-01", institutions=("Test University", "Other University"),
+                  edit=lambda lines: [line.replace(",Y,Y", ",N,Y") if "Title 3," in line else line for line in lines])
+        Scraping.update_tables(["b"], "local", self.source, "DELETE")
+        self.assertEqual(export_changesets(self.source, self.path), 4)
+
+        target = self.database()
+        self.assertEqual(apply_changesets(target, self.path), (4, 0))
+        self.assertEqual(self.contents(target, "crkn_a"), self.contents(self.source, "crkn_a"))
+        self.assertFalse(changesets.table_exists(target, "local_b"))
+        for sql in ("SELECT * FROM CRKN_file_names", "SELECT * FROM local_file_names",
+                    "SELECT file_table, digest FROM changeset_tables", "SELECT changeset_id FROM changesets"):
+            self.assertEqual(target.execute(sql).fetchall(), self.source.execute(sql).fetchall(), sql)
+        self.assertEqual(target.execute("SELECT COUNT(*) FROM title_keys WHERE file_table = 'crkn_a'").fetchone()[0], 21)
+
+        # Applying the same file again changes nothing
+        self.assertEqual(apply_changesets(target, self.path), (0, 4))
+
+        # Changes made on the other workstation come back the same way
+        self.load(target, "c", "local", institutions=("Local College",))
+        export_changesets(target, self.path)
+        self.assertEqual(apply_changesets(self.source, self.path), (1, 4))
+        self.assertEqual(self.contents(self.source, "local_c"), self.contents(target, "local_c"))
+        self.assertIn("Local College", registry.names(LOCAL, self.source))
+        target.close()
+
+    def test_diverged_table_is_refused(self):
+        self.load(self.source, "a", "local")
+        export_changesets(self.source, self.path)
+        target = self.database()
+        apply_changesets(target, self.path)
+
+        # Both workstations load another version of the file
+        self.load(target, "a", "local", rows=4, date="2024-01-15")
+        self.load(self.source, "a", "local", rows=6, date="2024-02-01")
+        export_changesets(self.source, self.path)
+        before = self.contents(target, "local_a")
+        with self.assertRaises(ChangesetError):
+            apply_changesets(target, self.path)
+        self.assertEqual(self.contents(target, "local_a"), before)
+        self.assertEqual(target.execute("SELECT file_date FROM local_file_names").fetchall(), [("2024-01-15",)])
+        target.close()
+
+    def test_changes_after_snapshot(self):
+        self.load(self.source, "a", "local")
+        snapshot_path = os.path.join(self.directory.name, "rights.snapshot")
+        export_snapshot(self.source, snapshot_path)
+        target = self.database()
+        import_snapshot(target, snapshot_path)
+
+        self.load(self.source, "a", "local", rows=7, date="2024-02-01")
+        export_changesets(self.source, self.path)
+        self.assertEqual(apply_changesets(target, self.path), (1, 1))
+        self.assertEqual(self.contents(target, "local_a"), self.contents(self.source, "local_a"))
+        target.close()
+
+    def test_export_since_last_export(self):
+        self.load(self.source, "a", "local")
+        self.assertEqual(export_changesets(self.source, self.path, peer="Branch"), 1)
+        target = self.database()
+        apply_changesets(target, self.path)
+
+        self.load(self.source, "b", "local")
+        self.load(self.source, "a", "local", rows=6, date="2024-02-01")
+        # Only the changesets made since the last export for the same workstation
+        self.assertEqual(export_changesets(self.source, self.path, peer="Branch"), 2)
+        self.assertEqual(apply_changesets(target, self.path), (2, 0))
+        self.assertEqual(self.contents(target, "local_a"), self.contents(self.source, "local_a"))
+        self.assertEqual(export_changesets(self.source, self.path, peer="Branch"), 0)
+        self.assertEqual(export_changesets(self.source, self.path, since=1), 2)
+        self.assertEqual(export_changesets(self.source, self.path, peer="Other"), 3)
+        target.close()
+
+    def test_compact_state(self):
+        self.load(self.source, "crkn_a", "CRKN", rows=20, institutions=("Test University", "Other University"))
+        columns, rows, _ = changesets.read_rows(self.source, "crkn_a")
+        self.assertEqual(changesets.load_state(self.source, "crkn_a")[2], rows)
+        # The institution columns and the values of the file in every row take 4 bits each
+        stored = self.source.execute("SELECT column_hashes FROM changeset_rows").fetchall()
+        self.assertTrue(all(len(compact) < 4 * len(columns) // 2 for compact, in stored))
+
+    def test_column_types_checked(self):
+        self.load(self.source, "a", "local")
+        export_changesets(self.source, self.path)
+        with gzip.open(self.path, "rt") as file:
+            lines = [json.loads(line) for line in file]
+        lines[1]["body"]["columns"][0][1] = "TEXT); DROP TABLE local_file_names; --"
+        with gzip.open(self.path, "wt") as file:
+            file.writelines(json.dumps(line) + "\n" for line in lines)
+        target = self.database()
+        with self.assertRaises(ChangesetError):
+            apply_changesets(target, self.path)
+        self.assertEqual(target.execute("SELECT COUNT(*) FROM local_file_names").fetchone()[0], 0)
+        target.close()
+
+    def test_not_a_changeset_file(self):
+        with open(self.path, "wb") as file:
+            file.write(b"not gzip")
+        with self.assertRaises(ChangesetError):
+            apply_changesets(self.source, self.path)
+        with gzip.open(self.path, "wt") as file:
+            file.write(json.dumps({"version": changesets.CHANGESET_VERSION + 1, "changesets": 0}) + "\n")
+        with self.assertRaises(ChangesetError):
+            apply_changesets(self.source, self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+from src.data_processing import Scraping, chunked_ingest, database
+from testing.utility_testing.batch_upload_test import write_csv
+
+TEST_SETTINGS = {"allow_CRKN": "True", "institution": "Test University", "strip_title_articles": "True",
+                 "ingest_chunk_rows": 1000, "ingest_memory_budget_mb": 0.01}
+
+
+class TestChunkedIngest(unittest.TestCase):
+    def setUp(self):
+        self.patcher = patch("src.utility.settings_manager.Settings.get_setting", side_effect=TEST_SETTINGS.get)
+        self.patcher.start()
+        self.directory = tempfile.TemporaryDirectory()
+        self.connection = sqlite3.connect(":memory:")
+        database.create_file_name_tables(self.connection)
+
+    def tearDown(self):
+        self.connection.close()
+        self.directory.cleanup()
+        self.patcher.stop()
+
+    def tables(self):
+        return [row[0] for row in self.connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+
+    def test_should_stream(self):
+        self.assertTrue(chunked_ingest.should_stream(write_csv(self.directory.name, "large.csv", rows=100)))
+        self.assertFalse(chunked_ingest.should_stream(os.path.join(self.directory.name, "large.xlsx")))
+
+    def test_same_table_as_whole_file(self):
+        path = write_csv(self.directory.name, "large.csv", rows=2500)
+        Scraping.upload_to_database(Scraping.file_to_dataframe_csv("large.csv", path), "whole", self.connection)
+        chunks = []
+        valid, rows = chunked_ingest.load_file_in_chunks("large.csv", path, "chunked", self.connection, chunks.append)
+        self.assertTrue(valid)
+        self.assertEqual(rows, 2500)
+        self.assertEqual(chunks, [1000, 1000, 500])
+
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(whole)")]
+        self.assertEqual([row[1] for row in self.connection.execute("PRAGMA table_info(chunked)")], columns)
+        self.assertEqual(self.connection.execute("SELECT * FROM chunked").fetchall(),
+                         self.connection.execute("SELECT * FROM whole").fetchall())
+        self.assertEqual(self.connection.execute("SELECT COUNT(*) FROM title_keys WHERE file_table = 'chunked'")
+                         .fetchone()[0], 2500)
+        self.assertNotIn("staging_chunked", self.tables())
+
+    def test_bad_row_keeps_existing_table(self):
+        chunked_ingest.load_file_in_chunks("data.csv", write_csv(self.directory.name, "data.csv", rows=10),
+                                           "data", self.connection)
+        path = write_csv(self.directory.name, "data.csv", rows=2500)
+        # Blank title in the last chunk
+        with open(path, "a") as file:
+            file.write(",Publisher,2020,9780000000000,1,AG1,Collection,2024-01-01,Y\n")
+
+        valid, _ = chunked_ingest.load_file_in_chunks("data.csv", path, "data", self.connection)
+        self.assertEqual(valid, "Missing title data.")
+        self.assertEqual(self.connection.execute("SELECT COUNT(*) FROM data").fetchone()[0], 10)
+        self.assertNotIn("staging_data", self.tables())
+
+    def test_validate_without_platform(self):
+        path = write_csv(self.directory.name, "data.csv")
+        with open(path) as file:
+            lines = file.readlines()
+        with open(path, "w") as file:
+            file.writelines(["," + lines[0].split(",", 1)[1]] + lines[1:])
+        valid, rows, headers = chunked_ingest.validate_file_in_chunks("data.csv", path)
+        self.assertNotEqual(valid, True)
+        self.assertEqual(rows, 0)
+
+    def test_validate_reads_headers(self):
+        valid, rows, headers = chunked_ingest.validate_file_in_chunks(
+            "data.csv", write_csv(self.directory.name, "data.csv", rows=1500))
+        self.assertTrue(valid)
+        self.assertEqual(rows, 1500)
+        self.assertEqual(headers[0], "Title")
+        self.assertEqual(headers[-3:], ["Test University", "Platform", "File_Name"])
@@ -0,0 +1,87 @@
+import sqlite3
+import unittest
+from unittest.mock import patch
+import pandas as pd
+from src.data_processing import database, Scraping
+from src.data_processing.facets import FacetFilter
+
+TEST_SETTINGS = {"allow_CRKN": "True", "institution": "Test University", "strip_title_articles": "True"}
+
+COLUMN_LABELS = ["Access", "File_Name", "Platform", "Title", "Publisher", "Platform_YOP", "Platform_eISBN", "OCN",
+                 "agreement_code", "collection_name", "title_metadata_last_modified"]
+
+
+def make_file_df(rows, platform):
+    """Build a dataframe the way Scraping.file_to_dataframe_* leaves it, from (Title, Publisher, YOP) rows."""
+    df = pd.DataFrame([[title, publisher, yop, f"978{i:010d}", str(i), "AG1", "Collection", "2024-01-01", "Y"]
+                       for i, (title, publisher, yop) in enumerate(rows)],
+                      columns=["Title", "Publisher", "Platform_YOP", "Platform_eISBN", "OCN", "agreement_code",
+                               "collection_name", "title_metadata_last_modified", "Test University"])
+    df["Platform"] = platform
+    df["File_Name"] = f"{platform}.xlsx"
+    return df
+
+
+def make_result(platform, publisher, year, collection="Collection"):
+    return ("Y", f"{platform}.xlsx", platform, "Title", publisher, year, "978", "1", "AG1", collection, "2024-01-01")
+
+
+class TestFacetCounts(unittest.TestCase):
+    def setUp(self):
+        self.patcher = patch("src.utility.settings_manager.Settings.get_setting", side_effect=TEST_SETTINGS.get)
+        self.patcher.start()
+        self.connection = sqlite3.connect(":memory:")
+        database.create_file_name_tables(self.connection)
+        self.add_file("Alpha", [("A", "Routledge", "2010"), ("B", "Routledge", "2011"), ("C", "Brill", "2010")])
+        self.add_file("Beta", [("D", "Routledge", "2010")])
+
+    def tearDown(self):
+        self.connection.close()
+        self.patcher.stop()
+
+    def add_file(self, table, rows):
+        Scraping.upload_to_database(make_file_df(rows, table), table, self.connection)
+        Scraping.update_tables([table, "2024_01_01"], "CRKN", self.connection, "INSERT INTO")
+
+    def test_counts_built_at_ingest(self):
+        self.assertEqual(database.get_facet_counts(self.connection, "Publisher"), {"Routledge": 3, "Brill": 1})
+        self.assertEqual(database.get_facet_counts(self.connection, "Platform"), {"Alpha": 3, "Beta": 1})
+        self.assertEqual(database.get_facet_counts(self.connection, "Platform_YOP"), {"2010": 3, "2011": 1})
+
+    def test_counts_replaced_and_removed(self):
+        self.add_file("Beta", [("D", "Brill", "2012"), ("E", "Brill", "2012")])
+        self.assertEqual(database.get_facet_counts(self.connection, "Publisher"), {"Routledge": 2, "Brill": 3})
+        Scraping.update_tables(["Alpha"], "CRKN", self.connection, "DELETE")
+        self.assertEqual(database.get_facet_counts(self.connection, "Publisher"), {"Brill": 2})
+
+    def test_counts_built_on_upgrade(self):
+        self.connection.execute("DROP TABLE facet_counts")
+        database.create_facet_table(self.connection)
+        self.assertEqual(database.get_facet_counts(self.connection, "Platform"), {"Alpha": 3, "Beta": 1})
+
+
+class TestFacetFilter(unittest.TestCase):
+    def setUp(self):
+        self.results = [make_result("Alpha", "Routledge", "2010"), make_result("Alpha", "Brill", "2011"),
+                        make_result("Beta", "Routledge", "2011"), make_result("Beta", "Brill", "2012", None)]
+        self.facets = FacetFilter(self.results, COLUMN_LABELS)
+
+    def test_no_selection(self):
+        self.assertEqual(self.facets.filtered_results(), self.results)
+        self.assertEqual(self.facets.counts()["collection_name"], {"Collection": 3, None: 1})
+
+    def test_or_within_and_across_facets(self):
+        self.facets.set_selected("Platform_YOP", "2010", True)
+        self.facets.set_selected("Platform_YOP", "2011", True)
+        self.facets.set_selected("Publisher", "Routledge", True)
+        self.assertEqual(self.facets.filtered_results(), [self.results[0], self.results[2]])
+        self.facets.set_selected("Publisher", "Routledge", False)
+        self.assertEqual(len(self.facets.filtered_results()), 3)
+        self.facets.clear()
+        self.assertEqual(len(self.facets.filtered_results()), 4)
+
+    def test_counts_ignore_own_selection(self):
+        self.facets.set_selected("Platform", "Alpha", True)
+        counts = self.facets.counts()
+        self.assertEqual(counts["Platform"], {"Alpha": 2, "Beta": 2})
+        self.assertEqual(counts["Publisher"], {"Routledge": 1, "Brill": 1})
@@ -0,0 +1,84 @@
+import os
+import tempfile
+import unittest
+import openpyxl
+from unittest.mock import patch
+from src.data_processing import Scraping
+from src.utility import batch_upload
+from testing.utility_testing.batch_upload_test import HEADERS, write_csv
+
+
+class TestFileHeader(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_xlsx(self, name, header, platform="Test Platform", sheet="PA-Rights"):
+        path = os.path.join(self.directory.name, name)
+        workbook = openpyxl.Workbook()
+        worksheet = workbook.active
+        worksheet.title = sheet
+        worksheet.append([platform])
+        worksheet.append([])
+        worksheet.append(header)
+        worksheet.append(["Title"] * len(header))
+        workbook.save(path)
+        return path
+
+    def test_valid_csv_header(self):
+        path = write_csv(self.directory.name, "data.csv", ("Test University", "Other University"))
+        header = Scraping.read_file_header("data.csv", path)
+        self.assertEqual(header.columns.to_list(), HEADERS.split(",") + ["Test University", "Other University",
+                                                                         "Platform", "File_Name"])
+        self.assertTrue(Scraping.check_file_header("data.csv", path))
+
+    def test_header_does_not_read_data(self):
+        path = write_csv(self.directory.name, "data.csv", rows=3)
+        # A data row that would make a full parse fail
+        with open(path, "a") as file:
+            file.write("a,b,c,d,e,f,g,h,i,j,k,l,m\n")
+        self.assertTrue(Scraping.check_file_header("data.csv", path))
+        self.assertEqual(Scraping.file_to_dataframe_csv("data.csv", path), "PA-Rights")
+
+    def test_wrong_fixed_header(self):
+        path = write_csv(self.directory.name, "data.csv")
+        with open(path) as file:
+            text = file.read()
+        with open(path, "w") as file:
+            file.write(text.replace("Publisher,Platform_YOP", "Platform_YOP,Publisher", 1))
+        self.assertEqual(Scraping.check_file_header("data.csv", path),
+                         "Missing or incorrect header column 'Publisher' in column 2 (A=1).")
+
+    def test_duplicate_institution(self):
+        path = write_csv(self.directory.name, "data.csv", ("Test University", "test university"))
+        self.assertEqual(Scraping.check_file_header("data.csv", path),
+                         "Duplicate column 'test university' in the header row.")
+
+    def test_no_platform(self):
+        path = write_csv(self.directory.name, "data.tsv")
+        with open(path) as file:
+            lines = file.read().replace(",", "\t").split("\n")
+        with open(path, "w") as file:
+            file.write("\n".join(["\t" * 8] + lines[1:]))
+        self.assertEqual(Scraping.check_file_header("data.tsv", path), "No platform listed in cell A1.")
+
+    def test_excel_header(self):
+        path = self.write_xlsx("data.xlsx", HEADERS.split(",") + ["Test University", None])
+        self.assertTrue(Scraping.check_file_header("data.xlsx", path))
+        self.assertEqual(Scraping.read_file_header("data.xlsx", path).columns.to_list()[-3:],
+                         ["Test University", "Platform", "File_Name"])
+        self.assertEqual(Scraping.check_file_header("data.xlsx", self.write_xlsx("sheet.xlsx", HEADERS.split(","),
+                                                                                 sheet="Other")),
+                         "The 'PA-Rights' sheet does not exist.")
+        self.assertEqual(Scraping.check_file_header("data.xlsx", self.write_xlsx("blank.xlsx", HEADERS.split(","),
+                                                                                 platform=None)),
+                         "No platform listed in cell A1.")
+
+    def test_bad_header_skips_full_parse(self):
+        path = write_csv(self.directory.name, "data.csv", ("Test University", "Test University"))
+        with patch("src.utility.batch_upload.file_to_df") as file_to_df:
+            result = batch_upload.parse_file(path)
+        file_to_df.assert_not_called()
+        self.assertEqual(result[3], batch_upload.INVALID_FORMAT)
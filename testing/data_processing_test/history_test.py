@@ -0,0 +1,134 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+from src.data_processing import database, Scraping, changesets, history
+from src.data_processing.changesets import apply_changesets, export_changesets
+from testing.utility_testing.batch_upload_test import write_csv
+
+TEST_SETTINGS = {"allow_CRKN": "True", "institution": "Test University", "strip_title_articles": "True"}
+
+
+class TestHistory(unittest.TestCase):
+    def setUp(self):
+        self.patcher = patch("src.utility.settings_manager.Settings.get_setting", side_effect=TEST_SETTINGS.get)
+        self.patcher.start()
+        self.directory = tempfile.TemporaryDirectory()
+        self.connection = self.database()
+        self.times = iter(["2024-01-10T09:00:00", "2024-02-10T09:00:00", "2024-03-10T09:00:00"])
+        self.time_patcher = patch("src.data_processing.changesets.new_changeset", side_effect=self.new_changeset)
+        self.time_patcher.start()
+
+    def tearDown(self):
+        self.connection.close()
+        self.directory.cleanup()
+        self.time_patcher.stop()
+        self.patcher.stop()
+
+    def database(self):
+        connection = sqlite3.connect(":memory:")
+        database.create_file_name_tables(connection)
+        return connection
+
+    def new_changeset(self, table_name, method, file_name, file_date, operation):
+        return {"id": f"{table_name}-{file_date}-{operation}", "created": next(self.times),
+                "file_table": table_name, "method": method, "file_name": file_name, "file_date": file_date,
+                "operation": operation}
+
+    def load(self, rows=5, edit=None, date="2024-01-01", operation="INSERT INTO"):
+        path = write_csv(self.directory.name, "crkn_a.csv", ("Test University", "Other University"), rows)
+        if edit:
+            with open(path) as file:
+                lines = file.readlines()
+            with open(path, "w") as file:
+                file.writelines(edit(lines))
+        Scraping.upload_to_database(Scraping.file_to_dataframe_csv("crkn_a.csv", path), "crkn_a", self.connection)
+        Scraping.update_tables(["crkn_a", date], "CRKN", self.connection, operation)
+
+    def history_rows(self, connection=None):
+        return (connection or self.connection).execute("SELECT COUNT(*) FROM title_history;").fetchone()[0]
+
+    def test_access_as_of(self):
+        self.load()
+        # Title 2 loses access for Test University, Title 0 is removed
+        self.load(rows=5, date="2024-02-01", operation="UPDATE", edit=lambda lines: [
+            line.replace(",Y,Y", ",N,Y") if line.startswith("Title 2,") else line
+            for line in lines if not line.startswith("Title 0,")])
+        self.assertEqual(history.access_as_of(self.connection, "9780000000002", "Test University", "2024-01-31"),
+                         {"crkn_a": "Y"})
+        self.assertEqual(history.access_as_of(self.connection, "9780000000002", "Test University", "2024-02-10"),
+                         {"crkn_a": "N"})
+        self.assertEqual(history.access_as_of(self.connection, "9780000000002", "Other University"),
+                         {"crkn_a": "Y"})
+        # Found by ISBN-10 or OCN as well
+        self.assertEqual(history.access_as_of(self.connection, "0000000000", "Test University", "2024-01-31"),
+                         {"crkn_a": "Y"})
+        self.assertEqual(history.access_as_of(self.connection, "0", "Test University", "2024-01-31"),
+                         {"crkn_a": "Y"})
+        self.assertEqual(history.access_as_of(self.connection, "9780000000000", "Test University"), {})
+        self.assertEqual(history.access_as_of(self.connection, "9780000000002", "Test University", "2023-12-31"), {})
+        self.assertEqual(len(history.table_as_of(self.connection, "crkn_a", "2024-01-31")), 5)
+        self.assertEqual(len(history.table_as_of(self.connection, "crkn_a")), 4)
+
+        Scraping.update_tables(["crkn_a"], "CRKN", self.connection, "DELETE")
+        self.assertEqual(history.table_as_of(self.connection, "crkn_a"), [])
+        self.assertEqual(len(history.table_as_of(self.connection, "crkn_a", "2024-02-10")), 4)
+
+    def test_only_changes_add_versions(self):
+        self.load(rows=50)
+        self.assertEqual(self.history_rows(), 50)
+        # The same file again adds nothing, one row changed adds one version
+        self.load(rows=50, date="2024-02-01", operation="UPDATE")
+        self.assertEqual(self.history_rows(), 50)
+        self.load(rows=50, date="2024-03-01", operation="UPDATE", edit=lambda lines: [
+            line.replace(",Y,Y", ",N,Y") if line.startswith("Title 7,") else line for line in lines])
+        self.assertEqual(self.history_rows(), 51)
+
+    def test_changed_rows_only_keep_changes(self):
+        self.load()
+        self.load(rows=5, date="2024-02-01", operation="UPDATE", edit=lambda lines: [
+            line.replace(",Y,Y", ",N,Y") if line.startswith("Title 2,") else line for line in lines])
+        self.assertEqual(self.connection.execute("SELECT row_values FROM title_history ORDER BY history_id DESC "
+                                                 "LIMIT 1").fetchone()[0], '{"Test University":"N"}')
+        version, = history.versions_as_of(self.connection, "9780000000002", "2024-02-10")
+        self.assertEqual((version["values"]["Title"], version["values"]["Test University"]), ("Title 2", "N"))
+        # The versions put back together give the rows of the table
+        cursor = self.connection.execute("SELECT * FROM crkn_a")
+        names = [column[0] for column in cursor.description]
+        self.assertEqual(sorted(history.table_as_of(self.connection, "crkn_a"), key=repr),
+                         sorted((dict(zip(names, row)) for row in cursor), key=repr))
+
+    def test_first_layout_versions(self):
+        # Versions recorded before columns_id, with every column
+        self.connection.execute("""INSERT INTO title_history (file_table, row_key, isbn, valid_from, row_values)
+                                   VALUES ('crkn_old', 'id:9780000000009|#1', '9780000000009', '2023-01-01T00:00:00',
+                                   '{"Title": "Old Title", "Test University": "Y"}');""")
+        self.assertEqual(history.access_as_of(self.connection, "9780000000009", "Test University"), {"crkn_old": "Y"})
+        self.assertEqual(history.table_as_of(self.connection, "crkn_old"),
+                         [{"Title": "Old Title", "Test University": "Y"}])
+
+    def test_queries_use_indexes(self):
+        self.load()
+        for sql, parameters in [
+                (f"SELECT * FROM title_history WHERE isbn = ? AND {history.valid_at()}", ("9780000000002", "x", "x")),
+                (f"SELECT * FROM title_history WHERE ocn = ? AND {history.valid_at()}", ("2", "x", "x")),
+                (f"SELECT * FROM title_history WHERE file_table = ? AND {history.valid_at()}", ("crkn_a", "x", "x"))]:
+            plan = " ".join(row[-1] for row in self.connection.execute(f"EXPLAIN QUERY PLAN {sql}", parameters))
+            self.assertIn("USING INDEX title_history_", plan)
+
+    def test_changesets_carry_history(self):
+        self.load()
+        self.load(rows=6, date="2024-02-01", operation="UPDATE")
+        path = os.path.join(self.directory.name, "changes.gz")
+        export_changesets(self.connection, path)
+        target = self.database()
+        apply_changesets(target, path)
+        sql = "SELECT file_table, row_key, isbn, ocn, valid_from, valid_to, row_values FROM title_history ORDER BY 2, 5"
+        self.assertEqual(target.execute(sql).fetchall(), self.connection.execute(sql).fetchall())
+        self.assertTrue(changesets.table_exists(target, "crkn_a"))
+        target.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
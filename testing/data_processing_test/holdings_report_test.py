@@ -0,0 +1,91 @@
+import csv
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+from src.data_processing import database
+from src.data_processing.holdings_report import HoldingsReport, REPORT_COLUMNS, identifier_key, totals_path
+from src.data_processing.normalization import canonical_isbn
+from src.utility.streaming_export import write_rows
+
+TEST_SETTINGS = {"allow_CRKN": "True", "institution": "Test University"}
+
+COLUMNS = ["Title", "Publisher", "Platform_YOP", "Platform_eISBN", "OCN", "agreement_code", "collection_name",
+           "title_metadata_last_modified"]
+
+
+class TestHoldingsReport(unittest.TestCase):
+    def setUp(self):
+        self.patcher = patch("src.utility.settings_manager.Settings.get_setting", side_effect=TEST_SETTINGS.get)
+        self.patcher.start()
+        self.connection = sqlite3.connect(":memory:")
+        database.create_file_name_tables(self.connection)
+
+    def tearDown(self):
+        self.connection.close()
+        self.patcher.stop()
+
+    def add_table(self, table, institutions, rows, source="CRKN"):
+        """
+        :param rows: list of (title, isbn, ocn, platform, access of each institution...)
+        """
+        columns = ", ".join(f"[{column}]" for column in COLUMNS + institutions + ["Platform", "File_Name"])
+        self.connection.execute(f"CREATE TABLE [{table}] ({columns})")
+        for title, isbn, ocn, platform, *access in rows:
+            self.connection.execute(f"INSERT INTO [{table}] VALUES ({', '.join('?' * (len(COLUMNS) + len(institutions) + 2))})",
+                                    [title, "Publisher", 2020, isbn, ocn, "AG", "Collection", "2024-01-01", *access,
+                                     platform, table])
+        if source == "CRKN":
+            self.connection.execute("INSERT INTO CRKN_file_names VALUES (?, '2024-01-01')", (table,))
+        else:
+            self.connection.execute("INSERT INTO local_file_names VALUES (?, '2024-01-01')", (table[len("local_"):],))
+
+    def test_canonical_isbn(self):
+        self.assertEqual(canonical_isbn("0-306-40615-2"), "9780306406157")
+        self.assertEqual(canonical_isbn(9780306406157.0), "9780306406157")
+        self.assertEqual(canonical_isbn(None), "")
+
+    def test_identifier_key(self):
+        row = dict.fromkeys(REPORT_COLUMNS)
+        row.update(Title="The Book", Publisher="Publisher", OCN=123)
+        self.assertEqual(identifier_key(list(row.values())), "ocn:123")
+        row["OCN"] = None
+        self.assertEqual(identifier_key(list(row.values())), "title:book|publisher")
+        row["Title"] = None
+        self.assertIsNone(identifier_key(list(row.values())))
+
+    def test_rows_with_access_once(self):
+        self.add_table("crkn_a", ["Test University", "Other University"], [
+            ("Book 1", "9780306406157", 1, "Platform A", "Y", "N"),
+            ("Book 2", "9780000000002", 2, "Platform A", "N", "Y"),
+            ("Book 3", None, 3, "Platform B", "Y", "Y"),
+        ])
+        self.add_table("crkn_b", ["Other University"], [("Book 4", "9780000000004", 4, "Platform B", "Y")])
+        self.add_table("local_c", ["Test University"], [
+            ("Book 1", "0-306-40615-2", 1, "Platform C", "Y"),
+            ("Book 3", None, 3.0, "Platform C", "Y"),
+            ("Book 5", None, None, "Platform C", "Y"),
+        ], "local")
+
+        report = HoldingsReport("Test University", self.connection)
+        self.assertEqual(report.count(), 5)
+        rows = list(report.rows())
+        self.assertEqual([(row[0], row[-1]) for row in rows],
+                         [("Book 1", "crkn_a"), ("Book 3", "crkn_a"), ("Book 5", "local_c")])
+        self.assertEqual(report.duplicates, 2)
+        self.assertEqual(report.tables, 2)
+        self.assertEqual(report.totals(), [("Platform A", 1), ("Platform B", 1), ("Platform C", 1)])
+
+    def test_written_as_streamed(self):
+        self.add_table("crkn_a", ["Test University"],
+                       [(f"Book {number}", f"978000000{number:04d}", number, f"Platform {number % 3}", "Y")
+                        for number in range(2500)])
+        report = HoldingsReport("Test University", self.connection)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "holdings.csv")
+            self.assertEqual(write_rows(report.rows(), REPORT_COLUMNS, path), 2500)
+            self.assertEqual(totals_path(path), os.path.join(directory, "holdings_totals.csv"))
+            with open(path, newline="") as file:
+                self.assertEqual(next(csv.reader(file)), REPORT_COLUMNS)
+        self.assertEqual(dict(report.totals()), {"Platform 0": 834, "Platform 1": 833, "Platform 2": 833})
@@ -0,0 +1,73 @@
+import sqlite3
+import unittest
+from unittest.mock import patch
+from src.data_processing import database
+from src.data_processing.institutions import InstitutionRegistry, CRKN, LOCAL
+
+TEST_SETTINGS = {"allow_CRKN": "True", "CRKN_institutions": ["Univ A", "Univ B"], "local_institutions": ["College C"]}
+
+
+class TestInstitutionRegistry(unittest.TestCase):
+    def setUp(self):
+        self.patcher = patch("src.utility.settings_manager.Settings.get_setting", side_effect=TEST_SETTINGS.get)
+        self.patcher.start()
+        self.connection = sqlite3.connect(":memory:")
+        database.create_file_name_tables(self.connection)
+        self.registry = InstitutionRegistry()
+        self.registry.load(self.connection)
+
+    def tearDown(self):
+        self.connection.close()
+        self.patcher.stop()
+
+    def ids(self):
+        return dict(self.connection.execute("SELECT name, institution_id FROM institutions").fetchall())
+
+    def test_migrated_from_settings(self):
+        self.assertEqual(self.registry.names(), ["College C", "Univ A", "Univ B"])
+        self.assertEqual(self.registry.names(CRKN), ["Univ A", "Univ B"])
+
+    def test_bulk_add_and_remove(self):
+        self.assertEqual(self.registry.add(["College D", "Univ A", " ", "College E", "College D"], LOCAL,
+                                           self.connection), ["College D", "College E"])
+        self.assertEqual(self.registry.names(LOCAL), ["College C", "College D", "College E"])
+        self.registry.remove(["College C", "College E", "Nowhere"], self.connection)
+        self.assertEqual(self.registry.names(LOCAL), ["College D"])
+        # Reading the tables again gives the same
+        other = InstitutionRegistry()
+        other.load(self.connection)
+        self.assertEqual(other.names(), ["College D", "Univ A", "Univ B"])
+
+    def test_aliases(self):
+        self.assertTrue(self.registry.add_alias("University A", "Univ A", self.connection))
+        self.assertFalse(self.registry.add_alias("Other", "Nowhere", self.connection))
+        self.assertEqual(self.registry.resolve("University A"), "Univ A")
+        self.assertEqual(self.registry.unknown(["University A", "Univ B", "College Z"]), ["College Z"])
+
+    def test_CRKN_update_keeps_ids(self):
+        ids = self.ids()
+        self.registry.add_alias("University B", "Univ B", self.connection)
+        self.registry.set_CRKN_institutions(["Univ B", "College C", "Univ F", "Univ B"], self.connection)
+        self.assertEqual(self.registry.names(CRKN), ["Univ B", "College C", "Univ F"])
+        self.assertEqual(self.registry.names(LOCAL), [])
+        self.assertFalse(self.registry.is_known("Univ A"))
+        new_ids = self.ids()
+        self.assertEqual(new_ids["Univ B"], ids["Univ B"])
+        self.assertEqual(new_ids["College C"], ids["College C"])
+        self.assertEqual(self.registry.resolve("University B"), "Univ B")
+
+    def test_CRKN_update_keeps_institutions_used_locally(self):
+        self.registry.set_CRKN_institutions(["Univ A", "Univ B", "College C"], self.connection)
+        self.connection.execute("INSERT INTO local_file_names (file_name, file_date) VALUES ('mine.csv', '');")
+        self.connection.execute("""CREATE TABLE [local_mine.csv] (Title, Publisher, Platform_YOP, Platform_eISBN,
+                                   OCN, agreement_code, collection_name, title_metadata_last_modified,
+                                   [College C], [Univ A], Platform, File_Name)""")
+        self.registry.set_CRKN_institutions(["Univ B"], self.connection)
+        self.assertEqual(self.registry.names(CRKN), ["Univ B"])
+        self.assertEqual(self.registry.names(LOCAL), ["Univ A", "College C"])
+
+    def test_institution_columns(self):
+        self.connection.execute("""CREATE TABLE crkn_file (Title, Publisher, Platform_YOP, Platform_eISBN, OCN,
+                                   agreement_code, collection_name, title_metadata_last_modified, [Univ A], [Univ G],
+                                   Platform, File_Name)""")
+        self.assertEqual(database.get_institution_columns(self.connection, "crkn_file"), ["Univ A", "Univ G"])
@@ -0,0 +1,122 @@
+import sqlite3
+import unittest
+from unittest.mock import patch
+import pandas as pd
+from src.data_processing import database, Scraping
+from src.data_processing.normalization import normalize_title, trigrams, trigram_similarity
+
+TEST_SETTINGS = {"allow_CRKN": "True", "institution": "Test University", "strip_title_articles": "True",
+                 "fuzzy_title_threshold": 0.4}
+
+
+def make_file_df(titles, platform="Test Platform", file_name="test.xlsx"):
+    """Build a dataframe the way Scraping.file_to_dataframe_* leaves it."""
+    rows = [[title, "Publisher", "2020", f"97800000000{i:02d}", str(1000 + i), "AG1", "Collection", "2024-01-01", "Y"]
+            for i, title in enumerate(titles)]
+    df = pd.DataFrame(rows, columns=["Title", "Publisher", "Platform_YOP", "Platform_eISBN", "OCN", "agreement_code",
+                                     "collection_name", "title_metadata_last_modified", "Test University"])
+    df["Platform"] = platform
+    df["File_Name"] = file_name
+    return df
+
+
+class TestNormalizeTitle(unittest.TestCase):
+    def test_accents_and_case(self):
+        self.assertEqual(normalize_title("Éducation Québécoise"), normalize_title("education quebecoise"))
+
+    def test_punctuation_and_whitespace(self):
+        self.assertEqual(normalize_title("  Bread,   and -- Circuses!  "), "bread and circuses")
+
+    def test_leading_articles(self):
+        self.assertEqual(normalize_title("The Art of War"), "art of war")
+        self.assertEqual(normalize_title("L'Œuvre au noir"), "oeuvre au noir")
+        self.assertEqual(normalize_title("Les Misérables", strip_articles=False), "les miserables")
+        # A title that is only an article keeps it
+        self.assertEqual(normalize_title("The"), "the")
+
+    def test_missing_title(self):
+        self.assertEqual(normalize_title(None), "")
+        self.assertEqual(normalize_title(float("nan")), "")
+
+    def test_trigram_similarity(self):
+        self.assertEqual(trigrams("abc"), {" ab", "abc", "bc "})
+        self.assertEqual(trigram_similarity(trigrams("war"), trigrams("war")), 1.0)
+        self.assertEqual(trigram_similarity(trigrams("war"), trigrams("peace")), 0.0)
+
+
+class TestTitleKeySearch(unittest.TestCase):
+    def setUp(self):
+        self.patcher = patch("src.utility.settings_manager.Settings.get_setting", side_effect=TEST_SETTINGS.get)
+        self.patcher.start()
+        self.connection = sqlite3.connect(":memory:")
+        database.create_file_name_tables(self.connection)
+        Scraping.upload_to_database(make_file_df(["Les Misérables", "The Art of War", "Artful Dodging"]),
+                                    "TestPlatform", self.connection)
+        Scraping.update_tables(["TestPlatform", "2024_01_01"], "CRKN", self.connection, "INSERT INTO")
+        self.query = "SELECT Title FROM table_name WHERE "
+
+    def tearDown(self):
+        self.connection.close()
+        self.patcher.stop()
+
+    def search(self, term):
+        return [row[0] for row in database.search_database(self.connection, self.query, [term], ["Title"])]
+
+    def test_exact_match_ignores_accents_and_articles(self):
+        self.assertEqual(self.search("miserables"), ["Les Misérables"])
+        self.assertEqual(self.search("ART OF WAR"), ["The Art of War"])
+
+    def test_prefix_match(self):
+        self.assertEqual(sorted(self.search("art*")), ["Artful Dodging", "The Art of War"])
+        self.assertEqual(self.search("art *"), ["The Art of War"])
+
+    def test_article_prefix(self):
+        # The article is stripped from the keys, not from the titles starting with it
+        self.assertEqual(self.search("The*"), ["The Art of War"])
+        self.assertEqual(self.search("les *"), ["Les Misérables"])
+        self.assertEqual(sorted(self.search("The Art*")), ["Artful Dodging", "The Art of War"])
+
+    def test_keys_rebuilt_when_setting_changes(self):
+        settings = dict(TEST_SETTINGS, strip_title_articles="False")
+        with patch("src.utility.settings_manager.Settings.get_setting", side_effect=settings.get):
+            version = self.connection.execute("SELECT version FROM data_version").fetchone()[0]
+            self.assertTrue(database.update_title_keys(self.connection))
+            self.assertFalse(database.update_title_keys(self.connection))
+            self.assertGreater(self.connection.execute("SELECT version FROM data_version").fetchone()[0], version)
+            self.assertEqual(self.search("the art*"), ["The Art of War"])
+            self.assertEqual(self.search("art*"), ["Artful Dodging"])
+
+    def test_keys_removed_with_table(self):
+        Scraping.update_tables(["TestPlatform"], "CRKN", self.connection, "DELETE")
+        self.assertEqual(self.connection.execute("SELECT COUNT(*) FROM title_keys").fetchone()[0], 0)
+
+    def test_existing_tables_indexed_on_upgrade(self):
+        self.connection.execute("DROP TABLE title_keys")
+        database.create_title_key_table(self.connection)
+        self.assertEqual(self.search("les misérables"), ["Les Misérables"])
+
+    def test_fuzzy_match_with_typos(self):
+        results = database.search_database(self.connection, self.query, ["les miserabels"], ["Fuzzy_Title"])
+        self.assertEqual([row[0] for row in results], ["Les Misérables"])
+
+    def test_fuzzy_results_ranked_by_similarity(self):
+        Scraping.upload_to_database(make_file_df(["Art of Wars"]), "OtherPlatform", self.connection)
+        Scraping.update_tables(["OtherPlatform", "2024_01_01"], "CRKN", self.connection, "INSERT INTO")
+        results = [row[0] for row in
+                   database.search_database(self.connection, self.query, ["art of warr"], ["Fuzzy_Title"])]
+        self.assertEqual(results[0], "The Art of War")
+        self.assertIn("Art of Wars", results)
+
+    def test_fuzzy_threshold(self):
+        self.assertEqual(database.find_similar_title_keys(self.connection, "artful", threshold=0.9), {})
+        self.assertIn("artful dodging", database.find_similar_title_keys(self.connection, "artful dodgng"))
+
+    def test_trigrams_removed_with_last_table(self):
+        Scraping.upload_to_database(make_file_df(["The Art of War"]), "OtherPlatform", self.connection)
+        Scraping.update_tables(["TestPlatform"], "CRKN", self.connection, "DELETE")
+        self.assertEqual(self.connection.execute("SELECT title_key FROM title_key_ids").fetchall(), [("art of war",)])
+        self.assertEqual(self.connection.execute("SELECT COUNT(*) FROM title_trigrams").fetchone()[0], 1)
+
+    def test_fuzzy_search_without_trigram_index(self):
+        with patch("src.data_processing.database.has_trigram_index", return_value=False):
+            self.assertIn("miserables", database.find_similar_title_keys(self.connection, "les miserabels"))
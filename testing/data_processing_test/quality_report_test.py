@@ -0,0 +1,74 @@
+import time
+import unittest
+import pandas as pd
+from src.data_processing import quality_report
+from src.data_processing.quality_report import QualityReport, valid_isbns
+
+HEADERS = ["Title", "Publisher", "Platform_YOP", "Platform_eISBN", "OCN", "agreement_code", "collection_name",
+           "title_metadata_last_modified", "Test University", "Other University", "Platform", "File_Name"]
+
+
+def file_df(rows):
+    return pd.DataFrame([row + ["Test Platform", "data.csv"] for row in rows], columns=HEADERS)
+
+
+class TestQualityReport(unittest.TestCase):
+    def test_every_problem_with_coordinates(self):
+        report = QualityReport("data.csv")
+        report.check(file_df([
+            ["Title A", "P", "2020", "9780306406157", "1", "A", "C", "2024-01-01", "Y", "N"],
+            [None, "P", "20x0", "9780306406158", "2", "A", "C", "not a date", "y", None],
+            ["Title C", "P", "2021", "978-0-306-40615-7", "1", "A", "C", "Jan 3 2021", "Y", "N"],
+        ]))
+        issues = report.issues()
+        self.assertEqual(issues[["Row", "Column", "Issue"]].values.tolist(), [
+            [5, "A", quality_report.MISSING_TITLE],
+            [5, "C", quality_report.BAD_YOP],
+            [5, "D", quality_report.BAD_ISBN],
+            [5, "H", quality_report.BAD_DATE],
+            [5, "I", quality_report.BAD_ACCESS],
+            [5, "J", quality_report.MISSING_ACCESS],
+            [6, "D", quality_report.DUPLICATE_IDENTIFIER],
+            [6, "E", quality_report.DUPLICATE_IDENTIFIER],
+        ])
+        self.assertEqual(issues.loc[6, "Value"], "978-0-306-40615-7 (first used on row 4)")
+        self.assertEqual(issues.loc[7, "Value"], "1 (first used on row 4)")
+        self.assertTrue(report.has_errors())
+        self.assertEqual(report.counts()[(quality_report.WARNING, quality_report.DUPLICATE_IDENTIFIER)], 2)
+
+    def test_duplicates_across_chunks(self):
+        report = QualityReport("data.csv")
+        first = file_df([["Title A", "P", "2020", "9780306406157", "1", "A", "C", "2024-01-01", "Y", "N"]])
+        second = file_df([["Title B", "P", "2020", "0306406152", "1", "A", "C", "2024-01-01", "Y", "N"]])
+        second.index = [1]
+        report.check(first)
+        report.check(second)
+        self.assertEqual(report.issues()[["Row", "Column", "Value"]].values.tolist(),
+                         [[5, "E", "1 (first used on row 4)"]])
+        self.assertFalse(report.has_errors())
+
+    def test_isbn_check_digits(self):
+        self.assertEqual(valid_isbns(pd.Series(["9780306406157", "978 0 306 40615 7", "0306406152", "080442957X",
+                                                "9780306406158", "978030640615X", "abc", ""])).to_list(),
+                         [True, True, True, True, False, False, False, False])
+
+    def test_excel_numbers(self):
+        df = file_df([["Title A", "P", 2020.0, 9780306406157.0, 1.0, "A", "C", "2024-01-01", "Y", "N"]])
+        df["Platform_eISBN"] = df["Platform_eISBN"].astype(float)
+        self.assertTrue(QualityReport("data.xlsx").issues().empty)
+        report = QualityReport("data.xlsx")
+        report.check(df)
+        self.assertTrue(report.issues().empty)
+
+    def test_large_file_is_fast(self):
+        rows = 100000
+        df = pd.DataFrame({"Title": [f"Title {i}" for i in range(rows)], "Publisher": "P", "Platform_YOP": "2020",
+                           "Platform_eISBN": ["9780306406157"] * rows, "OCN": [str(i) for i in range(rows)],
+                           "agreement_code": "A", "collection_name": "C", "title_metadata_last_modified": "2024-01-01",
+                           "Test University": "Y", "Other University": "N", "Platform": "P", "File_Name": "data.csv"})
+        start = time.perf_counter()
+        report = QualityReport("data.csv")
+        report.check(df)
+        self.assertEqual(len(report.issues()), rows - 1)
+        # Every row is a duplicate here, the worst case for the report
+        self.assertLess(time.perf_counter() - start, 1)
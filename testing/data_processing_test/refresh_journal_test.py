@@ -0,0 +1,198 @@
+from datetime import datetime, timedelta
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+import requests
+from src.data_processing import database, refresh_journal
+from src.data_processing.refresh_journal import RefreshJournal, resume_download, DownloadCancelled, LISTED
+from src.data_processing.Scraping import CRKNUpdate
+from testing.utility_testing.batch_upload_test import write_csv
+
+TEST_SETTINGS = {"allow_CRKN": "True", "institution": "Test University", "strip_title_articles": "True",
+                 "language": "English", "CRKN_root_url": "https://crkn.example", "ingest_memory_budget_mb": 256}
+
+
+class FakeResponse:
+    """Serves a file, or the part of it a Range header asks for, and can drop the connection part way."""
+
+    def __init__(self, data, headers, supports_range=True, etag='"v1"', fail_after=None):
+        self.headers = {"ETag": etag}
+        start = 0
+        range_header = headers.get("Range")
+        if range_header and supports_range and headers.get("If-Range", etag) == etag:
+            start = int(range_header[len("bytes="):-1])
+            self.status_code = 206 if start < len(data) else 416
+        else:
+            self.status_code = 200
+        self.data = data[start:]
+        self.headers["Content-Length"] = str(len(self.data))
+        self.fail_after = fail_after
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(self.status_code)
+
+    def iter_content(self, size):
+        for start in range(0, len(self.data), 4):
+            if self.fail_after is not None and start >= self.fail_after:
+                raise requests.exceptions.ConnectionError("Connection lost")
+            yield self.data[start:start + 4]
+
+
+class TestRefreshJournal(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings = dict(TEST_SETTINGS, database_name=os.path.join(self.directory.name, "ebook_database.db"))
+        self.patcher = patch("src.utility.settings_manager.Settings.get_setting", side_effect=self.settings.get)
+        self.patcher.start()
+        self.connection = sqlite3.connect(":memory:")
+        database.create_file_name_tables(self.connection)
+        self.requests = []
+
+    def tearDown(self):
+        self.connection.close()
+        self.directory.cleanup()
+        self.patcher.stop()
+
+    def serve(self, files, **options):
+        def get(url, stream=False, headers=None, timeout=None):
+            self.requests.append((url, dict(headers or {})))
+            return FakeResponse(files[url], headers or {}, **options.get(url, {}))
+        return patch("src.data_processing.refresh_journal.requests.get", side_effect=get)
+
+    def test_partial_download_is_continued(self):
+        path = os.path.join(self.directory.name, "file.csv")
+        data = b"0123456789abcdefghij"
+        validators = []
+        with self.serve({"u": data}, u={"fail_after": 8}):
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                resume_download("u", path, on_response=validators.append)
+        self.assertEqual(os.path.getsize(path), 8)
+        with self.serve({"u": data}):
+            resume_download("u", path, validators[0])
+        with open(path, "rb") as file:
+            self.assertEqual(file.read(), data)
+        self.assertEqual(self.requests[-1][1], {"Range": "bytes=8-", "If-Range": '"v1"'})
+
+        # A file changed on the server, or a server without Range support, is downloaded from the start
+        with open(path, "wb") as file:
+            file.write(b"0123")
+        with self.serve({"u": data}, u={"etag": '"v2"'}):
+            resume_download("u", path, '"v1"')
+        with open(path, "rb") as file:
+            self.assertEqual(file.read(), data)
+
+        # Without a validator the partial file can not be checked, so no Range is asked for
+        with open(path, "wb") as file:
+            file.write(b"ABCD")
+        with self.serve({"u": data}):
+            resume_download("u", path)
+        self.assertEqual(self.requests[-1][1], {})
+        with open(path, "rb") as file:
+            self.assertEqual(file.read(), data)
+
+    def test_cancelled_download_keeps_its_bytes(self):
+        path = os.path.join(self.directory.name, "file.csv")
+        waits = []
+        with self.serve({"u": b"0123456789abcdefghij"}):
+            with self.assertRaises(DownloadCancelled):
+                resume_download("u", path, wait_cancelled=lambda seconds: waits.append(seconds) or len(waits) == 2)
+        self.assertEqual((waits, os.path.getsize(path)), ([0, 0], 8))
+
+    def test_old_journal_is_started_over(self):
+        now = datetime(2024, 3, 1, 12)
+        journal = RefreshJournal(self.connection, clock=lambda: now)
+        journal.start([("/files/CRKN_PARightsTracking_A_2024_01_01_01.csv", "A", "2024_01_01_01", "INSERT INTO")],
+                      ["B"])
+        self.assertTrue(journal.resumable())
+        self.assertEqual([file["state"] for file in journal.pending_downloads()], [LISTED])
+        self.assertEqual(journal.pending_removals(), [(1, "B")])
+        journal.clock = lambda: now + timedelta(hours=refresh_journal.JOURNAL_MAX_AGE_HOURS + 1)
+        self.assertFalse(journal.resumable())
+        self.assertEqual(self.connection.execute("SELECT COUNT(*) FROM refresh_journal").fetchone()[0], 0)
+
+    def test_failed_load_is_rejected_after_attempts(self):
+        journal = RefreshJournal(self.connection)
+        journal.start([], ["A"])
+        thread = CRKNUpdate()
+        # A is not in the database, so it can not be removed
+        for attempt in range(1, refresh_journal.MAX_ATTEMPTS):
+            thread.refresh(journal, self.connection)
+            self.assertEqual(journal.pending_removals(), [(0, "A")])
+            self.assertEqual(thread.errors, [])
+        thread.refresh(journal, self.connection)
+        self.assertEqual(len(thread.errors), 1)
+        # Nothing is left, so the journal was dropped
+        self.assertEqual(self.connection.execute("SELECT COUNT(*) FROM refresh_journal").fetchone()[0], 0)
+
+    def test_failed_upload_keeps_file_date(self):
+        links = [f"/files/CRKN_PARightsTracking_A_{date}.csv" for date in ("2024_01_01_01", "2024_02_01_01")]
+        with open(write_csv(self.directory.name, "A.csv", rows=5), "rb") as file:
+            data = file.read()
+        files = {"https://crkn.example" + link: data for link in links}
+        journal = RefreshJournal(self.connection)
+        journal.start([(links[0], "A", "2024_01_01_01", "INSERT INTO")], [])
+        with self.serve(files):
+            CRKNUpdate().refresh(journal, self.connection)
+
+        journal.start([(links[1], "A", "2024_02_01_01", "UPDATE")], [])
+        with self.serve(files), patch("src.data_processing.Scraping.upload_to_database", return_value=False):
+            CRKNUpdate().refresh(journal, self.connection)
+        self.assertEqual(self.connection.execute("SELECT file_date FROM CRKN_file_names").fetchall(),
+                         [("2024_01_01_01",)])
+        self.assertNotIn(self.connection.execute("SELECT state FROM refresh_journal").fetchone()[0],
+                         refresh_journal.DONE)
+
+        # Tried again by the next update
+        with self.serve(files):
+            CRKNUpdate().refresh(journal, self.connection)
+        self.assertEqual(self.connection.execute("SELECT file_date FROM CRKN_file_names").fetchall(),
+                         [("2024_02_01_01",)])
+
+    def test_interrupted_update_carries_on(self):
+        links = [f"/files/CRKN_PARightsTracking_{name}_2024_01_01_01.csv" for name in ("A", "B", "C")]
+        files = {}
+        for name, link in zip(("A", "B", "C"), links):
+            with open(write_csv(self.directory.name, f"{name}.csv", rows=30), "rb") as file:
+                files["https://crkn.example" + link] = file.read()
+        files["https://crkn.example" + links[2]] = b"not a CRKN file"
+        journal = RefreshJournal(self.connection)
+        journal.start([(link, name, "2024_01_01_01", "INSERT INTO") for name, link in zip(("A", "B", "C"), links)],
+                      [])
+
+        # The connection drops part way through B
+        thread = CRKNUpdate()
+        with self.serve(files, **{"https://crkn.example" + links[1]: {"fail_after": 100}}):
+            thread.refresh(journal, self.connection)
+        self.assertEqual([(file["file_name"], file["state"]) for file in journal.pending_downloads()],
+                         [("B", LISTED), ("C", LISTED)])
+        self.assertEqual(self.connection.execute("SELECT file_name FROM CRKN_file_names").fetchall(), [("A",)])
+        self.assertTrue(journal.resumable())
+
+        # The next update starts from B, with the bytes it already has
+        self.requests.clear()
+        thread = CRKNUpdate()
+        with self.serve(files):
+            thread.refresh(journal, self.connection)
+        self.assertEqual([url for url, _ in self.requests], ["https://crkn.example" + links[1],
+                                                             "https://crkn.example" + links[2]])
+        self.assertEqual(self.requests[0][1]["Range"], "bytes=100-")
+        self.assertEqual(sorted(self.connection.execute("SELECT file_name FROM CRKN_file_names").fetchall()),
+                         [("A",), ("B",)])
+        self.assertEqual(self.connection.execute("SELECT COUNT(*) FROM B").fetchone()[0], 30)
+        # Done - the journal and the downloaded files are gone
+        self.assertFalse(journal.resumable())
+        self.assertEqual(self.connection.execute("SELECT COUNT(*) FROM refresh_journal").fetchone()[0], 0)
+        self.assertEqual(os.listdir(refresh_journal.download_folder()), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import sqlite3
+import unittest
+from unittest.mock import patch
+import pandas as pd
+from src.data_processing import database, Scraping
+
+TEST_SETTINGS = {"allow_CRKN": "True", "institution": "Test University", "strip_title_articles": "True",
+                 "fuzzy_title_threshold": 0.4}
+
+COLUMNS = ["Title", "Publisher", "Platform_YOP", "Platform_eISBN", "OCN", "agreement_code", "collection_name",
+           "title_metadata_last_modified", "Test University"]
+
+
+def make_file_df(rows, platform):
+    """Build a dataframe the way Scraping.file_to_dataframe_* leaves it, from (Title, Publisher, YOP, collection) rows."""
+    df = pd.DataFrame([[title, publisher, yop, f"978{i:010d}", str(i), "AG1", collection, "2024-01-01", "Y"]
+                       for i, (title, publisher, yop, collection) in enumerate(rows)], columns=COLUMNS)
+    df["Platform"] = platform
+    df["File_Name"] = f"{platform}.xlsx"
+    return df
+
+
+class TestBooleanSearch(unittest.TestCase):
+    def setUp(self):
+        self.patcher = patch("src.utility.settings_manager.Settings.get_setting", side_effect=TEST_SETTINGS.get)
+        self.patcher.start()
+        self.connection = sqlite3.connect(":memory:")
+        database.create_file_name_tables(self.connection)
+        self.add_file("Alpha", [("Roman History", "Routledge", "2010", "Classics"),
+                                ("Roman Law", "Routledge", "2015", "Law"),
+                                ("Greek History", "Brill", "2012", "Classics")])
+        self.add_file("Beta", [("Roman Roads", "Routledge", "2020", None)])
+        self.query = "SELECT Title FROM table_name WHERE "
+
+    def tearDown(self):
+        self.connection.close()
+        self.patcher.stop()
+
+    def add_file(self, table, rows):
+        Scraping.upload_to_database(make_file_df(rows, table), table, self.connection)
+        Scraping.update_tables([table, "2024_01_01"], "CRKN", self.connection, "INSERT INTO")
+
+    def search(self, terms, searchTypes, operators=None):
+        results = database.search_database(self.connection, self.query, terms, searchTypes, operators)
+        return sorted(row[0] for row in results)
+
+    def test_or_is_default(self):
+        self.assertEqual(self.search(["Roman Law", "Greek History"], ["Title", "Title"]),
+                         ["Greek History", "Roman Law"])
+
+    def test_and_not_across_fields(self):
+        # roman* AND routledge NOT law - OR or AND on the first term changes nothing
+        self.assertEqual(self.search(["roman*", "routledge", "law"], ["Title", "Publisher", "collection_name"],
+                                     ["AND", "AND", "NOT"]),
+                         ["Roman History", "Roman Roads"])
+
+    def test_leading_not(self):
+        # As when the main search box is empty and the first extra box is NOT
+        self.assertEqual(self.search(["law"], ["collection_name"], ["NOT"]),
+                         ["Greek History", "Roman History", "Roman Roads"])
+        self.assertEqual(self.search(["roman*", "greek*"], ["Title", "Title"], ["NOT", "OR"]),
+                         ["Greek History"])
+
+    def test_and_binds_before_or(self):
+        # greek* OR (roman* AND law), not (greek* OR roman*) AND law
+        self.assertEqual(self.search(["greek*", "roman*", "law"], ["Title", "Title", "collection_name"],
+                                     ["OR", "OR", "AND"]),
+                         ["Greek History", "Roman Law"])
+        # law OR (roman* AND NOT routledge), not (law OR roman*) AND NOT routledge
+        self.assertEqual(self.search(["law", "roman*", "routledge"], ["collection_name", "Title", "Publisher"],
+                                     ["OR", "OR", "NOT"]),
+                         ["Roman Law"])
+
+    def test_statements_held_to_parameter_limit(self):
+        with patch.object(database, "MAX_VARIABLES", 4):
+            statements, _ = database.compile_search(self.connection, self.query, ["roman*"], ["Title"])
+            self.assertEqual(len(statements), 2)
+            self.assertEqual(self.search(["roman*"], ["Title"]), ["Roman History", "Roman Law", "Roman Roads"])
+        with self.assertRaises(ValueError):
+            self.search(["roman"] * (database.MAX_SEARCH_TERMS + 1), ["Title"] * (database.MAX_SEARCH_TERMS + 1))
+
+    def test_limit(self):
+        limited = database.search_database(self.connection, self.query, ["roman*"], ["Title"], limit=2)
+        self.assertEqual(len(limited), 2)
+        # Across statements, the later ones only look for the rows still wanted
+        with patch.object(database, "MAX_VARIABLES", 4):
+            self.assertEqual(len(database.search_database(self.connection, self.query, ["roman*"], ["Title"],
+                                                          limit=2)), 2)
+            self.assertEqual(database.search_database(self.connection, self.query, ["roman*"], ["Title"], limit=0), [])
+
+    def test_year_range(self):
+        self.assertEqual(self.search(["2011-2016"], ["Platform_YOP"]), ["Greek History", "Roman Law"])
+        self.assertEqual(self.search(["2015-"], ["Platform_YOP"]), ["Roman Law", "Roman Roads"])
+
+    def test_platform_and_agreement(self):
+        self.assertEqual(self.search(["beta", "ag1"], ["Platform", "agreement_code"], ["OR", "AND"]), ["Roman Roads"])
+
+    def test_single_statement_for_all_tables(self):
+        statements, _ = database.compile_search(self.connection, self.query, ["roman*"], ["Title"])
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(statements[0][0].count("UNION ALL"), 1)
+        self.assertEqual(statements[0][1].count("Beta"), 1)
+
+    def test_identifiers_compared_normalized(self):
+        df = make_file_df([("Hyphenated", "Brill", "2021", None)], "Gamma")
+        df["Platform_eISBN"] = "978-0-00-000000-9"
+        df["OCN"] = "4567.0"
+        Scraping.upload_to_database(df, "Gamma", self.connection)
+        Scraping.update_tables(["Gamma", "2024_01_01"], "CRKN", self.connection, "INSERT INTO")
+        # As suggested (normalized) or as typed
+        self.assertEqual(self.search(["9780000000009"], ["Platform_eISBN"]), ["Hyphenated"])
+        self.assertEqual(self.search(["978 0 00 000000 9"], ["Platform_eISBN"]), ["Hyphenated"])
+        self.assertEqual(self.search(["4567"], ["OCN"]), ["Hyphenated"])
+
+    def test_unknown_field_rejected(self):
+        with self.assertRaises(ValueError):
+            self.search(["x"], ["Title; DROP TABLE Alpha"])
+
+    def test_explain_uses_indexes(self):
+        explanation = database.explain_search(self.connection, self.query, ["9780000000001", "roman law"],
+                                              ["Platform_eISBN", "Title"])
+        self.assertIn("USING INDEX Alpha_Platform_eISBN_key", explanation)
+        self.assertIn("USING INDEX title_keys_lookup", explanation)
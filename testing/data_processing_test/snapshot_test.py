@@ -0,0 +1,137 @@
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+import zipfile
+from unittest.mock import patch
+from src.data_processing import database, Scraping, snapshot
+from src.data_processing.institutions import registry, CRKN, LOCAL
+from src.data_processing.snapshot import export_snapshot, import_snapshot, verify_snapshot, SnapshotError
+from testing.utility_testing.batch_upload_test import write_csv
+
+TEST_SETTINGS = {"allow_CRKN": "True", "institution": "Test University", "strip_title_articles": "True"}
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.patcher = patch("src.utility.settings_manager.Settings.get_setting", side_effect=TEST_SETTINGS.get)
+        self.patcher.start()
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "rights.snapshot")
+        self.source = self.database()
+        self.add_file(self.source, "crkn_a", "CRKN", ("Test University", "Other University"), 1200)
+        self.add_file(self.source, "b", "local", ("Local College",), 3)
+
+    def tearDown(self):
+        self.source.close()
+        self.directory.cleanup()
+        self.patcher.stop()
+
+    def database(self):
+        connection = sqlite3.connect(":memory:")
+        database.create_file_name_tables(connection)
+        return connection
+
+    def add_file(self, connection, name, method, institutions, rows):
+        path = write_csv(self.directory.name, f"{name}.csv", institutions, rows)
+        table = name if method == "CRKN" else f"local_{name}"
+        Scraping.upload_to_database(Scraping.file_to_dataframe_csv(f"{name}.csv", path), table, connection)
+        Scraping.update_tables([name, "2024-01-01"], method, connection, "INSERT INTO")
+
+    def rows(self, connection, sql):
+        return connection.execute(sql).fetchall()
+
+    def test_round_trip(self):
+        manifest = export_snapshot(self.source, self.path)
+        self.assertEqual(manifest["format"], snapshot.default_format())
+        self.assertEqual([table["rows"] for table in manifest["tables"]], [1200, 3])
+
+        target = self.database()
+        self.add_file(target, "old", "local", ("Test University",), 2)
+        import_snapshot(target, self.path)
+        for sql in ("SELECT * FROM crkn_a", "SELECT * FROM local_b", "SELECT * FROM CRKN_file_names",
+                    "SELECT * FROM local_file_names", "SELECT file_table, title_key FROM title_keys ORDER BY 1, 2",
+                    "SELECT * FROM facet_counts ORDER BY 1, 2, 3"):
+            self.assertEqual(self.rows(target, sql), self.rows(self.source, sql), sql)
+        self.assertEqual(self.rows(target, "SELECT name FROM sqlite_master WHERE name = 'local_old'"), [])
+        self.assertEqual(registry.names(CRKN, target), ["Test University", "Other University"])
+        self.assertEqual(registry.names(LOCAL, target), ["Local College"])
+        target.close()
+
+    def test_columns(self):
+        values = [1, None, "Théâtre", 2.5, "", "日本"]
+        kind = snapshot.column_type(values)
+        self.assertEqual(kind, snapshot.TEXT)
+        self.assertEqual(snapshot.decode_column(snapshot.encode_column(values, kind), kind),
+                         ["1", None, "Théâtre", "2.5", "", "日本"])
+        for values, kind in (([1, None, 3], snapshot.INTEGER), ([1, 2.5, None], snapshot.REAL)):
+            self.assertEqual(snapshot.column_type(values), kind)
+            self.assertEqual(snapshot.decode_column(snapshot.encode_column(values, kind), kind), values)
+
+    def test_changed_snapshot_not_imported(self):
+        export_snapshot(self.source, self.path, snapshot.NPZ)
+        changed = os.path.join(self.directory.name, "changed.snapshot")
+        with zipfile.ZipFile(self.path) as original, zipfile.ZipFile(changed, "w") as copy:
+            for item in original.infolist():
+                data = original.read(item)
+                copy.writestr(item, data[:-1] + b"x" if item.filename.startswith("tables/1") else data)
+        with self.assertRaises(SnapshotError):
+            verify_snapshot(changed)
+
+        target = self.database()
+        self.add_file(target, "old", "local", ("Test University",), 2)
+        with self.assertRaises(SnapshotError):
+            import_snapshot(target, changed)
+        self.assertEqual(self.rows(target, "SELECT file_name FROM local_file_names"), [("old",)])
+        self.assertEqual(len(self.rows(target, "SELECT * FROM local_old")), 2)
+        target.close()
+
+    def rewrite_manifest(self, change, update_checksum=True):
+        # Copy of the snapshot with its manifest changed
+        changed = os.path.join(self.directory.name, "changed.snapshot")
+        with zipfile.ZipFile(self.path) as original, zipfile.ZipFile(changed, "w") as copy:
+            manifest = json.loads(original.read(snapshot.MANIFEST))
+            change(manifest)
+            data = json.dumps(manifest).encode("utf-8")
+            copy.writestr(snapshot.MANIFEST, data)
+            copy.writestr(snapshot.MANIFEST_CHECKSUM, snapshot.checksum(data) if update_checksum else
+                          original.read(snapshot.MANIFEST_CHECKSUM))
+            for item in original.infolist():
+                if item.filename not in (snapshot.MANIFEST, snapshot.MANIFEST_CHECKSUM):
+                    copy.writestr(item, original.read(item))
+        return changed
+
+    def test_manifest_checked(self):
+        export_snapshot(self.source, self.path, snapshot.NPZ)
+
+        def rename(manifest):
+            manifest["tables"][0]["name"] = "institutions"
+            manifest["CRKN_file_names"][0][0] = "institutions"
+
+        def bad_type(manifest):
+            manifest["tables"][0]["columns"][0][1] = "TEXT); DROP TABLE local_file_names; --"
+
+        def unlisted(manifest):
+            manifest["tables"][1]["name"] = "local_other"
+
+        target = self.database()
+        self.add_file(target, "old", "local", ("Test University",), 2)
+        for changed in (self.rewrite_manifest(lambda manifest: manifest.update(created="2000-01-01"), False),
+                        self.rewrite_manifest(rename), self.rewrite_manifest(bad_type),
+                        self.rewrite_manifest(unlisted)):
+            with self.assertRaises(SnapshotError):
+                import_snapshot(target, changed)
+            self.assertEqual(self.rows(target, "SELECT file_name FROM local_file_names"), [("old",)])
+        target.close()
+
+    def test_not_a_snapshot(self):
+        with open(self.path, "w") as file:
+            file.write("not a zip")
+        with self.assertRaises(SnapshotError):
+            verify_snapshot(self.path)
+
+    def test_parquet_needs_pyarrow(self):
+        with patch.object(snapshot, "pyarrow", None):
+            with self.assertRaises(SnapshotError):
+                snapshot.read_table(b"", ["Title"], {"Title": snapshot.TEXT}, snapshot.PARQUET)
@@ -0,0 +1,103 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+from src.data_processing import database, Scraping, source_store
+from src.data_processing.source_store import SourceStore
+from testing.utility_testing.batch_upload_test import write_csv
+
+TEST_SETTINGS = {"allow_CRKN": "True", "institution": "Test University", "strip_title_articles": "True",
+                 "ingest_memory_budget_mb": 256, "source_store_enabled": "True", "source_store_max_mb": 0}
+
+
+class TestSourceStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings = dict(TEST_SETTINGS, source_store_folder=os.path.join(self.directory.name, "store"))
+        self.patcher = patch("src.utility.settings_manager.Settings.get_setting", side_effect=self.settings.get)
+        self.patcher.start()
+        self.connection = sqlite3.connect(":memory:", factory=database.BatchConnection)
+        database.create_file_name_tables(self.connection)
+
+    def tearDown(self):
+        self.connection.close()
+        self.directory.cleanup()
+        self.patcher.stop()
+
+    def load(self, name, method, rows=5, date="2024-01-01"):
+        path = write_csv(self.directory.name, f"{name}.csv", ("Test University",), rows)
+        table = name if method == "CRKN" else f"local_{name}"
+        command = Scraping.compare_file([name, date], method, self.connection)
+        Scraping.upload_to_database(Scraping.file_to_dataframe_csv(f"{name}.csv", path), table, self.connection)
+        Scraping.update_tables([name, date], method, self.connection, command)
+        source_store.keep_source(path, method, name, date)
+        return path
+
+    def contents(self, table):
+        return sorted(self.connection.execute(f"SELECT * FROM [{table}];").fetchall(), key=repr)
+
+    def test_same_contents_stored_once(self):
+        first = write_csv(self.directory.name, "first.csv", rows=50)
+        with SourceStore(compression="lzma") as store:
+            sha256 = store.put(first, "local", "first", "2024_01_01")
+            self.assertEqual(store.put(first, "local", "copy", "2024_01_01"), sha256)
+            self.assertEqual(store.index.execute("SELECT COUNT(*) FROM blobs").fetchone()[0], 1)
+            self.assertTrue(os.path.exists(store.blob_path(sha256, "lzma")))
+            self.assertLess(store.stored_bytes(), os.path.getsize(first))
+            self.assertEqual([row[1] for row in store.current_sources()], ["copy", "first"])
+
+    def test_eviction_keeps_current_files(self):
+        with SourceStore() as store:
+            old = store.put(write_csv(self.directory.name, "a.csv", rows=40), "CRKN", "a", "2024_01")
+            store.put(write_csv(self.directory.name, "a.csv", rows=41), "CRKN", "a", "2024_02")
+            store.put(write_csv(self.directory.name, "b.csv", rows=42), "CRKN", "b", "2024_01")
+            # Room for two of the three blobs - the older version of a goes first
+            store.max_bytes = store.stored_bytes() - 1
+            self.assertEqual(store.evict(), 1)
+            self.assertFalse(os.path.exists(store.blob_path(old, "gzip")))
+            self.assertEqual([(row[1], row[2]) for row in store.current_sources()],
+                             [("a", "2024_02"), ("b", "2024_01")])
+
+            # Current files are kept even when they do not fit
+            store.max_bytes = 1
+            with self.assertLogs(level="WARNING"):
+                self.assertEqual(store.evict(), 0)
+            self.assertEqual(len(store.current_sources()), 2)
+
+    def test_rebuild_without_downloading(self):
+        self.load("crkn_a", "CRKN", rows=6)
+        self.load("b", "local", date="2024_01_01")
+        self.load("c", "local", date="2024_01_01")
+        Scraping.update_tables(["c"], "local", self.connection, "DELETE")
+        before = {table: self.contents(table) for table in ("crkn_a", "local_b")}
+        # The files are gone and the tables were changed since
+        for name in ("crkn_a.csv", "b.csv", "c.csv"):
+            os.remove(os.path.join(self.directory.name, name))
+        self.connection.execute("DELETE FROM crkn_a WHERE Title = 'Title 0';")
+        self.connection.commit()
+
+        with SourceStore() as store:
+            self.assertEqual(store.rebuild(self.connection, max_workers=1), (2, []))
+        self.assertEqual({table: self.contents(table) for table in ("crkn_a", "local_b")}, before)
+        # A removed file is not loaded again
+        self.assertFalse(self.connection.execute("SELECT name FROM sqlite_master WHERE name = 'local_c'").fetchall())
+        self.assertEqual(self.connection.execute("SELECT file_date FROM CRKN_file_names").fetchall(),
+                         [("2024-01-01",)])
+
+    def test_damaged_blob_is_reported(self):
+        self.load("crkn_a", "CRKN")
+        with SourceStore() as store:
+            (_, _, _, _, sha256, compression), = store.current_sources()
+            with open(store.blob_path(sha256, compression), "wb") as file:
+                file.write(b"not gzip")
+            self.assertEqual(store.rebuild(self.connection, max_workers=1), (0, ["crkn_a.csv"]))
+
+    def test_disabled_store(self):
+        self.settings["source_store_enabled"] = "False"
+        self.load("crkn_a", "CRKN")
+        self.assertFalse(os.path.exists(self.settings["source_store_folder"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
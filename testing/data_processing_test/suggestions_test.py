@@ -0,0 +1,67 @@
+import sqlite3
+import time
+import unittest
+from unittest.mock import patch
+import pandas as pd
+from src.data_processing import database, Scraping
+from src.data_processing.suggestions import PrefixIndex
+
+TEST_SETTINGS = {"allow_CRKN": "True", "institution": "Test University", "strip_title_articles": "True"}
+
+
+def make_file_df(rows):
+    """Build a dataframe the way Scraping.file_to_dataframe_* leaves it, from (Title, eISBN, OCN) rows."""
+    df = pd.DataFrame([[title, "Publisher", "2020", isbn, ocn, "AG1", "Collection", "2024-01-01", "Y"]
+                       for title, isbn, ocn in rows],
+                      columns=["Title", "Publisher", "Platform_YOP", "Platform_eISBN", "OCN", "agreement_code",
+                               "collection_name", "title_metadata_last_modified", "Test University"])
+    df["Platform"] = "Test Platform"
+    df["File_Name"] = "test.xlsx"
+    return df
+
+
+class TestPrefixIndex(unittest.TestCase):
+    def setUp(self):
+        self.patcher = patch("src.utility.settings_manager.Settings.get_setting", side_effect=TEST_SETTINGS.get)
+        self.patcher.start()
+        self.connection = sqlite3.connect(":memory:")
+        database.create_file_name_tables(self.connection)
+        self.add_file("TestPlatform", [("Les Misérables", "978-0-00-000001-1", 1001),
+                                       ("Lesson Plans", "9780000000028", 1002),
+                                       ("The Art of War", "9781000000035", 2001)])
+        self.index = PrefixIndex()
+
+    def tearDown(self):
+        self.connection.close()
+        self.patcher.stop()
+
+    def add_file(self, table, rows):
+        Scraping.upload_to_database(make_file_df(rows), table, self.connection)
+        Scraping.update_tables([table, "2024_01_01"], "CRKN", self.connection, "INSERT INTO")
+
+    def test_title_prefix(self):
+        self.assertEqual(self.index.suggest(self.connection, "Title", "lesso"), ["Lesson Plans"])
+        # Articles and accents are ignored the same way as in the Title search
+        self.assertEqual(self.index.suggest(self.connection, "Title", "misé"), ["Les Misérables"])
+        self.assertEqual(self.index.suggest(self.connection, "Title", "The Ar"), ["The Art of War"])
+
+    def test_identifier_prefix(self):
+        self.assertEqual(self.index.suggest(self.connection, "Platform_eISBN", "978-000"),
+                         ["9780000000011", "9780000000028"])
+        self.assertEqual(self.index.suggest(self.connection, "OCN", "100"), ["1001", "1002"])
+
+    def test_limit_and_empty_text(self):
+        self.assertEqual(len(self.index.suggest(self.connection, "OCN", "", limit=1)), 0)
+        self.assertEqual(len(self.index.suggest(self.connection, "Platform_eISBN", "978", limit=2)), 2)
+
+    def test_rebuilt_when_data_changes(self):
+        self.assertEqual(self.index.suggest(self.connection, "Title", "new"), [])
+        self.add_file("OtherPlatform", [("New Worlds", "9782000000011", 3001)])
+        self.assertEqual(self.index.suggest(self.connection, "Title", "new"), ["New Worlds"])
+
+    def test_lookup_speed(self):
+        self.add_file("BigPlatform", [(f"Title number {i}", f"97830{i:08d}", 400000 + i) for i in range(20000)])
+        self.index.suggest(self.connection, "Title", "title")
+        start = time.perf_counter()
+        self.index.suggest(self.connection, "Title", "title number 123")
+        self.assertLess(time.perf_counter() - start, 0.02)
@@ -0,0 +1,135 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+from src.data_processing import database
+from src.data_processing.institutions import registry, LOCAL
+from src.utility import batch_upload
+from src.utility.batch_upload import BatchUpload
+
+TEST_SETTINGS = {"allow_CRKN": "True", "institution": "Test University", "strip_title_articles": "True",
+                 "CRKN_institutions": ["Test University"], "local_institutions": [],
+                 "ingest_chunk_rows": 50000, "ingest_memory_budget_mb": 256}
+
+HEADERS = "Title,Publisher,Platform_YOP,Platform_eISBN,OCN,agreement_code,collection_name,title_metadata_last_modified"
+
+
+def write_csv(directory, name, institutions=("Test University",), rows=2, missing_title=False):
+    """Write a local file in the CRKN layout - platform in A1, a blank row, the header row, then the data."""
+    path = os.path.join(directory, name)
+    with open(path, "w") as file:
+        file.write("Test Platform" + "," * (7 + len(institutions)) + "\n")
+        file.write("," * (7 + len(institutions)) + "\n")
+        file.write(HEADERS + "," + ",".join(institutions) + "\n")
+        for i in range(rows):
+            title = "" if missing_title and i == 0 else f"Title {i}"
+            file.write(f"{title},Publisher,2020,978{i:010d},{i},AG1,Collection,2024-01-01" + ",Y" * len(institutions) + "\n")
+    return path
+
+
+class TestBatchUpload(unittest.TestCase):
+    def setUp(self):
+        self.settings = {key: list(value) if isinstance(value, list) else value for key, value in TEST_SETTINGS.items()}
+        self.patchers = [patch("src.utility.settings_manager.Settings.get_setting", side_effect=self.settings.get)]
+        for patcher in self.patchers:
+            patcher.start()
+        self.directory = tempfile.TemporaryDirectory()
+        self.connection = sqlite3.connect(":memory:", factory=database.BatchConnection)
+        database.create_file_name_tables(self.connection)
+        registry.load(self.connection)
+
+    def tearDown(self):
+        self.connection.close()
+        self.directory.cleanup()
+        for patcher in self.patchers:
+            patcher.stop()
+
+    def upload(self, paths, confirm=True, max_workers=1):
+        batch = BatchUpload(paths, max_workers=max_workers)
+        batch.validate(self.connection)
+        if not confirm:
+            batch.skip_unconfirmed()
+        batch.load(self.connection)
+        return batch
+
+    def test_parallel_validation_and_load(self):
+        paths = [write_csv(self.directory.name, f"file{i}.csv", rows=i + 1) for i in range(3)]
+        paths.append(write_csv(self.directory.name, "broken.csv", missing_title=True))
+        paths.append(os.path.join(self.directory.name, "notes.txt"))
+        batch = self.upload(paths, max_workers=2)
+        self.assertEqual([job.file_name for job in batch.loaded_files()], ["file0", "file1", "file2"])
+        self.assertEqual(batch.loaded_rows, 6)
+        self.assertEqual({job.file_name: job.error for job in batch.failed_jobs()},
+                         {"broken": batch_upload.INVALID_FORMAT, "notes": batch_upload.INVALID_TYPE})
+        self.assertEqual(database.get_local_tables(self.connection), ["local_file0", "local_file1", "local_file2"])
+
+    def test_one_question_for_replacements_and_institutions(self):
+        self.upload([write_csv(self.directory.name, "first.csv")])
+        batch = BatchUpload([write_csv(self.directory.name, "first.csv", rows=3),
+                             write_csv(self.directory.name, "second.csv", ("Test University", "New College")),
+                             write_csv(self.directory.name, "third.csv")], max_workers=1)
+        batch.validate(self.connection)
+        self.assertEqual(batch.replaced_files(), ["first.csv"])
+        self.assertEqual(batch.new_institutions(), ["New College"])
+
+        batch.skip_unconfirmed()
+        batch.load(self.connection)
+        self.assertEqual([job.file_name for job in batch.loaded_files()], ["third"])
+        self.assertEqual(registry.names(LOCAL), [])
+        self.assertEqual(self.connection.execute("SELECT COUNT(*) FROM local_first").fetchone()[0], 2)
+
+    def test_confirmed_batch_adds_institutions(self):
+        self.upload([write_csv(self.directory.name, "second.csv", ("Test University", "New College"))])
+        self.assertEqual(registry.names(LOCAL), ["New College"])
+
+    def test_duplicate_names_in_batch(self):
+        os.mkdir(os.path.join(self.directory.name, "other"))
+        batch = self.upload([write_csv(self.directory.name, "same.csv"),
+                             write_csv(os.path.join(self.directory.name, "other"), "same.csv")])
+        self.assertEqual(len(batch.loaded_files()), 1)
+        self.assertEqual(batch.failed_jobs()[0].error, batch_upload.DUPLICATE_NAME)
+
+    def test_failed_file_rolled_back(self):
+        path = write_csv(self.directory.name, "first.csv")
+        with patch("src.data_processing.Scraping.update_tables", return_value=False):
+            batch = self.upload([path])
+        self.assertEqual(batch.failed_jobs()[0].error, batch_upload.LOAD_FAILED)
+        self.assertEqual(self.connection.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE name = 'local_first'").fetchone()[0], 0)
+        self.assertEqual(self.connection.execute("SELECT COUNT(*) FROM title_keys").fetchone()[0], 0)
+
+    def test_large_file_loaded_in_chunks(self):
+        self.settings["ingest_memory_budget_mb"] = 0.01
+        self.settings["ingest_chunk_rows"] = 1000
+        progress = []
+        batch = BatchUpload([write_csv(self.directory.name, "large.csv", rows=2500)], max_workers=1)
+        batch.validate(self.connection)
+        self.assertTrue(batch.jobs[0].streamed)
+        self.assertIsNone(batch.jobs[0].df)
+        batch.load(self.connection, lambda done, total, rows: progress.append(rows))
+        self.assertEqual(batch.loaded_rows, 2500)
+        self.assertEqual(sum(progress), 2500)
+        self.assertEqual(self.connection.execute("SELECT COUNT(*) FROM local_large").fetchone()[0], 2500)
+
+    def test_frames_over_budget_read_again(self):
+        paths = [write_csv(self.directory.name, f"file{i}.csv", rows=3) for i in range(2)]
+        batch = BatchUpload(paths, max_workers=1)
+        with patch("src.data_processing.chunked_ingest.should_stream", return_value=False), \
+                patch("src.data_processing.chunked_ingest.memory_budget", return_value=1):
+            batch.validate(self.connection)
+        # Dropped once validated, not loaded in chunks
+        self.assertEqual([(job.df, job.reread, job.streamed) for job in batch.jobs], [(None, True, False)] * 2)
+        # A file broken since it was validated is not loaded
+        write_csv(self.directory.name, "file1.csv", rows=3, missing_title=True)
+        batch.load(self.connection)
+        self.assertEqual([job.file_name for job in batch.loaded_files()], ["file0"])
+        self.assertEqual(batch.failed_jobs()[0].error, batch_upload.LOAD_FAILED)
+        self.assertEqual(self.connection.execute("SELECT COUNT(*) FROM local_file0").fetchone()[0], 3)
+
+    def test_invalid_file_gets_report(self):
+        batch = self.upload([write_csv(self.directory.name, "broken.csv", missing_title=True)])
+        report = batch.failed_jobs()[0].report_path
+        self.assertEqual(report, os.path.join(self.directory.name, "broken_report.csv"))
+        with open(report) as file:
+            self.assertIn("4,A,Title,Error,Missing title", file.read())
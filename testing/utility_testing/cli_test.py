@@ -0,0 +1,115 @@
+import contextlib
+import csv
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+from src import cli
+from src.data_processing import database
+from src.data_processing.institutions import registry
+from testing.utility_testing.batch_upload_test import write_csv
+
+TEST_SETTINGS = {"allow_CRKN": "True", "institution": "Command Line University", "strip_title_articles": "True",
+                 "language": "English", "ingest_memory_budget_mb": 256, "source_store_enabled": "False",
+                 "fuzzy_title_threshold": 0.4}
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class TestCommandLine(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings = dict(TEST_SETTINGS, database_name=os.path.join(self.directory.name, "ebook_database.db"))
+        self.patcher = patch("src.utility.settings_manager.Settings.get_setting", side_effect=self.settings.get)
+        self.patcher.start()
+        # The institutions read from another test's database are not kept
+        connection = database.connect_to_database()
+        database.create_file_name_tables(connection)
+        registry.load(connection)
+        database.close_database(connection)
+
+    def tearDown(self):
+        self.directory.cleanup()
+        self.patcher.stop()
+
+    def run_cli(self, *argv):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            status = cli.main(list(argv))
+        return status, output.getvalue()
+
+    def test_no_qt_imported(self):
+        code = ("import sys; import src.cli, src.data_processing.Scraping, src.utility.upload; "
+                "print(sorted(name for name in sys.modules if name.startswith('PyQt6')))")
+        result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.strip(), "[]")
+
+    def test_upload_search_and_export(self):
+        path = write_csv(self.directory.name, "local_books.csv", ("Command Line University",), rows=3)
+        # The institution is not known yet
+        with contextlib.redirect_stderr(io.StringIO()):
+            self.assertEqual(self.run_cli("upload", path)[0], 1)
+        status, output = self.run_cli("upload", path, "--add-institutions")
+        self.assertEqual(status, 0)
+        self.assertIn("1 of 1 files uploaded", output)
+
+        status, output = self.run_cli("search", "Title 1", "OCN:2", "--format", "csv")
+        self.assertEqual(status, 0)
+        rows = list(csv.reader(io.StringIO(output)))
+        self.assertEqual(rows[0][:4], ["Access", "File_Name", "Platform", "Title"])
+        self.assertEqual(sorted(row[3] for row in rows[1:]), ["Title 1", "Title 2"])
+        status, output = self.run_cli("search", "Title*", "--limit", "2")
+        self.assertEqual(len(output.splitlines()), 3)
+        status, output = self.run_cli("search", "Title*", "OCN:1", "--operator", "NOT")
+        self.assertEqual(sorted(row.split("\t")[3] for row in output.splitlines()[1:]), ["Title 0", "Title 2"])
+
+        export_path = os.path.join(self.directory.name, "results")
+        status, output = self.run_cli("export", "Title 1", "--output", export_path)
+        self.assertEqual(status, 0)
+        with open(export_path + ".tsv", encoding="utf-8") as file:
+            self.assertEqual(len(file.read().splitlines()), 2)
+
+        report_path = os.path.join(self.directory.name, "holdings.csv")
+        status, output = self.run_cli("report", "--output", report_path)
+        self.assertEqual(status, 0)
+        self.assertTrue(os.path.exists(os.path.join(self.directory.name, "holdings_totals.csv")))
+
+    def test_history(self):
+        path = write_csv(self.directory.name, "local_books.csv", ("Command Line University",), rows=3)
+        self.run_cli("upload", path, "--add-institutions")
+        status, output = self.run_cli("history", "9780000000001", "--format", "csv")
+        self.assertEqual(status, 0)
+        rows = list(csv.reader(io.StringIO(output)))
+        self.assertEqual([row[:3] for row in rows], [["File_Name", "Title", "Command Line University"],
+                                                     ["local_local_books", "Title 1", "Y"]])
+        self.assertEqual(self.run_cli("history", "9780000000001", "--date", "2000-01-01"),
+                         (0, "File_Name\tTitle\tCommand Line University\tValid_From\tValid_To\n"))
+        status, output = self.run_cli("history", "--table", "local_local_books")
+        self.assertEqual(len(output.splitlines()), 4)
+        with self.assertRaises(SystemExit), contextlib.redirect_stderr(io.StringIO()):
+            cli.main(["history"])
+
+    def test_reading_leaves_tables_alone(self):
+        self.assertEqual(self.run_cli("search", "Title 1")[0], 0)
+        with patch("src.cli.database.create_file_name_tables") as create_tables:
+            self.assertEqual(self.run_cli("search", "Title 1")[0], 0)
+            create_tables.assert_not_called()
+            path = write_csv(self.directory.name, "local_books.csv", ("Command Line University",), rows=1)
+            self.run_cli("upload", path, "--add-institutions")
+            create_tables.assert_called_once()
+
+    def test_failures_set_exit_status(self):
+        with contextlib.redirect_stderr(io.StringIO()):
+            self.assertEqual(self.run_cli("upload", os.path.join(self.directory.name, "missing.txt"))[0], 1)
+        self.settings["institution"] = ""
+        with contextlib.redirect_stderr(io.StringIO()):
+            self.assertEqual(self.run_cli("search", "Title 1")[0], 1)
+        with self.assertRaises(SystemExit), contextlib.redirect_stderr(io.StringIO()):
+            cli.main(["search", "Title 1", "--field", "Author"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+from src.utility.progress import ProgressReporter, format_amount, format_duration
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestProgressReporter(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.reports = []
+        self.reporter = ProgressReporter(lambda percent, status: self.reports.append((percent, status)),
+                                         [("Download", 75), ("Load", 25)], interval=0.1, clock=self.clock)
+
+    def test_weighted_stages(self):
+        self.reporter.start("Download", 1000)
+        self.clock.now = 1
+        self.reporter.update(500, 500, "bytes")
+        self.assertEqual(self.reports[-1][0], 37)
+        self.clock.now = 2
+        self.reporter.start("Load", 10)
+        self.clock.now = 3
+        self.reporter.update(5, 5, "rows")
+        self.assertEqual(self.reports[-1][0], 87)
+        self.reporter.finish()
+        self.assertEqual(self.reports[-1][0], 100)
+
+    def test_rate_limited(self):
+        self.reporter.start("Download", 1000)
+        for i in range(1, 101):
+            self.clock.now += 0.01
+            self.reporter.update(i * 10, 10, "bytes")
+        # One report at the start, then one per 0.1s
+        self.assertLessEqual(len(self.reports), 11)
+        self.assertGreaterEqual(len(self.reports), 9)
+
+    def test_throughput_and_eta(self):
+        self.reporter.start("Download", 4096)
+        self.clock.now = 2
+        self.reporter.update(2048, 2048, "bytes")
+        self.assertEqual(self.reporter.throughput(), 1024)
+        # 37.5% done in 2s
+        self.assertAlmostEqual(self.reporter.eta(), 2 * 0.625 / 0.375)
+        self.assertEqual(self.reports[-1][1], "Download - 1.0 KB/s - about 3 s left")
+
+    def test_never_goes_back(self):
+        self.reporter.start("Download", 10)
+        self.reporter.update(8)
+        self.reporter.update(2)
+        self.assertEqual(self.reporter.percent(), 60)
+
+    def test_formatting(self):
+        self.assertEqual(format_amount(3 * 1024 * 1024, "bytes", "English"), "3.0 MB")
+        self.assertEqual(format_amount(1536, "bytes", "French"), "1,5 Ko")
+        self.assertEqual(format_amount(1200.4, "rows", "French"), "1200 lignes")
+        self.assertEqual(format_duration(125), "2 min 05 s")
+        self.assertEqual(format_duration(3725), "1 h 02 min")
@@ -0,0 +1,127 @@
+from datetime import datetime, time
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+from src.data_processing import database, Scraping
+from src.data_processing.refresh_journal import resume_download
+from src.data_processing.Scraping import CRKNUpdate, ScheduledRefresh
+from src.utility import refresh_schedule
+from src.utility.refresh_schedule import in_window, is_due, describe_run
+from testing.data_processing_test.refresh_journal_test import FakeResponse
+
+TEST_SETTINGS = {"allow_CRKN": "True", "language": "English", "scheduled_refresh": "True",
+                 "scheduled_refresh_hours": 24, "scheduled_refresh_start": "22:00", "scheduled_refresh_end": "05:00",
+                 "scheduled_refresh_bandwidth_kbps": 0, "scheduled_refresh_remove_policy": "Keep"}
+
+
+class TestRefreshSchedule(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings = dict(TEST_SETTINGS, database_name=os.path.join(self.directory.name, "ebook_database.db"))
+        self.patcher = patch("src.utility.settings_manager.Settings.get_setting", side_effect=self.settings.get)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.directory.cleanup()
+        self.patcher.stop()
+
+    def test_window_past_midnight(self):
+        start, end = time(22, 0), time(5, 0)
+        self.assertTrue(in_window(datetime(2024, 3, 1, 23, 30), start, end))
+        self.assertTrue(in_window(datetime(2024, 3, 1, 4, 59), start, end))
+        self.assertFalse(in_window(datetime(2024, 3, 1, 5, 0), start, end))
+        self.assertFalse(in_window(datetime(2024, 3, 1, 12, 0), start, end))
+        # The same start and end means any time
+        self.assertTrue(in_window(datetime(2024, 3, 1, 12, 0), start, start))
+
+    def test_due_once_interval_has_passed(self):
+        start, end = time(1, 0), time(5, 0)
+        self.assertTrue(is_due(None, datetime(2024, 3, 2, 2, 0), 24, start, end))
+        self.assertFalse(is_due("2024-03-01T02:00:00", datetime(2024, 3, 2, 1, 30), 24, start, end))
+        self.assertTrue(is_due("2024-03-01T02:00:00", datetime(2024, 3, 2, 2, 0), 24, start, end))
+        # Not outside the window, however long it has been
+        self.assertFalse(is_due("2024-02-01T02:00:00", datetime(2024, 3, 2, 12, 0), 24, start, end))
+
+        self.settings["scheduled_refresh"] = "False"
+        self.assertFalse(refresh_schedule.schedule_due(None, datetime(2024, 3, 2, 23, 0)))
+        self.settings["scheduled_refresh"] = "True"
+        self.assertTrue(refresh_schedule.schedule_due(None, datetime(2024, 3, 2, 23, 0)))
+
+    def test_download_held_to_bandwidth(self):
+        path = os.path.join(self.directory.name, "file.csv")
+        clock = [0.0]
+        waits = []
+
+        def sleep(seconds):
+            waits.append(seconds)
+            clock[0] += seconds
+
+        with patch("src.data_processing.refresh_journal.requests.get",
+                   side_effect=lambda url, stream, headers, timeout: FakeResponse(b"x" * 20, headers)), \
+                patch("src.data_processing.refresh_journal.time.monotonic", side_effect=lambda: clock[0]), \
+                patch("src.data_processing.refresh_journal.time.sleep", side_effect=sleep):
+            resume_download("u", path, max_bytes_per_second=8)
+        # 20 bytes at 8 bytes per second take 2.5 seconds
+        self.assertEqual(os.path.getsize(path), 20)
+        self.assertAlmostEqual(clock[0], 2.5)
+        self.assertEqual(len(waits), 5)
+
+    def test_runs_recorded(self):
+        connection = sqlite3.connect(self.settings["database_name"])
+        database.create_file_name_tables(connection)
+        self.assertIsNone(database.get_last_refresh_run(connection))
+        self.assertEqual(describe_run(None), "No CRKN update yet")
+
+        # A scheduled update that fails after one that got through
+        update = ScheduledRefresh()
+        with patch.object(ScheduledRefresh, "scrapeCRKN",
+                          lambda self: setattr(self, "files_changed", 2)):
+            update.update_database()
+        with patch.object(ScheduledRefresh, "scrapeCRKN",
+                          lambda self: self.report_error("Internet Connection Error")):
+            update.update_database()
+        last = database.get_last_refresh_run(connection)
+        self.assertEqual((last["trigger"], last["status"], last["detail"]),
+                         ("Scheduled", "Failed", "Internet Connection Error"))
+        last = database.get_last_refresh_run(connection, refresh_schedule.SUCCESSFUL)
+        self.assertEqual((last["status"], last["files_changed"]), ("Completed", 2))
+        self.assertTrue(describe_run(dict(last, seconds=125)).endswith("- Completed, 2 files in 2 min 05 s"))
+
+        # Not while another update is running
+        Scraping.REFRESH_LOCK.acquire()
+        try:
+            CRKNUpdate().update_database()
+        finally:
+            Scraping.REFRESH_LOCK.release()
+        self.assertEqual(connection.execute("SELECT COUNT(*) FROM refresh_runs").fetchone()[0], 2)
+        connection.close()
+
+    def test_failed_update_does_not_stop_the_schedule(self):
+        connection = sqlite3.connect(self.settings["database_name"])
+        database.create_file_name_tables(connection)
+        update = ScheduledRefresh()
+
+        def scrape(self):
+            raise OSError("Disk full")
+        with patch.object(ScheduledRefresh, "is_due", return_value=True), \
+                patch.object(ScheduledRefresh, "scrapeCRKN", scrape), self.assertLogs(level="ERROR"):
+            self.assertTrue(update.run_if_due())
+        self.assertEqual(database.get_last_refresh_run(connection)["status"], "Failed")
+        connection.close()
+
+    def test_scheduled_update_asks_nobody(self):
+        asked = []
+        update = ScheduledRefresh()
+        update.confirm = asked.append
+        files = [["/files/CRKN_PARightsTracking_A_2024_01_01_01.csv", "A", "2024_01_01_01", "UPDATE"]]
+        # Files no longer listed are kept with the Keep policy
+        self.assertEqual(update.confirm_changes(files, ["B"]), (files, []))
+        self.assertIsNone(update.confirm_changes([], ["B"]))
+        self.settings["scheduled_refresh_remove_policy"] = "Remove"
+        self.assertEqual(update.confirm_changes(files, ["B"]), (files, ["B"]))
+        self.assertEqual(asked, [])
+
+if __name__ == '__main__':
+    unittest.main()
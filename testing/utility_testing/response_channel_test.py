@@ -0,0 +1,39 @@
+import threading
+import time
+import unittest
+from src.utility.response_channel import ResponseChannel, RequestCancelled
+
+
+class TestResponseChannel(unittest.TestCase):
+    def setUp(self):
+        self.channel = ResponseChannel()
+
+    def test_answer_before_wait_is_kept(self):
+        # The UI can answer before the worker starts waiting - the request is opened before it is sent
+        self.assertEqual(self.channel.ask(lambda: self.channel.respond("Y")), "Y")
+
+    def test_answer_from_other_thread(self):
+        timer = threading.Timer(0.05, self.channel.respond, args=(True,))
+        start = time.perf_counter()
+        self.assertTrue(self.channel.ask(timer.start, timeout=5))
+        # Woken by the answer, not by polling
+        self.assertLess(time.perf_counter() - start, 1)
+
+    def test_timeout_returns_default_and_ignores_late_answer(self):
+        self.assertEqual(self.channel.ask(lambda: None, timeout=0.01, default="N"), "N")
+        self.assertFalse(self.channel.respond("Y"))
+        self.assertEqual(self.channel.ask(lambda: self.channel.respond("Y"), timeout=1), "Y")
+
+    def test_answer_without_request_ignored(self):
+        self.assertFalse(self.channel.respond(True))
+
+    def test_cancel_while_waiting(self):
+        threading.Timer(0.05, self.channel.cancel).start()
+        with self.assertRaises(RequestCancelled):
+            self.channel.ask(lambda: None)
+        self.assertTrue(self.channel.cancelled)
+
+    def test_cancelled_before_asking(self):
+        self.channel.cancel()
+        with self.assertRaises(RequestCancelled):
+            self.channel.ask(lambda: self.channel.respond(True))
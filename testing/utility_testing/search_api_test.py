@@ -0,0 +1,151 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+from src.data_processing import database
+from src.utility.search_api import ResponseCache, SearchAPI, SearchServer, percentile
+from src.utility.upload import LocalUpload
+from testing.utility_testing.batch_upload_test import write_csv
+
+TEST_SETTINGS = {"allow_CRKN": "True", "institution": "Search API University", "strip_title_articles": "True",
+                 "language": "English", "ingest_memory_budget_mb": 256, "source_store_enabled": "False",
+                 "fuzzy_title_threshold": 0.4}
+
+
+class TestSearchAPI(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings = dict(TEST_SETTINGS, database_name=os.path.join(self.directory.name, "ebook_database.db"))
+        self.patcher = patch("src.utility.settings_manager.Settings.get_setting", side_effect=self.settings.get)
+        self.patcher.start()
+        connection = database.connect_to_database()
+        database.create_file_name_tables(connection)
+        database.close_database(connection)
+        self.upload("api_books.csv", 3)
+        # Localhost only, on any free port
+        self.server = SearchServer("127.0.0.1", 0, SearchAPI(connections=2, cache_rows=10))
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+        self.patcher.stop()
+        self.directory.cleanup()
+
+    def upload(self, name, rows):
+        path = write_csv(self.directory.name, name, (self.settings["institution"],), rows=rows)
+        LocalUpload([path], (True, True)).process_files()
+
+    def request(self, path, body=None, method=None):
+        data = None if body is None else (body if isinstance(body, bytes) else json.dumps(body).encode("utf-8"))
+        request = Request(self.server.url() + path, data=data, method=method,
+                          headers={"Content-Type": "application/json"})
+        try:
+            with urlopen(request, timeout=10) as response:
+                return response.status, json.loads(response.read())
+        except HTTPError as e:
+            return e.code, json.loads(e.read())
+
+    def test_search(self):
+        status, response = self.request("/search?OCN=2")
+        self.assertEqual(status, 200)
+        self.assertEqual(response["institution"], "Search API University")
+        self.assertEqual(response["count"], 1)
+        row = response["results"][0]
+        self.assertEqual((row["Access"], row["Title"], row["File_Name"]), ("Y", "Title 2", "api_books.csv"))
+
+        status, response = self.request("/search?Title=title+0&Platform_eISBN=9780000000001&limit=1")
+        self.assertEqual((status, response["count"], len(response["results"])), (200, 2, 1))
+        status, response = self.request("/search?Title=Title*&OCN=1&operator=NOT")
+        self.assertEqual(sorted(row["Title"] for row in response["results"]), ["Title 0", "Title 2"])
+
+    def test_bad_requests(self):
+        self.assertEqual(self.request("/search")[0], 400)
+        self.assertEqual(self.request("/search?Author=Someone")[0], 400)
+        self.assertEqual(self.request("/search?OCN=1&operator=XOR")[0], 400)
+        # NOT with nothing to take away from would otherwise answer the titles that match
+        self.assertEqual(self.request("/search?OCN=1&operator=NOT")[0], 400)
+        self.assertEqual(self.request("/search?OCN=1&limit=many")[0], 400)
+        self.assertEqual(self.request("/titles")[0], 404)
+        # Nothing is changed through the API
+        self.assertEqual(self.request("/search?OCN=1", {"OCN": "1"})[0], 405)
+        self.assertEqual(self.request("/search?OCN=1", method="DELETE")[0], 405)
+        self.settings["institution"] = ""
+        self.assertEqual(self.request("/search?OCN=1")[0], 503)
+
+    def test_batch(self):
+        lookups = [{"field": "Platform_eISBN", "term": "9780000000002"}, {"field": "OCN", "term": "99"},
+                   {"field": "Title", "term": "Title 0"}]
+        status, response = self.request("/batch", {"lookups": lookups})
+        self.assertEqual(status, 200)
+        self.assertEqual([(result["term"], result["count"]) for result in response["results"]],
+                         [("9780000000002", 1), ("99", 0), ("Title 0", 1)])
+
+        self.assertEqual(self.request("/batch", b"not json")[0], 400)
+        self.assertEqual(self.request("/batch", {"lookups": [{"field": "Author", "term": "x"}]})[0], 400)
+        self.assertEqual(self.request("/batch", {"lookups": [{"field": "OCN", "term": "1"}] * 1001})[0], 413)
+        self.assertEqual(self.request("/batch")[0], 405)
+
+    def test_concurrent_reads_and_metrics(self):
+        paths = [f"/search?OCN={i % 3}" for i in range(40)]
+        with ThreadPoolExecutor(8) as executor:
+            responses = list(executor.map(self.request, paths))
+        self.assertTrue(all(status == 200 and response["count"] == 1 for status, response in responses))
+
+        status, metrics = self.request("/metrics")
+        self.assertEqual(status, 200)
+        search = metrics["endpoints"]["/search"]
+        self.assertEqual((search["requests"], search["errors"]), (40, 0))
+        self.assertLessEqual(search["p50_ms"], search["p99_ms"])
+        # Every search went through the cache, which holds the 3 distinct ones
+        self.assertEqual(metrics["cache"]["misses"] + metrics["cache"]["hits"], 40)
+        self.assertLessEqual(metrics["cache"]["entries"], 3)
+        self.assertEqual(metrics["connections"], {"size": 2, "available": 2})
+
+    def test_limit_read_by_sqlite(self):
+        self.upload("more_books.csv", 8)
+        with patch("src.utility.search_api.database.search_database", wraps=database.search_database) as search:
+            status, response = self.request("/search?Title=Title*&limit=3")
+        self.assertEqual((status, response["count"], len(response["results"])), (200, 11, 3))
+        self.assertEqual(search.call_args.args[-1], 3)
+        # A limit past the results needs no count
+        with patch("src.utility.search_api.database.count_search") as count:
+            self.assertEqual(self.request("/search?Title=Title*&limit=20")[1]["count"], 11)
+            count.assert_not_called()
+
+    def test_cache_held_to_rows(self):
+        cache = ResponseCache(5)
+        # Results are kept for the data last looked up
+        self.assertIsNone(cache.get("data", "a"))
+        cache.put("data", "a", ["a"] * 2, 2)
+        cache.put("data", "b", ["b"] * 3, 3)
+        cache.put("data", "none", [], 0)
+        # The least recently used is dropped to make room, and results larger than the cache are not kept
+        self.assertEqual((cache.get("data", "a"), cache.stats()["rows"]), (None, 4))
+        cache.put("data", "big", ["c"] * 6, 6)
+        self.assertIsNone(cache.get("data", "big"))
+        self.assertEqual(cache.get("data", "b"), ["b"] * 3)
+
+    def test_cache_follows_data_changes(self):
+        self.assertEqual(self.request("/search?Title=Title+4")[1]["count"], 0)
+        self.upload("more_books.csv", 5)
+        self.assertEqual(self.request("/search?Title=Title+4")[1]["count"], 1)
+
+    def test_connections_read_only(self):
+        with self.server.api.pool.connection() as connection:
+            with self.assertRaises(sqlite3.OperationalError):
+                connection.execute("DELETE FROM local_file_names;")
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual((percentile(values, 0.5), percentile(values, 0.99)), (50, 99))
+        self.assertEqual(percentile([7], 0.99), 7)
+        self.assertIsNone(percentile([], 0.5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,7 +3,8 @@ import tempfile
 import shutil
 import os
 import json
-from src.utility.settings_manager import Settings
+from unittest.mock import patch
+from src.utility.settings_manager import Settings, SingletonMeta
 
 class TestSettingsManager(unittest.TestCase):
     temp_dir = None
@@ -61,3 +62,68 @@ class TestSettingsManager(unittest.TestCase):
     def test_get_setting_value(self):
         settings_manager = Settings(self.settings_path)
         self.assertEqual(settings_manager.get_setting("language"), self.default_settings["language"], "Failed to retrieve the correct setting value")
+
+
+class TestSettingsPersistence(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.settings_path = os.path.join(self.temp_dir, 'settings.json')
+        with open(self.settings_path, 'w') as file:
+            json.dump({"language": "English", "institution": "Initial University",
+                       "CRKN_institutions": ["Univ A"], "local_institutions": []}, file)
+        # A new instance for each test, not the application's one
+        with patch.dict(SingletonMeta._instances, clear=True):
+            self.settings_manager = Settings(self.settings_path)
+        self.settings_manager.save_delay = 60
+
+    def tearDown(self):
+        self.settings_manager._cancel_timer()
+        shutil.rmtree(self.temp_dir)
+
+    def read(self):
+        with open(self.settings_path) as file:
+            return json.load(file)
+
+    def test_changes_written_once(self):
+        with patch("os.replace", wraps=os.replace) as replace:
+            with self.settings_manager.batch():
+                self.settings_manager.set_language("French")
+                self.settings_manager.set_crkn_url("https://example.com/crkn/page")
+                self.assertEqual(self.read()["language"], "English")
+            self.assertEqual(replace.call_count, 1)
+        settings = self.read()
+        self.assertEqual(settings["language"], "French")
+        self.assertEqual(settings["CRKN_root_url"], "https://example.com")
+        self.assertEqual(os.listdir(self.temp_dir), ['settings.json'])
+
+    def test_change_written_after_delay(self):
+        self.settings_manager.save_delay = 0.05
+        self.settings_manager.set_institution("Other University")
+        self.settings_manager.set_language("French")
+        self.assertEqual(self.read()["institution"], "Initial University")
+        self.settings_manager._timer.join(2)
+        self.assertEqual(self.read()["institution"], "Other University")
+        self.assertEqual(self.read()["language"], "French")
+
+    def test_institution_lists_not_written(self):
+        self.assertEqual(self.settings_manager.get_setting("CRKN_institutions"), ["Univ A"])
+        self.settings_manager.set_language("French")
+        self.settings_manager.flush()
+        self.assertNotIn("CRKN_institutions", self.read())
+        self.assertNotIn("local_institutions", self.read())
+
+    def test_external_change_read(self):
+        settings = self.read()
+        settings["institution"] = "Changed University"
+        settings["language"] = "German"
+        with open(self.settings_path, 'w') as file:
+            json.dump(settings, file)
+        os.utime(self.settings_path, ns=(0, 0))
+        # Not written yet - kept over the outside change
+        self.settings_manager.set_language("French")
+        self.assertTrue(self.settings_manager.reload_if_changed())
+        self.assertEqual(self.settings_manager.get_setting("institution"), "Changed University")
+        self.assertEqual(self.settings_manager.get_setting("language"), "French")
+        self.settings_manager.flush()
+        self.assertEqual(self.read()["institution"], "Changed University")
+        self.assertFalse(self.settings_manager.reload_if_changed())
@@ -0,0 +1,83 @@
+import csv
+import os
+import sqlite3
+import tempfile
+import unittest
+import openpyxl
+from unittest.mock import patch
+from src.utility import streaming_export
+from src.utility.streaming_export import write_rows, export_cursor, ExportCancelled
+
+HEADERS = ["Title", "Publisher", "Platform_YOP"]
+
+
+def rows(count):
+    for number in range(count):
+        yield (f"Title {number}", "Publisher, Inc.", 2000 + number % 20)
+
+
+class TestStreamingExport(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def read_text(self, path, separator):
+        with open(path, newline="", encoding="utf-8") as file:
+            return list(csv.reader(file, delimiter=separator))
+
+    def test_tsv_and_csv(self):
+        for name, separator in (("export.tsv", "\t"), ("export.csv", ",")):
+            self.assertEqual(write_rows(rows(2500), HEADERS, self.path(name)), 2500)
+            written = self.read_text(self.path(name), separator)
+            self.assertEqual(written[0], HEADERS)
+            self.assertEqual(len(written), 2501)
+            self.assertEqual(written[1], ["Title 0", "Publisher, Inc.", "2000"])
+
+    def test_missing_values(self):
+        write_rows([("Title", None, 2020)], HEADERS, self.path("export.tsv"))
+        self.assertEqual(self.read_text(self.path("export.tsv"), "\t")[1], ["Title", "", "2020"])
+
+    def test_xlsx(self):
+        write_rows([("Title\x01 A", "Publisher", 2020), ("Title B", None, 2021)], HEADERS, self.path("export.xlsx"))
+        sheet = openpyxl.load_workbook(self.path("export.xlsx"), read_only=True).active
+        self.assertEqual([list(row) for row in sheet.values],
+                         [HEADERS, ["Title A", "Publisher", 2020], ["Title B", None, 2021]])
+
+    def test_xlsx_continues_on_new_sheet(self):
+        with patch.object(streaming_export, "XLSX_MAX_ROWS", 3):
+            write_rows(rows(5), HEADERS, self.path("export.xlsx"))
+        workbook = openpyxl.load_workbook(self.path("export.xlsx"), read_only=True)
+        self.assertEqual(workbook.sheetnames, ["Export", "Export 2", "Export 3"])
+        self.assertEqual([len(list(sheet.values)) for sheet in workbook.worksheets], [3, 3, 2])
+
+    def test_empty_xlsx(self):
+        self.assertEqual(write_rows([], HEADERS, self.path("export.xlsx")), 0)
+        sheet = openpyxl.load_workbook(self.path("export.xlsx"), read_only=True).active
+        self.assertEqual([list(row) for row in sheet.values], [HEADERS])
+
+    def test_from_cursor(self):
+        connection = sqlite3.connect(":memory:")
+        connection.execute("CREATE TABLE books (Title, Publisher, Platform_YOP)")
+        connection.executemany("INSERT INTO books VALUES (?, ?, ?)", rows(1500))
+        cursor = connection.execute("SELECT * FROM books")
+        self.assertEqual(export_cursor(cursor, self.path("books.csv")), 1500)
+        self.assertEqual(self.read_text(self.path("books.csv"), ",")[0], HEADERS)
+        connection.close()
+
+    def test_progress(self):
+        progress = []
+        write_rows(rows(2500), HEADERS, self.path("export.tsv"), progress=progress.append)
+        self.assertEqual(progress, [1000, 2000, 2500])
+
+    def test_cancelled_keeps_existing_file(self):
+        write_rows(rows(10), HEADERS, self.path("export.tsv"))
+        for name in ("export.tsv", "export.xlsx"):
+            with self.assertRaises(ExportCancelled):
+                write_rows(rows(5000), HEADERS, self.path(name), cancelled=lambda: True)
+        self.assertEqual(len(self.read_text(self.path("export.tsv"), "\t")), 11)
+        self.assertEqual(os.listdir(self.directory.name), ["export.tsv"])
@@ -0,0 +1,107 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+from src.data_processing import database
+from src.data_processing.institutions import registry
+from src.utility import batch_upload
+from src.utility.watch_folder import FolderWatcher, file_signature, hash_file, is_watched_file, LOADED, DUPLICATE
+from testing.utility_testing.batch_upload_test import TEST_SETTINGS, write_csv
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestFolderWatcher(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.clock = FakeClock()
+        self.watcher = FolderWatcher(self.directory.name, 5, clock=self.clock)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_waits_for_file_to_settle(self):
+        path = write_csv(self.directory.name, "data.csv")
+        self.assertEqual(self.watcher.poll(), [])
+        self.clock.now = 3
+        # Still being written
+        with open(path, "a") as file:
+            file.write("Title 9,Publisher,2020,9780000000009,9,AG1,Collection,2024-01-01,Y\n")
+        self.assertEqual(self.watcher.poll(), [])
+        self.clock.now = 6
+        self.assertEqual(self.watcher.poll(), [])
+        self.clock.now = 9
+        self.assertEqual(self.watcher.poll(), [path])
+
+    def test_processed_files_only_picked_up_when_changed(self):
+        path = write_csv(self.directory.name, "data.csv")
+        self.watcher.poll()
+        self.clock.now = 10
+        self.assertEqual(self.watcher.poll(), [path])
+        self.watcher.mark_processed(path, file_signature(path), hash_file(path), LOADED)
+        self.clock.now = 20
+        self.assertEqual(self.watcher.poll(), [])
+        self.assertTrue(self.watcher.is_duplicate(hash_file(path)))
+
+        write_csv(self.directory.name, "data.csv", rows=5)
+        os.utime(path, ns=(1, 1))
+        self.watcher.poll()
+        self.clock.now = 30
+        self.assertEqual(self.watcher.poll(), [path])
+        self.assertFalse(self.watcher.is_duplicate(hash_file(path)))
+
+    def test_ignored_files(self):
+        self.assertFalse(is_watched_file("~$data.xlsx"))
+        self.assertFalse(is_watched_file(".data.csv"))
+        self.assertFalse(is_watched_file("notes.txt"))
+        # Reports written next to rejected files are not uploaded as data
+        self.assertFalse(is_watched_file("data_report.csv"))
+        self.assertTrue(is_watched_file("Data.XLSX"))
+
+    def test_from_database(self):
+        path = write_csv(self.directory.name, "data.csv")
+        connection = sqlite3.connect(":memory:")
+        database.create_watch_table(connection)
+        database.record_watched_file(connection, path, *file_signature(path), hash_file(path), LOADED)
+        database.record_watched_file(connection, "other.csv", 1, 1, "abc", DUPLICATE)
+        watcher = FolderWatcher.from_database(self.directory.name, 0, connection, clock=self.clock)
+        connection.close()
+        watcher.poll()
+        self.assertEqual(watcher.poll(), [])
+        self.assertEqual(watcher.loaded_hashes, {hash_file(path)})
+
+
+class TestUploadPolicy(unittest.TestCase):
+    def setUp(self):
+        self.settings = {key: list(value) if isinstance(value, list) else value for key, value in TEST_SETTINGS.items()}
+        self.patcher = patch("src.utility.settings_manager.Settings.get_setting", side_effect=self.settings.get)
+        self.patcher.start()
+        self.directory = tempfile.TemporaryDirectory()
+        self.connection = sqlite3.connect(":memory:", factory=database.BatchConnection)
+        database.create_file_name_tables(self.connection)
+        registry.load(self.connection)
+
+    def tearDown(self):
+        self.connection.close()
+        self.directory.cleanup()
+        self.patcher.stop()
+
+    def test_policy_instead_of_question(self):
+        first = batch_upload.BatchUpload([write_csv(self.directory.name, "first.csv")], max_workers=1)
+        first.validate(self.connection)
+        first.load(self.connection)
+
+        batch = batch_upload.BatchUpload([write_csv(self.directory.name, "first.csv", rows=3),
+                                          write_csv(self.directory.name, "second.csv", ("Test University", "New College"))],
+                                         max_workers=1)
+        batch.validate(self.connection)
+        batch.apply_policy(replace_files=True, add_institutions=False)
+        self.assertEqual([job.file_name for job in batch.ready_jobs()], ["first"])
+        self.assertEqual(batch.jobs[1].error, batch_upload.NOT_CONFIRMED)